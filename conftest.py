@@ -0,0 +1 @@
+# conftest.py - Đặt thư mục gốc vào sys.path để các test trong tests/ import được package src (chạy: pytest -q)
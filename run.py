@@ -2,7 +2,6 @@
 import sys
 import logging
 import asyncio
-import joblib
 import json
 from dotenv import load_dotenv
 
@@ -16,21 +15,24 @@ from src.database_handler import init_sqlite_db
 from src.telegram_handler import TelegramHandler
 from src.notifications import NotificationHandler
 from src.performance_analyzer import get_performance_stats
+from src.state_cache import state_cache
 from src.updater import get_usdt_futures_symbols
 from src.trainer import train_model
+from src.model_registry import LiveModel, model_registry
 from src.training_loop import training_loop
+from src.training_worker import train_in_subprocess
 from src.data_simulator import simulate_trade_data
 from src.pairlist_updater import perform_single_pairlist_update, CONFIG_FILE_PATH as PAIRLIST_CONFIG_PATH
 
 # CẢI TIẾN: Nhập tất cả các vòng lặp từ tệp src/run_loops.py
 from src.run_loops import (
     analysis_loop,
-    signal_check_loop,
     updater_loop,
-    outcome_check_loop,
+    price_stream_loop,
     notification_flush_loop,
     summary_loop,
     update_loop,
+    command_loop,
     run_api_server
 )
 
@@ -46,6 +48,8 @@ logger = logging.getLogger(__name__)
 async def main():
     logger.info("--- 🚀 Khởi tạo Bot ---")
     client = None
+    tg_handler = None
+    notifier = None
     running_tasks = []
     initial_accuracy = None
 
@@ -69,16 +73,33 @@ async def main():
         
         logger.info("🧠 Bắt đầu huấn luyện mô hình AI...")
         loop = asyncio.get_running_loop()
-        initial_accuracy = await loop.run_in_executor(None, train_model)
-        if initial_accuracy:
+        if config.TRAINING_IN_SUBPROCESS:
+            training_result = await train_in_subprocess()
+        else:
+            training_result = await loop.run_in_executor(None, train_model)
+        # Model giữ nguyên (changed=False) thì không có accuracy mới để báo
+        initial_accuracy = training_result.accuracy if training_result else None
+        if initial_accuracy is not None:
             logger.info(f"✅ Huấn luyện hoàn tất. Độ chính xác ban đầu: {initial_accuracy:.2%}")
 
-        # --- BƯỚC 3: Tải model và khởi tạo thông báo ---
-        model = joblib.load("model_trend.pkl")
-        label_encoder = joblib.load("trend_label_encoder.pkl")
-        model_features = joblib.load("model_features.pkl")
+        # Bộ đệm trạng thái cho lệnh Telegram (đọc DB một lần, sau khi mô phỏng đã ghi dữ liệu)
+        await loop.run_in_executor(None, state_cache.load, config.SQLITE_DB_PATH)
 
-        tg_handler = TelegramHandler(api_token=config.TELEGRAM_BOT_TOKEN, proxy_url=getattr(config, 'TELEGRAM_PROXY_URL', None))
+        # --- BƯỚC 3: Tải model và khởi tạo thông báo ---
+        live_model = LiveModel(model_registry, mmap=config.MODEL_MMAP_LOAD)
+        if await live_model.refresh() is None:
+            logger.warning("⚠️ Không có model nào trong registry; phân tích sẽ dùng luật (Rule-Based).")
+
+        tg_handler = TelegramHandler(
+            api_token=config.TELEGRAM_BOT_TOKEN,
+            proxy_url=getattr(config, 'TELEGRAM_PROXY_URL', None),
+            http2=config.TELEGRAM_HTTP2,
+            max_connections=config.TELEGRAM_MAX_CONNECTIONS,
+            max_keepalive_connections=config.TELEGRAM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.TELEGRAM_KEEPALIVE_EXPIRY_SECONDS,
+            connect_timeout=config.TELEGRAM_CONNECT_TIMEOUT_SECONDS,
+            read_timeout=config.TELEGRAM_READ_TIMEOUT_SECONDS,
+        )
         notifier = NotificationHandler(telegram_handler=tg_handler)
 
         # Gửi báo cáo kết quả mô phỏng và thông báo khởi động
@@ -95,16 +116,18 @@ async def main():
         logger.info("--- 🟢 Bot is now running. All loops are active. ---")
         
         running_tasks = [
-            asyncio.create_task(analysis_loop(client, model, label_encoder, model_features)),
-            asyncio.create_task(signal_check_loop(notifier)),
-            asyncio.create_task(updater_loop(client)),
-            asyncio.create_task(outcome_check_loop(notifier)),
+            asyncio.create_task(analysis_loop(client, live_model)),
+            asyncio.create_task(
+                price_stream_loop(notifier) if config.TRADE_UPDATER_MODE == 'stream' else updater_loop(client)
+            ),
             asyncio.create_task(training_loop(notifier, len(all_symbols))), # Vòng lặp huấn luyện lại định kỳ
             asyncio.create_task(notification_flush_loop(notifier)),
             asyncio.create_task(summary_loop(notifier)),
             asyncio.create_task(update_loop(notifier)),
             loop.run_in_executor(None, run_api_server),
         ]
+        if config.ENABLE_TELEGRAM_COMMANDS:
+            running_tasks.append(asyncio.create_task(command_loop(notifier)))
 
         await asyncio.gather(*running_tasks)
 
@@ -113,7 +136,7 @@ async def main():
             logger.info("🛑 Bot đã dừng bởi người dùng (Ctrl+C).")
         else:
             logger.critical(f"🔥 Lỗi nghiêm trọng trong hàm main(): {main_exc}", exc_info=True)
-            if 'notifier' in locals() and notifier:
+            if notifier:
                 await notifier.send_message_to_all(f"🔥 BOT GẶP LỖI NGHIÊM TRỌNG VÀ ĐÃ DỪNG LẠI!\n\nLỗi: `{main_exc}`")
 
     finally:
@@ -122,6 +145,10 @@ async def main():
             task.cancel()
         if running_tasks:
             await asyncio.gather(*running_tasks, return_exceptions=True)
+        if notifier:
+            await notifier.aclose()
+        if tg_handler:
+            await tg_handler.aclose()
         if client:
             await client.close_connection()
         logger.info("--- ✅ Tắt bot hoàn tất. ---")
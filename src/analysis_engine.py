@@ -1,9 +1,10 @@
 # analysis_engine.py (Phiên bản đã hoàn thiện logic cho cả 2 chiến lược)
+import numpy as np
 import pandas as pd
 import pandas_ta as ta 
 import sqlite3
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from functools import reduce
 
 # Import các type hint cho model
@@ -12,7 +13,12 @@ from sklearn.preprocessing import LabelEncoder
 
 # Import các biến và hàm cần thiết
 from . import config 
+from . import outbox
+from .state_cache import state_cache
+from .signal_coalescer import signal_coalescer
 from .market_data_handler import get_market_data
+from .features import add_indicators, feature_frame
+from .feature_store import feature_store
 from binance import AsyncClient
 
 logger = logging.getLogger(__name__)
@@ -20,7 +26,9 @@ logger = logging.getLogger(__name__)
 # --- HÀM HELPER CHUNG ---
 
 def _save_signal_to_db(signal_data: Dict[str, Any]) -> None:
-    """Lưu tín hiệu được tạo ra từ bất kỳ chiến lược nào vào database."""
+    """Lưu tín hiệu được tạo ra từ bất kỳ chiến lược nào vào database (trừ khi trùng với một tín hiệu còn mở)."""
+    if not signal_coalescer.admit(signal_data.get('symbol'), signal_data.get('trend'), signal_data.get('kline_time')):
+        return
     sql_insert = """
     INSERT INTO trend_analysis (
         analysis_timestamp_utc, symbol, timeframe, last_price, timestamp_utc,
@@ -28,8 +36,8 @@ def _save_signal_to_db(signal_data: Dict[str, Any]) -> None:
         rsi_len, rsi_val, trend, kline_open_time,
         bbands_lower, bbands_middle, bbands_upper, atr_val,
         macd, macd_signal, macd_hist, adx,
-        entry_price, stop_loss, take_profit_1, take_profit_2, take_profit_3, status, method
-    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+        entry_price, stop_loss, take_profit_1, take_profit_2, take_profit_3, status, method, confidence
+    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
     """
     db_values = (
         signal_data.get('analysis_time'), signal_data.get('symbol'), signal_data.get('timeframe'), signal_data.get('price'),
@@ -39,17 +47,116 @@ def _save_signal_to_db(signal_data: Dict[str, Any]) -> None:
         signal_data.get('bb_lower'), signal_data.get('bb_middle'), signal_data.get('bb_upper'), signal_data.get('atr'),
         signal_data.get('macd'), signal_data.get('macd_signal'), signal_data.get('macd_hist'), signal_data.get('adx'),
         signal_data.get('entry'), signal_data.get('sl'), signal_data.get('tp1'), signal_data.get('tp2'), signal_data.get('tp3'), 'ACTIVE',
-        signal_data.get('method', 'Unknown')
+        signal_data.get('method', 'Unknown'), signal_data.get('confidence')
     )
     try:
-        with sqlite3.connect(SQLITE_DB_PATH) as conn:
-            conn.execute(sql_insert, db_values)
+        with sqlite3.connect(config.SQLITE_DB_PATH) as conn:
+            rowid = conn.execute(sql_insert, db_values).lastrowid
+            # Thông báo được ghi vào outbox trong cùng giao dịch: lưu tín hiệu thành công thì thông báo không thể bị mất
+            notification = {
+                'rowid': rowid, 'symbol': signal_data.get('symbol'), 'trend': signal_data.get('trend'),
+                'method': signal_data.get('method', 'Unknown'), 'timeframe': signal_data.get('timeframe'), 'kline_open_time': signal_data.get('kline_time'),
+                'analysis_timestamp_utc': signal_data.get('analysis_time'),
+                'entry_price': signal_data.get('entry'), 'stop_loss': signal_data.get('sl'),
+                'take_profit_1': signal_data.get('tp1'), 'take_profit_2': signal_data.get('tp2'), 'take_profit_3': signal_data.get('tp3'),
+                'confidence': signal_data.get('confidence'),
+            }
+            outbox.enqueue(conn, 'signal', outbox.trade_key('signal', notification), notification)
+        state_cache.add_active_signal(notification)
+        signal_coalescer.record(signal_data.get('symbol'), signal_data.get('trend'), rowid, signal_data.get('kline_time'))
         logger.info(f"✅ ({signal_data.get('method')}) Signal Saved for {signal_data['symbol']}: Trend={signal_data['trend']}")
     except sqlite3.Error as e:
         logger.error(f"❌ Error saving analysis for {signal_data['symbol']} to DB: {e}", exc_info=True)
 
 # === CHIẾN LƯỢC 1: AI / FALLBACK =============================================
 
+# Nhãn mà trainer dạy model (cột 'outcome')
+_OUTCOME_LABELS = {'WIN', 'LOSS'}
+
+def ai_fallback_decisions(
+    candles: pd.DataFrame,
+    features: pd.DataFrame,
+    model: Optional[RandomForestClassifier],
+    label_encoder: Optional[LabelEncoder],
+    model_features: Optional[List[str]]
+) -> pd.DataFrame:
+    """
+    Quyết định của chiến lược AI/Fallback cho từng nến, vector hóa: cột trend (None = bị bộ lọc loại / thiếu dữ liệu /
+    model dự đoán LOSS), method và confidence (xác suất của lớp dự đoán). Phân tích live chỉ đưa vào nến cuối; backtest đưa vào mọi nến của lịch sử.
+    """
+    price = candles['close'].to_numpy(dtype=float)
+    atr_value = features['atr_val'].to_numpy()
+    volume_sma = features['volume_sma'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Bộ lọc cơ bản: ATR hợp lệ, biến động tối thiểu và volume so với SMA
+        eligible = (
+            ~np.isnan(atr_value) & (atr_value != 0)
+            & ~((atr_value / price) * 100 < config.MIN_ATR_PERCENT)
+            & ~(candles['volume'].to_numpy(dtype=float) < volume_sma * config.MIN_VOLUME_RATIO)
+        )
+    trend = np.full(len(candles), None, dtype=object)
+    confidence = np.full(len(candles), np.nan)
+
+    # Xu hướng theo EMA của từng nến: kết quả của chế độ Rule-Based, đồng thời là giá trị 'trend' mà model AI
+    # nhận làm feature (trainer one-hot cột trend của tín hiệu, nên ở đây điền trend_* theo đúng giá trị này)
+    ema_f, ema_m, ema_s = (features[name].to_numpy() for name in ('ema_fast_val', 'ema_medium_val', 'ema_slow_val'))
+    has_emas = ~(np.isnan(ema_f) | np.isnan(ema_m) | np.isnan(ema_s))
+    rules = np.select(
+        [
+            (price > ema_f) & (ema_f > ema_m) & (ema_m > ema_s),
+            (price < ema_f) & (ema_f < ema_m) & (ema_m < ema_s),
+            (price > ema_s) & (ema_f > ema_m),
+            (price < ema_s) & (ema_f < ema_m),
+        ],
+        [config.TREND_STRONG_BULLISH, config.TREND_STRONG_BEARISH, config.TREND_BULLISH, config.TREND_BEARISH],
+        default=config.TREND_SIDEWAYS,
+    )
+
+    # CHỌN CHẾ ĐỘ PHÂN TÍCH
+    if all([model, label_encoder, model_features]):
+        method = "AI"
+        # Cùng tên feature với lúc huấn luyện (pd.get_dummies + reindex của trainer): trend_<X> = 1 khi trend là X
+        X = np.column_stack([
+            features[name].to_numpy(dtype=float) if name in features.columns
+            else (rules == name[len('trend_'):]).astype(float) if name.startswith('trend_')
+            else np.zeros(len(features))
+            for name in model_features
+        ])
+        rows = eligible & has_emas & ~np.isnan(X).any(axis=1)
+        if rows.any():
+            if hasattr(model, 'predict_proba'):
+                # Một lượt predict_proba cho cả lớp dự đoán (giống predict: argmax) lẫn độ tin cậy của nó
+                probabilities = model.predict_proba(X[rows])
+                best = probabilities.argmax(axis=1)
+                prediction_encoded = model.classes_[best]
+                confidence[rows] = probabilities[np.arange(len(best)), best]
+            else:
+                prediction_encoded = model.predict(X[rows])
+            # Model (trainer) dự đoán KẾT QUẢ WIN/LOSS của việc vào lệnh theo trend EMA của nến, không dự đoán trend:
+            # WIN -> giữ trend đó (tạo tín hiệu nếu là STRONG_*), LOSS -> bỏ qua như bị bộ lọc loại
+            outcome = label_encoder.inverse_transform(prediction_encoded)
+            if not set(label_encoder.classes_) <= _OUTCOME_LABELS:
+                raise ValueError(f"Model labels {list(label_encoder.classes_)} are not WIN/LOSS outcomes; retrain with the current trainer.")
+            trend[np.flatnonzero(rows)[outcome == 'WIN']] = rules[rows][outcome == 'WIN']
+    else:
+        method = "Rule-Based"
+        rows = eligible & has_emas
+        trend[rows] = rules[rows]
+    return pd.DataFrame({
+        'trend': pd.Series(trend, index=candles.index, dtype=object), 'method': method, 'confidence': confidence,
+    }, index=candles.index)
+
+def trade_levels(entry: Any, atr_value: Any, is_long: Any) -> Tuple[Any, Any, Any, Any]:
+    """(sl, tp1, tp2, tp3) theo bội số ATR quanh giá vào lệnh; lệnh short đối xứng. Nhận số hoặc mảng."""
+    direction = np.where(is_long, 1.0, -1.0)
+    risk = direction * atr_value
+    return (
+        entry - risk * config.ATR_MULTIPLIER_SL,
+        entry + risk * config.ATR_MULTIPLIER_TP1,
+        entry + risk * config.ATR_MULTIPLIER_TP2,
+        entry + risk * config.ATR_MULTIPLIER_TP3,
+    )
+
 async def perform_ai_fallback_analysis(
     client: AsyncClient, 
     symbol: str, 
@@ -60,8 +167,6 @@ async def perform_ai_fallback_analysis(
     """
     Hàm chính cho chiến lược AI/Fallback, đã được hoàn thiện.
     """
-        
-
     try:
         # Dòng này đã đúng từ lần sửa trước
         df = await get_market_data(client, symbol, config.TIMEFRAME, limit=500)
@@ -70,122 +175,124 @@ async def perform_ai_fallback_analysis(
         if df is None or df.empty or len(df) < config.EMA_SLOW: 
             return
 
-        # 1. Tính toán tất cả các chỉ báo kỹ thuật
-        # SỬA LỖI: Thêm `config.` vào tất cả các tham số
-        df.ta.ema(length=config.EMA_FAST, append=True)
-        df.ta.ema(length=config.EMA_MEDIUM, append=True)
-        df.ta.ema(length=config.EMA_SLOW, append=True)
-        df.ta.rsi(length=config.RSI_PERIOD, append=True)
-        df.ta.bbands(length=config.BBANDS_PERIOD, std=config.BBANDS_STD_DEV, append=True)
-        df.ta.atr(length=config.ATR_PERIOD, append=True)
-        df.ta.sma(length=config.VOLUME_SMA_PERIOD, close='volume', prefix='VOLUME', append=True)
-        df.ta.macd(fast=config.MACD_FAST_PERIOD, slow=config.MACD_SLOW_PERIOD, signal=config.MACD_SIGNAL_PERIOD, append=True)
-        df.ta.adx(length=config.ADX_PERIOD, append=True)
-        
-        last = df.iloc[-1]
-        price = last.get('close')
-        if price is None: 
+        # 1. Tính toán tất cả các chỉ báo kỹ thuật (định nghĩa dùng chung trong features.py)
+        add_indicators(df)
+        features = feature_frame(df)
+        closed = (df['kline_close_time'].astype('int64') < pd.Timestamp.now(tz='UTC').value // 10**6).to_numpy()
+        if config.FEATURE_STORE_ENABLED:
+            # Chỉ lưu nến đã đóng; nến đã có trong kho được bỏ qua nên mỗi nến chỉ được ghi một lần
+            feature_store.write(symbol, config.TIMEFRAME, features[closed])
+        if not closed.any():
             return
 
-        # 2. Áp dụng các bộ lọc cơ bản
-        # SỬA LỖI: Thêm `config.` vào các tham số
-        atr_value = last.get(f'ATRr_{config.ATR_PERIOD}')
-        if atr_value is None or atr_value == 0: 
-            return
-        if (atr_value / price) * 100 < config.MIN_ATR_PERCENT: 
+        # Quyết định trên nến ĐÃ ĐÓNG cuối cùng (không phải nến đang hình thành): tín hiệu được khóa theo open time của
+        # nến này, nên feature lưu trong hàng tín hiệu trùng với feature store mà trainer đọc lại (không lệch train/serve)
+        at = int(np.flatnonzero(closed)[-1])
+        last = df.iloc[at]
+        last_features = features.iloc[at]
+        price = df['close'].iloc[-1] # Giá hiện tại (nến đang chạy) làm giá vào lệnh
+        if price is None: 
             return
-        
-        current_volume = last.get('volume')
-        volume_sma = last.get(f'VOLUME_SMA_{config.VOLUME_SMA_PERIOD}')
-        if current_volume is None or volume_sma is None or current_volume < (volume_sma * config.MIN_VOLUME_RATIO): 
+
+        # 2-3. Bộ lọc cơ bản + chọn chế độ phân tích (cùng hàm với backtest)
+        decision = ai_fallback_decisions(df.iloc[at:at + 1], features.iloc[at:at + 1], model, label_encoder, model_features).iloc[0]
+        trend, analysis_method = decision['trend'], decision['method']
+        if trend is None:
             return
+        confidence = None if pd.isna(decision['confidence']) else float(decision['confidence'])
+        atr_value = last_features['atr_val']
 
-            # SỬA LỖI: Thêm `config.` vào hằng số xu hướng
-            trend = config.TREND_SIDEWAYS
-            analysis_method = ""
-        # 3. CHỌN CHẾ ĐỘ PHÂN TÍCH
-        if all([model, label_encoder, model_features]):
-            analysis_method = "AI"
-            features_for_prediction = [last.get(feature_name) for feature_name in model_features]
-            if any(v is None for v in features_for_prediction): return
-            prediction_encoded = model.predict([features_for_prediction])
-            trend = label_encoder.inverse_transform(prediction_encoded)[0]
-        else:
-            analysis_method = "Rule-Based"
-            if not all(k in last for k in [f'EMA_{EMA_FAST}', f'EMA_{EMA_MEDIUM}', f'EMA_{EMA_SLOW}']): return
-            ema_f, ema_m, ema_s = last[f'EMA_{EMA_FAST}'], last[f'EMA_{EMA_MEDIUM}'], last[f'EMA_{EMA_SLOW}']
-            if price > ema_f > ema_m > ema_s: trend = TREND_STRONG_BULLISH
-            elif price < ema_f < ema_m < ema_s: trend = TREND_STRONG_BEARISH
-            elif price > ema_s and ema_f > ema_m: trend = TREND_BULLISH
-            elif price < ema_s and ema_f < ema_m: trend = TREND_BEARISH
+        # Kết quả mới nhất của symbol cho lệnh /signal (kể cả khi không có tín hiệu mạnh)
+        state_cache.record_analysis(symbol, {
+            'trend': trend, 'method': analysis_method, 'price': price, 'kline_time': last.name.isoformat(),
+            'rsi': last_features['rsi_val'], 'adx': last_features['adx'], 'atr': atr_value,
+            'confidence': confidence,
+        })
 
         # 4. TÍNH TOÁN VÀ LƯU TÍN HIỆU
         if trend.startswith("STRONG"):
             entry = price
-            if trend == TREND_STRONG_BULLISH:
-                sl = entry - (atr_value * ATR_MULTIPLIER_SL)
-                tp1, tp2, tp3 = entry + (atr_value * ATR_MULTIPLIER_TP1), entry + (atr_value * ATR_MULTIPLIER_TP2), entry + (atr_value * ATR_MULTIPLIER_TP3)
-            else: # TREND_STRONG_BEARISH
-                sl = entry + (atr_value * ATR_MULTIPLIER_SL)
-                tp1, tp2, tp3 = entry - (atr_value * ATR_MULTIPLIER_TP1), entry - (atr_value * ATR_MULTIPLIER_TP2), entry - (atr_value * ATR_MULTIPLIER_TP3)
-            
+            sl, tp1, tp2, tp3 = (float(level) for level in trade_levels(entry, atr_value, trend == config.TREND_STRONG_BULLISH))
             signal_data = {
-                "analysis_time": pd.to_datetime('now', utc=True).isoformat(), "symbol": symbol, "timeframe": TIMEFRAME, "price": price,
+                "analysis_time": pd.to_datetime('now', utc=True).isoformat(), "symbol": symbol, "timeframe": config.TIMEFRAME, "price": price,
                 "kline_time": last.name.isoformat(), "kline_timestamp": last.name.timestamp(),
-                "ema_fast_len": EMA_FAST, "ema_fast_val": last.get(f'EMA_{EMA_FAST}'), "ema_medium_len": EMA_MEDIUM, "ema_medium_val": last.get(f'EMA_{EMA_MEDIUM}'), "ema_slow_len": EMA_SLOW, "ema_slow_val": last.get(f'EMA_{EMA_SLOW}'),
-                "rsi_len": RSI_PERIOD, "rsi_val": last.get(f'RSI_{RSI_PERIOD}'), "trend": trend, "method": analysis_method,
-                "bb_lower": last.get(f'BBL_{BBANDS_PERIOD}_{BBANDS_STD_DEV}'), "bb_middle": last.get(f'BBM_{BBANDS_PERIOD}_{BBANDS_STD_DEV}'), "bb_upper": last.get(f'BBU_{BBANDS_PERIOD}_{BBANDS_STD_DEV}'),
-                "atr": atr_value, "macd": last.get(f'MACD_{MACD_FAST_PERIOD}_{MACD_SLOW_PERIOD}_{MACD_SIGNAL_PERIOD}'), "macd_signal": last.get(f'MACDs_{MACD_FAST_PERIOD}_{MACD_SLOW_PERIOD}_{MACD_SIGNAL_PERIOD}'), "macd_hist": last.get(f'MACDh_{MACD_FAST_PERIOD}_{MACD_SLOW_PERIOD}_{MACD_SIGNAL_PERIOD}'), "adx": last.get(f'ADX_{ADX_PERIOD}'),
-                "entry": entry, "sl": sl, "tp1": tp1, "tp2": tp2, "tp3": tp3
+                "ema_fast_len": config.EMA_FAST, "ema_fast_val": last_features['ema_fast_val'], "ema_medium_len": config.EMA_MEDIUM, "ema_medium_val": last_features['ema_medium_val'], "ema_slow_len": config.EMA_SLOW, "ema_slow_val": last_features['ema_slow_val'],
+                "rsi_len": config.RSI_PERIOD, "rsi_val": last_features['rsi_val'], "trend": trend, "method": analysis_method,
+                "bb_lower": last_features['bbands_lower'], "bb_middle": last_features['bbands_middle'], "bb_upper": last_features['bbands_upper'],
+                "atr": atr_value, "macd": last_features['macd'], "macd_signal": last_features['macd_signal'], "macd_hist": last_features['macd_hist'], "adx": last_features['adx'],
+                "entry": entry, "sl": sl, "tp1": tp1, "tp2": tp2, "tp3": tp3,
+                "confidence": confidence
             }
             _save_signal_to_db(signal_data)
         else:
             logger.info(f"{symbol}: ({analysis_method}) Analysis complete. Trend is '{trend}', no strong signal generated.")
 
     except Exception as e:
-        ogger.error(f"❌ FAILED TO PROCESS SYMBOL {symbol} with AI/Fallback: {e}", exc_info=True)
+        logger.error(f"❌ FAILED TO PROCESS SYMBOL {symbol} with AI/Fallback: {e}", exc_info=True)
 
 
 # === CHIẾN LƯỢC 2: ELLIOTV8 =================================================
 
+# Thông số Elliotv8
+_BASE_NB_CANDLES_BUY, _LOW_OFFSET, _EWO_LOW, _EWO_HIGH, _RSI_BUY_VALUE, _BASE_NB_CANDLES_SELL, _HIGH_OFFSET_SELL = 14, 0.975, -19.988, 2.327, 69, 24, 0.991
+ELLIOTV8_MIN_CANDLES = 200
+
 def _ewo_indicator(dataframe, ema_length=5, ema2_length=35):
     """Hàm tính chỉ báo Elliot Wave Oscillator."""
     df = dataframe.copy(); ema1 = ta.ema(df["close"], length=ema_length); ema2 = ta.ema(df["close"], length=ema2_length)
     return (ema1 - ema2) / df['close'] * 100
 
+def elliotv8_indicators(df: pd.DataFrame) -> pd.DataFrame:
+    """Thêm các chỉ báo của Elliotv8 vào DataFrame nến (tại chỗ) và trả về chính nó."""
+    df[f'ma_buy_{_BASE_NB_CANDLES_BUY}'] = ta.ema(df["close"], length=_BASE_NB_CANDLES_BUY)
+    df[f'ma_sell_{_BASE_NB_CANDLES_SELL}'] = ta.ema(df["close"], length=_BASE_NB_CANDLES_SELL)
+    df['EWO'] = _ewo_indicator(df, 50, 200)
+    df['rsi'] = ta.rsi(df["close"], length=13)
+    df['rsi_fast'] = ta.rsi(df["close"], length=4)
+    df['atr'] = ta.atr(df["high"], df["low"], df["close"], length=config.ATR_PERIOD)
+    return df
+
+def elliotv8_decisions(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Quyết định Elliotv8 cho từng nến (df đã qua elliotv8_indicators), vector hóa: should_buy (điều kiện mua)
+    và enter (mua + volume > 0 + giá dưới MA bán + ATR hợp lệ -> tạo tín hiệu).
+    """
+    ma_buy = df[f'ma_buy_{_BASE_NB_CANDLES_BUY}'] * _LOW_OFFSET
+    buy_conditions = [
+        ((df['rsi_fast'] < 35) & (df['close'] < ma_buy) & (df['EWO'] > _EWO_HIGH) & (df['rsi'] < _RSI_BUY_VALUE)),
+        ((df['rsi_fast'] < 35) & (df['close'] < ma_buy) & (df['EWO'] < _EWO_LOW))
+    ]
+    should_buy = reduce(lambda x, y: x | y, buy_conditions)
+    enter = (
+        should_buy & (df['volume'] > 0) & (df['close'] < (df[f'ma_sell_{_BASE_NB_CANDLES_SELL}'] * _HIGH_OFFSET_SELL))
+        & df['atr'].notna() & (df['atr'] != 0)
+    )
+    return pd.DataFrame({'should_buy': should_buy, 'enter': enter}, index=df.index)
+
 async def perform_elliotv8_analysis(client: AsyncClient, symbol: str) -> None:
     """Hàm chính cho chiến lược Elliotv8."""
     try:
         df = await get_market_data(client, symbol, '15m', limit=400)
-        if df is None or df.empty or len(df) < 200: return
+        if df is None or df.empty or len(df) < ELLIOTV8_MIN_CANDLES: return
 
-        # 1. Lấy thông số
-        base_nb_candles_buy, low_offset, ewo_low, ewo_high, rsi_buy_value, base_nb_candles_sell, high_offset_sell = 14, 0.975, -19.988, 2.327, 69, 24, 0.991
+        # 1-2. Tính toán chỉ báo
+        elliotv8_indicators(df)
+        last, price = df.iloc[-1], df.iloc[-1]['close']
 
-        # 2. Tính toán chỉ báo
-        df[f'ma_buy_{base_nb_candles_buy}'] = ta.ema(df["close"], length=base_nb_candles_buy)
-        df[f'ma_sell_{base_nb_candles_sell}'] = ta.ema(df["close"], length=base_nb_candles_sell)
-        df['EWO'] = _ewo_indicator(df, 50, 200)
-        df['rsi'] = ta.rsi(df["close"], length=13)
-        df['rsi_fast'] = ta.rsi(df["close"], length=4)
-        df['atr'] = ta.atr(df["high"], df["low"], df["close"], length=ATR_PERIOD)
+        # 3. Áp dụng logic vào lệnh (cùng hàm với backtest)
+        decision = elliotv8_decisions(df.iloc[-1:]).iloc[0]
+        should_buy = bool(decision['should_buy'])
 
-        last, price = df.iloc[-1], df.iloc[-1]['close']
-        
-        # 3. Áp dụng logic vào lệnh
-        buy_conditions = [
-            ((last['rsi_fast'] < 35) & (last['close'] < (last[f'ma_buy_{base_nb_candles_buy}'] * low_offset)) & (last['EWO'] > ewo_high) & (last['rsi'] < rsi_buy_value)),
-            ((last['rsi_fast'] < 35) & (last['close'] < (last[f'ma_buy_{base_nb_candles_buy}'] * low_offset)) & (last['EWO'] < ewo_low))
-        ]
-        should_buy = reduce(lambda x, y: x | y, buy_conditions)
+        state_cache.record_analysis(symbol, {
+            'trend': config.TREND_STRONG_BULLISH if should_buy else 'NO_SIGNAL', 'method': 'Elliotv8', 'price': price,
+            'kline_time': last.name.isoformat(), 'rsi': last.get('rsi'), 'ewo': last.get('EWO'), 'atr': last.get('atr'),
+        })
 
         # 4. Tính toán và lưu tín hiệu nếu có
-        if should_buy and last['volume'] > 0 and (last['close'] < (last[f'ma_sell_{base_nb_candles_sell}'] * high_offset_sell)):
+        if decision['enter']:
             atr_value = last.get('atr')
-            if atr_value is None or atr_value == 0: return
-            entry, trend = price, TREND_STRONG_BULLISH
-            sl = entry - (atr_value * ATR_MULTIPLIER_SL)
-            tp1, tp2, tp3 = entry + (atr_value * ATR_MULTIPLIER_TP1), entry + (atr_value * ATR_MULTIPLIER_TP2), entry + (atr_value * ATR_MULTIPLIER_TP3)
+            entry, trend = price, config.TREND_STRONG_BULLISH
+            sl, tp1, tp2, tp3 = (float(level) for level in trade_levels(entry, atr_value, True))
             signal_data = {
                 "analysis_time": pd.to_datetime('now', utc=True).isoformat(), "symbol": symbol, "timeframe": '5m', "price": price,
                 "kline_time": last.name.isoformat(), "kline_timestamp": last.name.timestamp(),
@@ -164,6 +164,9 @@ def delete_user(user_id):
         return jsonify({"msg": "User not found."}), 404
 
     conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
+    from .watchlists import init_watchlist_tables, delete_user_watchlist
+    init_watchlist_tables(conn.cursor())
+    delete_user_watchlist(conn, user_id)
     conn.commit()
     conn.close()
     return jsonify({"msg": f"User with ID {user_id} deleted."}), 200
@@ -176,6 +179,98 @@ def get_stats():
     stats = get_performance_stats()
     return jsonify(stats)
 
+@app.route('/api/notifications/latency', methods=['GET'])
+@admin_required()
+def get_notification_latency():
+    # Import tại chỗ để file vẫn chạy độc lập được khi không cần endpoint này
+    from .outbox import delivery_latency_percentiles
+    window_hours = request.args.get('hours', 24, type=float)
+    return jsonify(delivery_latency_percentiles(config.SQLITE_DB_PATH, window_seconds=window_hours * 3600))
+
+# --- Watchlist của người dùng (symbol / phương pháp / độ tin cậy -> chat Telegram riêng) ---
+def _current_user_id(conn):
+    user = conn.execute('SELECT id FROM users WHERE username = ?', (get_jwt_identity(),)).fetchone()
+    return user['id'] if user else None
+
+@app.route('/api/watchlist', methods=['GET'])
+@jwt_required()
+def get_watchlist():
+    from .watchlists import init_watchlist_tables, get_user_watchlist
+    conn = get_db_connection()
+    try:
+        user_id = _current_user_id(conn)
+        if user_id is None:
+            return jsonify({"msg": "User not found."}), 404
+        init_watchlist_tables(conn.cursor())
+        return jsonify(get_user_watchlist(conn, user_id))
+    finally:
+        conn.close()
+
+@app.route('/api/watchlist', methods=['PUT'])
+@jwt_required()
+def put_watchlist():
+    """
+    Replaces the caller's watchlist. Body:
+    {"entries": [{"symbol": "BTCUSDT", "methods": ["AI"], "min_confidence": 0.6}, {"symbol": "*"}]}
+    min_confidence > 0 is only accepted with methods ["AI"] (rule-based signals have no confidence).
+    The Telegram chat is linked through POST /api/watchlist/telegram-link; "telegram_chat_id": null unlinks it.
+    """
+    from .watchlists import init_watchlist_tables, set_user_chat, set_user_watchlist, get_user_watchlist
+    from .config import WATCHLIST_MAX_ENTRIES_PER_USER
+    data = request.get_json() or {}
+    entries = data.get('entries', [])
+    if not isinstance(entries, list):
+        return jsonify({"msg": "'entries' must be a list"}), 400
+    if len(entries) > WATCHLIST_MAX_ENTRIES_PER_USER:
+        return jsonify({"msg": f"At most {WATCHLIST_MAX_ENTRIES_PER_USER} watchlist entries are allowed"}), 400
+    # Chat chỉ được gán qua deep link của bot (chứng minh người dùng ở trong chat đó), không nhận chat_id tùy ý
+    if data.get('telegram_chat_id'):
+        return jsonify({"msg": "Link a Telegram chat via POST /api/watchlist/telegram-link; only null (unlink) is accepted here"}), 400
+
+    conn = get_db_connection()
+    try:
+        user_id = _current_user_id(conn)
+        if user_id is None:
+            return jsonify({"msg": "User not found."}), 404
+        init_watchlist_tables(conn.cursor())
+        try:
+            if 'telegram_chat_id' in data:
+                set_user_chat(conn, user_id, None)
+            set_user_watchlist(conn, user_id, entries)
+        except (ValueError, TypeError, AttributeError) as e:
+            conn.rollback()
+            return jsonify({"msg": f"Invalid watchlist: {e}"}), 400
+        conn.commit()
+        return jsonify(get_user_watchlist(conn, user_id))
+    finally:
+        conn.close()
+
+@app.route('/api/watchlist/telegram-link', methods=['POST'])
+@jwt_required()
+def create_telegram_link():
+    """
+    Issues a one-time token. Opening the returned deep link and pressing Start makes the bot
+    link that chat to the caller's watchlist (proving the caller controls the chat).
+    """
+    from .watchlists import init_watchlist_tables, create_chat_link_token
+    from .config import TELEGRAM_BOT_USERNAME, WATCHLIST_LINK_TOKEN_TTL_SECONDS
+    conn = get_db_connection()
+    try:
+        user_id = _current_user_id(conn)
+        if user_id is None:
+            return jsonify({"msg": "User not found."}), 404
+        init_watchlist_tables(conn.cursor())
+        token = create_chat_link_token(conn, user_id, WATCHLIST_LINK_TOKEN_TTL_SECONDS)
+        conn.commit()
+    finally:
+        conn.close()
+    return jsonify({
+        'token': token,
+        'deep_link': f"https://t.me/{TELEGRAM_BOT_USERNAME}?start={token}" if TELEGRAM_BOT_USERNAME else None,
+        'command': f"/start {token}",
+        'expires_in': WATCHLIST_LINK_TOKEN_TTL_SECONDS,
+    })
+
 @app.route('/api/trades', methods=['GET'])
 @jwt_required()
 def get_trades():
@@ -0,0 +1,346 @@
+# backtest.py
+# Backtest offline: phát lại nến lưu cục bộ (BACKTEST_DATA_DIR) qua đúng code quyết định của chiến lược trong
+# analysis_engine (ai_fallback_decisions / elliotv8_decisions, trade_levels). Chỉ báo được tính một lần trên cả lịch sử
+# và quyết định được lấy cho mọi nến cùng lúc (vector hóa) thay vì gọi lại chiến lược cho từng nến.
+# Lệnh được đóng theo quy tắc của check_signal_outcomes (max/min kể từ sau nến vào lệnh, ưu tiên SL, TP3 > TP2 > TP1),
+# tín hiệu trùng được gộp như signal_coalescer. Không gọi API, không ghi DB; mỗi symbol là một tác vụ của process pool.
+# Feature được đọc từ feature_store khi kho có đủ (cùng giá trị live đã phục vụ), còn lại mới tính lại từ nến.
+# Chiến lược AI chỉ được chấm trên nến SAU watermark của phiên bản model (lệnh cuối cùng nó đã học), để không
+# backtest model trên chính các kết quả nó được huấn luyện (look-ahead); chọn phiên bản cũ hơn để có giai đoạn kiểm tra dài hơn.
+# Kết quả: nhật ký lệnh (BACKTEST_TRADES_PATH), thống kê theo symbol (BACKTEST_STATS_PATH) và thông lượng (nến/giây).
+# Cách chạy: python -m src.backtest [AI|Rule-Based|Elliotv8] [số_worker] [SYMBOL ...]  (phiên bản model: BACKTEST_MODEL_VERSION)
+import concurrent.futures
+import glob
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import config
+from .analysis_engine import ELLIOTV8_MIN_CANDLES, ai_fallback_decisions, elliotv8_decisions, elliotv8_indicators, trade_levels
+from .feature_store import feature_store, to_epoch_ms
+from .features import add_indicators, feature_frame
+from .market_data_handler import KLINE_COLUMNS
+from .model_registry import LEGACY_VERSION, model_registry
+from .performance_analyzer import win_mask
+from .signal_coalescer import signal_coalescer, signal_direction
+from .updater import first_hit_outcomes
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('AI', 'Rule-Based', 'Elliotv8')
+_KLINE_EXTENSIONS = ('.csv', '.csv.gz', '.zip')
+_OHLCV = ['open', 'high', 'low', 'close', 'volume']
+# Lượt đầu chỉ xét chừng này nến sau entry; lệnh chưa đóng được xét lại với cửa sổ gấp 4 (phần lớn lệnh đóng sớm)
+_FIRST_HORIZON = 96
+_TRADE_COLUMNS = [
+    'symbol', 'method', 'trend', 'confidence', 'entry_time', 'entry_price', 'stop_loss',
+    'take_profit_1', 'take_profit_2', 'take_profit_3', 'status', 'exit_time', 'exit_price',
+    'pnl_percentage', 'pnl_with_leverage', 'bars_held',
+]
+
+# Model của chiến lược AI trong mỗi worker (nạp một lần bởi _init_worker)
+_worker_state: Dict[str, Any] = {}
+
+def _file_pattern(timeframe: str, symbol: str = '[A-Z0-9]+') -> 're.Pattern':
+    return re.compile(rf"^({symbol})-{re.escape(timeframe)}(?:[-.].*)?$")
+
+def kline_files(symbol: str, timeframe: Optional[str] = None, data_dir: Optional[str] = None) -> List[str]:
+    """Các tệp nến của symbol (vd. BTCUSDT-15m-2024-01.zip), theo thứ tự tên."""
+    pattern = _file_pattern(timeframe or config.TIMEFRAME, re.escape(symbol))
+    paths = glob.glob(os.path.join(glob.escape(data_dir or config.BACKTEST_DATA_DIR), f"{symbol}-*"))
+    return sorted(p for p in paths if p.endswith(_KLINE_EXTENSIONS) and pattern.match(os.path.basename(p)))
+
+def available_symbols(timeframe: Optional[str] = None, data_dir: Optional[str] = None) -> List[str]:
+    pattern = _file_pattern(timeframe or config.TIMEFRAME)
+    names = os.listdir(data_dir or config.BACKTEST_DATA_DIR) if os.path.isdir(data_dir or config.BACKTEST_DATA_DIR) else []
+    return sorted({m.group(1) for m in map(pattern.match, names) if m and m.string.endswith(_KLINE_EXTENSIONS)})
+
+def _read_kline_file(path: str) -> pd.DataFrame:
+    # Tệp của Binance có thể có hoặc không có dòng tiêu đề; chỉ đọc 7 cột đầu (tới close time)
+    first = str(pd.read_csv(path, header=None, nrows=1).iat[0, 0]).strip()
+    return pd.read_csv(
+        path, header=None if first.isdigit() else 0, names=KLINE_COLUMNS[:7], usecols=range(7),
+        dtype={**{c: 'float64' for c in _OHLCV}, 'kline_open_time': 'int64', 'kline_close_time': 'int64'},
+    )
+
+def load_klines(symbol: str, timeframe: Optional[str] = None, data_dir: Optional[str] = None) -> pd.DataFrame:
+    """Nến của symbol từ các tệp cục bộ, index kline_open_time (UTC) như market_data_handler; rỗng nếu không có tệp."""
+    frames = [_read_kline_file(path) for path in kline_files(symbol, timeframe, data_dir)]
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    for column in ('kline_open_time', 'kline_close_time'):
+        # Tệp spot mới của Binance ghi thời gian bằng micro giây
+        df[column] = np.where(df[column] > 10**14, df[column] // 1000, df[column])
+    df = df.drop_duplicates('kline_open_time', keep='last').sort_values('kline_open_time')
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.pop('kline_open_time'), unit='ms', utc=True), name='kline_open_time')
+    return df
+
+def _stored_features(symbol: str, timeframe: str, candles: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """
+    Feature của các nến từ feature_store (index như candles). None nếu kho thiếu nến nào sau nến đầu tiên có trong kho
+    (các nến thiếu ở đầu là giai đoạn khởi động chỉ báo, kho không lưu chúng).
+    """
+    stored = feature_store.read(symbol, timeframe)
+    if stored.empty:
+        return None
+    features = stored.reindex(to_epoch_ms(candles.index))
+    present = features.notna().all(axis=1).to_numpy()
+    if not present.any() or not present[np.argmax(present):].all():
+        return None
+    features.index = candles.index
+    return features
+
+def _candidate_signals(candles: pd.DataFrame, strategy: str, bundle: Any, symbol: Optional[str] = None, timeframe: Optional[str] = None) -> pd.DataFrame:
+    """Tín hiệu mạnh (STRONG_*) mà chiến lược tạo ra ở mỗi nến: chỉ số nến, trend, method, confidence, ATR."""
+    positions = np.arange(len(candles))
+    if strategy == 'Elliotv8':
+        frame = elliotv8_indicators(candles.copy())
+        # Như phân tích live: cần ít nhất ELLIOTV8_MIN_CANDLES nến
+        bars = np.flatnonzero(elliotv8_decisions(frame)['enter'].to_numpy() & (positions + 1 >= ELLIOTV8_MIN_CANDLES))
+        return pd.DataFrame({
+            'bar': bars, 'trend': config.TREND_STRONG_BULLISH, 'method': 'Elliotv8',
+            'confidence': np.nan, 'atr': frame['atr'].to_numpy()[bars],
+        })
+    features = _stored_features(symbol, timeframe or config.TIMEFRAME, candles) if config.FEATURE_STORE_ENABLED and symbol else None
+    if features is None:
+        features = feature_frame(add_indicators(candles.copy()))
+    use_model = strategy == 'AI' and bundle is not None
+    # Như phân tích live: cần ít nhất EMA_SLOW nến
+    warm = positions + 1 >= config.EMA_SLOW
+    decisions = ai_fallback_decisions(
+        candles[warm], features[warm],
+        bundle.model if use_model else None, bundle.label_encoder if use_model else None, bundle.features if use_model else None,
+    )
+    strong = np.array([isinstance(trend, str) and trend.startswith('STRONG') for trend in decisions['trend']], dtype=bool)
+    bars = positions[warm][strong]
+    return pd.DataFrame({
+        'bar': bars, 'trend': decisions['trend'].to_numpy()[strong], 'method': decisions['method'].to_numpy()[strong],
+        'confidence': decisions['confidence'].to_numpy()[strong], 'atr': features['atr_val'].to_numpy()[bars],
+    })
+
+def _resolve(highs: np.ndarray, lows: np.ndarray, closes: np.ndarray, entries: np.ndarray, is_long: np.ndarray,
+             levels: Tuple[np.ndarray, ...], max_hold_bars: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Kết quả của từng lệnh: first_hit_outcomes với cửa sổ tăng dần (x4) cho các lệnh chưa đóng.
+    Lệnh chưa chạm TP/SL khi hết dữ liệu giữ 'ACTIVE' (exit_idx -1); quá max_hold_bars (nếu > 0) -> CLOSED_MANUAL.
+    """
+    n_candles = len(closes)
+    limit = max_hold_bars or n_candles
+    statuses = np.full(len(entries), 'ACTIVE', dtype='<U13')
+    exit_prices = np.full(len(entries), np.nan)
+    exit_idx = np.full(len(entries), -1, dtype=np.int64)
+    pending = np.arange(len(entries))
+    horizon = min(_FIRST_HORIZON, limit)
+    while pending.size:
+        status, price, index = first_hit_outcomes(
+            highs, lows, closes, entries[pending], is_long[pending], *(level[pending] for level in levels), horizon
+        )
+        window_complete = entries[pending] + horizon < n_candles
+        done = (status != 'CLOSED_MANUAL') | (window_complete & (horizon >= limit))
+        statuses[pending[done]], exit_prices[pending[done]], exit_idx[pending[done]] = status[done], price[done], index[done]
+        if horizon >= limit:
+            break
+        pending = pending[~done & window_complete]
+        horizon = min(horizon * 4, limit)
+    return statuses, exit_prices, exit_idx
+
+def _coalesce(symbol: str, trends: np.ndarray, entries: np.ndarray, exit_idx: np.ndarray, times_s: np.ndarray) -> np.ndarray:
+    """Như signal_coalescer.admit: bỏ tín hiệu khi tín hiệu trước cùng hướng còn mở và còn trong cửa sổ gộp."""
+    admitted = np.zeros(len(entries), dtype=bool)
+    last: Dict[str, Tuple[float, int]] = {}
+    for k, (trend, bar) in enumerate(zip(trends, entries)):
+        direction = signal_direction(trend)
+        previous = last.get(direction)
+        if previous is not None:
+            accepted_at, previous_exit = previous
+            still_open = previous_exit < 0 or previous_exit >= bar
+            if still_open and times_s[bar] - accepted_at < signal_coalescer.window_for(symbol, direction):
+                continue
+        admitted[k] = True
+        last[direction] = (times_s[bar], exit_idx[k])
+    return admitted
+
+def backtest_symbol(symbol: str, strategy: str, timeframe: Optional[str] = None, data_dir: Optional[str] = None,
+                    max_hold_bars: Optional[int] = None) -> Tuple[pd.DataFrame, int]:
+    """Nhật ký lệnh của một symbol trên toàn bộ nến cục bộ của nó, cùng số nến đã phát lại."""
+    candles = load_klines(symbol, timeframe, data_dir)
+    if candles.empty:
+        return pd.DataFrame(columns=_TRADE_COLUMNS), 0
+    signals = _candidate_signals(candles, strategy, _worker_state.get('bundle'), symbol, timeframe)
+    out_of_sample_ms = _worker_state.get('out_of_sample_ms')
+    if out_of_sample_ms is not None:
+        # Chỉ giữ tín hiệu sau lệnh cuối cùng model đã học
+        signals = signals[to_epoch_ms(candles.index)[signals['bar'].to_numpy()] > out_of_sample_ms].reset_index(drop=True)
+    entries = signals['bar'].to_numpy()
+    trends = signals['trend'].to_numpy()
+    highs, lows, closes = (candles[c].to_numpy(dtype=float) for c in ('high', 'low', 'close'))
+    # Vào lệnh ở giá close của nến tạo tín hiệu; updater chỉ xét các nến sau nến vào lệnh
+    entry_prices = closes[entries]
+    is_long = np.array(['BULLISH' in trend for trend in trends], dtype=bool)
+    levels = tuple(np.asarray(level, dtype=float) for level in trade_levels(entry_prices, signals['atr'].to_numpy(), is_long))
+    max_hold = config.BACKTEST_MAX_HOLD_BARS if max_hold_bars is None else max_hold_bars
+    statuses, exit_prices, exit_idx = _resolve(highs, lows, closes, entries, is_long, levels, max_hold)
+
+    times = candles.index
+    admitted = _coalesce(symbol, trends, entries, exit_idx, times.as_unit('s').asi8)
+    closed = exit_idx >= 0
+    pnl = (exit_prices - entry_prices) / entry_prices * 100 * np.where(is_long, 1.0, -1.0) # Đảo dấu PnL cho lệnh short
+    trades = pd.DataFrame({
+        'symbol': symbol, 'method': signals['method'].to_numpy(), 'trend': trends, 'confidence': signals['confidence'].to_numpy(),
+        'entry_time': times[entries], 'entry_price': entry_prices, 'stop_loss': levels[0],
+        'take_profit_1': levels[1], 'take_profit_2': levels[2], 'take_profit_3': levels[3],
+        'status': statuses, 'exit_time': pd.Series(times[np.where(closed, exit_idx, 0)]).where(closed).to_numpy(),
+        'exit_price': exit_prices, 'pnl_percentage': pnl, 'pnl_with_leverage': pnl * config.LEVERAGE,
+        'bars_held': np.where(closed, exit_idx - entries, -1),
+    }, columns=_TRADE_COLUMNS)
+    return trades[admitted].reset_index(drop=True), len(candles)
+
+def model_cutoff(bundle: Any) -> Optional[int]:
+    """Watermark (ms) của phiên bản model: thời điểm đóng của lệnh cuối cùng nó đã học; None nếu không biết (model cũ)."""
+    if bundle is None:
+        return None
+    watermark = model_registry.metadata(bundle.version).get('watermark') if bundle.version != LEGACY_VERSION else None
+    if not watermark:
+        return None
+    cutoff = int(to_epoch_ms([watermark])[0])
+    return cutoff if cutoff >= 0 else None
+
+def _load_model(strategy: str, version: Optional[str] = None) -> None:
+    _worker_state.clear()
+    if strategy == 'AI':
+        bundle = model_registry.load(version)
+        if bundle is not None:
+            # Một process pool đã chia tải theo symbol; mỗi model chỉ dùng một luồng
+            bundle.model.set_params(n_jobs=1)
+            _worker_state['out_of_sample_ms'] = model_cutoff(bundle)
+        else:
+            logger.warning("No published model; the AI strategy falls back to the rule-based analysis as in live.")
+        _worker_state['bundle'] = bundle
+
+def _init_worker(strategy: str, niceness: int, version: Optional[str] = None, registry_root: Optional[str] = None) -> None:
+    if niceness:
+        os.nice(niceness)
+    if registry_root:
+        model_registry.root = registry_root
+    _load_model(strategy, version)
+
+def _run_symbol(symbol: str, strategy: str, timeframe: str, data_dir: str, max_hold_bars: int) -> Tuple[pd.DataFrame, int, float]:
+    started = time.perf_counter()
+    trades, bars = backtest_symbol(symbol, strategy, timeframe, data_dir, max_hold_bars)
+    return trades, bars, time.perf_counter() - started
+
+def summarize(trades: pd.DataFrame) -> pd.DataFrame:
+    """
+    Một hàng cho mỗi symbol và một hàng 'ALL': số lệnh, tỉ lệ thắng, PnL (%), profit factor, drawdown, số nến giữ lệnh.
+    Thắng = chạm TP hoặc PnL > 0 (performance_analyzer.win_mask), cùng định nghĩa với bảng live và nhãn của trainer.
+    """
+    def stats(name: str, group: pd.DataFrame) -> Dict[str, Any]:
+        closed = group[group['status'] != 'ACTIVE'].sort_values('exit_time', kind='stable')
+        pnl = closed['pnl_percentage'].to_numpy(dtype=float)
+        equity = np.concatenate([[0.0], np.cumsum(pnl)])
+        gains, losses = pnl[pnl > 0].sum(), -pnl[pnl < 0].sum()
+        return {
+            'symbol': name, 'signals': len(group), 'closed': len(closed), 'open': len(group) - len(closed),
+            'tp_hits': int(closed['status'].str.startswith('TP').sum()), 'sl_hits': int((closed['status'] == 'SL_HIT').sum()),
+            'win_rate': float(win_mask(closed['status'], closed['pnl_percentage']).mean()) if len(closed) else float('nan'),
+            'avg_pnl': float(pnl.mean()) if len(pnl) else float('nan'), 'total_pnl': float(pnl.sum()),
+            'profit_factor': float(gains / losses) if losses else float('inf') if gains else float('nan'),
+            'max_drawdown': float((np.maximum.accumulate(equity) - equity).max()),
+            'avg_bars_held': float(closed['bars_held'].mean()) if len(closed) else float('nan'),
+        }
+    rows = [stats(symbol, group) for symbol, group in trades.groupby('symbol', sort=True)]
+    return pd.DataFrame(rows + [stats('ALL', trades)])
+
+def run_backtest(symbols: Optional[List[str]] = None, strategy: Optional[str] = None, workers: Optional[int] = None,
+                 timeframe: Optional[str] = None, data_dir: Optional[str] = None,
+                 model_version: Optional[str] = None) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, Any]]:
+    """
+    Backtest mọi symbol (mặc định: mọi symbol có tệp nến); trả về (nhật ký lệnh, thống kê, báo cáo thông lượng).
+    Với AI, báo cáo ghi phiên bản model và thời điểm bắt đầu giai đoạn ngoài mẫu (out_of_sample_from).
+    """
+    strategy = strategy or ('Elliotv8' if config.STRATEGY_MODE == 'Elliotv8' else 'AI')
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}'; expected one of {', '.join(STRATEGIES)}.")
+    timeframe, data_dir = timeframe or config.TIMEFRAME, data_dir or config.BACKTEST_DATA_DIR
+    symbols = symbols or available_symbols(timeframe, data_dir)
+    if not symbols:
+        raise ValueError(f"No {timeframe} kline files found in '{data_dir}'.")
+    workers = min(workers or config.BACKTEST_WORKERS or os.cpu_count() or 1, len(symbols))
+    logger.info(f"🧪 Backtest ({strategy}, {timeframe}): {len(symbols)} symbol(s) on {workers} worker(s)...")
+    model_version = model_version or config.BACKTEST_MODEL_VERSION
+    model_report: Dict[str, Any] = {}
+    _load_model(strategy, model_version)
+    if strategy == 'AI':
+        bundle, cutoff = _worker_state.get('bundle'), _worker_state.get('out_of_sample_ms')
+        model_report = {
+            'model_version': bundle.version if bundle is not None else None,
+            'out_of_sample_from': pd.Timestamp(cutoff, unit='ms', tz='UTC').isoformat() if cutoff is not None else None,
+            # Model không rõ dữ liệu huấn luyện (bản cũ, không có watermark): kết quả có thể gồm chính các lệnh nó đã học
+            'look_ahead_bias': bundle is not None and cutoff is None,
+        }
+        if bundle is not None and bundle.version != LEGACY_VERSION:
+            # Worker nạp đúng phiên bản đã chọn ở đây, kể cả khi CURRENT đổi giữa chừng
+            model_version = bundle.version
+        if model_report['look_ahead_bias']:
+            logger.warning(f"⚠️ Model {bundle.version} has no training watermark; AI results may include trades it was trained on (look-ahead bias).")
+        elif cutoff is not None:
+            logger.info(f"🔒 Model {bundle.version}: only signals after {model_report['out_of_sample_from']} (its training data) are tested.")
+
+    started = time.perf_counter()
+    frames, total_bars = [], 0
+    args = (strategy, timeframe, data_dir, config.BACKTEST_MAX_HOLD_BARS)
+
+    def collect(done: int, symbol: str, result: Tuple[pd.DataFrame, int, float]) -> None:
+        nonlocal total_bars
+        trades, bars, seconds = result
+        frames.append(trades)
+        total_bars += bars
+        logger.info(f"  [{done}/{len(symbols)}] {symbol}: {len(trades)} trade(s) over {bars} bars in {seconds:.2f}s")
+
+    if workers <= 1:
+        for done, symbol in enumerate(symbols, 1):
+            try:
+                collect(done, symbol, _run_symbol(symbol, *args))
+            except Exception as e:
+                logger.error(f"❌ Backtest failed for {symbol}: {e}", exc_info=True)
+    else:
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                                    initargs=(strategy, config.TRAINING_NICENESS, model_version, model_registry.root)) as pool:
+            futures = {pool.submit(_run_symbol, symbol, *args): symbol for symbol in symbols}
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                try:
+                    collect(done, futures[future], future.result())
+                except Exception as e:
+                    logger.error(f"❌ Backtest failed for {futures[future]}: {e}", exc_info=True)
+
+    trades = pd.concat([f for f in frames if len(f)], ignore_index=True) if any(len(f) for f in frames) else pd.DataFrame(columns=_TRADE_COLUMNS)
+    trades = trades.sort_values(['entry_time', 'symbol'], kind='stable').reset_index(drop=True)
+    stats = summarize(trades)
+    trades.to_csv(config.BACKTEST_TRADES_PATH, index=False)
+    stats.to_csv(config.BACKTEST_STATS_PATH, index=False)
+    seconds = time.perf_counter() - started
+    report = {'symbols': len(symbols), 'bars': total_bars, 'trades': len(trades), 'seconds': seconds,
+              'bars_per_second': total_bars / seconds if seconds > 0 else 0.0, **model_report}
+    logger.info(f"✅ Backtest finished: {report['trades']} trade(s), {total_bars} bars in {seconds:.1f}s "
+                f"({report['bars_per_second']:,.0f} bars/s); trades in {config.BACKTEST_TRADES_PATH}, stats in {config.BACKTEST_STATS_PATH}.")
+    return trades, stats, report
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    strategy = sys.argv[1] if len(sys.argv) > 1 else None
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    trades, stats, report = run_backtest(sys.argv[3:] or None, strategy, workers)
+    if report.get('model_version'):
+        bias = " (LOOK-AHEAD BIAS: model has no training watermark)" if report['look_ahead_bias'] else ""
+        print(f"Model {report['model_version']} | out-of-sample from {report['out_of_sample_from'] or '-'}{bias}")
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.float_format', '{:.3f}'.format):
+        print(stats.to_string(index=False))
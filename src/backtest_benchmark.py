@@ -0,0 +1,60 @@
+# backtest_benchmark.py - Đo thông lượng (nến/giây) của backtest trên tệp nến tổng hợp theo định dạng tải về của Binance
+# (random-walk 15m, một tệp CSV mỗi symbol trong thư mục tạm, tạo một lần cho mỗi kích thước) với cả hai chiến lược
+# không cần model (Rule-Based, Elliotv8), rồi ước lượng thời gian cho một năm 15m của 600 symbol.
+# Cách chạy: python -m src.backtest_benchmark [số_symbol] [số_nến_mỗi_symbol] [số_worker]
+import logging
+import os
+import sys
+import tempfile
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from . import config
+from .backtest import run_backtest
+
+_INTERVAL_MS = 15 * 60 * 1000
+_YEAR_OF_15M = 365 * 96
+
+def write_synthetic_klines(directory: str, n_symbols: int, n_bars: int, seed: int = 5) -> None:
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    open_times = 1704067200000 + np.arange(n_bars, dtype=np.int64) * _INTERVAL_MS # 2024-01-01 UTC
+    for i in range(n_symbols):
+        close = 50 * np.exp(np.cumsum(rng.normal(0, 0.004, n_bars)))
+        open_ = np.concatenate([[close[0]], close[:-1]])
+        spread = np.abs(rng.normal(0, 0.003, n_bars)) * close
+        volume = rng.lognormal(8, 0.6, n_bars)
+        columns = [open_times, open_, np.maximum(open_, close) + spread, np.minimum(open_, close) - spread, close, volume,
+                   open_times + _INTERVAL_MS - 1, volume * close, rng.integers(100, 5000, n_bars), volume / 2, volume * close / 2, np.zeros(n_bars)]
+        np.savetxt(os.path.join(directory, f"SYN{i:03d}USDT-15m-synthetic.csv"), np.column_stack(columns),
+                   delimiter=',', fmt=['%d', '%.6f', '%.6f', '%.6f', '%.6f', '%.3f', '%d', '%.3f', '%d', '%.3f', '%.3f', '%d'])
+
+def run_benchmark(n_symbols: int = 16, n_bars: int = _YEAR_OF_15M, workers: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+    directory = os.path.join(tempfile.gettempdir(), f'backtest-bench-{n_symbols}x{n_bars}')
+    if not os.path.isdir(directory):
+        write_synthetic_klines(directory, n_symbols, n_bars)
+    saved = config.TIMEFRAME, config.BACKTEST_TRADES_PATH, config.BACKTEST_STATS_PATH
+    config.TIMEFRAME = '15m'
+    config.BACKTEST_TRADES_PATH = os.path.join(directory, 'trades.csv')
+    config.BACKTEST_STATS_PATH = os.path.join(directory, 'stats.csv')
+    results = {}
+    try:
+        for strategy in ('Rule-Based', 'Elliotv8'):
+            trades, stats, report = run_backtest(strategy=strategy, workers=workers, data_dir=directory)
+            results[strategy] = {**report, 'win_rate': stats.iloc[-1]['win_rate']}
+    finally:
+        config.TIMEFRAME, config.BACKTEST_TRADES_PATH, config.BACKTEST_STATS_PATH = saved
+    return results
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    n_symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    n_bars = int(sys.argv[2]) if len(sys.argv) > 2 else _YEAR_OF_15M
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    results = run_benchmark(n_symbols, n_bars, workers)
+    print(f"Symbols: {n_symbols} x {n_bars} bars (15m) | workers: {workers or config.BACKTEST_WORKERS or os.cpu_count()}")
+    for strategy, report in results.items():
+        estimate = 600 * _YEAR_OF_15M / report['bars_per_second']
+        print(f"  {strategy:<10} {report['trades']:>7} trades | {report['seconds']:6.2f}s | {report['bars_per_second']:>10,.0f} bars/s "
+              f"| win rate {report['win_rate']:.1%} | 600 symbols x 1 year ~ {estimate / 60:.1f} min")
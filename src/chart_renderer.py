@@ -0,0 +1,175 @@
+# chart_renderer.py
+# Vẽ biểu đồ nến (EMA, Bollinger Bands, mức Entry/SL/TP) cho tín hiệu mạnh, trong một process pool
+# để event loop không bao giờ bị chặn bởi matplotlib. Ảnh PNG được cache theo (symbol, kline time, các mức giá),
+# nên group và channel dùng chung một lần vẽ; các yêu cầu trùng đang chạy cũng chỉ vẽ một lần.
+import asyncio
+import importlib.util
+import io
+import logging
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import config
+from .market_data_handler import get_cached_candles
+
+logger = logging.getLogger(__name__)
+
+LEVEL_FIELDS = ('entry_price', 'stop_loss', 'take_profit_1', 'take_profit_2', 'take_profit_3')
+LEVEL_STYLES = {
+    'entry_price': ('Entry', '#1f77b4'),
+    'stop_loss': ('SL', '#d62728'),
+    'take_profit_1': ('TP1', '#2ca02c'),
+    'take_profit_2': ('TP2', '#2ca02c'),
+    'take_profit_3': ('TP3', '#2ca02c'),
+}
+
+def _render_chart_png(
+    title: str,
+    open_times_ms: np.ndarray,
+    ohlc: np.ndarray,
+    levels: Dict[str, float],
+    ema_periods: Tuple[int, ...],
+    bbands_period: int,
+    bbands_std: float,
+    bars: int,
+) -> Tuple[bytes, float]:
+    """Chạy trong process con: tính EMA/BBands trên toàn bộ nến rồi vẽ `bars` nến cuối. Trả về (PNG, số giây vẽ)."""
+    start = time.perf_counter()
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    close = pd.Series(ohlc[:, 3])
+    emas = {period: close.ewm(span=period, adjust=False).mean().to_numpy() for period in ema_periods}
+    middle = close.rolling(bbands_period).mean()
+    std = close.rolling(bbands_period).std(ddof=0)
+    upper, lower = (middle + bbands_std * std).to_numpy(), (middle - bbands_std * std).to_numpy()
+
+    view = slice(max(0, len(close) - bars), len(close))
+    o, h, l, c = (ohlc[view, i] for i in range(4))
+    x = np.arange(len(c))
+    up = c >= o
+
+    fig, ax = plt.subplots(figsize=(10, 5.5), dpi=100)
+    try:
+        ax.vlines(x, l, h, colors=np.where(up, '#26a69a', '#ef5350'), linewidth=0.8)
+        ax.bar(x, np.abs(c - o), bottom=np.minimum(o, c), width=0.7, color=np.where(up, '#26a69a', '#ef5350'))
+        for period, values in emas.items():
+            ax.plot(x, values[view], linewidth=1.0, label=f'EMA {period}')
+        ax.plot(x, upper[view], color='#9e9e9e', linewidth=0.8, linestyle='--', label=f'BB {bbands_period}/{bbands_std:g}')
+        ax.plot(x, lower[view], color='#9e9e9e', linewidth=0.8, linestyle='--')
+        ax.fill_between(x, lower[view], upper[view], color='#9e9e9e', alpha=0.08)
+        for field, price in levels.items():
+            label, color = LEVEL_STYLES[field]
+            ax.axhline(price, color=color, linewidth=1.0, linestyle='-' if field == 'entry_price' else ':')
+            ax.annotate(f'{label} {price:.6g}', xy=(x[-1], price), xytext=(4, 0), textcoords='offset points',
+                        va='center', fontsize=8, color=color, annotation_clip=False)
+
+        times = pd.to_datetime(open_times_ms[view], unit='ms', utc=True)
+        ticks = x[::max(1, len(x) // 6)]
+        ax.set_xticks(ticks)
+        ax.set_xticklabels([times[i].strftime('%m-%d %H:%M') for i in ticks], fontsize=8)
+        ax.set_xlim(-1, len(x) + 8)
+        ax.set_title(title)
+        ax.grid(alpha=0.2)
+        ax.legend(loc='upper left', fontsize=8)
+        fig.tight_layout()
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+    finally:
+        plt.close(fig)
+    return buffer.getvalue(), time.perf_counter() - start
+
+class ChartRenderer:
+    """Vẽ biểu đồ tín hiệu ngoài event loop, có cache PNG và ghi lại thời gian vẽ từng ảnh."""
+    def __init__(self, max_workers: int = 2, cache_size: int = 256, bars: int = 120):
+        self.enabled = importlib.util.find_spec('matplotlib') is not None
+        if not self.enabled:
+            logger.warning("matplotlib is not installed; signal charts are disabled.")
+        self.max_workers = max_workers
+        self.bars = bars
+        self.cache_size = cache_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        # (symbol, số giây vẽ) của các ảnh gần nhất
+        self.render_times: Deque[Tuple[str, float]] = deque(maxlen=500)
+        self.cache_hits = 0
+
+    @staticmethod
+    def cache_key(signal: Dict[str, Any]) -> tuple:
+        levels = tuple(None if signal.get(f) is None else round(float(signal[f]), 10) for f in LEVEL_FIELDS)
+        return (signal.get('symbol'), str(signal.get('kline_open_time')), levels)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    async def render(self, signal: Dict[str, Any]) -> Optional[bytes]:
+        """PNG cho một tín hiệu, hoặc None nếu không vẽ được (không có matplotlib / không có nến trong cache)."""
+        if not self.enabled:
+            return None
+        key = self.cache_key(signal)
+        if key in self._cache:
+            self.cache_hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            png = await self._render_uncached(signal)
+            if png is not None:
+                self._cache[key] = png
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            future.set_result(png)
+            return png
+        except Exception as e:
+            logger.error(f"Chart rendering failed for {signal.get('symbol')}: {e}", exc_info=True)
+            future.set_result(None)
+            return None
+        finally:
+            if not future.done():  # Bị hủy giữa chừng: các yêu cầu trùng nhận None thay vì chờ mãi
+                future.set_result(None)
+            del self._inflight[key]
+
+    async def _render_uncached(self, signal: Dict[str, Any]) -> Optional[bytes]:
+        symbol = signal.get('symbol')
+        kline_time = pd.Timestamp(signal['kline_open_time']) if signal.get('kline_open_time') else None
+        if kline_time is not None and kline_time.tzinfo is None:
+            kline_time = kline_time.tz_localize('UTC')
+        candles = get_cached_candles(symbol, signal.get('timeframe') or config.TIMEFRAME, kline_time)
+        if candles is None or len(candles) < 2:
+            logger.info(f"No cached candles for {symbol}; sending signal without a chart.")
+            return None
+
+        levels = {f: float(signal[f]) for f in LEVEL_FIELDS if signal.get(f) is not None}
+        direction = 'LONG' if 'BULLISH' in (signal.get('trend') or '') else 'SHORT'
+        title = f"{symbol} {signal.get('timeframe') or config.TIMEFRAME} | {direction}"
+        png, seconds = await asyncio.get_running_loop().run_in_executor(
+            self._get_executor(), _render_chart_png,
+            title,
+            candles.index.as_unit('ms').asi8,
+            candles[['open', 'high', 'low', 'close']].to_numpy(dtype=np.float64),
+            levels,
+            (config.EMA_FAST, config.EMA_MEDIUM, config.EMA_SLOW),
+            config.BBANDS_PERIOD, config.BBANDS_STD_DEV, self.bars,
+        )
+        self.render_times.append((symbol, seconds))
+        logger.info(f"🖼️ Rendered chart for {symbol} in {seconds * 1000:.0f} ms ({len(png) // 1024} KB).")
+        return png
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,256 @@
+# command_bot.py
+# Lệnh Telegram qua long-polling getUpdates: /stats, /active, /signal BTCUSDT, /perf 24h.
+# Câu trả lời được dựng hoàn toàn từ state_cache (bộ nhớ), không truy vấn DB, nên thời gian xử lý tính bằng
+# micro/mili giây; câu trả lời được gửi qua dispatcher như mọi tin khác. Mỗi người dùng có một token bucket riêng.
+# Ngoại lệ duy nhất chạm DB: /start <token> (deep link từ /api/watchlist/telegram-link) gán chat hiện tại cho watchlist,
+# chạy trong asyncio.to_thread để không chặn event loop.
+import asyncio
+import logging
+import re
+import sqlite3
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from . import config
+from .markdown_template import escape
+from .notifications import LIVE_BOARD_POSITION_TEMPLATE, _signal_fields
+from .rate_limiter import TelegramDispatcher, TokenBucket, PRIORITY_NORMAL
+from .state_cache import StateCache
+from .signal_coalescer import signal_coalescer
+from .telegram_handler import TelegramHandler
+from .watchlists import init_watchlist_tables, redeem_chat_link_token
+
+logger = logging.getLogger(__name__)
+
+MAX_LISTED_SIGNALS = 20
+_DURATION = re.compile(r'^(\d+(?:\.\d+)?)\s*([mhd])$', re.IGNORECASE)
+_DURATION_SECONDS = {'m': 60, 'h': 3600, 'd': 86400}
+
+def parse_duration(text: str, default_seconds: float = 86400) -> Optional[float]:
+    """'30m' / '24h' / '7d' -> số giây; chuỗi rỗng -> default_seconds; sai cú pháp -> None."""
+    if not text:
+        return default_seconds
+    match = _DURATION.match(text.strip())
+    if not match:
+        return None
+    return float(match.group(1)) * _DURATION_SECONDS[match.group(2).lower()]
+
+def _num(value: Any, spec: str = '.5f') -> str:
+    if value is None:
+        return '`—`'
+    try:
+        return f"`{escape(format(float(value), spec))}`"
+    except (ValueError, TypeError):
+        return '`—`'
+
+class CommandBot:
+    """Đọc lệnh bằng getUpdates và trả lời từ StateCache."""
+    def __init__(self, telegram_handler: TelegramHandler, dispatcher: TelegramDispatcher, cache: StateCache):
+        self.telegram_handler = telegram_handler
+        self.dispatcher = dispatcher
+        self.cache = cache
+        self.commands: Dict[str, Callable[[List[str]], str]] = {
+            'start': self.cmd_help, 'help': self.cmd_help, 'stats': self.cmd_stats, 'active': self.cmd_active,
+            'signal': self.cmd_signal, 'perf': self.cmd_perf,
+        }
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._throttle_noticed: Dict[int, float] = {}
+        self._last_sweep = time.monotonic()
+        self._replies: set = set()
+        self._offset: Optional[int] = None
+        # Thời gian dựng câu trả lời (giây) của các lệnh gần nhất
+        self.response_times: Deque[float] = deque(maxlen=1000)
+        self.throttled_count = 0
+
+    # --- Lệnh ---
+
+    def cmd_help(self, args: List[str]) -> str:
+        return escape(
+            "Commands:\n"
+            "/stats - overall performance\n"
+            "/active - open signals\n"
+            "/signal BTCUSDT - latest analysis of a symbol\n"
+            "/perf 24h - performance over a window (30m, 24h, 7d)"
+        )
+
+    def link_chat(self, token: str, chat_id: Any) -> str:
+        """/start <token>: đổi token liên kết lấy chat đang nhắn, để watchlist của người dùng gửi về đây."""
+        try:
+            with sqlite3.connect(config.SQLITE_DB_PATH) as conn:
+                init_watchlist_tables(conn.cursor())
+                user_id = redeem_chat_link_token(conn, token, chat_id)
+        except sqlite3.Error as e:
+            logger.error(f"Linking chat {chat_id} failed: {e}", exc_info=True)
+            return escape("⚠️ Could not link this chat, please try again.")
+        if user_id is None:
+            return escape("⚠️ This link is invalid or has expired. Request a new one from the app.")
+        logger.info(f"🔗 Chat {chat_id} linked to watchlist of user {user_id}.")
+        return escape("✅ This chat will now receive your watchlist notifications.")
+
+    def cmd_stats(self, args: List[str]) -> str:
+        stats = self.cache.stats()
+        coalesced = signal_coalescer.report()
+        return (
+            f"📊 *Stats*\n\n"
+            f"Closed Trades: `{stats['total_completed_trades']}`\n"
+            f"Wins: `{stats['wins']}` \\| Losses: `{stats['losses']}`\n"
+            f"Win Rate: `{stats['win_rate']:.2f}%`\n"
+            f"Net PnL \\(1x\\): `{stats['net_pnl_percentage']:+.2f}%`\n"
+            f"Active Signals: `{stats['active']}`\n"
+            f"Duplicates Suppressed: `{coalesced['suppressed']}` \\({escape(format(coalesced['suppression_rate'], '.1f'))}%\\)"
+        )
+
+    def _signal_lines(self, signals: List[Dict[str, Any]]) -> List[str]:
+        lines = LIVE_BOARD_POSITION_TEMPLATE.render_many(_signal_fields(s, i + 1) for i, s in enumerate(signals[:MAX_LISTED_SIGNALS]))
+        if len(signals) > MAX_LISTED_SIGNALS:
+            lines.append(escape(f"... and {len(signals) - MAX_LISTED_SIGNALS} more"))
+        return lines
+
+    def cmd_active(self, args: List[str]) -> str:
+        signals = self.cache.active_list()
+        if not signals:
+            return escape("📂 No active signals.")
+        return "\n".join([f"📂 *Active Signals* \\({len(signals)}\\)", "", *self._signal_lines(signals)])
+
+    def cmd_signal(self, args: List[str]) -> str:
+        if not args:
+            return escape("Usage: /signal BTCUSDT")
+        symbol = args[0].upper()
+        if not symbol.endswith('USDT') and f"{symbol}USDT" in self.cache.latest_analysis:
+            symbol = f"{symbol}USDT"
+        analysis = self.cache.latest_analysis.get(symbol)
+        active = self.cache.active_list(symbol)
+        if analysis is None and not active:
+            return escape(f"No analysis for {symbol} yet.")
+        lines = [f"🔎 *{escape(symbol)}*", ""]
+        if analysis is not None:
+            age = time.time() - analysis['analysed_at']
+            lines += [
+                f"Trend: `{escape(analysis.get('trend'))}` \\({escape(analysis.get('method'))}\\)",
+                f"Price: {_num(analysis.get('price'))}",
+                f"RSI: {_num(analysis.get('rsi'), '.2f')} \\| ADX: {_num(analysis.get('adx'), '.2f')}",
+            ]
+            if analysis.get('confidence') is not None:
+                lines.append(f"Confidence: `{escape(format(analysis['confidence'] * 100, '.1f'))}%`")
+            lines.append(escape(f"Candle: {analysis.get('kline_time')} (analysed {age:.0f}s ago)"))
+        if active:
+            lines += ["", f"📂 *Active* \\({len(active)}\\)", *self._signal_lines(active)]
+        return "\n".join(lines)
+
+    def cmd_perf(self, args: List[str]) -> str:
+        window = parse_duration(args[0] if args else '')
+        if window is None or window <= 0:
+            return escape("Usage: /perf 24h (units: m, h, d)")
+        window = min(window, self.cache.window_seconds)
+        perf = self.cache.performance(window)
+        label = escape(args[0] if args else '24h')
+        if not perf['trades']:
+            return f"📈 *Performance {label}*\n\n" + escape("No trades closed in this window.")
+        lines = [
+            f"📈 *Performance {label}*", "",
+            f"Closed Trades: `{perf['trades']}`",
+            f"Wins: `{perf['wins']}` \\| Losses: `{perf['losses']}`",
+            f"Win Rate: `{perf['win_rate']:.2f}%`",
+            f"Net PnL \\(1x\\): `{perf['net_pnl_percentage']:+.2f}%`",
+        ]
+        if perf['best']:
+            lines.append(f"Best: {escape(perf['best'][0])} `{perf['best'][1]:+.2f}%` \\| Worst: {escape(perf['worst'][0])} `{perf['worst'][1]:+.2f}%`")
+        return "\n".join(lines)
+
+    # --- Xử lý update ---
+
+    def _allow(self, user_id: int, now: float) -> bool:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(config.TELEGRAM_COMMAND_RATE_PER_MINUTE / 60.0, config.TELEGRAM_COMMAND_BURST)
+        if bucket.wait_time(now) > 0:
+            return False
+        bucket.consume(now)
+        return True
+
+    def _evict_idle(self, now: float) -> None:
+        """
+        Bỏ trạng thái giới hạn của người dùng đã im lặng: bucket đầy và không dùng quá TELEGRAM_COMMAND_IDLE_SECONDS,
+        nhắc 'slow down' đã quá một phút. Cả hai đều tương đương một người dùng mới, nên việc dọn không đổi hành vi.
+        """
+        if now - self._last_sweep < config.TELEGRAM_COMMAND_SWEEP_SECONDS:
+            return
+        self._last_sweep = now
+        idle = [user_id for user_id, bucket in self._buckets.items()
+                if now - bucket.updated >= config.TELEGRAM_COMMAND_IDLE_SECONDS and bucket.is_full(now)]
+        for user_id in idle:
+            del self._buckets[user_id]
+        for user_id in [u for u, noticed in self._throttle_noticed.items() if now - noticed >= 60]:
+            del self._throttle_noticed[user_id]
+        if idle:
+            logger.debug(f"Evicted {len(idle)} idle command rate limit bucket(s); {len(self._buckets)} left.")
+
+    async def handle_update(self, update: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Trả về payload sendMessage cho update (None nếu không phải lệnh / bị giới hạn)."""
+        message = update.get('message') or {}
+        text = (message.get('text') or '').strip()
+        if not text.startswith('/'):
+            return None
+        start = time.perf_counter()
+        parts = text.split()
+        command = parts[0][1:].split('@', 1)[0].lower()
+        handler = self.commands.get(command)
+        if handler is None:
+            return None
+        user_id = (message.get('from') or {}).get('id') or message['chat']['id']
+        reply = {'chat_id': message['chat']['id'], 'reply_to_message_id': message.get('message_id'), 'parse_mode': 'MarkdownV2'}
+        if message.get('message_thread_id'):
+            reply['message_thread_id'] = message['message_thread_id']
+
+        now = time.monotonic()
+        self._evict_idle(now)
+        if not self._allow(user_id, now):
+            self.throttled_count += 1
+            # Chỉ nhắc một lần mỗi phút, các lệnh vượt giới hạn khác bị bỏ qua
+            if now - self._throttle_noticed.get(user_id, -60.0) < 60:
+                return None
+            self._throttle_noticed[user_id] = now
+            return {**reply, 'text': escape("⏳ Too many commands, please slow down.")}
+        try:
+            if command == 'start' and len(parts) > 1:
+                text = await asyncio.to_thread(self.link_chat, parts[1], message['chat']['id'])
+            else:
+                text = handler(parts[1:])
+        except Exception as e:
+            logger.error(f"Command '{command}' failed: {e}", exc_info=True)
+            text = escape("⚠️ Command failed.")
+        elapsed = time.perf_counter() - start
+        self.response_times.append(elapsed)
+        logger.info(f"💬 /{command} from {user_id} answered in {elapsed * 1000:.2f} ms.")
+        return {**reply, 'text': text}
+
+    async def _reply(self, payload: Dict[str, Any]) -> None:
+        try:
+            await self.dispatcher.submit(self.telegram_handler.send_message, priority=PRIORITY_NORMAL, **payload)
+        except Exception as e:
+            logger.error(f"Failed to answer command in chat {payload.get('chat_id')}: {e}")
+
+    async def run(self) -> None:
+        logger.info("✅ Telegram command handler starting (long-polling getUpdates)...")
+        failures = 0
+        while True:
+            try:
+                updates = await self.telegram_handler.get_updates(self._offset, timeout=config.TELEGRAM_COMMAND_POLL_TIMEOUT_SECONDS)
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                delay = min(60, 2 ** failures)
+                logger.error(f"getUpdates failed ({e}); retrying in {delay}s.")
+                await asyncio.sleep(delay)
+                continue
+            for update in updates:
+                self._offset = update['update_id'] + 1
+                payload = await self.handle_update(update)
+                if payload is not None:
+                    # Gửi nền để vòng poll không chờ dispatcher
+                    task = asyncio.create_task(self._reply(payload))
+                    self._replies.add(task)
+                    task.add_done_callback(self._replies.discard)
@@ -0,0 +1,138 @@
+# compiled_forest.py
+# "Biên dịch" RandomForestClassifier đã huấn luyện thành vài mảng NumPy phẳng (feature, threshold, con trái/phải,
+# xác suất lá của mọi nút của mọi cây) và một bộ đánh giá vector hóa đi qua mọi cây cho cả lô dòng cùng lúc.
+# Không có kiểm tra đầu vào / dispatch joblib cho từng cây như sklearn nên dự đoán 1 dòng nhanh hơn nhiều; kết quả
+# trùng từng bit với model.predict (cùng float32 cho X, cùng thứ tự cộng các cây) và được kiểm tra bằng verify().
+# Một CompiledForest chỉ là vài mảng -> rẻ để pickle sang worker của process pool; lưu/nạp bằng .npz.
+from typing import Any, Dict
+
+import numpy as np
+
+_LEAF = -1
+
+class CompiledForest:
+    """Có cùng giao diện dự đoán với RandomForestClassifier (classes_, predict_proba, predict) cho analysis_engine."""
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        # children[n] = (con phải, con trái): chỉ số con = children[n, x <= threshold]; lá có (-1, -1)
+        self.children = arrays['children']
+        self.is_leaf = self.children[:, 0] == _LEAF
+        self.missing_left = arrays['missing_left']
+        self.leaf_value = arrays['leaf_value']
+        self.roots = arrays['roots']
+        self.classes_ = arrays['classes']
+        self.n_features_in_ = int(arrays['n_features'])
+
+    @classmethod
+    def from_sklearn(cls, model: Any) -> 'CompiledForest':
+        """Chuyển một RandomForestClassifier (một đầu ra) đã fit thành mảng phẳng."""
+        if getattr(model, 'n_outputs_', 1) != 1:
+            raise ValueError("Only single-output forests can be compiled.")
+        n_classes = int(model.n_classes_)
+        parts = {key: [] for key in ('feature', 'threshold', 'children', 'missing_left', 'leaf_value')}
+        roots, offset = [], 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            roots.append(offset)
+            is_leaf = tree.children_left == _LEAF
+            parts['feature'].append(np.where(is_leaf, 0, tree.feature))
+            parts['threshold'].append(tree.threshold)
+            # Chỉ số con đổi sang chỉ số toàn cục; lá giữ -1
+            parts['children'].append(np.where(is_leaf[:, None], _LEAF, np.column_stack([tree.children_right, tree.children_left]) + offset))
+            missing = getattr(tree, 'missing_go_to_left', None)
+            parts['missing_left'].append(np.zeros(tree.node_count, dtype=bool) if missing is None else missing.astype(bool))
+            # Giống DecisionTreeClassifier.predict_proba: giá trị của nút (đã là tỉ lệ) cho các lớp
+            parts['leaf_value'].append(tree.value[:, 0, :n_classes])
+            offset += tree.node_count
+        return cls({
+            # Chỉ số nút/feature dạng int32 cho gọn; xác suất giữ float64 để trùng từng bit với sklearn
+            'feature': np.concatenate(parts['feature']).astype(np.int32),
+            'threshold': np.concatenate(parts['threshold']).astype(np.float64),
+            'children': np.concatenate(parts['children']).astype(np.int32),
+            'missing_left': np.concatenate(parts['missing_left']),
+            'leaf_value': np.concatenate(parts['leaf_value']).astype(np.float64),
+            'roots': np.asarray(roots, dtype=np.int32),
+            'classes': np.asarray(model.classes_),
+            'n_features': np.asarray(model.n_features_in_),
+        })
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.children, self.missing_left, self.leaf_value, self.roots))
+
+    def apply(self, X: Any) -> np.ndarray:
+        """Chỉ số (toàn cục) của lá mà mỗi dòng rơi vào ở mỗi cây, shape (n_rows, n_trees)."""
+        # sklearn so sánh X (float32) với threshold (float64)
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has {X.shape[1]} features, but the forest expects {self.n_features_in_}.")
+        n_rows, n_features = X.shape
+        flat_X = np.ascontiguousarray(X).ravel()
+        nodes = np.tile(self.roots, n_rows)
+        # Vị trí đầu hàng của mỗi cặp (dòng, cây) trong flat_X
+        row_offset = np.repeat(np.arange(n_rows, dtype=np.intp) * n_features, self.n_trees)
+        next_node = self.children.ravel()
+        # Chỉ đi tiếp các cặp (dòng, cây) chưa tới lá; danh sách co lại sau mỗi tầng
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        node = nodes[active]
+        offset = row_offset[active]
+        while active.size:
+            value = flat_X[offset + self.feature[node]]
+            go_left = value <= self.threshold[node]
+            missing = np.isnan(value)
+            if missing.any():
+                go_left = np.where(missing, self.missing_left[node], go_left)
+            node = next_node[2 * node + go_left]
+            done = self.is_leaf[node]
+            nodes[active[done]] = node[done]
+            inner = ~done
+            active, node, offset = active[inner], node[inner], offset[inner]
+        return nodes.reshape(n_rows, self.n_trees)
+
+    def predict_proba(self, X: Any) -> np.ndarray:
+        leaves = self.leaf_value.take(self.apply(X), axis=0) # (n_rows, n_trees, n_classes)
+        # Cộng lần lượt từng cây như RandomForestClassifier (cumsum cộng tuần tự, không cộng theo cặp) rồi chia số cây
+        proba = np.cumsum(leaves, axis=1)[:, -1, :] if self.n_trees > 1 else leaves[:, 0, :].copy()
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X: Any) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+    def save(self, path: str) -> None:
+        np.savez(path, feature=self.feature, threshold=self.threshold, children=self.children,
+                 missing_left=self.missing_left, leaf_value=self.leaf_value, roots=self.roots,
+                 classes=self.classes_, n_features=np.asarray(self.n_features_in_))
+
+    @classmethod
+    def load(cls, path: str) -> 'CompiledForest':
+        with np.load(path, allow_pickle=False) as data:
+            return cls({key: data[key] for key in data.files})
+
+def verify(compiled: CompiledForest, model: Any, X: Any) -> Dict[str, Any]:
+    """
+    So CompiledForest với model trên X: nhãn predict phải trùng hoàn toàn; xác suất so với sklearn chạy n_jobs=1
+    (khi n_jobs > 1 thứ tự cộng giữa các luồng không cố định nên chính sklearn cũng có thể lệch bit cuối).
+    """
+    n_jobs = model.n_jobs
+    model.set_params(n_jobs=1)
+    try:
+        expected_proba = model.predict_proba(X)
+        expected = model.predict(X)
+    finally:
+        model.set_params(n_jobs=n_jobs)
+    proba = compiled.predict_proba(np.asarray(X, dtype=np.float64))
+    predicted = compiled.predict(np.asarray(X, dtype=np.float64))
+    return {
+        'rows': len(expected),
+        'labels_identical': bool(np.array_equal(predicted, expected)),
+        'proba_identical': bool(np.array_equal(proba, expected_proba)),
+        'max_abs_diff': float(np.max(np.abs(proba - expected_proba))) if len(expected) else 0.0,
+    }
@@ -11,14 +11,58 @@ load_dotenv()
 API_KEY = os.getenv("API_KEY")
 API_SECRET = os.getenv("API_SECRET")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_BOT_USERNAME = os.getenv("TELEGRAM_BOT_USERNAME") # Username của bot (không có @), dùng cho deep link t.me/<bot>?start=
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 TELEGRAM_MESSAGE_THREAD_ID = os.getenv("TELEGRAM_MESSAGE_THREAD_ID") # ID của topic trong group (nếu có)
+TELEGRAM_PROXY_URL = os.getenv("TELEGRAM_PROXY_URL") # Proxy cho Telegram API (nếu có)
+
+# --- Kết nối HTTP tới Telegram (client dùng chung, keep-alive) ---
+TELEGRAM_HTTP2 = False # Cần cài gói 'h2'
+TELEGRAM_MAX_CONNECTIONS = 20
+TELEGRAM_MAX_KEEPALIVE_CONNECTIONS = 10
+TELEGRAM_KEEPALIVE_EXPIRY_SECONDS = 60.0
+TELEGRAM_CONNECT_TIMEOUT_SECONDS = 10.0
+TELEGRAM_READ_TIMEOUT_SECONDS = 30.0
+
+# --- Giới hạn gửi tin của Telegram (token bucket chủ động) ---
+TELEGRAM_GLOBAL_RATE_PER_SECOND = 30 # Toàn bộ bot
+TELEGRAM_PRIVATE_CHAT_RATE_PER_SECOND = 1 # Mỗi chat riêng
+TELEGRAM_GROUP_RATE_PER_MINUTE = 20 # Mỗi group/channel
+TELEGRAM_GROUP_BURST = 3 # Số tin được gửi dồn ngay vào một group/channel trước khi bị giãn nhịp
 
 # ==============================================================================
 # === 2. DATABASE
 # ==============================================================================
 SQLITE_DB_PATH = "trading_bot.db"
 
+# --- Outbox thông báo (bảng notification_outbox) ---
+OUTBOX_CLAIM_BATCH_SIZE = 200 # Số thông báo tối đa được claim mỗi lần flush
+OUTBOX_LEASE_SECONDS = 300 # Thông báo đã claim quá thời gian này (do crash/restart) sẽ được gửi lại
+OUTBOX_MAX_ATTEMPTS = 5 # Sau số lần gửi lỗi này thông báo bị đánh dấu FAILED
+OUTBOX_RETRY_BACKOFF_SECONDS = 30 # Chờ trước lần gửi lại đầu tiên (nhân đôi sau mỗi lần lỗi)
+OUTBOX_RETENTION_DAYS = 7 # Dòng DELIVERED/FAILED cũ hơn số ngày này bị xóa khỏi outbox
+OUTBOX_PURGE_INTERVAL_SECONDS = 3600 # Chu kỳ dọn outbox của FlushScheduler
+
+# Chính sách flush cho từng hàng đợi outbox. Một lô được gửi ngay khi:
+#   - có đủ max_batch thông báo đang chờ, hoặc
+#   - thông báo cũ nhất đã chờ max_wait_seconds (SLO độ trễ), hoặc
+#   - có thông báo khẩn: giá trị trường urgent_field nằm trong urgent_values
+NOTIFICATION_FLUSH_POLICIES = {
+    'signal': {'max_batch': 10, 'max_wait_seconds': 60, 'urgent_field': 'trend', 'urgent_values': ('STRONG_BULLISH', 'STRONG_BEARISH')},
+    'outcome': {'max_batch': 10, 'max_wait_seconds': 120, 'urgent_field': 'status', 'urgent_values': ('SL_HIT',)},
+}
+# Kiểm tra outbox định kỳ, phòng khi thông báo được ghi từ tiến trình/luồng khác không đánh thức được bộ lập lịch
+NOTIFICATION_FLUSH_POLL_SECONDS = 15
+# Hàng đợi flush xong mà thông báo cũ nhất vẫn còn (hoặc vòng lặp flush lỗi) chờ từng này giây, nhân đôi tới POLL_SECONDS
+NOTIFICATION_FLUSH_RETRY_SECONDS = 1
+
+# --- Biểu đồ đính kèm tín hiệu (cần matplotlib) ---
+ENABLE_SIGNAL_CHARTS = True
+CHART_TRENDS = ("STRONG_BULLISH", "STRONG_BEARISH") # Chỉ vẽ cho các tín hiệu có xu hướng này
+CHART_RENDER_WORKERS = 2 # Số process vẽ biểu đồ
+CHART_BARS = 120 # Số nến hiển thị
+CHART_CACHE_SIZE = 256 # Số ảnh PNG giữ trong bộ nhớ
+
 # ==============================================================================
 # === 3. SYMBOL & MARKET DATA SETTINGS
 # ==============================================================================
@@ -31,7 +75,7 @@ DATA_FETCH_LIMIT = 500 # Đã cập nhật theo yêu cầu trong file cũ của
 DYN_SYMBOLS_ENABLED = True 
 # Danh sách tĩnh này không còn được sử dụng khi DYN_SYMBOLS_ENABLED = True
 # STATIC_SYMBOLS = ["BTCUSDT", "ETHUSDT"] 
-CONCURRENT_REQUESTS = 10 # Số lượng yêu cầu đồng thời tối đa khi lấy dữ liệu từ Binance
+CONCURRENT_REQUESTS = 10 # Số yêu cầu Binance đồng thời tối đa, chung cho vòng phân tích, updater và simulator (binance_request_limiter)
 # ==============================================================================
 # === 4. ANALYSIS STRATEGY PARAMETERS
 # ==============================================================================
@@ -95,13 +139,130 @@ SIGNAL_CHECK_INTERVAL_SECONDS = 60 # 1 phút (Để nhận thông báo tín hi
 
 # Tần suất vòng lặp cập nhật trạng thái trade TP/SL (Đã rút ngắn)
 UPDATER_INTERVAL_SECONDS = 300 # 5 phút (Để kiểm tra thắng/thua nhanh hơn)
+# Số trang nến (1500 nến/trang) tối đa cho mỗi symbol khi tải lại lịch sử từ entry cũ nhất
+UPDATER_MAX_KLINE_PAGES = 10
+
+# Chế độ cập nhật TP/SL:
+#   'poll'   -> updater_loop tải nến mỗi UPDATER_INTERVAL_SECONDS
+#   'snapshot' -> mỗi lượt chỉ một request giá cho mọi symbol + bộ theo dõi high/low trong bộ nhớ
+#   'stream' -> nghe luồng mark price qua WebSocket và đóng lệnh ngay khi giá cắt qua mức
+TRADE_UPDATER_MODE = 'poll'
+# Chu kỳ của chế độ 'snapshot' (chi phí mỗi lượt cố định nên có thể chạy dày hơn)
+SNAPSHOT_UPDATER_INTERVAL_SECONDS = 30
+# Quá khoảng này giữa hai lượt quan sát thì coi là khoảng trống và bù bằng klines
+SNAPSHOT_MAX_GAP_SECONDS = 120
+MARK_PRICE_STREAM_URL = "wss://fstream.binance.com/ws/!markPrice@arr@1s"
 
 # Tần suất vòng lặp huấn luyện lại model AI (Đã tăng lên)
 TRAINING_INTERVAL_SECONDS = 14400 # 4 giờ
+# Chế độ huấn luyện lại:
+#   'incremental' -> mỗi chu kỳ chỉ đọc các lệnh đóng sau watermark của phiên bản model trước;
+#                    huấn luyện lại toàn bộ chỉ sau TRAINING_FULL_RETRAIN_INTERVAL_SECONDS
+#   'full'        -> mỗi chu kỳ đọc lại toàn bộ lịch sử và huấn luyện từ đầu (cách cũ)
+TRAINING_MODE = 'incremental'
+# Cách cập nhật tăng dần:
+#   'warm_start' -> thêm TRAINING_WARM_START_TREES cây (warm_start) học trên cửa sổ trượt các lệnh mới nhất,
+#                   bỏ cây cũ nhất khi vượt TRAINING_MAX_TREES
+#   'reservoir'  -> huấn luyện lại trên một mẫu reservoir có kích thước cố định của toàn bộ lịch sử
+TRAINING_INCREMENTAL_STRATEGY = 'warm_start'
+TRAINING_FULL_RETRAIN_INTERVAL_SECONDS = 7 * 86400
+TRAINING_WINDOW_ROWS = 20000 # Cửa sổ trượt cho warm_start
+TRAINING_WARM_START_TREES = 20
+TRAINING_MAX_TREES = 300
+TRAINING_RESERVOIR_SIZE = 50000
+# Lượt incremental cần ít nhất ngần này lệnh mới (để giữ lại 20% chấm điểm ngoài mẫu); ít hơn thì model giữ nguyên
+# và các lệnh đó được tích lũy cho lượt sau (watermark không tiến)
+TRAINING_INCREMENTAL_MIN_ROWS = 150
+# Accuracy của lượt incremental chỉ được công bố khi chấm trên ít nhất ngần này lệnh giữ lại (150 x 20% = 30)
+TRAINING_MIN_HOLDOUT_ROWS = 30
+TRAINING_STATE_PATH = "training_state.pkl" # Watermark, cửa sổ/reservoir và số phiên bản model
+TRAINING_HISTORY_PATH = "training_history.jsonl" # Mỗi dòng: thời gian huấn luyện + accuracy của một phiên bản
+# Bộ nạp dữ liệu huấn luyện (training_data.py): đọc trend_analysis theo khối vào các cột có kiểu
+TRAINING_LOADER_CHUNK_ROWS = 100000
+TRAINING_LOADER_SAMPLING = 'all' # 'all' | 'reservoir' (mẫu phân tầng cùng số WIN/LOSS, kích thước cố định)
+TRAINING_LOADER_WINDOW_DAYS = 0 # Chỉ học các tín hiệu trong N ngày gần nhất; 0 = toàn bộ lịch sử
+TRAINING_LOADER_RESERVOIR_SIZE = 200000 # Tổng số hàng của reservoir (một nửa mỗi nhãn)
+TRAINING_LOADER_MAX_MEMORY_MB = 512 # Trần bộ nhớ của các cột đã nạp; quá thì chỉ giữ các hàng mới nhất
+# Kho model có phiên bản (models/vXXXX + con trỏ CURRENT); analysis_loop tự đổi sang phiên bản mới giữa các chu kỳ
+MODEL_REGISTRY_DIR = "models"
+MODEL_REGISTRY_KEEP_VERSIONS = 10 # Số phiên bản giữ lại để quay lui
+MODEL_MMAP_LOAD = True # Nạp mảng của cây bằng mmap (đổi model rẻ, dùng chung page cache)
+MODEL_COMPILE_ENABLED = True # Công bố kèm bản biên dịch mảng phẳng (src/compiled_forest.py) của model
+MODEL_COMPILED_INFERENCE = True # Phân tích live dự đoán bằng bản biên dịch (nếu phiên bản có) thay vì sklearn
+# Huấn luyện trong một tiến trình con riêng (training_worker.py) để không tranh CPU/GIL với event loop,
+# Flask và vòng phân tích; tiến độ + kết quả gửi về qua pipe, bị dừng khi bot tắt.
+TRAINING_IN_SUBPROCESS = True
+TRAINING_MAX_CORES = 2 # Số core tiến trình huấn luyện được dùng (CPU affinity); 0 = không giới hạn
+TRAINING_MAX_MEMORY_MB = 4096 # Giới hạn bộ nhớ ảo (RLIMIT_AS); 0 = không giới hạn
+TRAINING_NICENESS = 10 # Độ ưu tiên thấp hơn tiến trình bot (0-19)
+TRAINING_N_JOBS = -1 # n_jobs của RandomForest (-1 = mọi core được phép dùng)
+# Đánh giá walk-forward (python -m src.walk_forward): các lệnh đã đóng chia theo thời gian thành
+# WALK_FORWARD_FOLDS + WALK_FORWARD_TRAIN_BLOCKS khối; mỗi fold huấn luyện trên các khối trước và chấm trên khối kế tiếp
+WALK_FORWARD_FOLDS = 5
+WALK_FORWARD_TRAIN_BLOCKS = 3 # Số khối huấn luyện của fold đầu tiên
+WALK_FORWARD_WINDOW = 'rolling' # 'rolling' (luôn WALK_FORWARD_TRAIN_BLOCKS khối gần nhất) | 'expanding' (mọi khối trước đó)
+WALK_FORWARD_EMBARGO_HOURS = 24 # Bỏ các lệnh huấn luyện vào trong khoảng này trước tập kiểm tra (lệnh còn đang chạy)
+WALK_FORWARD_WORKERS = 0 # Số tiến trình của pool; 0 = số core
+WALK_FORWARD_PARAM_GRID = {
+    'n_estimators': [100, 200],
+    'max_depth': [None, 12],
+    'min_samples_leaf': [1, 5],
+    'class_weight': ['balanced'],
+}
+WALK_FORWARD_CACHE_DIR = "walk_forward_cache" # X/y + chỉ số từng fold, theo dấu vân tay của DB và cấu hình
+WALK_FORWARD_RESULTS_PATH = "walk_forward_results.csv"
+# Kho feature dạng cột (feature_store.py) khóa theo (symbol, timeframe, open time, phiên bản bộ feature):
+# simulator và vòng phân tích ghi feature của nến đã đóng một lần, trainer/backtest đọc lại thay vì tính lại.
+FEATURE_STORE_ENABLED = True
+FEATURE_STORE_DIR = "feature_store"
+FEATURE_STORE_MAX_SEGMENTS = 64 # Quá số segment này thì gộp phân vùng thành một tệp
+# Mô phỏng dữ liệu lúc khởi động (data_simulator.py): nến tải đồng thời theo CONCURRENT_REQUESTS,
+# chỉ báo + lệnh mô phỏng tính trong process pool, ghi DB bằng một executemany.
+SIMULATOR_WORKERS = 0 # Số tiến trình tính chỉ báo; 0 = số core, 1 = tính trong thread (không spawn)
+SIMULATOR_TRADES_PER_SYMBOL = 9 # Kết quả TP/SL được tính vector hóa nên có thể đặt tới hàng nghìn (tối đa một lệnh mỗi nến)
+SIMULATOR_HORIZON_CANDLES = 5 # Số nến sau entry được xét; không chạm TP/SL thì đóng ở giá close của nến cuối
+# Backtest offline (backtest.py): phát lại nến lưu cục bộ qua đúng code chiến lược (analysis_engine) và quy tắc
+# TP/SL của updater, mỗi symbol một tác vụ trong process pool. Tệp nến theo định dạng dữ liệu tải về của Binance:
+# <SYMBOL>-<timeframe>[-...].csv / .csv.gz / .zip (có hoặc không có dòng tiêu đề).
+BACKTEST_DATA_DIR = "klines"
+BACKTEST_WORKERS = 0 # Số tiến trình; 0 = số core, 1 = chạy trong tiến trình hiện tại
+BACKTEST_MAX_HOLD_BARS = 0 # Quá số nến này chưa chạm TP/SL thì đóng tay (CLOSED_MANUAL); 0 = giữ như updater
+BACKTEST_TRADES_PATH = "backtest_trades.csv"
+BACKTEST_STATS_PATH = "backtest_stats.csv"
+BACKTEST_MODEL_VERSION = None # Phiên bản model cho chiến lược AI (vd. 'v0003'); None = CURRENT. Chỉ nến sau watermark của nó được chấm
 
 # Tần suất vòng lặp gửi báo cáo tổng kết (Đã tăng lên)
 SUMMARY_INTERVAL_SECONDS = 14400 # 4 giờ (Để tránh spam báo cáo)
 
+# "Bảng trực tiếp": sửa tại chỗ một tin tóm tắt + lệnh đang mở cho mỗi chat (editMessageText) thay vì gửi tin mới.
+# Nội dung không đổi thì không gọi API, nên có thể làm mới dày mà gần như không tốn hạn mức gửi.
+LIVE_BOARD_ENABLED = True
+LIVE_BOARD_REFRESH_SECONDS = 60
+LIVE_BOARD_PIN = True # Ghim bảng khi gửi mới (cần quyền ghim trong group/channel)
+LIVE_BOARD_MAX_POSITIONS = 30 # Số lệnh đang mở tối đa liệt kê trên bảng
+
+# Watchlist riêng của người dùng: tín hiệu/kết quả khớp (symbol, phương pháp, độ tin cậy tối thiểu) được gửi thêm
+# tới chat Telegram của họ, sau group/channel. Quản lý qua API /api/watchlist.
+ENABLE_USER_WATCHLISTS = True
+WATCHLIST_MAX_ENTRIES_PER_USER = 200
+WATCHLIST_LINK_TOKEN_TTL_SECONDS = 900 # Thời hạn của token liên kết chat (/start <token>) do /api/watchlist/telegram-link cấp
+
+# Lệnh Telegram (/stats, /active, /signal BTCUSDT, /perf 24h) qua long-polling getUpdates.
+# Câu trả lời lấy từ bộ đệm trong bộ nhớ (state_cache.py), không truy vấn DB.
+ENABLE_TELEGRAM_COMMANDS = True
+TELEGRAM_COMMAND_POLL_TIMEOUT_SECONDS = 25 # Thời gian giữ kết nối getUpdates
+TELEGRAM_COMMAND_RATE_PER_MINUTE = 10 # Giới hạn lệnh cho mỗi người dùng
+TELEGRAM_COMMAND_BURST = 3
+TELEGRAM_COMMAND_IDLE_SECONDS = 600 # Bucket giới hạn của người dùng không gửi lệnh trong khoảng này (và đã đầy) bị xóa khỏi bộ nhớ
+TELEGRAM_COMMAND_SWEEP_SECONDS = 60 # Chu kỳ dọn các bucket đó
+STATE_CACHE_PERF_WINDOW_SECONDS = 7 * 86400 # Khung thời gian dài nhất cho /perf
+
+# Gộp tín hiệu trùng: trong cửa sổ này, tín hiệu cùng symbol + hướng bị bỏ qua nếu tín hiệu trước vẫn ACTIVE
+# (không ghi DB, không gửi Telegram, updater không phải theo dõi thêm). 0 = chỉ bỏ tín hiệu trùng nến.
+SIGNAL_COALESCE_WINDOW_SECONDS = 4 * 3600
+# Cửa sổ riêng, khóa "SYMBOL:LONG" / "SYMBOL:SHORT" hoặc "SYMBOL", vd. {"BTCUSDT": 3600, "ETHUSDT:SHORT": 7200}
+SIGNAL_COALESCE_WINDOW_OVERRIDES = {}
+
 # Tần suất gửi tin nhắn "nhịp tim" báo bot còn sống
 HEARTBEAT_INTERVAL_SECONDS = 1800 # 30 p
 # ==============================================================================
@@ -113,6 +274,8 @@ API_SECRET_PLACEHOLDER = "YOUR_API_SECRET_HERE"
 TELEGRAM_BOT_TOKEN_PLACEHOLDER = "YOUR_TELEGRAM_BOT_TOKEN"
 TELEGRAM_CHAT_ID_PLACEHOLDER = "YOUR_TELEGRAM_CHAT_ID"
 TELEGRAM_CHANNEL_ID = os.getenv("TELEGRAM_CHANNEL_ID")
+# Các đích nhận thông báo bổ sung (group/channel/topic), dạng "chat_id[:thread_id],..."
+TELEGRAM_EXTRA_DESTINATIONS = os.getenv("TELEGRAM_EXTRA_DESTINATIONS", "")
 
 ENABLE_ANALYSIS_LOOP=True
 ENABLE_SIGNAL_NOTIFICATIONS=True
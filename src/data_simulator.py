@@ -1,10 +1,15 @@
 # data_simulator.py
 import asyncio
+import concurrent.futures
+import multiprocessing
 import sqlite3
 import random
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timedelta, timezone
 import logging
 import os 
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
 import pandas as pd
 import pandas_ta as ta
 import json # Import json to read config.json directly
@@ -13,6 +18,10 @@ from .pairlist_updater import perform_single_pairlist_update, CONFIG_FILE_PATH a
 
 # Assume config.py exists in the same directory or is importable
 from . import config  # Import config to access trading settings and database path
+from .features import add_indicators, feature_frame
+from .feature_store import feature_store
+from .market_data_handler import binance_request_limiter
+from .updater import first_hit_outcomes
 from binance import AsyncClient
 
 # Configure logging
@@ -30,27 +39,132 @@ async def fetch_klines(client, symbol, interval, start_str, end_str=None):
     try:
         klines = await client.get_historical_klines(symbol, interval, start_str, end_str)
         # Convert klines to a more usable format (list of dicts)
+        # Thời gian theo UTC (có múi giờ) như market_data_handler, để khóa feature store khớp với đường live trên mọi máy
         parsed_klines = []
         for kline in klines:
             parsed_klines.append({
-                'open_time': datetime.fromtimestamp(kline[0] / 1000),
+                'open_time': datetime.fromtimestamp(kline[0] / 1000, tz=timezone.utc),
                 'open': float(kline[1]),
                 'high': float(kline[2]),
                 'low': float(kline[3]),
                 'close': float(kline[4]),
                 'volume': float(kline[5]),
-                'close_time': datetime.fromtimestamp(kline[6] / 1000)
+                'close_time': datetime.fromtimestamp(kline[6] / 1000, tz=timezone.utc)
             })
         return parsed_klines
     except Exception as e:
         logger.error(f"Error fetching klines for {symbol}: {e}")
         return []
 
-async def simulate_trade_data(client: AsyncClient, db_path: str, all_symbols: list, num_trades_per_symbol: int = 9, lookback_days: int = 30):
+_INSERT_SQL = """
+    INSERT INTO trend_analysis (
+        analysis_timestamp_utc, symbol, timeframe, last_price, timestamp_utc,
+        ema_fast_len, ema_fast_val, ema_medium_len, ema_medium_val, ema_slow_len, ema_slow_val,
+        rsi_len, rsi_val, trend, kline_open_time,
+        bbands_lower, bbands_middle, bbands_upper, atr_val,
+        macd, macd_signal, macd_hist, adx,
+        entry_price, stop_loss, take_profit_1, take_profit_2, take_profit_3, status, method,
+        exit_price, pnl_percentage, pnl_with_leverage, outcome_timestamp_utc, entry_timestamp_utc
+    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+# SL/TP theo phần trăm giá vào lệnh: SL 2.5%, TP1/TP2/TP3 2.8% / 3.6% / 4.9%
+_SL_FACTOR = 0.025
+_TP_FACTORS = (0.028, 0.036, 0.049)
+
+def _simulate_symbol(symbol: str, klines: List[Dict[str, Any]], num_trades_per_symbol: int, run_timestamp: str) -> Tuple[List[tuple], pd.DataFrame]:
+    """
+    Chạy trong worker của process pool: tính chỉ báo cho nến của một symbol và mô phỏng các lệnh.
+    Trả về (các hàng để executemany, feature của các nến đã đóng cho feature store); không đụng tới DB.
+    """
+    # Convert klines to a DataFrame for indicator calculation
+    df = pd.DataFrame(klines)
+    df.set_index('open_time', inplace=True)
+
+    # Calculate all necessary indicators for the entire DataFrame (định nghĩa dùng chung trong features.py)
+    add_indicators(df)
+    # CẢI TIẾN: Xóa các hàng có giá trị NaN sau khi tính toán tất cả các chỉ báo
+    df.dropna(inplace=True)
+    features = feature_frame(df)
+    # Feature của các nến đã đóng được ghi một lần (ở tiến trình chính); trainer đọc lại thay vì tính lại
+    closed_features = features[(df['close_time'] < datetime.now(timezone.utc)).to_numpy()]
+
+    # Simple strategy: simulate a trade every N candles
+    candles_per_trade = len(df) // num_trades_per_symbol
+    if candles_per_trade < 1:
+        candles_per_trade = 1 # Ensure at least one trade if not enough klines
+    # Bắt đầu từ đầu vì đã dropna()
+    entries = np.arange(0, max(len(df) - 6, 0), candles_per_trade)[:num_trades_per_symbol]
+    if not len(entries):
+        return [], closed_features
+
+    entry_prices = df['close'].to_numpy(dtype=float)[entries]
+    # Randomly choose trend (cùng nhãn STRONG_* như tín hiệu live, để one-hot 'trend' của trainer khớp lúc phục vụ)
+    trends = np.array(random.choices([config.TREND_STRONG_BULLISH, config.TREND_STRONG_BEARISH], k=len(entries)))
+    is_long = trends == config.TREND_STRONG_BULLISH
+    # Định nghĩa SL/TP dựa trên các phần trăm yêu cầu (lệnh short: đối xứng qua giá vào)
+    direction = np.where(is_long, 1.0, -1.0)
+    stop_loss = entry_prices * (1 - direction * _SL_FACTOR)
+    take_profit_1, take_profit_2, take_profit_3 = (entry_prices * (1 + direction * factor) for factor in _TP_FACTORS)
+
+    # Kết quả trong SIMULATOR_HORIZON_CANDLES nến tiếp theo cho mọi lệnh cùng lúc (ưu tiên SL, rồi TP3 > TP2 > TP1);
+    # không chạm mức nào thì đóng tay ở giá close của nến cuối cửa sổ
+    statuses, exit_prices, _ = first_hit_outcomes(
+        df['high'].to_numpy(dtype=float), df['low'].to_numpy(dtype=float), df['close'].to_numpy(dtype=float),
+        entries, is_long, stop_loss, take_profit_1, take_profit_2, take_profit_3, config.SIMULATOR_HORIZON_CANDLES
+    )
+    pnl_percentage = (exit_prices - entry_prices) / entry_prices * 100 * direction # Đảo dấu PnL cho lệnh short
+    pnl_with_leverage = pnl_percentage * config.LEVERAGE
+
+    # Get indicator values for the entry klines
+    entry_features = features.to_numpy()[entries]
+    column = {name: i for i, name in enumerate(features.columns)}
+    entry_times = df.index[entries]
+    rows = [(
+        run_timestamp,
+        symbol,
+        config.TIMEFRAME,
+        float(entry_prices[k]), # last_price
+        entry_times[k].timestamp(), # timestamp_utc
+        config.EMA_FAST, float(values[column['ema_fast_val']]),
+        config.EMA_MEDIUM, float(values[column['ema_medium_val']]),
+        config.EMA_SLOW, float(values[column['ema_slow_val']]),
+        config.RSI_PERIOD, float(values[column['rsi_val']]),
+        str(trends[k]),
+        entry_times[k].isoformat(), # kline_open_time
+        float(values[column['bbands_lower']]), float(values[column['bbands_middle']]), float(values[column['bbands_upper']]),
+        float(values[column['atr_val']]),
+        float(values[column['macd']]), float(values[column['macd_signal']]), float(values[column['macd_hist']]), float(values[column['adx']]),
+        float(entry_prices[k]),
+        float(stop_loss[k]),
+        float(take_profit_1[k]), float(take_profit_2[k]), float(take_profit_3[k]),
+        str(statuses[k]),
+        "SIMULATED", # method
+        float(exit_prices[k]),
+        float(pnl_percentage[k]),
+        float(pnl_with_leverage[k]),
+        run_timestamp, # outcome_timestamp_utc
+        entry_times[k].isoformat() # entry_timestamp_utc
+    ) for k, values in enumerate(entry_features)]
+    return rows, closed_features
+
+def _indicator_pool(n_symbols: int) -> Optional[concurrent.futures.ProcessPoolExecutor]:
+    """Process pool tính chỉ báo; None (= thread executor mặc định) khi chỉ có một worker, tránh chi phí spawn."""
+    workers = min(config.SIMULATOR_WORKERS or os.cpu_count() or 1, n_symbols)
+    if workers <= 1:
+        return None
+    return concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+
+async def simulate_trade_data(client: AsyncClient, db_path: str, all_symbols: list, num_trades_per_symbol: Optional[int] = None, lookback_days: int = 30) -> Dict[str, Any]:
     """
     Simulates historical trade data and inserts it into the trend_analysis table.
     This function will clear existing data in trend_analysis before inserting new.
+    Nến của các symbol được tải đồng thời qua binance_request_limiter (chung giới hạn CONCURRENT_REQUESTS với updater và vòng phân tích);
+    mỗi symbol tải xong được đưa ngay sang process pool để tính chỉ báo và mô phỏng lệnh,
+    rồi mọi lệnh được ghi bằng một executemany trong cùng transaction với lệnh xóa dữ liệu cũ.
     """
+    started = time.perf_counter()
+    num_trades_per_symbol = num_trades_per_symbol or config.SIMULATOR_TRADES_PER_SYMBOL
     logger.info(f"Starting trade data simulation for {num_trades_per_symbol} trades per symbol over {lookback_days} days.")
     
     # all_symbols is now passed as an argument, reflecting the latest from config.json
@@ -63,213 +177,63 @@ async def simulate_trade_data(client: AsyncClient, db_path: str, all_symbols: li
         
     logger.info(f"Will simulate data for {len(symbols_to_simulate)} symbols: {symbols_to_simulate}")
 
-    # Clear existing data to ensure a fresh start for simulation
-    try:
-        with get_db_connection(db_path) as conn:
-            conn.execute("DELETE FROM trend_analysis")
-            conn.commit()
-        logger.info("Cleared existing data from 'trend_analysis' table.")
-    except Exception as e:
-        logger.error(f"Error clearing 'trend_analysis' table: {e}")
-        return
+    end_date = datetime.utcnow()
+    start_date = end_date - timedelta(days=lookback_days)
+    run_timestamp = end_date.isoformat()
+    semaphore = binance_request_limiter()
+    loop = asyncio.get_running_loop()
+    pool = _indicator_pool(len(symbols_to_simulate))
 
-    for symbol in symbols_to_simulate:
-        logger.info(f"Simulating trades for {symbol}...")
-        end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=lookback_days)
-        
-        klines = await fetch_klines(client, symbol, config.TIMEFRAME, 
-                                    start_date.strftime('%d %b %Y %H:%M:%S'), 
-                                    end_date.strftime('%d %b %Y %H:%M:%S'))
-        
+    async def simulate(symbol: str):
+        async with semaphore:
+            klines = await fetch_klines(client, symbol, config.TIMEFRAME,
+                                        start_date.strftime('%d %b %Y %H:%M:%S'),
+                                        end_date.strftime('%d %b %Y %H:%M:%S'))
         if not klines:
             logger.warning(f"No klines fetched for {symbol}. Skipping simulation for this symbol.")
-            continue
-
-        # Convert klines to a DataFrame for indicator calculation
-        df = pd.DataFrame(klines)
-        df.set_index('open_time', inplace=True)
+            return None
+        return await loop.run_in_executor(pool, _simulate_symbol, symbol, klines, num_trades_per_symbol, run_timestamp)
 
-        # Calculate all necessary indicators for the entire DataFrame
-        df.ta.ema(length=config.EMA_FAST, append=True)
-        df.ta.ema(length=config.EMA_MEDIUM, append=True)
-        df.ta.ema(length=config.EMA_SLOW, append=True)
-        df.ta.rsi(length=config.RSI_PERIOD, append=True)
-        df.ta.bbands(length=config.BBANDS_PERIOD, std=config.BBANDS_STD_DEV, append=True)
-        df.ta.atr(length=config.ATR_PERIOD, append=True)
-        # CẢI TIẾN: Thêm các chỉ báo còn thiếu để khớp với schema
-        df.ta.macd(fast=config.MACD_FAST_PERIOD, slow=config.MACD_SLOW_PERIOD, signal=config.MACD_SIGNAL_PERIOD, append=True)
-        df.ta.adx(length=config.ADX_PERIOD, append=True)
-        # CẢI TIẾN: Xóa các hàng có giá trị NaN sau khi tính toán tất cả các chỉ báo
-        df.dropna(inplace=True)
-
-        # Simple strategy: simulate a trade every N candles
-        candles_per_trade = len(df) // num_trades_per_symbol
-        if candles_per_trade < 1:
-            candles_per_trade = 1 # Ensure at least one trade if not enough klines
-
-        trade_counter = 0
-        # Bắt đầu từ đầu vì đã dropna()
-        for i in range(0, len(df) - 6, candles_per_trade):
-            if trade_counter >= num_trades_per_symbol:
-                break
-
-            # Get data for the entry candle from the DataFrame
-            entry_kline = df.iloc[i]
-            entry_price = entry_kline['close']
-            
-            # Randomly choose trend
-            trend = random.choice(['BULLISH', 'BEARISH'])
-            
-            # Định nghĩa SL/TP dựa trên các phần trăm yêu cầu
-            sl_factor = 0.025 # 2.5%
-            tp1_factor = 0.028 # 2.8%
-            tp2_factor = 0.036 # 3.6%
-            tp3_factor = 0.049 # 4.9%
-            
-            if trend == 'BULLISH':
-                stop_loss = entry_price * (1 - sl_factor)
-                take_profit_1 = entry_price * (1 + tp1_factor)
-                take_profit_2 = entry_price * (1 + tp2_factor)
-                take_profit_3 = entry_price * (1 + tp3_factor)
-            else: # BEARISH
-                stop_loss = entry_price * (1 + sl_factor)
-                take_profit_1 = entry_price * (1 - tp1_factor)
-                take_profit_2 = entry_price * (1 - tp2_factor)
-                take_profit_3 = entry_price * (1 - tp3_factor)
+    try:
+        results = await asyncio.gather(*(simulate(s) for s in symbols_to_simulate), return_exceptions=True)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    simulated_seconds = time.perf_counter() - started
 
-            # Mô phỏng kết quả trong vài nến tiếp theo, kiểm tra tất cả các TP
-            exit_price = None
-            status = 'ACTIVE'
-            
-            for j in range(i + 1, min(i + 6, len(df))): # Check next 5 candles
-                outcome_kline = df.iloc[j]
-                sl_hit = False
-                tp_hit = False
-                exit_price_candidate = None
-                status_candidate = None
-                
-                if trend == 'BULLISH':
-                    # Luôn kiểm tra SL trước (giả định thận trọng)
-                    if outcome_kline['low'] <= stop_loss:
-                        sl_hit = True
-                    
-                    # Sau đó kiểm tra các mức TP
-                    if outcome_kline['high'] >= take_profit_3:
-                        tp_hit = True
-                        exit_price_candidate = take_profit_3
-                        status_candidate = 'TP3_HIT'
-                    elif outcome_kline['high'] >= take_profit_2:
-                        tp_hit = True
-                        exit_price_candidate = take_profit_2
-                        status_candidate = 'TP2_HIT'
-                    elif outcome_kline['high'] >= take_profit_1:
-                        tp_hit = True
-                        exit_price_candidate = take_profit_1
-                        status_candidate = 'TP1_HIT'
-                else: # BEARISH
-                    if outcome_kline['high'] >= stop_loss:
-                        sl_hit = True
+    rows = []
+    for symbol, result in zip(symbols_to_simulate, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error simulating trades for {symbol}: {result}")
+            continue
+        if result is None:
+            continue
+        symbol_rows, closed_features = result
+        if config.FEATURE_STORE_ENABLED:
+            feature_store.write(symbol, config.TIMEFRAME, closed_features)
+        rows.extend(symbol_rows)
+        logger.info(f"Finished simulating {len(symbol_rows)} trades for {symbol}.")
 
-                    if outcome_kline['low'] <= take_profit_3:
-                        tp_hit = True
-                        exit_price_candidate = take_profit_3
-                        status_candidate = 'TP3_HIT'
-                    elif outcome_kline['low'] <= take_profit_2:
-                        tp_hit = True
-                        exit_price_candidate = take_profit_2
-                        status_candidate = 'TP2_HIT'
-                    elif outcome_kline['low'] <= take_profit_1:
-                        tp_hit = True
-                        exit_price_candidate = take_profit_1
-                        status_candidate = 'TP1_HIT'
-                
-                # Ưu tiên SL nếu cả hai cùng bị chạm trong một nến
-                if sl_hit:
-                    exit_price = stop_loss
-                    status = 'SL_HIT'
-                    break
-                elif tp_hit:
-                    exit_price = exit_price_candidate
-                    status = status_candidate
-                    break
-            
-            # If no SL/TP hit within 5 candles, close manually at last candle's close
-            if status == 'ACTIVE':
-                exit_price = df.iloc[min(i + 5, len(df) - 1)]['close'] # Close at the end of the check window
-                status = 'CLOSED_MANUAL' # Standardize status for clarity
-            pnl_percentage = None
-            pnl_with_leverage = None
-            if exit_price is not None:
-                try:
-                    pnl = ((exit_price - entry_price) / entry_price) * 100
-                    if trend == 'BEARISH':
-                        pnl *= -1 # Đảo dấu PnL cho lệnh short
-                    pnl_percentage = pnl
-                    pnl_with_leverage = pnl * config.LEVERAGE # Assuming LEVERAGE is in config
-                except (TypeError, ZeroDivisionError):
-                    logger.warning(f"Could not calculate PnL for {symbol} trade at {entry_kline.name}.")
-            
-            # Get indicator values for the entry kline
-            ema_fast_val = entry_kline.get(f'EMA_{config.EMA_FAST}')
-            ema_medium_val = entry_kline.get(f'EMA_{config.EMA_MEDIUM}')
-            ema_slow_val = entry_kline.get(f'EMA_{config.EMA_SLOW}')
-            rsi_val = entry_kline.get(f'RSI_{config.RSI_PERIOD}')
-            # SỬA LỖI: Lấy đúng giá trị ATR từ cột được tạo bởi pandas-ta
-            atr_val = entry_kline.get(f'ATRr_{config.ATR_PERIOD}')
-            bb_lower = entry_kline.get(f'BBL_{config.BBANDS_PERIOD}_{config.BBANDS_STD_DEV}')
-            bb_middle = entry_kline.get(f'BBM_{config.BBANDS_PERIOD}_{config.BBANDS_STD_DEV}')
-            bb_upper = entry_kline.get(f'BBU_{config.BBANDS_PERIOD}_{config.BBANDS_STD_DEV}')
-            macd = entry_kline.get(f'MACD_{config.MACD_FAST_PERIOD}_{config.MACD_SLOW_PERIOD}_{config.MACD_SIGNAL_PERIOD}')
-            macd_signal = entry_kline.get(f'MACDs_{config.MACD_FAST_PERIOD}_{config.MACD_SLOW_PERIOD}_{config.MACD_SIGNAL_PERIOD}')
-            macd_hist = entry_kline.get(f'MACDh_{config.MACD_FAST_PERIOD}_{config.MACD_SLOW_PERIOD}_{config.MACD_SIGNAL_PERIOD}')
-            adx = entry_kline.get(f'ADX_{config.ADX_PERIOD}')
+    # Clear existing data to ensure a fresh start for simulation; xóa và ghi trong một transaction
+    write_started = time.perf_counter()
+    try:
+        with get_db_connection(db_path) as conn:
+            conn.execute("DELETE FROM trend_analysis")
+            conn.executemany(_INSERT_SQL, rows)
+    except Exception as e:
+        logger.error(f"Error writing simulated trades to 'trend_analysis': {e}")
+        rows = []
+    write_seconds = time.perf_counter() - write_started
 
-            # Insert into DB
-            try:
-                with get_db_connection(db_path) as conn:
-                    # SỬA LỖI: Thay thế hoàn toàn câu lệnh INSERT để khớp với schema mới nhất
-                    conn.execute("""
-                        INSERT INTO trend_analysis (
-                            analysis_timestamp_utc, symbol, timeframe, last_price, timestamp_utc,
-                            ema_fast_len, ema_fast_val, ema_medium_len, ema_medium_val, ema_slow_len, ema_slow_val,
-                            rsi_len, rsi_val, trend, kline_open_time,
-                            bbands_lower, bbands_middle, bbands_upper, atr_val,
-                            macd, macd_signal, macd_hist, adx,
-                            entry_price, stop_loss, take_profit_1, take_profit_2, take_profit_3, status, method,
-                            exit_price, pnl_percentage, pnl_with_leverage, outcome_timestamp_utc, entry_timestamp_utc
-                        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                    """, (
-                        datetime.utcnow().isoformat(),
-                        symbol, 
-                        config.TIMEFRAME,
-                        entry_price, # last_price
-                        entry_kline.name.timestamp(), # timestamp_utc
-                        config.EMA_FAST, ema_fast_val,
-                        config.EMA_MEDIUM, ema_medium_val,
-                        config.EMA_SLOW, ema_slow_val,
-                        config.RSI_PERIOD, rsi_val,
-                        trend, 
-                        entry_kline.name.isoformat(), # kline_open_time
-                        bb_lower, bb_middle, bb_upper,
-                        atr_val,
-                        macd, macd_signal, macd_hist, adx,
-                        entry_price, 
-                        stop_loss, 
-                        take_profit_1, take_profit_2, take_profit_3,
-                        status,
-                        "SIMULATED", # method
-                        exit_price, 
-                        pnl_percentage, 
-                        pnl_with_leverage,
-                        datetime.utcnow().isoformat() if status != 'ACTIVE' else None, # outcome_timestamp_utc
-                        entry_kline.name.isoformat() # entry_timestamp_utc
-                    ))
-                    conn.commit()
-                trade_counter += 1
-            except Exception as e:
-                logger.error(f"Error inserting simulated trade for {symbol}: {e}")
-        logger.info(f"Finished simulating {trade_counter} trades for {symbol}.")
+    seconds = time.perf_counter() - started
+    report = {
+        'symbols': len(symbols_to_simulate), 'rows': len(rows), 'seconds': seconds,
+        'simulate_seconds': simulated_seconds, 'write_seconds': write_seconds,
+        'rows_per_second': len(rows) / seconds if seconds > 0 else 0.0,
+    }
+    logger.info(f"🧪 Simulated {report['rows']} trades for {report['symbols']} symbols in {seconds:.2f}s "
+                f"(fetch + indicators {simulated_seconds:.2f}s, write {write_seconds:.3f}s, {report['rows_per_second']:.0f} rows/s).")
+    return report
 
 async def main():
     logger.info("Initializing data simulation...")
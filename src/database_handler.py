@@ -3,6 +3,10 @@ import sqlite3
 import logging
 from typing import List
 
+from .outbox import init_outbox_table
+from .live_board import init_live_board_table
+from .watchlists import init_watchlist_tables
+
 # Cấu hình logging cơ bản để có thể chạy file một cách độc lập
 logging.basicConfig(
     level=logging.INFO, 
@@ -61,7 +65,8 @@ def init_sqlite_db(db_path: str):
             outcome_timestamp_utc TEXT,
             exit_price REAL, 
             pnl_percentage REAL, -- Changed from pnl_percent to pnl_percentage
-            pnl_with_leverage REAL -- Added new column for PnL with leverage
+            pnl_with_leverage REAL, -- Added new column for PnL with leverage
+            confidence REAL -- Xác suất của lớp dự đoán (chỉ có với model AI)
         );
         """
         cursor.execute(create_table_query)
@@ -82,7 +87,8 @@ def init_sqlite_db(db_path: str):
             "pnl_with_leverage": "REAL",
             "exit_price": "REAL",
             "outcome_timestamp_utc": "TEXT",
-            "entry_timestamp_utc": "TEXT"
+            "entry_timestamp_utc": "TEXT",
+            "confidence": "REAL"
         }
 
         # Thêm các cột còn thiếu vào bảng
@@ -96,6 +102,13 @@ def init_sqlite_db(db_path: str):
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_symbol_time ON trend_analysis(symbol, kline_open_time);")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_status ON trend_analysis(status);")
 
+        # Bảng outbox cho thông báo Telegram (bền vững qua crash / khởi động lại)
+        init_outbox_table(cursor)
+        # message_id của các bảng trực tiếp (tin tóm tắt được sửa tại chỗ)
+        init_live_board_table(cursor)
+        # Watchlist của người dùng (symbol -> chat riêng)
+        init_watchlist_tables(cursor)
+
         conn.commit()
         logger.info(f"✅ SQLite DB initialized/updated successfully at: {db_path}")
 
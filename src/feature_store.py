@@ -0,0 +1,160 @@
+# feature_store.py
+# Kho feature dạng cột trên đĩa, khóa theo (symbol, timeframe, kline open time, FEATURE_SET_VERSION).
+# Bố cục: <root>/<version>/<timeframe>/<symbol>/seg-<từ ms>-<đến ms>.npy
+#   Mỗi segment là một ma trận float64 lưu theo cột (Fortran order): cột 0 = open time (ms), các cột sau = FEATURE_COLUMNS,
+#   nên đọc một cột / nạp bằng mmap không phải sao chép cả hàng. Segment không bao giờ bị sửa: ghi thêm = segment mới,
+#   quá FEATURE_STORE_MAX_SEGMENTS thì gộp lại thành một (ghi tệp tạm + os.replace).
+# Feature của một nến đã đóng được ghi một lần khi tính (simulator / phân tích live); trainer và backtest chỉ đọc lại.
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import config
+from .features import FEATURE_COLUMNS, FEATURE_SET_VERSION, INDICATOR_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+_SEGMENT = re.compile(r'^seg-(\d+)-(\d+)\.npy$')
+
+def to_epoch_ms(values) -> np.ndarray:
+    """
+    Thời điểm (DatetimeIndex / chuỗi ISO / Series) -> ms kể từ epoch (int64); không có múi giờ thì coi là UTC.
+    Giá trị không đọc được -> -1 (không khớp khóa nào).
+    """
+    times = values if isinstance(values, pd.DatetimeIndex) else pd.to_datetime(pd.Index(values), utc=True, format='ISO8601', errors='coerce')
+    if times.tz is None:
+        times = times.tz_localize('UTC')
+    return np.asarray(((times - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(milliseconds=1)).fillna(-1), dtype='int64')
+
+class FeatureStore:
+    def __init__(self, root: str, version: str = FEATURE_SET_VERSION, columns: Optional[List[str]] = None, max_segments: int = 64):
+        self.root = root
+        self.version = version
+        self.columns = list(columns or FEATURE_COLUMNS)
+        self.max_segments = max_segments
+        self._last_open_time: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def _partition(self, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.root, self.version, timeframe, symbol)
+
+    def _write_schema(self) -> None:
+        path = os.path.join(self.root, self.version, 'schema.json')
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump({'version': self.version, 'columns': ['open_time_ms', *self.columns], 'indicators': INDICATOR_COLUMNS}, f, indent=2)
+
+    @staticmethod
+    def _segments(partition: str) -> List[Tuple[int, int, str]]:
+        try:
+            names = os.listdir(partition)
+        except FileNotFoundError:
+            return []
+        found = [(int(m.group(1)), int(m.group(2)), os.path.join(partition, name)) for name in names if (m := _SEGMENT.match(name))]
+        return sorted(found)
+
+    def last_open_time(self, symbol: str, timeframe: str) -> int:
+        """Open time (ms) mới nhất đã lưu của phân vùng; -1 nếu chưa có."""
+        key = (symbol, timeframe)
+        if key not in self._last_open_time:
+            segments = self._segments(self._partition(symbol, timeframe))
+            self._last_open_time[key] = max((end for _, end, _ in segments), default=-1)
+        return self._last_open_time[key]
+
+    @staticmethod
+    def _save(path: str, block: np.ndarray) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.asfortranarray(block))
+        os.replace(tmp_path, path)
+
+    def write(self, symbol: str, timeframe: str, frame: pd.DataFrame) -> int:
+        """
+        Ghi các nến (index = open time) mới hơn nến cuối đã lưu; bỏ các hàng còn NaN (giai đoạn khởi động chỉ báo).
+        Nến đã lưu không bị ghi đè. Trả về số hàng đã ghi.
+        """
+        if frame.empty:
+            return 0
+        with self._lock:
+            times = to_epoch_ms(frame.index)
+            values = frame.reindex(columns=self.columns).to_numpy(dtype='float64')
+            keep = (times > self.last_open_time(symbol, timeframe)) & np.isfinite(values).all(axis=1)
+            if not keep.any():
+                return 0
+            times, values = times[keep], values[keep]
+            times, first = np.unique(times, return_index=True)
+            block = np.column_stack([times.astype('float64'), values[first]])
+
+            partition = self._partition(symbol, timeframe)
+            os.makedirs(partition, exist_ok=True)
+            self._write_schema()
+            self._save(os.path.join(partition, f"seg-{times[0]:013d}-{times[-1]:013d}.npy"), block)
+            self._last_open_time[(symbol, timeframe)] = int(times[-1])
+            if len(self._segments(partition)) > self.max_segments:
+                self._compact(partition)
+            return len(times)
+
+    def _load_blocks(self, partition: str, mmap: bool) -> List[np.ndarray]:
+        blocks = []
+        for _, _, path in self._segments(partition):
+            try:
+                blocks.append(np.load(path, mmap_mode='r' if mmap else None))
+            except FileNotFoundError: # Vừa bị gộp bởi một lần ghi khác
+                continue
+        return blocks
+
+    def _compact(self, partition: str) -> None:
+        segments = self._segments(partition)
+        blocks = self._load_blocks(partition, mmap=False)
+        merged = np.concatenate(blocks)
+        _, first = np.unique(merged[:, 0], return_index=True)
+        merged = merged[first]
+        start, end = int(merged[0, 0]), int(merged[-1, 0])
+        self._save(os.path.join(partition, f"seg-{start:013d}-{end:013d}.npy"), merged)
+        for _, _, path in segments:
+            if os.path.basename(path) != f"seg-{start:013d}-{end:013d}.npy":
+                os.remove(path)
+        logger.debug(f"Feature store partition {partition} compacted from {len(segments)} segment(s).")
+
+    def read(self, symbol: str, timeframe: str, start_ms: Optional[int] = None, end_ms: Optional[int] = None, mmap: bool = True) -> pd.DataFrame:
+        """Feature của một phân vùng, index = open time (ms), tùy chọn giới hạn [start_ms, end_ms]."""
+        blocks = self._load_blocks(self._partition(symbol, timeframe), mmap)
+        if not blocks:
+            return pd.DataFrame(columns=self.columns, index=pd.Index([], dtype='int64', name='open_time_ms'), dtype='float64')
+        data = np.concatenate(blocks) if len(blocks) > 1 else np.asarray(blocks[0])
+        times = data[:, 0].astype('int64')
+        if len(blocks) > 1:
+            # Segment gối nhau trong lúc gộp -> giữ một bản cho mỗi open time
+            times, first = np.unique(times, return_index=True)
+            data = data[first]
+        lo = 0 if start_ms is None else np.searchsorted(times, start_ms, side='left')
+        hi = len(times) if end_ms is None else np.searchsorted(times, end_ms, side='right')
+        return pd.DataFrame(data[lo:hi, 1:], columns=self.columns, index=pd.Index(times[lo:hi], name='open_time_ms'))
+
+    def lookup(self, keys: pd.DataFrame) -> pd.DataFrame:
+        """
+        Feature cho từng dòng của keys (cột symbol, timeframe, open_time_ms), cùng index với keys;
+        khóa không có trong kho -> NaN.
+        """
+        result = np.full((len(keys), len(self.columns)), np.nan)
+        positional = keys[['symbol', 'timeframe', 'open_time_ms']].reset_index(drop=True)
+        for (symbol, timeframe), group in positional.groupby(['symbol', 'timeframe'], sort=False):
+            stored = self.read(symbol, timeframe)
+            if stored.empty:
+                continue
+            times = stored.index.to_numpy()
+            wanted = group['open_time_ms'].to_numpy(dtype='int64')
+            at = np.searchsorted(times, wanted).clip(0, len(times) - 1)
+            found = times[at] == wanted
+            result[group.index.to_numpy()[found]] = stored.to_numpy()[at[found]]
+        return pd.DataFrame(result, columns=self.columns, index=keys.index)
+
+# Kho dùng chung của tiến trình
+feature_store = FeatureStore(config.FEATURE_STORE_DIR, max_segments=config.FEATURE_STORE_MAX_SEGMENTS)
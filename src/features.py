@@ -0,0 +1,60 @@
+# features.py
+# Định nghĩa feature DUY NHẤT, dùng chung cho data_simulator, phân tích live (analysis_engine), trainer và backtest:
+#   - add_indicators(df): các chỉ báo pandas-ta được thêm vào DataFrame nến
+#   - feature_frame(df): đổi tên cột pandas-ta (EMA_34, BBL_20_2.0, ...) về tên feature chuẩn (ema_fast_val, ...)
+# FEATURE_SET_VERSION gồm số hiệu định nghĩa + hash các tham số chỉ báo trong config, nên đổi chu kỳ/định nghĩa
+# sẽ tự tạo một phiên bản feature mới trong feature store thay vì trộn lẫn với dữ liệu cũ.
+import hashlib
+from typing import Dict, List
+
+import pandas as pd
+import pandas_ta as ta # noqa: F401 - đăng ký accessor df.ta
+
+from . import config
+
+# Tăng khi đổi cách tính (không phải tham số) của một feature
+_DEFINITION_REVISION = 1
+
+def _indicator_columns() -> Dict[str, str]:
+    bbands = f"{config.BBANDS_PERIOD}_{config.BBANDS_STD_DEV}"
+    macd = f"{config.MACD_FAST_PERIOD}_{config.MACD_SLOW_PERIOD}_{config.MACD_SIGNAL_PERIOD}"
+    return {
+        'ema_fast_val': f'EMA_{config.EMA_FAST}',
+        'ema_medium_val': f'EMA_{config.EMA_MEDIUM}',
+        'ema_slow_val': f'EMA_{config.EMA_SLOW}',
+        'rsi_val': f'RSI_{config.RSI_PERIOD}',
+        'atr_val': f'ATRr_{config.ATR_PERIOD}',
+        'bbands_lower': f'BBL_{bbands}',
+        'bbands_middle': f'BBM_{bbands}',
+        'bbands_upper': f'BBU_{bbands}',
+        'macd': f'MACD_{macd}',
+        'macd_signal': f'MACDs_{macd}',
+        'macd_hist': f'MACDh_{macd}',
+        'adx': f'ADX_{config.ADX_PERIOD}',
+        'volume_sma': f'VOLUME_SMA_{config.VOLUME_SMA_PERIOD}',
+    }
+
+# Tên feature chuẩn -> tên cột do pandas-ta tạo
+INDICATOR_COLUMNS = _indicator_columns()
+FEATURE_COLUMNS: List[str] = list(INDICATOR_COLUMNS)
+FEATURE_SET_VERSION = f"{_DEFINITION_REVISION}-" + hashlib.sha1(
+    repr(sorted(INDICATOR_COLUMNS.items())).encode('utf-8')
+).hexdigest()[:8]
+
+def add_indicators(df: pd.DataFrame) -> pd.DataFrame:
+    """Thêm mọi chỉ báo của bộ feature vào DataFrame nến (tại chỗ) và trả về chính nó."""
+    df.ta.ema(length=config.EMA_FAST, append=True)
+    df.ta.ema(length=config.EMA_MEDIUM, append=True)
+    df.ta.ema(length=config.EMA_SLOW, append=True)
+    df.ta.rsi(length=config.RSI_PERIOD, append=True)
+    df.ta.bbands(length=config.BBANDS_PERIOD, std=config.BBANDS_STD_DEV, append=True)
+    df.ta.atr(length=config.ATR_PERIOD, append=True)
+    df.ta.sma(length=config.VOLUME_SMA_PERIOD, close='volume', prefix='VOLUME', append=True)
+    df.ta.macd(fast=config.MACD_FAST_PERIOD, slow=config.MACD_SLOW_PERIOD, signal=config.MACD_SIGNAL_PERIOD, append=True)
+    df.ta.adx(length=config.ADX_PERIOD, append=True)
+    return df
+
+def feature_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Các feature chuẩn (float64) của DataFrame đã có chỉ báo, cùng index nến; cột thiếu -> NaN."""
+    columns = {name: df[column] if column in df.columns else float('nan') for name, column in INDICATOR_COLUMNS.items()}
+    return pd.DataFrame(columns, index=df.index).astype('float64')
@@ -0,0 +1,143 @@
+# flush_scheduler.py
+# Bộ lập lịch flush outbox theo sự kiện, thay cho vòng lặp ngủ cố định 10 phút.
+# Mỗi hàng đợi (kind) có chính sách riêng trong config.NOTIFICATION_FLUSH_POLICIES; hàng đợi được flush khi
+# đủ max_batch thông báo, khi thông báo cũ nhất chạm max_wait_seconds, hoặc khi có thông báo khẩn.
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from . import config, outbox
+
+logger = logging.getLogger(__name__)
+
+class FlushScheduler:
+    """
+    Được đánh thức bởi outbox mỗi khi có thông báo mới (set_enqueue_listener) hoặc khi tới hạn chờ
+    của thông báo cũ nhất; ngoài ra kiểm tra lại outbox mỗi poll_seconds như một lưới an toàn.
+    Mỗi OUTBOX_PURGE_INTERVAL_SECONDS dọn các dòng đã DELIVERED/FAILED quá hạn giữ lại.
+    Truy vấn SQLite chạy trong asyncio.to_thread. Hàng đợi vừa flush mà thông báo cũ nhất vẫn nằm nguyên
+    (claim lỗi, flusher nuốt lỗi...) bị tạm hoãn retry_seconds, nhân đôi tới poll_seconds, thay vì flush lại liên tục;
+    lỗi của cả một vòng lặp cũng được ghi log và chờ theo cùng cách, bộ lập lịch không bao giờ dừng.
+    """
+    def __init__(
+        self,
+        db_path: str,
+        flushers: Dict[str, Callable[[], Awaitable[None]]],
+        policies: Dict[str, Dict[str, Any]],
+        poll_seconds: float = 15.0,
+        retry_seconds: float = 1.0,
+    ):
+        self.db_path = db_path
+        self.flushers = flushers
+        self.policies = policies
+        self.poll_seconds = poll_seconds
+        self.retry_seconds = retry_seconds
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._urgent_kinds: set = set()
+        self.flush_counts: Dict[str, int] = {kind: 0 for kind in flushers}
+        self._last_purge = 0.0
+        # kind -> (ready, oldest_enqueued_at) ngay trước lần flush gần nhất, để nhận ra flush không tiến triển
+        self._flushed_heads: Dict[str, tuple] = {}
+        # kind -> (thời điểm được flush lại, thời gian hoãn hiện tại)
+        self._stalled: Dict[str, tuple] = {}
+
+    def notify(self, kind: Optional[str] = None, urgent: bool = False) -> None:
+        """Báo có thông báo mới; an toàn khi gọi từ luồng khác. urgent=True buộc flush hàng đợi đó ngay."""
+        if self._loop is None or self._wakeup is None:
+            return
+        def wake():
+            if urgent and kind:
+                self._urgent_kinds.add(kind)
+            self._wakeup.set()
+        if threading.get_ident() == self._loop_thread_id:
+            wake()
+        else:
+            self._loop.call_soon_threadsafe(wake)
+
+    def _check_progress(self, kind: str, queue: Optional[Dict[str, Any]], now: float) -> None:
+        """Hoãn hàng đợi nếu lần flush trước không lấy đi thông báo cũ nhất; bỏ hoãn khi hàng đợi đã tiến lên."""
+        head = self._flushed_heads.pop(kind, None)
+        if head is None:
+            return
+        if queue and queue['ready'] >= head[0] and queue['oldest_enqueued_at'] == head[1]:
+            delay = min(self.poll_seconds, self._stalled[kind][1] * 2) if kind in self._stalled else self.retry_seconds
+            self._stalled[kind] = (now + delay, delay)
+            logger.warning(f"Flush of '{kind}' made no progress ({queue['ready']} still ready); retrying in {delay:g}s.")
+        else:
+            self._stalled.pop(kind, None)
+
+    def _due_kinds(self, now: float, stats: Dict[str, Dict[str, Any]]) -> tuple:
+        """Trả về (các hàng đợi cần flush ngay, số giây tới hạn gần nhất của các hàng đợi còn lại)."""
+        due, next_check = [], self.poll_seconds
+        for kind, policy in self.policies.items():
+            if kind not in self.flushers:
+                continue
+            queue = stats.get(kind)
+            self._check_progress(kind, queue, now)
+            if not queue:
+                continue
+            if kind in self._stalled and now < self._stalled[kind][0]:
+                next_check = min(next_check, self._stalled[kind][0] - now)
+                continue
+            if queue['next_retry_at'] is not None:
+                next_check = min(next_check, max(0.0, queue['next_retry_at'] - now))
+            if not queue['ready']:
+                continue
+            age = now - (queue['oldest_enqueued_at'] or now)
+            reason = None
+            if kind in self._urgent_kinds or queue['urgent']:
+                reason = 'urgent'
+            elif queue['ready'] >= policy['max_batch']:
+                reason = f"batch of {queue['ready']}"
+            elif age >= policy['max_wait_seconds']:
+                reason = f"oldest waited {age:.1f}s"
+            if reason:
+                due.append((kind, reason))
+                self._flushed_heads[kind] = (queue['ready'], queue['oldest_enqueued_at'])
+            else:
+                next_check = min(next_check, policy['max_wait_seconds'] - age)
+        self._urgent_kinds.difference_update(kind for kind, _ in due)
+        return due, next_check
+
+    async def _flush(self, kind: str, reason: str) -> None:
+        logger.info(f"📤 Flushing '{kind}' notifications ({reason}).")
+        try:
+            await self.flushers[kind]()
+            self.flush_counts[kind] += 1
+        except Exception as e:
+            logger.error(f"Flush of '{kind}' notifications failed: {e}", exc_info=True)
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._wakeup = asyncio.Event()
+        outbox.set_enqueue_listener(self.notify)
+        error_delay = self.retry_seconds
+        try:
+            while True:
+                self._wakeup.clear()
+                try:
+                    now = time.time()
+                    if now - self._last_purge >= config.OUTBOX_PURGE_INTERVAL_SECONDS:
+                        self._last_purge = now
+                        await asyncio.to_thread(outbox.purge_finished, self.db_path)
+                    due, next_check = self._due_kinds(now, await asyncio.to_thread(outbox.queue_stats, self.db_path))
+                    error_delay = self.retry_seconds
+                    if due:
+                        await asyncio.gather(*(self._flush(kind, reason) for kind, reason in due))
+                        continue
+                except Exception as e:
+                    logger.error(f"Flush scheduler iteration failed: {e}; retrying in {error_delay:g}s.", exc_info=True)
+                    await asyncio.sleep(error_delay)
+                    error_delay = min(self.poll_seconds, error_delay * 2)
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.05, next_check))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            outbox.set_enqueue_listener(None)
@@ -0,0 +1,71 @@
+# inference_benchmark.py - So sánh độ trễ dự đoán của RandomForestClassifier (sklearn) với CompiledForest
+# ở các kích thước lô 1 / 100 / 1.000 dòng, sau khi kiểm tra hai bên cho kết quả trùng từng bit trên tập kiểm tra.
+# Model có cùng cấu hình với trainer (100 cây, class_weight='balanced', 8 feature số + one-hot trend) trên dữ liệu tổng hợp.
+# Cách chạy: python -m src.inference_benchmark [số_dòng_huấn_luyện] [số_lần_lặp]
+import pickle
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from . import config
+from .compiled_forest import CompiledForest, verify
+
+_BATCH_SIZES = (1, 100, 1000)
+
+def make_model(n_rows: int, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    values = rng.random((n_rows, 8)) * 100
+    trends = np.eye(4)[rng.integers(0, 4, n_rows)]
+    X = np.column_stack([values, trends])
+    y = (values[:, 3] + rng.normal(0, 15, n_rows) > 50).astype(int)
+    split = int(n_rows * 0.8)
+    model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=config.TRAINING_N_JOBS, class_weight='balanced')
+    model.fit(X[:split], y[:split])
+    return model, X[split:]
+
+def _timings(predict: Callable, X: np.ndarray, repeats: int) -> List[float]:
+    predict(X) # Làm nóng
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict(X)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def run_benchmark(n_rows: int = 20000, repeats: int = 50) -> Dict[str, Dict]:
+    model, X_valid = make_model(n_rows)
+    # Cùng chế độ như lúc phục vụ: một dòng mỗi lần, nên so với sklearn một luồng
+    model.set_params(n_jobs=1)
+    compiled = CompiledForest.from_sklearn(model)
+    results = {
+        'parity': verify(compiled, model, X_valid),
+        'size': {
+            'trees': compiled.n_trees,
+            'compiled_bytes': len(pickle.dumps(compiled)),
+            'sklearn_bytes': len(pickle.dumps(model)),
+        },
+        'latency': {},
+    }
+    for batch in _BATCH_SIZES:
+        X = X_valid[np.arange(batch) % len(X_valid)]
+        results['latency'][batch] = {
+            'sklearn': _timings(model.predict_proba, X, repeats),
+            'compiled': _timings(compiled.predict_proba, X, repeats),
+        }
+    return results
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    results = run_benchmark(n, repeats)
+    parity, size = results['parity'], results['size']
+    print(f"Parity on {parity['rows']} validation rows: labels identical={parity['labels_identical']}, "
+          f"probabilities identical={parity['proba_identical']} (max diff {parity['max_abs_diff']:.3g})")
+    print(f"Trees: {size['trees']} | pickled size: sklearn {size['sklearn_bytes'] / 1e6:.2f} MB, compiled {size['compiled_bytes'] / 1e6:.2f} MB")
+    for batch, timings in results['latency'].items():
+        sk, cf = statistics.median(timings['sklearn']) * 1000, statistics.median(timings['compiled']) * 1000
+        print(f"  {batch:>5} row(s): sklearn p50 {sk:8.3f} ms | compiled p50 {cf:8.3f} ms | speedup {sk / cf:5.1f}x")
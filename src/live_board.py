@@ -0,0 +1,158 @@
+# live_board.py
+# "Bảng trực tiếp": mỗi chat giữ MỘT tin nhắn tóm tắt (có thể ghim) và bot cập nhật nó bằng editMessageText
+# thay vì gửi tin mới mỗi chu kỳ. Nội dung không đổi (cùng hash) thì không gọi API, nên các lần làm mới
+# định kỳ gần như không tốn hạn mức gửi. Chỉ gửi tin mới khi chat chưa có bảng hoặc tin cũ không sửa được nữa.
+# message_id và hash được lưu trong bảng live_board_messages để dùng lại sau khi khởi động lại.
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from .rate_limiter import TelegramDispatcher, PRIORITY_LOW
+from .telegram_handler import TelegramHandler
+
+logger = logging.getLogger(__name__)
+
+BOARD_UNCHANGED = 'unchanged'
+BOARD_EDITED = 'edited'
+BOARD_POSTED = 'posted'
+BOARD_FAILED = 'failed'
+
+# Mô tả lỗi 400 của Telegram cho biết tin cũ không còn sửa được -> gửi tin mới
+_REPOST_ERRORS = (
+    'message to edit not found',
+    "message can't be edited",
+    'message_id_invalid',
+    'message identifier is not specified',
+)
+
+def init_live_board_table(cursor: sqlite3.Cursor) -> None:
+    """Tạo bảng live_board_messages nếu chưa có. Được gọi từ init_sqlite_db."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS live_board_messages (
+        board TEXT NOT NULL,
+        chat_key TEXT NOT NULL, -- chat_id hoặc "chat_id:thread_id"
+        message_id INTEGER NOT NULL,
+        content_hash TEXT NOT NULL,
+        updated_at REAL,
+        PRIMARY KEY (board, chat_key)
+    );
+    """)
+
+def _telegram_error_description(error: httpx.HTTPStatusError) -> str:
+    try:
+        return str(error.response.json().get('description', '')).lower()
+    except Exception:
+        return ''
+
+class LiveBoard:
+    """Một bảng trực tiếp (vd. 'summary') trên nhiều chat; mọi lệnh gửi/sửa đi qua dispatcher."""
+    def __init__(self, telegram_handler: TelegramHandler, dispatcher: TelegramDispatcher, db_path: str, name: str = 'summary', pin: bool = False):
+        self.telegram_handler = telegram_handler
+        self.dispatcher = dispatcher
+        self.db_path = db_path
+        self.name = name
+        self.pin = pin
+        self._messages: Optional[Dict[str, Tuple[int, str]]] = None # chat_key -> (message_id, content_hash)
+        self.counts = {BOARD_UNCHANGED: 0, BOARD_EDITED: 0, BOARD_POSTED: 0, BOARD_FAILED: 0}
+
+    @staticmethod
+    def content_hash(text: str, parse_mode: Optional[str]) -> str:
+        return hashlib.sha256(f"{parse_mode}\x00{text}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _chat_key(destination: Dict[str, Any]) -> str:
+        thread_id = destination.get('message_thread_id')
+        return f"{destination['chat_id']}:{thread_id}" if thread_id else str(destination['chat_id'])
+
+    def _load(self) -> Dict[str, Tuple[int, str]]:
+        if self._messages is None:
+            self._messages = {}
+            try:
+                with sqlite3.connect(self.db_path) as conn:
+                    init_live_board_table(conn.cursor())
+                    rows = conn.execute(
+                        "SELECT chat_key, message_id, content_hash FROM live_board_messages WHERE board = ?", (self.name,)
+                    ).fetchall()
+                self._messages = {chat_key: (message_id, digest) for chat_key, message_id, digest in rows}
+            except sqlite3.Error as e:
+                logger.error(f"Could not load live board '{self.name}' message ids: {e}", exc_info=True)
+        return self._messages
+
+    def _remember(self, chat_key: str, message_id: int, digest: str) -> None:
+        self._messages[chat_key] = (message_id, digest)
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO live_board_messages (board, chat_key, message_id, content_hash, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (self.name, chat_key, message_id, digest, time.time()),
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Could not persist live board '{self.name}' message id for {chat_key}: {e}", exc_info=True)
+
+    async def _post(self, destination: Dict[str, Any], chat_key: str, payload: Dict[str, Any], digest: str) -> str:
+        kwargs = {**payload, 'chat_id': destination['chat_id']}
+        if destination.get('message_thread_id'):
+            kwargs['message_thread_id'] = destination['message_thread_id']
+        response = await self.dispatcher.submit(self.telegram_handler.send_message, priority=PRIORITY_LOW, **kwargs)
+        message_id = ((response or {}).get('result') or {}).get('message_id')
+        if message_id is None:
+            raise ValueError(f"sendMessage response has no message_id: {response}")
+        self._remember(chat_key, message_id, digest)
+        if self.pin:
+            try:
+                await self.dispatcher.submit(
+                    self.telegram_handler.pin_chat_message, priority=PRIORITY_LOW, chat_id=destination['chat_id'], message_id=message_id
+                )
+            except Exception as e:
+                logger.warning(f"Could not pin live board '{self.name}' in chat {destination['chat_id']}: {e}")
+        return BOARD_POSTED
+
+    async def _update_one(self, destination: Dict[str, Any], payload: Dict[str, Any], digest: str) -> str:
+        chat_key = self._chat_key(destination)
+        stored = self._messages.get(chat_key)
+        if stored is None:
+            return await self._post(destination, chat_key, payload, digest)
+        message_id, stored_digest = stored
+        if stored_digest == digest:
+            return BOARD_UNCHANGED
+        try:
+            await self.dispatcher.submit(
+                self.telegram_handler.edit_message_text, priority=PRIORITY_LOW,
+                chat_id=destination['chat_id'], message_id=message_id, **payload,
+            )
+        except httpx.HTTPStatusError as e:
+            description = _telegram_error_description(e)
+            if e.response.status_code != 400:
+                raise
+            if 'message is not modified' in description:
+                self._remember(chat_key, message_id, digest)
+                return BOARD_UNCHANGED
+            if any(marker in description for marker in _REPOST_ERRORS):
+                logger.info(f"Live board '{self.name}' message {message_id} in {chat_key} is gone ({description}); posting a new one.")
+                return await self._post(destination, chat_key, payload, digest)
+            raise
+        self._remember(chat_key, message_id, digest)
+        return BOARD_EDITED
+
+    async def update(self, text: str, destinations: List[Dict[str, Any]], parse_mode: Optional[str] = 'MarkdownV2') -> Dict[str, str]:
+        """Đưa nội dung bảng lên mọi đích; trả về {chat_key: unchanged | edited | posted | failed}."""
+        self._load()
+        payload = {'text': text, 'disable_web_page_preview': True}
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+        digest = self.content_hash(text, parse_mode)
+
+        outcomes = await asyncio.gather(*(self._update_one(d, payload, digest) for d in destinations), return_exceptions=True)
+        results = {}
+        for destination, outcome in zip(destinations, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error(f"Live board '{self.name}' update failed for chat {destination['chat_id']}: {outcome}")
+                outcome = BOARD_FAILED
+            results[self._chat_key(destination)] = outcome
+            self.counts[outcome] += 1
+        return results
@@ -0,0 +1,79 @@
+# markdown_template.py
+# Template MarkdownV2 được biên dịch một lần: phần tĩnh đã ở dạng MarkdownV2 (hoặc được escape sẵn qua literal()),
+# giá trị động được escape bằng str.translate thay vì một re.sub cho mỗi trường.
+#
+# Cú pháp placeholder (theo string.Formatter):
+#   {field}         -> escape(str(value))
+#   {field:.2f}     -> escape(format(value, '.2f'))
+#   {field:num}     -> như format_and_escape: `giá trị 5 chữ số thập phân` trong backtick, '`—`' nếu rỗng/không phải số
+#   {field:num2}    -> như trên với 2 chữ số thập phân (num0..num9)
+#   {field:raw}     -> chèn nguyên văn (giá trị đã là MarkdownV2)
+# Không hỗ trợ conversion (!r/!s/!a): template dùng chúng sẽ báo lỗi khi biên dịch.
+import string
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+# Các ký tự phải escape trong MarkdownV2: _*[]()~`>#+-=|{}.!
+MARKDOWNV2_ESCAPE_TABLE = str.maketrans({c: '\\' + c for c in '_*[]()~`>#+-=|{}.!'})
+
+def escape(text: Any) -> str:
+    """Escape MarkdownV2 bằng bảng dịch (cùng kết quả với TelegramHandler.escape_markdownv2)."""
+    if not isinstance(text, str):
+        text = str(text)
+    # Đa số giá trị (symbol, trạng thái...) không có ký tự đặc biệt
+    return text if text.isalnum() else text.translate(MARKDOWNV2_ESCAPE_TABLE)
+
+def _escape_fixed(number: str) -> str:
+    # Số định dạng kiểu 'f' chỉ có chữ số, '.', '-' (và 'inf'/'nan'), nên replace là đủ và nhanh hơn translate
+    return number.replace('.', '\\.').replace('-', '\\-')
+
+def literal(text: str) -> str:
+    """Escape sẵn một đoạn văn bản tĩnh để ghép vào nguồn template (ngoặc nhọn được nhân đôi)."""
+    return escape(text).replace('{', '{{').replace('}', '}}')
+
+def _num_getter(field: str, precision: int) -> Callable[[Dict[str, Any]], str]:
+    spec = f'.{precision}f'
+    def get(values: Dict[str, Any]) -> str:
+        value = values.get(field)
+        if value is None:
+            return '`—`'
+        try:
+            return f"`{_escape_fixed(format(float(value), spec))}`"
+        except (ValueError, TypeError):
+            return '`—`'
+    return get
+
+def _compile_field(field: str, spec: str, conversion: str | None) -> Callable[[Dict[str, Any]], str]:
+    if conversion:
+        raise ValueError(f"Unsupported conversion '!{conversion}' for field '{field}'; use {{{field}:raw}} for pre-escaped MarkdownV2")
+    if spec == 'raw':
+        return lambda values: str(values[field])
+    if spec.startswith('num'):
+        return _num_getter(field, int(spec[3:] or 5))
+    if spec:
+        return lambda values: escape(format(values[field], spec))
+    return lambda values: escape(values[field])
+
+class MarkdownTemplate:
+    """Một template đã biên dịch thành chuỗi (phần tĩnh, hàm lấy trường) để render nhanh."""
+    __slots__ = ('source', '_parts', '_tail')
+
+    def __init__(self, source: str):
+        self.source = source
+        parts: List[Tuple[str, Callable[[Dict[str, Any]], str]]] = []
+        pending = ''
+        for static, field, spec, conversion in string.Formatter().parse(source):
+            pending += static
+            if field is None:
+                continue
+            parts.append((pending, _compile_field(field, spec or '', conversion)))
+            pending = ''
+        self._parts = tuple(parts)
+        self._tail = pending
+
+    def render(self, values: Dict[str, Any]) -> str:
+        return ''.join([static + get(values) for static, get in self._parts]) + self._tail
+
+    def render_many(self, items: Iterable[Dict[str, Any]]) -> List[str]:
+        """Render cả lô trong một lượt."""
+        parts, tail, join = self._parts, self._tail, ''.join
+        return [join([static + get(values) for static, get in parts]) + tail for values in items]
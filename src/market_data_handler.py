@@ -1,10 +1,79 @@
 # market_data_handler.py (Phiên bản có thêm log INFO chi tiết)
+import asyncio
+import weakref
 import pandas as pd
 from binance import AsyncClient as Client
 import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from . import config
 
 logger = logging.getLogger(__name__)
 
+KLINE_COLUMNS = [
+    'kline_open_time', 'open', 'high', 'low', 'close', 'volume',
+    'kline_close_time', 'quote_asset_volume', 'number_of_trades',
+    'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
+]
+
+# Binance Futures trả về tối đa 1500 nến cho mỗi request /fapi/v1/klines
+FUTURES_KLINES_MAX_LIMIT = 1500
+
+# Giới hạn chung số yêu cầu Binance đồng thời (config.CONCURRENT_REQUESTS): vòng phân tích, updater và simulator
+# cùng lấy slot từ một semaphore cho mỗi event loop, nên tổng số request song song không vượt giới hạn
+_request_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def binance_request_limiter() -> asyncio.Semaphore:
+    """Semaphore dùng chung của event loop đang chạy. Không giữ nó khi gọi một hàm cũng lấy slot (sẽ tự khóa)."""
+    loop = asyncio.get_running_loop()
+    limiter = _request_limiters.get(loop)
+    if limiter is None:
+        limiter = _request_limiters[loop] = asyncio.Semaphore(config.CONCURRENT_REQUESTS)
+    return limiter
+
+# Bộ nhớ đệm OHLCV mới nhất theo (symbol, timeframe) từ các lần phân tích, để vẽ biểu đồ mà không gọi lại API
+CANDLE_CACHE_MAX_ENTRIES = 1000
+_candle_cache: "OrderedDict[Tuple[str, str], pd.DataFrame]" = OrderedDict()
+
+def _cache_candles(symbol: str, timeframe: str, df: pd.DataFrame) -> None:
+    if df.empty:
+        return
+    key = (symbol, timeframe)
+    _candle_cache[key] = df[['open', 'high', 'low', 'close', 'volume']].copy()
+    _candle_cache.move_to_end(key)
+    while len(_candle_cache) > CANDLE_CACHE_MAX_ENTRIES:
+        _candle_cache.popitem(last=False)
+
+def get_cached_candles(symbol: str, timeframe: Optional[str] = None, kline_time: Optional[pd.Timestamp] = None) -> Optional[pd.DataFrame]:
+    """
+    Nến đã tải gần nhất của symbol (ưu tiên đúng timeframe). Nếu có kline_time, chỉ nhận bản
+    có chứa nến đó và cắt bỏ các nến sau nó. Trả về None nếu không có trong bộ nhớ đệm.
+    """
+    candidates = [_candle_cache[(symbol, timeframe)]] if (symbol, timeframe) in _candle_cache else []
+    candidates += [df for (sym, tf), df in reversed(_candle_cache.items()) if sym == symbol and tf != timeframe]
+    for df in candidates:
+        if kline_time is None:
+            return df
+        if kline_time in df.index:
+            return df.loc[:kline_time]
+    return None
+
+def _klines_to_dataframe(klines: list) -> pd.DataFrame:
+    """Chuyển danh sách kline thô từ Binance thành DataFrame, index theo kline_open_time."""
+    if not klines:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(klines, columns=KLINE_COLUMNS)
+    
+    df['kline_open_time'] = pd.to_datetime(df['kline_open_time'], unit='ms', utc=True)
+    for col in ['open', 'high', 'low', 'close', 'volume', 'quote_asset_volume']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    
+    df.set_index('kline_open_time', inplace=True)
+    
+    return df
+
 async def get_market_data(client: Client, symbol: str, timeframe: str, limit: int) -> pd.DataFrame:
     """
     Lấy dữ liệu nến từ Binance và chuyển thành Pandas DataFrame.
@@ -22,25 +91,38 @@ async def get_market_data(client: Client, symbol: str, timeframe: str, limit: in
             logger.warning(f"--- [INFO] Binance API returned an EMPTY list for {symbol}. This almost always points to an API key permission issue on the Binance website.")
         # ================================
 
-        if not klines:
-            return pd.DataFrame()
-
-        columns = [
-            'kline_open_time', 'open', 'high', 'low', 'close', 'volume',
-            'kline_close_time', 'quote_asset_volume', 'number_of_trades',
-            'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
-        ]
-        df = pd.DataFrame(klines, columns=columns)
-        
-        df['kline_open_time'] = pd.to_datetime(df['kline_open_time'], unit='ms', utc=True)
-        for col in ['open', 'high', 'low', 'close', 'volume', 'quote_asset_volume']:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        df.set_index('kline_open_time', inplace=True)
-        
+        df = _klines_to_dataframe(klines)
+        _cache_candles(symbol, timeframe, df)
         return df
 
     except Exception as e:
         logger.error(f"Error inside get_market_data for {symbol}: {e}", exc_info=True)
         return pd.DataFrame()
 
+async def get_market_data_since(client: Client, symbol: str, timeframe: str, start_time_ms: int, max_pages: int = 10) -> pd.DataFrame:
+    """
+    Lấy toàn bộ nến từ `start_time_ms` đến hiện tại, tự phân trang theo startTime.
+    Dừng khi Binance trả về ít hơn một trang đầy đủ hoặc khi đạt `max_pages`.
+    """
+    all_klines: list = []
+    next_start = int(start_time_ms)
+    try:
+        for _ in range(max_pages):
+            klines = await client.futures_klines(
+                symbol=symbol, interval=timeframe,
+                startTime=next_start, limit=FUTURES_KLINES_MAX_LIMIT
+            )
+            if not klines:
+                break
+            all_klines.extend(klines)
+            if len(klines) < FUTURES_KLINES_MAX_LIMIT:
+                break
+            next_start = int(klines[-1][0]) + 1
+        else:
+            logger.warning(f"⚠️ {symbol}: reached {max_pages} kline pages since {start_time_ms} without reaching the latest candle.")
+
+        return _klines_to_dataframe(all_klines)
+
+    except Exception as e:
+        logger.error(f"Error inside get_market_data_since for {symbol}: {e}", exc_info=True)
+        return pd.DataFrame()
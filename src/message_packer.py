@@ -0,0 +1,102 @@
+# message_packer.py
+# Xếp các mục đã định dạng (MarkdownV2) vào ít tin nhắn Telegram nhất có thể, thay vì cắt ở 4096 ký tự.
+# Một mục không bao giờ bị tách giữa hai tin (nên không thể cắt đôi một chuỗi escape như "\\."),
+# trừ khi bản thân nó dài hơn giới hạn - khi đó nó được tách theo dòng.
+import logging
+from typing import Callable, List, NamedTuple, Sequence, Union
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+class PackedMessage(NamedTuple):
+    text: str
+    entries: List[int]  # Vị trí (trong danh sách đầu vào) của các mục nằm trong tin này
+
+def telegram_length(text: str) -> int:
+    """Độ dài theo cách Telegram đếm (UTF-16 code units): emoji ngoài BMP tính là 2."""
+    return len(text.encode('utf-16-le')) // 2
+
+def _split_oversized(entry: str, limit: int) -> List[str]:
+    """Tách một mục dài hơn giới hạn theo dòng; dòng vẫn quá dài thì cắt nhưng không sau một dấu '\\' lẻ."""
+    chunks, current = [], ''
+    for line in entry.split('\n'):
+        candidate = f"{current}\n{line}" if current else line
+        if telegram_length(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            chunks.append(current)
+        while telegram_length(line) > limit:
+            cut = limit
+            while telegram_length(line[:cut]) > limit:
+                cut -= 1
+            # Không để lại một dấu escape lẻ ở cuối đoạn
+            trailing = len(line[:cut]) - len(line[:cut].rstrip('\\'))
+            if trailing % 2:
+                cut -= 1
+            chunks.append(line[:cut])
+            line = line[cut:]
+        current = line
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _pack_once(entries: Sequence[str], header: Callable[[int], str], separator: str, footer: str, limit: int) -> List[PackedMessage]:
+    messages: List[PackedMessage] = []
+    text, indices = None, []
+
+    def close():
+        nonlocal text, indices
+        if text is not None:
+            messages.append(PackedMessage(text, indices))
+        text, indices = None, []
+
+    for i, entry in enumerate(entries):
+        pieces = [entry]
+        budget = limit - telegram_length(header(len(messages) + 1))
+        if telegram_length(entry) > budget:
+            logger.warning(f"Entry {i} ({telegram_length(entry)} chars) exceeds the message limit; splitting it by lines.")
+            pieces = _split_oversized(entry, budget)
+        for piece in pieces:
+            if text is not None and telegram_length(text + separator + piece) <= limit:
+                text += separator + piece
+                if indices[-1] != i:
+                    indices.append(i)
+                continue
+            close()
+            text, indices = header(len(messages) + 1) + piece, [i]
+
+    if footer:
+        if text is not None and telegram_length(text + footer) <= limit:
+            text += footer
+        else:
+            close()
+            text = header(len(messages) + 1) + footer.lstrip('\n')
+    close()
+    return messages
+
+def pack_messages(
+    entries: Sequence[str],
+    header: Union[str, Callable[[int, int], str]] = '',
+    separator: str = '\n',
+    footer: str = '',
+    limit: int = TELEGRAM_MESSAGE_LIMIT,
+) -> List[PackedMessage]:
+    """
+    Xếp tuần tự các mục vào tin nhắn: mỗi tin = header + mục + separator + mục ... (+ footer ở tin cuối).
+    Với thứ tự mục cố định, cách xếp tham lam này cho số tin ít nhất.
+    `header` có thể là chuỗi hoặc hàm (số_thứ_tự_tin, tổng_số_tin) -> chuỗi; mọi phần phải đã được escape.
+    """
+    if not callable(header):
+        static_header = header
+        header = lambda part, total: static_header
+    total = 1
+    for _ in range(5):
+        # Header có thể phụ thuộc tổng số tin (vd. "(1/3)"), nên xếp lại tới khi tổng số tin ổn định
+        messages = _pack_once(entries, lambda part: header(part, total), separator, footer, limit)
+        if len(messages) == total:
+            break
+        total = len(messages)
+    logger.debug(f"Packed {len(entries)} entries into {len(messages)} message(s).")
+    return messages
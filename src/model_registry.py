@@ -0,0 +1,235 @@
+# model_registry.py
+# Kho model có phiên bản: mỗi lần huấn luyện ghi model + label encoder + danh sách feature vào một thư mục riêng
+# (models/v0001, v0002, ...) rồi mới đổi con trỏ CURRENT bằng os.replace (nguyên tử). Một lần ghi hỏng giữa chừng
+# chỉ để lại thư mục tạm, không bao giờ làm lệch ba thành phần của phiên bản đang dùng.
+# LiveModel giữ bộ (model, encoder, features) đang chạy và đổi sang phiên bản mới giữa các chu kỳ phân tích,
+# không cần khởi động lại; quay lui = trỏ CURRENT về một phiên bản cũ (python -m src.model_registry rollback [vXXXX]).
+# Quay lui đồng thời ghim phiên bản đó (tệp PINNED): trainer không huấn luyện/công bố gì cho tới khi bỏ ghim
+# (python -m src.model_registry unpin), nên lần huấn luyện kế tiếp không lặng lẽ đè lên phiên bản đã quay về.
+# Mỗi phiên bản có thể kèm compiled.npz: bản biên dịch (CompiledForest) của model, dùng cho dự đoán từng dòng.
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import joblib
+
+from . import config
+from .compiled_forest import CompiledForest
+
+logger = logging.getLogger(__name__)
+
+_VERSION_DIR = re.compile(r'^v(\d+)$')
+_POINTER = 'CURRENT'
+_PIN = 'PINNED'
+# Các tệp model cũ ở thư mục làm việc (trước khi có registry) -> dùng khi registry còn trống
+LEGACY_FILES = ("model_trend.pkl", "trend_label_encoder.pkl", "model_features.pkl")
+LEGACY_VERSION = 'legacy'
+
+class ModelBundle(NamedTuple):
+    version: str
+    model: Any
+    label_encoder: Any
+    features: List[str]
+    compiled: Optional[CompiledForest] = None
+
+class ModelRegistry:
+    def __init__(self, root: str, keep_versions: int = 10):
+        self.root = root
+        self.keep_versions = keep_versions
+
+    @property
+    def _pointer_path(self) -> str:
+        return os.path.join(self.root, _POINTER)
+
+    @property
+    def _pin_path(self) -> str:
+        return os.path.join(self.root, _PIN)
+
+    @staticmethod
+    def _write_atomic(path: str, text: str) -> None:
+        # Ghi tệp tạm + os.replace: người đọc chỉ thấy nội dung cũ hoặc mới, không bao giờ nửa chừng
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def versions(self) -> List[str]:
+        """Các phiên bản đã công bố, cũ nhất trước."""
+        if not os.path.isdir(self.root):
+            return []
+        found = [(int(m.group(1)), name) for name in os.listdir(self.root) if (m := _VERSION_DIR.match(name))]
+        return [name for _, name in sorted(found)]
+
+    def current_version(self) -> Optional[str]:
+        try:
+            with open(self._pointer_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def pinned_version(self) -> Optional[str]:
+        """Phiên bản đang được ghim (sau rollback); None nếu trainer được phép công bố phiên bản mới."""
+        try:
+            with open(self._pin_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def pin(self, version: str) -> None:
+        if version not in self.versions():
+            raise ValueError(f"Unknown model version '{version}'.")
+        self._write_atomic(self._pin_path, version)
+
+    def unpin(self) -> Optional[str]:
+        """Bỏ ghim; trả về phiên bản vừa được bỏ ghim (None nếu không có)."""
+        version = self.pinned_version()
+        try:
+            os.remove(self._pin_path)
+        except FileNotFoundError:
+            pass
+        if version:
+            logger.info(f"📌 Model {version} unpinned; training may publish new versions again.")
+        return version
+
+    def metadata(self, version: str) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self.root, version, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def set_current(self, version: str) -> None:
+        """Đổi con trỏ CURRENT một cách nguyên tử (ghi tệp tạm + os.replace)."""
+        if version not in self.versions():
+            raise ValueError(f"Unknown model version '{version}'.")
+        self._write_atomic(self._pointer_path, version)
+
+    def publish(self, model: Any, label_encoder: Any, features: List[str], metadata: Optional[Dict[str, Any]] = None,
+                compiled: Optional[CompiledForest] = None) -> str:
+        """Ghi một phiên bản mới đầy đủ (kèm bản biên dịch nếu có) rồi trỏ CURRENT vào nó. Trả về tên phiên bản."""
+        os.makedirs(self.root, exist_ok=True)
+        staging = os.path.join(self.root, f".staging-{os.getpid()}-{time.time_ns()}")
+        os.makedirs(staging)
+        try:
+            # Không nén để có thể nạp bằng mmap
+            joblib.dump(model, os.path.join(staging, 'model.joblib'))
+            joblib.dump(label_encoder, os.path.join(staging, 'label_encoder.joblib'))
+            joblib.dump(list(features), os.path.join(staging, 'features.joblib'))
+            if compiled is not None:
+                compiled.save(os.path.join(staging, 'compiled.npz'))
+            with open(os.path.join(staging, 'meta.json'), 'w') as f:
+                json.dump({**(metadata or {}), 'published_at': time.time()}, f)
+            existing = self.versions()
+            number = int(_VERSION_DIR.match(existing[-1]).group(1)) + 1 if existing else 1
+            version = f"v{number:04d}"
+            os.rename(staging, os.path.join(self.root, version))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self.set_current(version)
+        self._prune()
+        logger.info(f"📦 Model {version} published to {self.root}.")
+        return version
+
+    def _prune(self) -> None:
+        versions = self.versions()
+        keep = {self.current_version(), self.pinned_version()}
+        for version in versions[:-self.keep_versions] if self.keep_versions > 0 else []:
+            if version not in keep:
+                shutil.rmtree(os.path.join(self.root, version), ignore_errors=True)
+
+    def load(self, version: Optional[str] = None, mmap: bool = True) -> Optional[ModelBundle]:
+        """
+        Nạp một phiên bản (mặc định: CURRENT). mmap=True ánh xạ các mảng của cây từ đĩa thay vì sao chép,
+        nên việc đổi model gần như không tốn bộ nhớ; dùng mmap=False khi cần sửa model (warm_start).
+        Registry trống -> các tệp model cũ (nếu có); không có gì -> None.
+        """
+        version = version or self.current_version()
+        mmap_mode = 'r' if mmap else None
+        if version is None:
+            if not all(os.path.exists(path) for path in LEGACY_FILES):
+                return None
+            model_path, encoder_path, features_path = LEGACY_FILES
+            return ModelBundle(LEGACY_VERSION, joblib.load(model_path), joblib.load(encoder_path), joblib.load(features_path))
+        directory = os.path.join(self.root, version)
+        compiled_path = os.path.join(directory, 'compiled.npz')
+        return ModelBundle(
+            version,
+            joblib.load(os.path.join(directory, 'model.joblib'), mmap_mode=mmap_mode),
+            joblib.load(os.path.join(directory, 'label_encoder.joblib')),
+            joblib.load(os.path.join(directory, 'features.joblib')),
+            CompiledForest.load(compiled_path) if os.path.exists(compiled_path) else None,
+        )
+
+    def rollback(self, version: Optional[str] = None, pin: bool = True) -> str:
+        """
+        Trỏ CURRENT về version (mặc định: phiên bản ngay trước phiên bản hiện tại).
+        pin=True ghim phiên bản đó: trainer bỏ qua các lượt huấn luyện cho tới khi unpin().
+        """
+        if version is None:
+            versions = self.versions()
+            current = self.current_version()
+            if current not in versions or versions.index(current) == 0:
+                raise ValueError("No earlier model version to roll back to.")
+            version = versions[versions.index(current) - 1]
+        self.set_current(version)
+        if pin:
+            self.pin(version)
+        logger.warning(f"⏪ Model registry rolled back to {version}" + (" and pinned; training is paused until it is unpinned." if pin else "."))
+        return version
+
+class LiveModel:
+    """Bộ model đang phục vụ trong tiến trình; refresh() đổi cả bộ sang phiên bản CURRENT mới (nếu có)."""
+    def __init__(self, registry: ModelRegistry, mmap: bool = True):
+        self.registry = registry
+        self.mmap = mmap
+        self.bundle: Optional[ModelBundle] = None
+        self._failed_version: Optional[str] = None
+
+    async def refresh(self) -> Optional[ModelBundle]:
+        """Kiểm tra con trỏ (đọc một tệp nhỏ); chỉ nạp lại khi phiên bản đổi, trong executor để không chặn event loop."""
+        target = self.registry.current_version() or LEGACY_VERSION
+        if (self.bundle is not None and self.bundle.version == target) or target == self._failed_version:
+            return self.bundle
+        loop = asyncio.get_running_loop()
+        try:
+            bundle = await loop.run_in_executor(None, lambda: self.registry.load(None if target == LEGACY_VERSION else target, self.mmap))
+        except Exception as e:
+            # Giữ bộ cũ; không thử lại phiên bản hỏng này cho tới khi con trỏ đổi
+            self._failed_version = target
+            logger.error(f"❌ Could not load model {target}; keeping {self.bundle.version if self.bundle else 'no model'}: {e}", exc_info=True)
+            return self.bundle
+        if bundle is not None:
+            previous = self.bundle.version if self.bundle else None
+            self.bundle = bundle
+            self._failed_version = None
+            logger.info(f"🔁 Live model switched {previous or '(none)'} -> {bundle.version}.")
+        return self.bundle
+
+# Registry dùng chung (trainer ghi, run.py/analysis_loop đọc)
+model_registry = ModelRegistry(config.MODEL_REGISTRY_DIR, keep_versions=config.MODEL_REGISTRY_KEEP_VERSIONS)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    if command == 'list':
+        current, pinned = model_registry.current_version(), model_registry.pinned_version()
+        for name in model_registry.versions():
+            meta = model_registry.metadata(name)
+            accuracy = f"{meta['accuracy']:.2%}" if isinstance(meta.get('accuracy'), (int, float)) else '-'
+            print(f"{'*' if name == current else ' '} {name}  mode={meta.get('mode', '-')}  accuracy={accuracy}{'  (pinned)' if name == pinned else ''}")
+    elif command == 'rollback':
+        print(model_registry.rollback(sys.argv[2] if len(sys.argv) > 2 else None))
+    elif command == 'unpin':
+        print(model_registry.unpin() or 'not pinned')
+    else:
+        print("Usage: python -m src.model_registry [list | rollback [vXXXX] | unpin]")
+        sys.exit(1)
@@ -1,25 +1,153 @@
 # notifications.py (Phiên bản cuối cùng, đầy đủ tất cả các hàm thông báo)
 import logging
-from typing import List, Dict, Any
+from typing import Callable, List, Dict, Any, Optional, Tuple
 import asyncio
+import sqlite3
+import httpx
 from .telegram_handler import TelegramHandler
-import httpx # Import httpx to catch its specific exceptions
-import json # Import json for parsing Telegram API error responses
+from .message_packer import pack_messages, telegram_length, TELEGRAM_MESSAGE_LIMIT
+from .chart_renderer import ChartRenderer
+from .live_board import LiveBoard
+from .watchlists import WatchlistIndex, disable_chat
+from .flush_scheduler import FlushScheduler
+from .markdown_template import MarkdownTemplate, literal, escape
+from .rate_limiter import TelegramDispatcher, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 from . import config
+from . import outbox
 import re
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+TELEGRAM_CAPTION_LIMIT = 1024 # Giới hạn chú thích ảnh của Telegram
+
+# --- Template MarkdownV2 biên dịch sẵn (phần tĩnh được escape một lần khi import) ---
+SIGNAL_TEMPLATE = MarkdownTemplate(
+    literal("🆘 New Signal Found! 🆘") + literal("\n\n----------------------------------------\n\n")
+    + "\\#{trend_title} // {direction:raw} // {symbol}\n"
+    "📌Entry: {entry_price:num}\n"
+    "❌SL: {stop_loss:num}\n"
+    "🎯TP1: {take_profit_1:num}\n"
+    "🎯TP2: {take_profit_2:num}\n"
+    "🎯TP3: {take_profit_3:num}"
+)
+SIGNAL_SUMMARY_TEMPLATE = MarkdownTemplate(
+    "*{n}\\. {symbol}* \\| {direction:raw}\n"
+    "  Entry: {entry_price:num} \\| SL: {stop_loss:num} \\| TP1: {take_profit_1:num}"
+    " \\| TP2: {take_profit_2:num} \\| TP3: {take_profit_3:num}"
+)
+TRADE_OUTCOME_TEMPLATE = MarkdownTemplate(
+    "{emoji:raw} *Trade Closed: {outcome}* {emoji:raw}\n\n"
+    "Symbol: `{symbol}`\n"
+    "Direction: `{direction}`\n"
+    "Outcome: `{status}`\n\n"
+    "Entry Price: {entry_price:num}\n"
+    "Closing Price: {exit_price:num}\n"
+    "PNL \\(x{leverage:raw}\\): {pnl_with_leverage:raw}"
+)
+LIVE_BOARD_POSITION_TEMPLATE = MarkdownTemplate(
+    "{n}\\. *{symbol}* {direction:raw} \\| Entry: {entry_price:num} \\| SL: {stop_loss:num} \\| TP1: {take_profit_1:num}"
+)
+
+def destination_key(destination: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    """Khóa của một đích: (chat_id, message_thread_id); hai topic trong cùng group là hai đích khác nhau."""
+    thread_id = destination.get('message_thread_id')
+    return str(destination['chat_id']), (str(thread_id) if thread_id else None)
+
+def _delivery_key(key: Tuple[str, Optional[str]]) -> str:
+    # Dạng lưu trong outbox.delivered_to (cùng dạng chat_key của live_board): chat_id hoặc "chat_id:thread_id"
+    chat_id, thread_id = key
+    return f"{chat_id}:{thread_id}" if thread_id else chat_id
+
+def _signal_fields(result: Dict[str, Any], n: int = 0) -> Dict[str, Any]:
+    """Các trường (chưa escape) cho SIGNAL_TEMPLATE / SIGNAL_SUMMARY_TEMPLATE."""
+    trend_title = (result.get('trend') or '').replace("_", " ").title()
+    return {
+        **result, 'n': n, 'trend_title': trend_title, 'symbol': result.get('symbol', 'N/A'),
+        'direction': "🔼 LONG" if "Bullish" in trend_title else "🔽 SHORT",
+    }
+
+def _trade_outcome_fields(trade_details: Dict[str, Any]) -> Dict[str, Any]:
+    """Các trường cho TRADE_OUTCOME_TEMPLATE; PnL được tính lại từ giá vào/ra."""
+    status_raw = trade_details.get('status', 'N/A')
+    trend_raw = trade_details.get('trend', '')
+    pnl_percentage_from_db = trade_details.get('pnl_percentage') # Lấy PnL từ DB
+    is_win = ("TP" in status_raw) or (pnl_percentage_from_db is not None and pnl_percentage_from_db > 0)
+    pnl_with_leverage_str = "`—`"
+    entry_p, closing_p = trade_details.get('entry_price'), trade_details.get('exit_price')
+    if entry_p and closing_p:
+        try:
+            pnl = ((float(closing_p) - float(entry_p)) / float(entry_p)) * 100
+            if 'BEARISH' in trend_raw: pnl *= -1
+            pnl_with_leverage_str = f"`{escape(f'{pnl * config.LEVERAGE:+.2f}%')}`"
+        except (ValueError, TypeError): pass
+    return {
+        'emoji': "✅" if is_win else "❌", 'outcome': "WIN" if is_win else "LOSS",
+        'symbol': trade_details.get('symbol', 'N/A'), 'direction': "LONG 🔼" if 'BULLISH' in trend_raw else "SHORT 🔽",
+        'status': status_raw, 'entry_price': entry_p, 'exit_price': closing_p,
+        'leverage': config.LEVERAGE, 'pnl_with_leverage': pnl_with_leverage_str,
+    }
+
+def _load_live_board_data(db_path: str, max_positions: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]], int]:
+    """Thống kê lệnh đã đóng + các lệnh đang mở mới nhất, trong một kết nối (chạy trong executor)."""
+    with sqlite3.connect(db_path) as conn:
+        conn.row_factory = sqlite3.Row
+        total, wins = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(status LIKE '%TP%' OR pnl_percentage > 0), 0) FROM trend_analysis WHERE status != 'ACTIVE'"
+        ).fetchone()
+        open_count = conn.execute("SELECT COUNT(*) FROM trend_analysis WHERE status = 'ACTIVE'").fetchone()[0]
+        positions = [dict(row) for row in conn.execute(
+            "SELECT rowid, symbol, trend, entry_price, stop_loss, take_profit_1 FROM trend_analysis "
+            "WHERE status = 'ACTIVE' ORDER BY rowid DESC LIMIT ?", (max_positions,)
+        )]
+    stats = {
+        'total_completed_trades': total, 'wins': wins, 'losses': total - wins,
+        'win_rate': (wins / total) * 100 if total else 0.0,
+    }
+    return stats, positions, open_count
+
+def _is_forbidden(error: Any) -> bool:
+    """
+    Lỗi vĩnh viễn của một chat: 403 (bot bị chặn/bị xóa khỏi chat) hoặc 400 "chat not found".
+    Thử lại cũng vô ích, nên chat bị gỡ khỏi watchlist thay vì giữ thông báo chờ gửi lại.
+    """
+    if not isinstance(error, httpx.HTTPStatusError):
+        return False
+    if error.response.status_code == 403:
+        return True
+    return error.response.status_code == 400 and 'chat not found' in error.response.text.lower()
+
 class NotificationHandler:
     # ... (rest of the class)
-    def __init__(self, telegram_handler: TelegramHandler):
+    def __init__(self, telegram_handler: TelegramHandler, dispatcher: TelegramDispatcher | None = None, db_path: str | None = None):
         self.telegram_handler = telegram_handler
+        self.dispatcher = dispatcher or TelegramDispatcher(
+            global_rate_per_second=config.TELEGRAM_GLOBAL_RATE_PER_SECOND,
+            private_rate_per_second=config.TELEGRAM_PRIVATE_CHAT_RATE_PER_SECOND,
+            group_rate_per_minute=config.TELEGRAM_GROUP_RATE_PER_MINUTE,
+            group_burst=config.TELEGRAM_GROUP_BURST,
+        )
         self.logger = logger
         self.esc = self.telegram_handler.escape_markdownv2
-        self.signal_notification_queue: List[Dict[str, Any]] = []
-        self.outcome_notification_queue: List[Dict[str, Any]] = []
+        self.destinations = self._build_destinations()
+        # Hàng đợi tín hiệu/kết quả nằm trong bảng notification_outbox của DB này (xem outbox.py)
+        self.db_path = db_path or config.SQLITE_DB_PATH
         self.BATCH_THRESHOLD = 10
+        # Quyết định thời điểm flush từng hàng đợi theo config.NOTIFICATION_FLUSH_POLICIES (chạy bởi notification_flush_loop)
+        self.flush_scheduler = FlushScheduler(
+            self.db_path,
+            {'signal': self.flush_signal_queue, 'outcome': self.flush_outcome_queue},
+            config.NOTIFICATION_FLUSH_POLICIES,
+            poll_seconds=config.NOTIFICATION_FLUSH_POLL_SECONDS,
+            retry_seconds=config.NOTIFICATION_FLUSH_RETRY_SECONDS,
+        )
+        self.chart_renderer = ChartRenderer(
+            max_workers=config.CHART_RENDER_WORKERS, cache_size=config.CHART_CACHE_SIZE, bars=config.CHART_BARS
+        ) if config.ENABLE_SIGNAL_CHARTS else None
+        # Chỉ mục symbol -> người dùng theo dõi, để gửi thêm tới chat riêng của họ (xem watchlists.py)
+        self.watchlists = WatchlistIndex(self.db_path) if config.ENABLE_USER_WATCHLISTS else None
+        # Tin tóm tắt được sửa tại chỗ ở mỗi chat (xem live_board.py)
+        self.live_board = LiveBoard(self.telegram_handler, self.dispatcher, self.db_path, name='summary', pin=config.LIVE_BOARD_PIN)
 
     def format_and_escape(self, value: Any, precision: int = 5) -> str:
         """Định dạng một giá trị số và escape nó an toàn cho MarkdownV2."""
@@ -29,149 +157,266 @@ class NotificationHandler:
         except (ValueError, TypeError):
             return '`—`'
 
-    async def _send_with_retry(self, send_func, **kwargs):
+    async def _send_with_retry(self, send_func, priority: int = PRIORITY_NORMAL, **kwargs):
         """
-        Hàm helper để gửi tin nhắn/ảnh với cơ chế thử lại,
-        đặc biệt xử lý lỗi 429 Too Many Requests từ Telegram API.
+        Gửi tin nhắn/ảnh qua dispatcher (token bucket + làn ưu tiên).
+        Dispatcher tự xử lý lỗi 429 theo retry_after; ở đây chỉ thử lại các lỗi khác với backoff lũy thừa.
         """
         max_retries = 3
         initial_delay = 2 # Initial delay for non-429 errors
 
         for attempt in range(max_retries):
             try:
-                await send_func(**kwargs)
+                await self.dispatcher.submit(send_func, priority=priority, **kwargs)
                 self.logger.debug(f"Successfully sent Telegram message/photo (attempt {attempt + 1}).")
                 return True
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code == 429:
-                    try:
-                        error_json = e.response.json()
-                        retry_after = error_json.get('parameters', {}).get('retry_after')
-                        if retry_after:
-                            self.logger.warning(f"Telegram API hit rate limit (429). Retrying after {retry_after} seconds (attempt {attempt + 1}/{max_retries}).")
-                            await asyncio.sleep(retry_after)
-                            continue # Continue to the next attempt immediately after sleeping
-                    except (json.JSONDecodeError, AttributeError): # Need to import json
-                        self.logger.warning(f"Telegram API hit rate limit (429) but could not parse 'retry_after'. Using exponential backoff (attempt {attempt + 1}/{max_retries}).")
-                
-                # For other HTTP errors or if 429 without retry_after
-                self.logger.error(f"HTTP error occurred while sending (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1: await asyncio.sleep(initial_delay * (2 ** attempt))
-                else: self.logger.critical(f"❌ Failed after {max_retries} attempts due to HTTP error.")
-                raise # Re-raise the last HTTP error if all retries fail
-            except Exception as e: # Catch any other unexpected errors
-                self.logger.error(f"An unexpected error occurred while sending (attempt {attempt + 1}/{max_retries}): {e}", exc_info=True)
-                if attempt < max_retries - 1: await asyncio.sleep(initial_delay * (2 ** attempt))
-                else: self.logger.critical(f"❌ Failed after {max_retries} attempts due to unexpected error.")
-                raise # Re-raise the last unexpected error if all retries fail
+            except Exception as e:
+                self.logger.error(f"Error occurred while sending (attempt {attempt + 1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(initial_delay * (2 ** attempt))
+                else:
+                    self.logger.critical(f"❌ Failed after {max_retries} attempts.")
+                    raise # Re-raise the last error if all retries fail
         return False
 
-    async def _send_to_both(self, message: str, thread_id: int = None, disable_web_page_preview: bool = False):
-        """Gửi tin nhắn văn bản đến cả group và channel."""
-        self.logger.debug(f"Preparing to send text message to Telegram (both group and channel): {message[:100]}...")
-        common_kwargs = {'parse_mode': 'MarkdownV2', 'disable_web_page_preview': disable_web_page_preview}
-        group_kwargs = {'chat_id': config.TELEGRAM_CHAT_ID, 'text': message, 'message_thread_id': thread_id, **common_kwargs}
-        await self._send_with_retry(self.telegram_handler.send_message, **group_kwargs)
-        # Gửi đến channel nếu TELEGRAM_CHANNEL_ID được cấu hình và khác với group ID
-        if hasattr(config, 'TELEGRAM_CHANNEL_ID') and config.TELEGRAM_CHANNEL_ID and config.TELEGRAM_CHANNEL_ID != config.TELEGRAM_CHAT_ID:
-            channel_kwargs = {'chat_id': config.TELEGRAM_CHANNEL_ID, 'text': message, **common_kwargs} # Channel thường không có thread_id
-            await self._send_with_retry(self.telegram_handler.send_message, **channel_kwargs)
-
-    async def _send_photo_to_both(self, photo: str, caption: str, thread_id: int = None):
-        """Gửi ảnh có chú thích đến cả group và channel."""
-        self.logger.debug(f"Preparing to send photo to Telegram with caption: {caption[:100]}...")
-        group_kwargs = {'chat_id': config.TELEGRAM_CHAT_ID, 'photo': photo, 'caption': caption, 'parse_mode': 'MarkdownV2', 'message_thread_id': thread_id}
-        await self._send_with_retry(self.telegram_handler.send_photo, **group_kwargs)
-        # Gửi ảnh đến channel nếu TELEGRAM_CHANNEL_ID được cấu hình và khác với group ID
-        if hasattr(config, 'TELEGRAM_CHANNEL_ID') and config.TELEGRAM_CHANNEL_ID and config.TELEGRAM_CHANNEL_ID != config.TELEGRAM_CHAT_ID:
-            channel_kwargs = {'chat_id': config.TELEGRAM_CHANNEL_ID, 'photo': photo, 'caption': caption, 'parse_mode': 'MarkdownV2'}
-            await self._send_with_retry(self.telegram_handler.send_photo, **channel_kwargs)
+    @staticmethod
+    def _build_destinations() -> List[Dict[str, Any]]:
+        """
+        Danh sách đích nhận thông báo: group chính (kèm topic nếu có), channel (nếu khác group)
+        và các đích bổ sung trong TELEGRAM_EXTRA_DESTINATIONS ("chat_id[:thread_id],...").
+        Trùng lặp được loại theo (chat_id, thread_id), nên nhiều topic của cùng một group đều được giữ.
+        """
+        candidates = []
+        if config.TELEGRAM_CHAT_ID:
+            candidates.append((str(config.TELEGRAM_CHAT_ID), config.TELEGRAM_MESSAGE_THREAD_ID or None))
+        if getattr(config, 'TELEGRAM_CHANNEL_ID', None) and str(config.TELEGRAM_CHANNEL_ID) != str(config.TELEGRAM_CHAT_ID):
+            candidates.append((str(config.TELEGRAM_CHANNEL_ID), None)) # Channel không có thread_id
+        for item in (getattr(config, 'TELEGRAM_EXTRA_DESTINATIONS', '') or '').split(','):
+            item = item.strip()
+            if item:
+                chat_id, _, thread_id = item.partition(':')
+                candidates.append((chat_id.strip(), thread_id.strip() or None))
+
+        destinations, seen = [], set()
+        for chat_id, thread_id in candidates:
+            destination = {'chat_id': chat_id, 'message_thread_id': thread_id}
+            if destination_key(destination) in seen:
+                continue
+            seen.add(destination_key(destination))
+            destinations.append(destination)
+        return destinations
+
+    async def _fan_out(self, send_func, payload: Dict[str, Any], priority: int, destinations: List[Dict[str, Any]] | None = None) -> Dict[str, Any]:
+        """
+        Gửi cùng một payload tới mọi đích cùng lúc (qua dispatcher). Mỗi đích có vòng thử lại riêng
+        nên một chat chậm hoặc lỗi không giữ chân các chat khác.
+        Trả về {(chat_id, message_thread_id): True | Exception} cho từng đích.
+        """
+        destinations = self.destinations if destinations is None else destinations
+
+        async def send_one(destination: Dict[str, Any]):
+            kwargs = {**payload, 'chat_id': destination['chat_id']}
+            if destination.get('message_thread_id'):
+                kwargs['message_thread_id'] = destination['message_thread_id']
+            return await self._send_with_retry(send_func, priority=priority, **kwargs)
+
+        outcomes = await asyncio.gather(*(send_one(d) for d in destinations), return_exceptions=True)
+        results = {destination_key(d): outcome for d, outcome in zip(destinations, outcomes)}
+        failed = [_delivery_key(key) for key, outcome in results.items() if isinstance(outcome, BaseException)]
+        if failed:
+            self.logger.error(f"Delivery failed for {len(failed)}/{len(destinations)} destination(s): {failed}")
+        return results
+
+    async def _send_to_all(self, message: str, disable_web_page_preview: bool = False, priority: int = PRIORITY_NORMAL, parse_mode: str | None = 'MarkdownV2') -> Dict[str, Any]:
+        """Gửi tin nhắn văn bản đến tất cả các đích đã cấu hình."""
+        self.logger.debug(f"Preparing to send text message to {len(self.destinations)} destination(s): {message[:100]}...")
+        payload = {'text': message, 'disable_web_page_preview': disable_web_page_preview}
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+        return await self._fan_out(self.telegram_handler.send_message, payload, priority)
+
+    async def _send_photo_to_all(self, photo: str, caption: str, priority: int = PRIORITY_NORMAL) -> Dict[str, Any]:
+        """Gửi ảnh có chú thích đến tất cả các đích đã cấu hình."""
+        self.logger.debug(f"Preparing to send photo to {len(self.destinations)} destination(s) with caption: {caption[:100]}...")
+        payload = {'photo': photo, 'caption': caption, 'parse_mode': 'MarkdownV2'}
+        return await self._fan_out(self.telegram_handler.send_photo, payload, priority)
+
+    async def send_message_to_all(self, text: str, priority: int = PRIORITY_NORMAL) -> Dict[str, Any]:
+        """Gửi một tin nhắn thuần (không parse Markdown) tới mọi đích, dùng cho cảnh báo hệ thống."""
+        return await self._send_to_all(text, priority=priority, parse_mode=None)
 
     # === CÁC HÀM GỬI THÔNG BÁO ===
 
+    def _queue(self, kind: str, item: Dict[str, Any]) -> bool:
+        """Ghi một thông báo vào outbox với key outbox.trade_key; trả về False nếu đã có."""
+        key = outbox.trade_key(kind, item)
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                added = outbox.enqueue(conn, kind, key, item)
+        except sqlite3.Error as e:
+            self.logger.error(f"Failed to queue {kind} notification for {item.get('symbol')}: {e}", exc_info=True)
+            return False
+        if added:
+            self.logger.info(f"Queued {kind} for {item.get('symbol')} (key {key}).")
+        return added
+
     def queue_signal(self, signal: Dict[str, Any]):
-        """Adds a single signal to the notification queue."""
-        self.signal_notification_queue.append(signal)
-        self.logger.info(f"Queued signal for {signal.get('symbol')}. Queue size: {len(self.signal_notification_queue)}")
+        """Adds a single signal to the notification outbox (no-op if it is already there)."""
+        self._queue('signal', signal)
 
     def queue_trade_outcome(self, trade_details: Dict[str, Any]):
-        """Adds a single closed trade to the outcome notification queue."""
-        self.outcome_notification_queue.append(trade_details)
-        self.logger.info(f"Queued outcome for {trade_details.get('symbol')}. Outcome queue size: {len(self.outcome_notification_queue)}")
+        """Adds a single closed trade to the notification outbox (no-op if it is already there)."""
+        self._queue('outcome', trade_details)
 
-    async def flush_signal_queue(self):
+    async def aclose(self):
+        """Dừng dispatcher gửi tin (và process vẽ biểu đồ). Gọi khi tắt bot, trước khi đóng TelegramHandler."""
+        await self.dispatcher.aclose()
+        if self.chart_renderer:
+            self.chart_renderer.shutdown()
+
+    async def publish_trade_outcome_now(self, trade_details: Dict[str, Any]):
         """
-        Checks the queue and sends notifications.
-        Groups them if the queue size is over the threshold.
+        Sends closed-trade notifications immediately instead of waiting for the flush policy.
+        The outcome is normally already in the outbox (written with the trade update), so this marks the queue urgent.
         """
-        if not self.signal_notification_queue:
-            return
+        self.queue_trade_outcome(trade_details)
+        self.flush_scheduler.notify('outcome', urgent=True)
 
-        signals_to_send = self.signal_notification_queue.copy()
-        self.signal_notification_queue.clear()
-        self.logger.info(f"Flushing signal queue with {len(signals_to_send)} signals.")
+    def delivery_latency_stats(self, window_seconds: float = 86400) -> Dict[str, Dict[str, float]]:
+        """Phân vị thời gian từ lúc ghi vào outbox tới lúc giao xong (giây), theo từng hàng đợi."""
+        return outbox.delivery_latency_percentiles(self.db_path, window_seconds)
 
-        if len(signals_to_send) > self.BATCH_THRESHOLD:
-            # Group messages into one
-            header = self.esc(f"🆘 {len(signals_to_send)} New Signals Found! 🆘")
-            message_parts = [header, self.esc("\n\n----------------------------------------\n\n")]
-            
-            for i, result in enumerate(signals_to_send):
-                trend_raw = result.get('trend', '').replace("_", " ").title()
-                trend_emoji = "🔼 LONG" if "Bullish" in trend_raw else "🔽 SHORT"
-                
-                signal_summary = (
-                    f"*{i+1}\\. {self.esc(result.get('symbol', 'N/A'))}* \\| {trend_emoji}\n"
-                    f"  Entry: {self.format_and_escape(result.get('entry_price'))} \\| SL: {self.format_and_escape(result.get('stop_loss'))} \\| TP1: {self.format_and_escape(result.get('take_profit_1'))}"
-                    f" \\| TP2: {self.format_and_escape(result.get('take_profit_2'))} \\| TP3: {self.format_and_escape(result.get('take_profit_3'))}"
-                )
-
-                message_parts.append(signal_summary)
-                
-                # Add a separator between signals, but not after the last one
-                if i < len(signals_to_send) - 1:
-                    message_parts.append(self.esc("---")) 
-            
-            full_message = "\n".join(message_parts)
-            
-            # Telegram message limit is 4096 characters. Truncate if necessary.
-            if len(full_message) > 4096:
-                self.logger.warning(f"Grouped message for {len(signals_to_send)} signals exceeds Telegram limit. Truncating.")
-                full_message = full_message[:4090] + self.esc("...") # Add ellipsis and ensure it's escaped
-            
-            await self._send_to_both(full_message, thread_id=config.TELEGRAM_MESSAGE_THREAD_ID)
+    async def _deliver_claimed(self, items: List[Dict[str, Any]], render: Callable[[List[Dict[str, Any]]], List[tuple]]) -> None:
+        """
+        Gửi các thông báo đã claim từ outbox tới những đích chưa nhận chúng, rồi ghi kết quả lại.
+        Đích của mỗi thông báo = các đích chung (group/channel) + chat của người dùng có watchlist khớp.
+        Các chat thiếu cùng một tập thông báo được gửi chung một lần render.
+        `render(payloads)` trả về [(message, [vị trí các payload nằm trong message], ảnh PNG hoặc None)];
+        tin có ảnh được gửi bằng sendPhoto với message làm chú thích.
+        Một thông báo chỉ được tính là đã tới một chat khi mọi tin chứa nó gửi thành công tới chat đó.
+        """
+        # Đích được nhận diện bằng _delivery_key (chat_id hoặc "chat_id:thread_id"), cùng dạng với delivered_to
+        all_chat_ids = [_delivery_key(destination_key(d)) for d in self.destinations]
+        # khóa đích -> (đích, làn ưu tiên); chat người dùng đi sau group/channel
+        targets = {key: (d, PRIORITY_HIGH) for key, d in zip(all_chat_ids, self.destinations)}
+        if self.watchlists:
+            self.watchlists.refresh()
+        missing_by_chat: Dict[str, List[int]] = {}
+        for pos, item in enumerate(items):
+            required = set(all_chat_ids)
+            if self.watchlists:
+                for destination in self.watchlists.recipients(item['payload']):
+                    key = _delivery_key(destination_key(destination))
+                    targets.setdefault(key, (destination, PRIORITY_NORMAL))
+                    required.add(key)
+            item['required_destinations'] = required
+            for chat_id in required - item['delivered_to']:
+                missing_by_chat.setdefault(chat_id, []).append(pos)
+        groups: Dict[tuple, List[str]] = {}
+        for chat_id, positions in missing_by_chat.items():
+            groups.setdefault((tuple(positions), targets[chat_id][1]), []).append(chat_id)
+
+        errors: Dict[int, str] = {}
+        dead_chats: set = set()
+
+        async def deliver_group(positions: tuple, priority: int, chat_ids: List[str]) -> None:
+            group = [items[pos] for pos in positions]
+            destinations = [targets[chat_id][0] for chat_id in chat_ids]
+            try:
+                rendered = render([item['payload'] for item in group])
+                results = await asyncio.gather(*(
+                    self._fan_out(
+                        self.telegram_handler.send_photo,
+                        {'photo': photo, 'caption': message, 'parse_mode': 'MarkdownV2'},
+                        priority, destinations
+                    ) if photo else self._fan_out(
+                        self.telegram_handler.send_message,
+                        {'text': message, 'disable_web_page_preview': False, 'parse_mode': 'MarkdownV2'},
+                        priority, destinations
+                    )
+                    for message, _, photo in rendered
+                ))
+            except Exception as e:
+                self.logger.error(f"Failed to deliver {len(group)} outbox notification(s): {e}", exc_info=True)
+                errors.update((item['id'], str(e)) for item in group)
+                return
+            delivered = [set(chat_ids) for _ in group]
+            for (_, message_positions, _), per_chat in zip(rendered, results):
+                for key, outcome in per_chat.items():
+                    if outcome is True:
+                        continue
+                    chat_id = _delivery_key(key)
+                    if priority != PRIORITY_HIGH and _is_forbidden(outcome):
+                        # Người dùng đã chặn bot / xóa chat: thử lại cũng vô ích
+                        self.logger.warning(f"Watchlist chat {chat_id} refused the message ({outcome}); not retrying, disabling chat.")
+                        dead_chats.add(key[0])
+                        continue
+                    for pos in message_positions:
+                        delivered[pos].discard(chat_id)
+                        errors[group[pos]['id']] = f"{chat_id}: {outcome}"
+            for item, chats in zip(group, delivered):
+                item['delivered_to'] |= chats
 
-        else:
-            # Send individually if not over threshold
-            header = self.esc("🆘 New Signal Found! 🆘") # Changed header for individual messages
-            separator = self.esc("\n\n----------------------------------------\n\n")
-            for result in signals_to_send:
-                trend_raw = result.get('trend', '').replace("_", " ").title()
-                trend_emoji = "🔼 LONG" if "Bullish" in trend_raw else "🔽 SHORT"
-                signal_detail = (
-                    f"\\#{self.esc(trend_raw)} // {trend_emoji} // {self.esc(result.get('symbol', 'N/A'))}\n"
-                    f"📌Entry: {self.format_and_escape(result.get('entry_price'))}\n"
-                    f"❌SL: {self.format_and_escape(result.get('stop_loss'))}\n"
-                    f"🎯TP1: {self.format_and_escape(result.get('take_profit_1'))}\n"
-                    f"🎯TP2: {self.format_and_escape(result.get('take_profit_2'))}\n"
-                    f"🎯TP3: {self.format_and_escape(result.get('take_profit_3'))}"
-                )
-                full_message = header + separator + signal_detail
-                await self._send_to_both(full_message, thread_id=config.TELEGRAM_MESSAGE_THREAD_ID)
-                await asyncio.sleep(0.5) # Small delay between individual messages
+        try:
+            # Các nhóm chạy song song; dispatcher giữ thứ tự ưu tiên (group/channel trước chat người dùng) và giới hạn tốc độ
+            await asyncio.gather(*(deliver_group(positions, priority, chat_ids) for (positions, priority), chat_ids in groups.items()))
+        finally:
+            latencies = outbox.complete(self.db_path, items, all_chat_ids, config.OUTBOX_MAX_ATTEMPTS, errors)
+            if latencies:
+                self.logger.info(f"Delivered {len(latencies)}/{len(items)} notification(s); time to delivery max {max(latencies):.1f}s.")
+            if dead_chats:
+                self._disable_chats(dead_chats)
+
+    def _disable_chats(self, chat_ids: set) -> None:
+        """Gỡ các chat watchlist bị lỗi vĩnh viễn khỏi DB; chỉ mục watchlist bỏ chúng ở lần refresh kế tiếp."""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                users = sum(disable_chat(conn, chat_id) for chat_id in chat_ids)
+        except sqlite3.Error as e:
+            self.logger.error(f"Failed to disable unreachable chat(s) {sorted(chat_ids)}: {e}", exc_info=True)
+            return
+        self.logger.warning(f"🚫 Disabled {len(chat_ids)} unreachable watchlist chat(s) ({users} user(s) affected).")
 
-    async def flush_outcome_queue(self):
+    def _render_signal_messages(self, signals_to_send: List[Dict[str, Any]], charts: Dict[Any, bytes] | None = None) -> List[tuple]:
         """
-        Checks the outcome queue and sends notifications.
-        Groups them into a summary if the queue size is over the threshold.
+        Tạo tin nhắn cho các tín hiệu; gom thành một tin nếu số lượng vượt BATCH_THRESHOLD.
+        Tin riêng lẻ kèm biểu đồ (charts theo rowid) nếu có và nội dung vừa giới hạn chú thích ảnh.
         """
-        if not self.outcome_notification_queue:
-            return
+        if len(signals_to_send) > self.BATCH_THRESHOLD:
+            # Group signals into as few messages as possible; a signal is never split across messages
+            divider = self.esc("\n\n----------------------------------------\n\n")
 
-        outcomes_to_send = self.outcome_notification_queue.copy()
-        self.outcome_notification_queue.clear()
-        self.logger.info(f"Flushing outcome queue with {len(outcomes_to_send)} closed trades.")
+            def header(part: int, total: int) -> str:
+                counter = f" ({part}/{total})" if total > 1 else ""
+                return self.esc(f"🆘 {len(signals_to_send)} New Signals Found!{counter} 🆘") + "\n" + divider + "\n"
 
+            summaries = SIGNAL_SUMMARY_TEMPLATE.render_many(
+                _signal_fields(result, i + 1) for i, result in enumerate(signals_to_send)
+            )
+
+            # Separator between signals, but not after the last one
+            packed = pack_messages(summaries, header=header, separator="\n" + self.esc("---") + "\n")
+            self.logger.info(f"Packed {len(signals_to_send)} signals into {len(packed)} message(s).")
+            return [(message.text, message.entries, None) for message in packed]
+
+        # Send individually if not over threshold
+        charts = charts or {}
+        rendered = SIGNAL_TEMPLATE.render_many(_signal_fields(result) for result in signals_to_send)
+        return [
+            (message, [i], charts.get(result.get('rowid')) if telegram_length(message) <= TELEGRAM_CAPTION_LIMIT else None)
+            for i, (message, result) in enumerate(zip(rendered, signals_to_send))
+        ]
+
+    async def _render_signal_charts(self, signals: List[Dict[str, Any]]) -> Dict[Any, bytes]:
+        """Vẽ (song song, ngoài event loop) biểu đồ cho các tín hiệu có xu hướng trong CHART_TRENDS; trả về {rowid: PNG}."""
+        if not self.chart_renderer:
+            return {}
+        wanted = [s for s in signals if s.get('trend') in config.CHART_TRENDS]
+        pngs = await asyncio.gather(*(self.chart_renderer.render(s) for s in wanted))
+        return {s.get('rowid'): png for s, png in zip(wanted, pngs) if png}
+
+    def _render_outcome_messages(self, outcomes_to_send: List[Dict[str, Any]]) -> List[tuple]:
+        """Tạo tin nhắn cho các lệnh đã đóng; gom thành một bản tóm tắt nếu vượt BATCH_THRESHOLD."""
         if len(outcomes_to_send) > self.BATCH_THRESHOLD:
             # Create a summary message
             wins = 0
@@ -199,12 +444,37 @@ class NotificationHandler:
                 f"Net PnL \\(1x\\): `{net_pnl:+.2f}%`"
             )
             full_message = "\n\n".join([header, self.esc("---"), summary_msg])
-            await self._send_to_both(full_message, thread_id=config.TELEGRAM_MESSAGE_THREAD_ID)
-        else:
-            # Send individually if not over threshold
-            for trade in outcomes_to_send:
-                await self.send_trade_outcome_notification(trade)
-                await asyncio.sleep(0.5) # Keep the delay
+            return [(full_message, list(range(len(outcomes_to_send))), None)]
+        # Send individually if not over threshold
+        rendered = TRADE_OUTCOME_TEMPLATE.render_many(_trade_outcome_fields(trade) for trade in outcomes_to_send)
+        return [(message, [i], None) for i, message in enumerate(rendered)]
+
+    async def flush_signal_queue(self):
+        """
+        Claims pending signals from the outbox and sends them.
+        Groups them if the batch size is over the threshold.
+        """
+        items = outbox.claim_batch(self.db_path, 'signal', config.OUTBOX_CLAIM_BATCH_SIZE, config.OUTBOX_LEASE_SECONDS)
+        if not items:
+            return
+        self.logger.info(f"Flushing signal queue with {len(items)} signals.")
+        # Biểu đồ chỉ dùng cho tin riêng lẻ (lô lớn được gom thành tin văn bản)
+        charts = {}
+        if len(items) <= self.BATCH_THRESHOLD:
+            charts = await self._render_signal_charts([item['payload'] for item in items])
+        # Dispatcher tự giãn nhịp theo giới hạn Telegram, không cần sleep cố định giữa các tin
+        await self._deliver_claimed(items, lambda payloads: self._render_signal_messages(payloads, charts))
+
+    async def flush_outcome_queue(self):
+        """
+        Claims pending trade outcomes from the outbox and sends them.
+        Groups them into a summary if the batch size is over the threshold.
+        """
+        items = outbox.claim_batch(self.db_path, 'outcome', config.OUTBOX_CLAIM_BATCH_SIZE, config.OUTBOX_LEASE_SECONDS)
+        if not items:
+            return
+        self.logger.info(f"Flushing outcome queue with {len(items)} closed trades.")
+        await self._deliver_claimed(items, self._render_outcome_messages)
 
     async def send_periodic_summary_notification(self):
         """Fetches performance stats and sends a summary notification."""
@@ -235,23 +505,56 @@ class NotificationHandler:
             )
             
             full_message = "\n\n".join([header, self.esc("---"), summary_msg])
-            await self._send_to_both(full_message, thread_id=config.TELEGRAM_MESSAGE_THREAD_ID)
+            await self._send_to_all(full_message, priority=PRIORITY_LOW)
 
         except Exception as e:
             self.logger.error(f"Failed to send periodic summary notification: {e}", exc_info=True)
 
+    def render_live_board(self, stats: Dict[str, Any], positions: List[Dict[str, Any]], open_count: int) -> str:
+        """Nội dung bảng trực tiếp (MarkdownV2). Không chứa thời gian hiện tại để hash chỉ đổi khi dữ liệu đổi."""
+        header = "\n\n".join([self.esc("📊 Live Board"), self.esc("---"), (
+            f"Total Trades: `{stats.get('total_completed_trades', 0)}`\n"
+            f"Wins: `{stats.get('wins', 0)}`\n"
+            f"Losses: `{stats.get('losses', 0)}`\n"
+            f"Win Rate: `{stats.get('win_rate', 0.0):.2f}%`"
+        ), f"📂 Open Positions: `{open_count}`"])
+        lines = LIVE_BOARD_POSITION_TEMPLATE.render_many(_signal_fields(p, i + 1) for i, p in enumerate(positions))
+        while True:
+            hidden = open_count - len(lines)
+            footer = [self.esc(f"... and {hidden} more")] if hidden > 0 else []
+            text = "\n".join([header, *lines, *footer])
+            if telegram_length(text) <= TELEGRAM_MESSAGE_LIMIT or not lines:
+                return text
+            lines.pop()
+
+    async def update_live_board(self) -> Dict[str, str]:
+        """Làm mới bảng trực tiếp ở mọi đích: bỏ qua nếu nội dung không đổi, sửa tin cũ, chỉ gửi mới khi bắt buộc."""
+        try:
+            loop = asyncio.get_running_loop()
+            stats, positions, open_count = await loop.run_in_executor(
+                None, _load_live_board_data, self.db_path, config.LIVE_BOARD_MAX_POSITIONS
+            )
+            results = await self.live_board.update(self.render_live_board(stats, positions, open_count), self.destinations)
+            self.logger.debug(f"Live board refreshed: {results}")
+            return results
+        except Exception as e:
+            self.logger.error(f"Failed to refresh the live board: {e}", exc_info=True)
+            return {}
+
     async def send_simulation_summary_notification(self, stats_by_symbol: Dict[str, Any]):
         """Sends a per-symbol summary of the data simulation results."""
         self.logger.info("Preparing data simulation summary notification...")
         
         if not stats_by_symbol:
             message = self.esc("Data simulation complete, but no trades were generated to analyze.")
-            await self._send_to_both(message)
+            await self._send_to_all(message, priority=PRIORITY_LOW)
             return
 
-        header = self.esc("📊 Data Simulation Complete - Per-Symbol Summary 📊")
-        
-        message_parts = [header]
+        def header(part: int, total: int) -> str:
+            counter = f" ({part}/{total})" if total > 1 else ""
+            return self.esc(f"📊 Data Simulation Complete - Per-Symbol Summary{counter} 📊") + "\n"
+
+        symbol_blocks = []
         
         # Sort symbols by the number of trades, descending
         sorted_symbols = sorted(stats_by_symbol.items(), key=lambda item: item[1].get('total_trades', 0), reverse=True)
@@ -271,54 +574,25 @@ class NotificationHandler:
                 f"Win Rate: `{win_rate:.2f}%`\n"
                 f"Net PnL: `{net_pnl:+.2f}%`"
             )
-            # Append the formatted block for this symbol to our list of message parts
-            message_parts.append("\n\n".join([self.esc("---"), symbol_header, symbol_details]))
+            # One block per symbol; the packer never splits a block across messages
+            symbol_blocks.append("\n\n".join([self.esc("---"), symbol_header, symbol_details]))
 
-        # The footer should be a standalone message and not include details from the last loop iteration.
+        # The footer goes only at the end of the last message.
         footer = self.esc("---") + "\n\n" + self.esc("The bot will now start with this historical data for training.")
-        message_parts.append("\n\n" + footer)
-        
-        full_message = "\n".join(message_parts)
+        packed = pack_messages(symbol_blocks, header=header, separator="\n", footer="\n\n\n" + footer)
+        self.logger.info(f"Packed {len(symbol_blocks)} symbol summaries into {len(packed)} message(s).")
 
-        # Truncate if message is too long for Telegram
-        if len(full_message) > 4096:
-            self.logger.warning("Per-symbol summary message exceeds Telegram limit. Truncating.")
-            full_message = full_message[:4090] + self.esc("\n... (message truncated)")
+        # Gửi lần lượt để các phần tới nơi đúng thứ tự
+        for message in packed:
+            await self._send_to_all(message.text, priority=PRIORITY_LOW)
 
-        await self._send_to_both(full_message, thread_id=config.TELEGRAM_MESSAGE_THREAD_ID)
+    def _format_trade_outcome(self, trade_details: Dict[str, Any]) -> str:
+        return TRADE_OUTCOME_TEMPLATE.render(_trade_outcome_fields(trade_details))
 
     async def send_trade_outcome_notification(self, trade_details: Dict[str, Any]):
         self.logger.info(f"Preparing to send trade outcome notification for {trade_details.get('symbol')}.")
         try:
-            status_raw = trade_details.get('status', 'N/A')
-            trend_raw = trade_details.get('trend', '')
-            pnl_percentage_from_db = trade_details.get('pnl_percentage') # Lấy PnL từ DB
-
-            is_win = ("TP" in status_raw) or (pnl_percentage_from_db is not None and pnl_percentage_from_db > 0)
-            outcome_emoji, outcome_text = ("✅", "WIN") if is_win else ("❌", "LOSS")
-            header = f"{outcome_emoji} *Trade Closed: {self.esc(outcome_text)}* {outcome_emoji}"
-            symbol = self.esc(trade_details.get('symbol', 'N/A'))
-            direction = f"LONG 🔼" if 'BULLISH' in trend_raw else f"SHORT 🔽"
-            pnl_without_leverage_str, pnl_with_leverage_str = "`—`", "`—`"
-            entry_p, closing_p = trade_details.get('entry_price'), trade_details.get('exit_price')
-            if entry_p and closing_p:
-                try:
-                    pnl = ((float(closing_p) - float(entry_p)) / float(entry_p)) * 100
-                    if 'BEARISH' in trend_raw: pnl *= -1
-                    pnl_without_leverage_str = f"`{self.esc(f'{pnl:+.2f}%')}`"
-                    pnl_with_leverage_str = f"`{self.esc(f'{pnl * config.LEVERAGE:+.2f}%')}`"
-                except (ValueError, TypeError): pass
-            message = (
-                f"{header}\n\n"
-                f"Symbol: `{symbol}`\n"
-                f"Direction: `{self.esc(direction)}`\n"
-                f"Outcome: `{self.esc(status_raw)}`\n\n"
-                f"Entry Price: {self.format_and_escape(trade_details.get('entry_price'))}\n"
-                f"Closing Price: {self.format_and_escape(closing_p)}\n"
-                # f"PNL \\(1x\\): {pnl_without_leverage_str}\n"
-                f"PNL \\(x{config.LEVERAGE}\\): {pnl_with_leverage_str}"
-            )
-            await self._send_to_both(message, thread_id=config.TELEGRAM_MESSAGE_THREAD_ID)
+            await self._send_to_all(self._format_trade_outcome(trade_details), priority=PRIORITY_HIGH)
         except Exception as e:
             self.logger.error(f"Failed to send trade outcome notification: {e}", exc_info=True)
 
@@ -335,9 +609,9 @@ class NotificationHandler:
         separator = self.esc("-----------------------------------------")
         caption = "\n\n".join(["🚀 *AI Trading Bot Activated*", safe_accuracy_msg, monitoring_msg, separator, promo_msg])
         photo_url = "https://github.com/DuoLE3383/AI-trending/blob/main/100usd.png?raw=true"
-        await self._send_photo_to_both(photo=photo_url, caption=caption, thread_id=config.TELEGRAM_MESSAGE_THREAD_ID)
+        await self._send_photo_to_all(photo=photo_url, caption=caption, priority=PRIORITY_NORMAL)
 
-    async def send_training_complete_notification(self, accuracy: float | None, symbols_count: int):
+    async def send_training_complete_notification(self, accuracy: float | None, symbols_count: int, mode: str | None = None, evaluated_rows: int = 0):
         self.logger.info("Preparing periodic training complete notification...")
         """Hàm thông báo kết quả training định kỳ."""
         self.logger.info("Preparing periodic training complete notification...")
@@ -346,13 +620,17 @@ class NotificationHandler:
         status_message = ""
         if accuracy is not None:
             status_message = f"✅ *Periodic Training Complete*\\.\n*New Accuracy:* `{self.esc(f'{accuracy:.2%}')}`"
+            if mode:
+                # Nguồn của con số: full (tập test cân bằng) hay incremental (balanced accuracy trên các lệnh mới giữ lại)
+                source = "full retrain, balanced test set" if mode == 'full' else f"{mode}, balanced accuracy on recent trades"
+                status_message += f" {self.esc(f'({source}, {evaluated_rows} held-out)')}"
         else:
             status_message = "❌ *Periodic Training Failed*\\."
 
         monitoring_msg = f"📡 Monitoring `{symbols_count}` pairs on the `{self.esc(config.TIMEFRAME)}` timeframe\\."
         
         full_message = "\n\n".join([header, status_message, monitoring_msg])
-        await self._send_to_both(full_message, thread_id=config.TELEGRAM_MESSAGE_THREAD_ID)
+        await self._send_to_all(full_message, priority=PRIORITY_LOW)
 
     async def send_fallback_mode_startup_notification(self, symbols_count: int):
         self.logger.info(f"Preparing to send fallback mode startup notification (symbols: {symbols_count}).")
@@ -366,4 +644,4 @@ class NotificationHandler:
         separator = self.esc("-----------------------------------------")
         caption = "\n\n".join(["🚀 *AI Trading Bot Activated \\(Fallback Mode\\)*", main_msg, separator, promo_msg])
         photo_url = "https://github.com/DuoLE3383/AI-trending/blob/main/100usd.png?raw=true"
-        await self._send_photo_to_both(photo=photo_url, caption=caption, thread_id=config.TELEGRAM_MESSAGE_THREAD_ID)
\ No newline at end of file
+        await self._send_photo_to_all(photo=photo_url, caption=caption, priority=PRIORITY_NORMAL)
\ No newline at end of file
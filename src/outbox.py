@@ -0,0 +1,276 @@
+# outbox.py
+# Hàng đợi thông báo bền vững (outbox) trên SQLite.
+# Bên tạo sự kiện (lưu tín hiệu, đóng lệnh) ghi vào outbox trong CÙNG giao dịch với dữ liệu giao dịch,
+# với một idempotency key duy nhất (xem trade_key). Bên gửi claim theo lô, gửi, rồi
+# đánh dấu đã giao cho từng đích. Crash hoặc os.execv giữa chừng: các dòng đã claim sẽ hết hạn thuê
+# (lease) và được claim lại ở lần chạy sau, nên không mất và không gửi trùng tới đích đã nhận.
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_PENDING = 'PENDING'
+OUTBOX_CLAIMED = 'CLAIMED'
+OUTBOX_DELIVERED = 'DELIVERED'
+OUTBOX_FAILED = 'FAILED'
+
+def init_outbox_table(cursor: sqlite3.Cursor) -> None:
+    """Tạo bảng notification_outbox nếu chưa có. Được gọi từ init_sqlite_db."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS notification_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'PENDING',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        delivered_to TEXT NOT NULL DEFAULT '', -- Danh sách chat_id đã nhận, phân tách bằng dấu phẩy
+        created_at TEXT,
+        claimed_at REAL,
+        delivered_at TEXT,
+        last_error TEXT,
+        enqueued_at REAL, -- epoch giây, dùng để tính thời gian chờ và độ trễ giao
+        urgent INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0, -- Thử lại sau lỗi không sớm hơn thời điểm này
+        latency_seconds REAL -- Từ lúc ghi vào outbox tới lúc giao tới mọi đích
+    );
+    """)
+    # Bổ sung các cột mới cho bảng đã tạo bởi phiên bản trước
+    existing_columns = [row[1] for row in cursor.execute("PRAGMA table_info(notification_outbox);").fetchall()]
+    required_columns = {
+        "enqueued_at": "REAL",
+        "urgent": "INTEGER NOT NULL DEFAULT 0",
+        "next_attempt_at": "REAL NOT NULL DEFAULT 0",
+        "latency_seconds": "REAL",
+    }
+    for col_name, col_type in required_columns.items():
+        if col_name not in existing_columns:
+            cursor.execute(f"ALTER TABLE notification_outbox ADD COLUMN {col_name} {col_type};")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_kind_status ON notification_outbox(kind, status, id);")
+
+# Hàm được gọi sau mỗi lần enqueue (vd. để đánh thức bộ lập lịch flush); None nếu chưa đăng ký
+_enqueue_listener: Optional[Callable[[str, bool], None]] = None
+
+def set_enqueue_listener(listener: Optional[Callable[[str, bool], None]]) -> None:
+    global _enqueue_listener
+    _enqueue_listener = listener
+
+def _notify(kind: str, urgent: bool) -> None:
+    if _enqueue_listener is not None:
+        try:
+            _enqueue_listener(kind, urgent)
+        except Exception as e:
+            logger.error(f"Outbox enqueue listener failed: {e}", exc_info=True)
+
+def is_urgent(kind: str, payload: Dict[str, Any]) -> bool:
+    """Thông báo khẩn (gửi ngay, không chờ gom lô) theo urgent_field/urgent_values của chính sách hàng đợi."""
+    policy = config.NOTIFICATION_FLUSH_POLICIES.get(kind, {})
+    field = policy.get('urgent_field')
+    return bool(field) and payload.get(field) in policy.get('urgent_values', ())
+
+def trade_key(kind: str, item: Dict[str, Any]) -> str:
+    """
+    Idempotency key "<kind>:<symbol>:<kline_open_time>:<analysis_timestamp_utc>" cho thông báo của một tín hiệu.
+    Không dùng rowid: trend_analysis không có AUTOINCREMENT và bị xóa sạch mỗi lần chạy simulator,
+    nên rowid được dùng lại và key theo rowid sẽ chặn nhầm thông báo của tín hiệu mới.
+    Thiếu một trong ba trường thì dùng key ngẫu nhiên (không chống trùng, nhưng không bao giờ bị chặn nhầm).
+    """
+    identity = (item.get('symbol'), item.get('kline_open_time'), item.get('analysis_timestamp_utc'))
+    if any(part is None for part in identity):
+        return f"{kind}:{uuid.uuid4().hex}"
+    return f"{kind}:" + ':'.join(str(part) for part in identity)
+
+def _clean_payload(payload: Dict[str, Any]) -> str:
+    # Bỏ các khóa nội bộ (bắt đầu bằng '_') trước khi lưu
+    return json.dumps({k: v for k, v in payload.items() if not k.startswith('_')}, default=str)
+
+def enqueue(conn: sqlite3.Connection, kind: str, idempotency_key: str, payload: Dict[str, Any]) -> bool:
+    """
+    Thêm một thông báo vào outbox bằng kết nối (và giao dịch) của bên gọi.
+    Trả về False nếu idempotency_key đã tồn tại (thông báo trùng bị bỏ qua).
+    """
+    urgent = is_urgent(kind, payload)
+    cursor = conn.execute(
+        """INSERT OR IGNORE INTO notification_outbox (idempotency_key, kind, payload, status, created_at, enqueued_at, urgent)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (idempotency_key, kind, _clean_payload(payload), OUTBOX_PENDING, pd.Timestamp.utcnow().isoformat(), time.time(), int(urgent))
+    )
+    added = cursor.rowcount == 1
+    if added:
+        _notify(kind, urgent)
+    return added
+
+def enqueue_many(conn: sqlite3.Connection, kind: str, items: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+    """Như enqueue nhưng cho nhiều (idempotency_key, payload) trong một executemany."""
+    created_at, enqueued_at = pd.Timestamp.utcnow().isoformat(), time.time()
+    rows = [
+        (key, kind, _clean_payload(payload), OUTBOX_PENDING, created_at, enqueued_at, int(is_urgent(kind, payload)))
+        for key, payload in items
+    ]
+    conn.executemany(
+        """INSERT OR IGNORE INTO notification_outbox (idempotency_key, kind, payload, status, created_at, enqueued_at, urgent)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        rows
+    )
+    if rows:
+        _notify(kind, any(row[-1] for row in rows))
+
+def claim_batch(db_path: str, kind: str, limit: int, lease_seconds: float) -> List[Dict[str, Any]]:
+    """
+    Claim tối đa `limit` thông báo PENDING của `kind` (theo thứ tự tạo).
+    Các dòng CLAIMED quá lease_seconds (do crash/khởi động lại) được trả về PENDING trước khi claim.
+    Mỗi dòng trả về có 'payload' đã giải mã và 'delivered_to' dạng set.
+    """
+    now = time.time()
+    try:
+        with sqlite3.connect(db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            conn.execute("BEGIN IMMEDIATE")
+            reclaimed = conn.execute(
+                "UPDATE notification_outbox SET status = ? WHERE kind = ? AND status = ? AND claimed_at < ?",
+                (OUTBOX_PENDING, kind, OUTBOX_CLAIMED, now - lease_seconds)
+            ).rowcount
+            if reclaimed:
+                logger.warning(f"📮 Outbox: reclaimed {reclaimed} stale '{kind}' notification(s) from an earlier run.")
+            rows = conn.execute(
+                "SELECT * FROM notification_outbox WHERE kind = ? AND status = ? AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (kind, OUTBOX_PENDING, now, limit)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE notification_outbox SET status = ?, claimed_at = ? WHERE id = ?",
+                    [(OUTBOX_CLAIMED, now, row['id']) for row in rows]
+                )
+    except sqlite3.Error as e:
+        logger.error(f"❌ Outbox claim failed for '{kind}': {e}", exc_info=True)
+        return []
+
+    claimed = []
+    for row in rows:
+        item = dict(row)
+        item['payload'] = json.loads(item['payload'])
+        item['delivered_to'] = {c for c in item['delivered_to'].split(',') if c}
+        claimed.append(item)
+    return claimed
+
+def complete(db_path: str, items: List[Dict[str, Any]], all_destinations: Iterable[str], max_attempts: int, errors: Optional[Dict[int, str]] = None) -> List[float]:
+    """
+    Ghi lại kết quả gửi cho các dòng đã claim. Dòng đã tới mọi đích (all_destinations, hoặc
+    item['required_destinations'] nếu bên gửi đã tính riêng cho dòng đó) -> DELIVERED;
+    còn thiếu -> PENDING (attempts + 1) để thử lại sau OUTBOX_RETRY_BACKOFF_SECONDS * 2^(attempts-1),
+    hoặc FAILED khi vượt max_attempts. Trả về độ trễ giao (giây) của các dòng vừa DELIVERED.
+    """
+    errors = errors or {}
+    all_destinations = set(all_destinations)
+    now = time.time()
+    delivered_at = pd.Timestamp.utcnow().isoformat()
+    params, latencies = [], []
+    for item in items:
+        done = set(item.get('required_destinations', all_destinations)) <= item['delivered_to']
+        attempts = item['attempts'] + (0 if done else 1)
+        latency = next_attempt_at = None
+        if done:
+            status = OUTBOX_DELIVERED
+            if item.get('enqueued_at') is not None:
+                latency = now - item['enqueued_at']
+                latencies.append(latency)
+        elif attempts >= max_attempts:
+            status = OUTBOX_FAILED
+            logger.error(f"❌ Outbox item {item['idempotency_key']} failed after {attempts} attempt(s); giving up.")
+        else:
+            status = OUTBOX_PENDING
+            next_attempt_at = now + config.OUTBOX_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+        params.append((
+            status, attempts, ','.join(sorted(item['delivered_to'])),
+            delivered_at if done else None, errors.get(item['id']), latency, next_attempt_at or 0, item['id']
+        ))
+    try:
+        with sqlite3.connect(db_path) as conn:
+            conn.executemany(
+                """UPDATE notification_outbox
+                   SET status = ?, attempts = ?, delivered_to = ?, delivered_at = ?, last_error = ?,
+                       latency_seconds = ?, next_attempt_at = ?, claimed_at = NULL
+                   WHERE id = ?""",
+                params
+            )
+    except sqlite3.Error as e:
+        logger.error(f"❌ Outbox completion write failed: {e}", exc_info=True)
+    return latencies
+
+def purge_finished(db_path: str, retention_seconds: Optional[float] = None) -> int:
+    """Xóa các dòng DELIVERED/FAILED được ghi vào outbox trước retention_seconds (mặc định OUTBOX_RETENTION_DAYS); trả về số dòng đã xóa."""
+    if retention_seconds is None:
+        retention_seconds = config.OUTBOX_RETENTION_DAYS * 86400
+    try:
+        with sqlite3.connect(db_path) as conn:
+            purged = conn.execute(
+                "DELETE FROM notification_outbox WHERE status IN (?, ?) AND COALESCE(enqueued_at, 0) < ?",
+                (OUTBOX_DELIVERED, OUTBOX_FAILED, time.time() - retention_seconds)
+            ).rowcount
+    except sqlite3.Error as e:
+        logger.error(f"❌ Outbox purge failed: {e}", exc_info=True)
+        return 0
+    if purged:
+        logger.info(f"🧹 Outbox: purged {purged} delivered/failed notification(s) older than {retention_seconds / 86400:g} day(s).")
+    return purged
+
+def pending_count(db_path: str, kind: Optional[str] = None) -> int:
+    try:
+        with sqlite3.connect(f'file:{db_path}?mode=ro', uri=True) as conn:
+            if kind:
+                return conn.execute("SELECT COUNT(*) FROM notification_outbox WHERE status IN (?, ?) AND kind = ?", (OUTBOX_PENDING, OUTBOX_CLAIMED, kind)).fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM notification_outbox WHERE status IN (?, ?)", (OUTBOX_PENDING, OUTBOX_CLAIMED)).fetchone()[0]
+    except sqlite3.Error:
+        return 0
+
+def queue_stats(db_path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Trạng thái từng hàng đợi: {kind: {'ready': số thông báo gửi được ngay, 'oldest_enqueued_at', 'urgent': số thông báo khẩn,
+    'next_retry_at': thời điểm sớm nhất một thông báo đang chờ thử lại sẵn sàng}}.
+    """
+    now = time.time()
+    stats: Dict[str, Dict[str, Any]] = {}
+    try:
+        with sqlite3.connect(f'file:{db_path}?mode=ro', uri=True) as conn:
+            rows = conn.execute(
+                """SELECT kind,
+                          SUM(next_attempt_at <= ?), MIN(CASE WHEN next_attempt_at <= ? THEN enqueued_at END),
+                          SUM(urgent AND next_attempt_at <= ?), MIN(CASE WHEN next_attempt_at > ? THEN next_attempt_at END)
+                   FROM notification_outbox WHERE status = ? GROUP BY kind""",
+                (now, now, now, now, OUTBOX_PENDING)
+            ).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"❌ Outbox stats query failed: {e}", exc_info=True)
+        return stats
+    for kind, ready, oldest, urgent, next_retry_at in rows:
+        stats[kind] = {'ready': ready or 0, 'oldest_enqueued_at': oldest, 'urgent': urgent or 0, 'next_retry_at': next_retry_at}
+    return stats
+
+def delivery_latency_percentiles(db_path: str, window_seconds: float = 86400, percentiles: Tuple[int, ...] = (50, 90, 99)) -> Dict[str, Dict[str, float]]:
+    """Phân vị thời gian từ lúc ghi vào outbox tới lúc giao xong, theo từng hàng đợi, trong window_seconds gần nhất."""
+    result: Dict[str, Dict[str, float]] = {}
+    try:
+        with sqlite3.connect(f'file:{db_path}?mode=ro', uri=True) as conn:
+            rows = conn.execute(
+                "SELECT kind, latency_seconds FROM notification_outbox WHERE status = ? AND latency_seconds IS NOT NULL AND enqueued_at >= ?",
+                (OUTBOX_DELIVERED, time.time() - window_seconds)
+            ).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"❌ Outbox latency query failed: {e}", exc_info=True)
+        return result
+    by_kind: Dict[str, List[float]] = {}
+    for kind, latency in rows:
+        by_kind.setdefault(kind, []).append(latency)
+    for kind, latencies in by_kind.items():
+        values = np.percentile(latencies, percentiles)
+        result[kind] = {'count': len(latencies), **{f'p{p}': round(float(v), 3) for p, v in zip(percentiles, values)}, 'max': round(max(latencies), 3)}
+    return result
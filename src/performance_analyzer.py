@@ -8,6 +8,10 @@ from . import config
 
 logger = logging.getLogger(__name__)
 
+def win_mask(status: pd.Series, pnl_percentage: pd.Series) -> pd.Series:
+    """Định nghĩa lệnh thắng dùng chung (state_cache, nhãn của trainer, backtest): chạm TP hoặc PnL > 0."""
+    return status.str.contains('TP', na=False) | (pnl_percentage > 0)
+
 def get_performance_stats(by_symbol: bool = False) -> Dict[str, Any]:
     """
     Connects to the SQLite database, analyzes completed trades,
@@ -30,7 +34,7 @@ def get_performance_stats(by_symbol: bool = False) -> Dict[str, Any]:
 
         # Define a win condition: A trade is a win if it hits TP or has a positive PnL
         # This correctly handles manually closed trades.
-        df['is_win'] = (df['status'].str.contains('TP', na=False)) | (df['pnl_percentage'] > 0)
+        df['is_win'] = win_mask(df['status'], df['pnl_percentage'])
 
         if by_symbol:
             # Group by symbol and calculate stats for each group
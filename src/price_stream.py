@@ -0,0 +1,317 @@
+# price_stream.py
+# Engine TP/SL thời gian thực: nghe luồng mark price của Binance Futures và đóng lệnh
+# ngay khi giá cắt qua mức SL/TP, thay vì chờ vòng lặp updater 5 phút.
+import asyncio
+import json
+import logging
+import sqlite3
+from bisect import bisect_left, bisect_right
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+import websockets
+
+from . import config
+from .updater import _calculate_pnl, write_closed_trades
+
+logger = logging.getLogger(__name__)
+
+# Thứ tự ưu tiên khi nhiều mức của cùng một lệnh bị cắt trong một tick (giống check_signal_outcomes)
+_STATUS_PRIORITY = {'SL_HIT': 0, 'TP3_HIT': 1, 'TP2_HIT': 2, 'TP1_HIT': 3}
+
+class _SymbolLevels:
+    """
+    Các mức kích hoạt đã sắp xếp của một symbol.
+    - down: kích hoạt khi giá <= mức (SL của lệnh LONG, TP của lệnh SHORT)
+    - up:   kích hoạt khi giá >= mức (TP của lệnh LONG, SL của lệnh SHORT)
+    Mỗi danh sách mức có một danh sách song song (rowid, status) cùng chỉ số.
+    """
+    __slots__ = ('down_levels', 'down_refs', 'up_levels', 'up_refs')
+
+    def __init__(self):
+        self.down_levels: List[float] = []
+        self.down_refs: List[Tuple[int, str]] = []
+        self.up_levels: List[float] = []
+        self.up_refs: List[Tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.down_levels) + len(self.up_levels)
+
+def _insert(levels: List[float], refs: List[Tuple[int, str]], level: float, ref: Tuple[int, str]) -> None:
+    idx = bisect_right(levels, level)
+    levels.insert(idx, level)
+    refs.insert(idx, ref)
+
+def _remove(levels: List[float], refs: List[Tuple[int, str]], level: float, rowid: int) -> None:
+    idx = bisect_left(levels, level)
+    while idx < len(levels) and levels[idx] == level:
+        if refs[idx][0] == rowid:
+            del levels[idx]
+            del refs[idx]
+            return
+        idx += 1
+
+class PriceLevelIndex:
+    """
+    Chỉ mục mức giá SL/TP cho tất cả tín hiệu ACTIVE, nhóm theo symbol.
+    Mỗi tick giá chỉ tốn một bisect trên mỗi danh sách để lấy ra mọi mức bị cắt,
+    không phải quét toàn bộ tín hiệu.
+    """
+    def __init__(self):
+        self._by_symbol: Dict[str, _SymbolLevels] = {}
+        self._signals: Dict[int, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._signals)
+
+    def __contains__(self, rowid: int) -> bool:
+        return rowid in self._signals
+
+    def active_ids(self) -> set:
+        return set(self._signals)
+
+    def _levels_of(self, signal: Dict[str, Any]) -> List[Tuple[str, str, float]]:
+        """Trả về [(side, status, level)] của một tín hiệu; side là 'down' hoặc 'up'."""
+        trend = signal.get('trend') or ''
+        if 'BULLISH' in trend:
+            sl_side, tp_side = 'down', 'up'
+        elif 'BEARISH' in trend:
+            sl_side, tp_side = 'up', 'down'
+        else:
+            return []
+        levels = []
+        for status, side, col in (
+            ('SL_HIT', sl_side, 'stop_loss'),
+            ('TP1_HIT', tp_side, 'take_profit_1'),
+            ('TP2_HIT', tp_side, 'take_profit_2'),
+            ('TP3_HIT', tp_side, 'take_profit_3'),
+        ):
+            value = signal.get(col)
+            if value is not None:
+                levels.append((side, status, float(value)))
+        return levels
+
+    def add_signal(self, signal: Dict[str, Any]) -> bool:
+        rowid = signal.get('rowid')
+        if rowid is None or rowid in self._signals:
+            return False
+        levels = self._levels_of(signal)
+        if not levels:
+            return False
+        book = self._by_symbol.setdefault(signal['symbol'], _SymbolLevels())
+        for side, status, level in levels:
+            if side == 'down':
+                _insert(book.down_levels, book.down_refs, level, (rowid, status))
+            else:
+                _insert(book.up_levels, book.up_refs, level, (rowid, status))
+        self._signals[rowid] = signal
+        return True
+
+    def remove_signal(self, rowid: int) -> Optional[Dict[str, Any]]:
+        signal = self._signals.pop(rowid, None)
+        if signal is None:
+            return None
+        book = self._by_symbol.get(signal['symbol'])
+        if book is not None:
+            for side, _, level in self._levels_of(signal):
+                if side == 'down':
+                    _remove(book.down_levels, book.down_refs, level, rowid)
+                else:
+                    _remove(book.up_levels, book.up_refs, level, rowid)
+            if not len(book):
+                del self._by_symbol[signal['symbol']]
+        return signal
+
+    def on_price(self, symbol: str, price: float) -> List[Tuple[Dict[str, Any], str, float]]:
+        """
+        Xử lý một tick giá. Trả về [(signal, status, exit_price)] cho các lệnh vừa đóng
+        và gỡ chúng khỏi chỉ mục.
+        """
+        book = self._by_symbol.get(symbol)
+        if book is None:
+            return []
+
+        fired: Dict[int, str] = {}
+        # Mức "down" kích hoạt khi price <= level, tức mọi level >= price (đuôi danh sách)
+        i = bisect_left(book.down_levels, price)
+        if i < len(book.down_levels):
+            for rowid, status in book.down_refs[i:]:
+                self._keep_best(fired, rowid, status)
+        # Mức "up" kích hoạt khi price >= level, tức mọi level <= price (đầu danh sách)
+        j = bisect_right(book.up_levels, price)
+        if j:
+            for rowid, status in book.up_refs[:j]:
+                self._keep_best(fired, rowid, status)
+        if not fired:
+            return []
+
+        closed = []
+        for rowid, status in fired.items():
+            signal = self.remove_signal(rowid)
+            if signal is None:
+                continue
+            exit_price = float(signal[{
+                'SL_HIT': 'stop_loss', 'TP1_HIT': 'take_profit_1',
+                'TP2_HIT': 'take_profit_2', 'TP3_HIT': 'take_profit_3',
+            }[status]])
+            closed.append((signal, status, exit_price))
+        return closed
+
+    @staticmethod
+    def _keep_best(fired: Dict[int, str], rowid: int, status: str) -> None:
+        current = fired.get(rowid)
+        if current is None or _STATUS_PRIORITY[status] < _STATUS_PRIORITY[current]:
+            fired[rowid] = status
+
+def _iter_price_ticks(payload: Any):
+    """
+    Trích (symbol, price) từ một message WebSocket. Hỗ trợ:
+    - !markPrice@arr@1s: danh sách các markPriceUpdate
+    - <symbol>@markPrice / <symbol>@aggTrade: một object có 's' và 'p'
+    - combined stream: {"stream": ..., "data": ...}
+    """
+    if isinstance(payload, dict) and 'data' in payload:
+        payload = payload['data']
+    items = payload if isinstance(payload, list) else [payload]
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        symbol, price = item.get('s'), item.get('p')
+        if symbol is None or price is None:
+            continue
+        try:
+            yield symbol, float(price)
+        except (TypeError, ValueError):
+            continue
+
+class PriceStreamEngine:
+    """
+    Giữ PriceLevelIndex đồng bộ với các tín hiệu ACTIVE trong DB, nghe luồng giá
+    và ghi kết quả TP/SL (cùng thông báo vào outbox) ngay khi có tick cắt qua mức.
+    Mỗi lệnh đóng được chuyển tới `on_close` (nếu có) để đẩy thông báo đi ngay lập tức.
+    """
+    def __init__(
+        self,
+        db_path: str,
+        on_close: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+        stream_url: Optional[str] = None,
+        sync_interval_seconds: Optional[float] = None,
+    ):
+        self.db_path = db_path
+        self.on_close = on_close
+        self.stream_url = stream_url or config.MARK_PRICE_STREAM_URL
+        self.sync_interval_seconds = sync_interval_seconds or config.SIGNAL_CHECK_INTERVAL_SECONDS
+        self.index = PriceLevelIndex()
+        self.ticks_processed = 0
+
+    def sync_active_signals(self) -> None:
+        """Nạp tín hiệu ACTIVE mới vào chỉ mục và gỡ các tín hiệu đã được đóng ở nơi khác."""
+        try:
+            with sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True) as conn:
+                conn.row_factory = sqlite3.Row
+                rows = conn.execute("SELECT rowid, * FROM trend_analysis WHERE status = 'ACTIVE'").fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Price stream: failed to load active signals: {e}", exc_info=True)
+            return
+
+        db_ids = set()
+        added = 0
+        for row in rows:
+            db_ids.add(row['rowid'])
+            if self.index.add_signal(dict(row)):
+                added += 1
+        removed = 0
+        for rowid in self.index.active_ids() - db_ids:
+            self.index.remove_signal(rowid)
+            removed += 1
+        if added or removed:
+            logger.info(f"🔄 Price stream index synced: +{added} / -{removed} (tracking {len(self.index)} signal(s)).")
+
+    def _write_outcomes(self, closed: List[Tuple[Dict[str, Any], str, float]]) -> List[Dict[str, Any]]:
+        """Ghi các lệnh vừa đóng (kèm thông báo outbox) bằng một giao dịch; chỉ trả về các trade đã thực sự được cập nhật."""
+        timestamp_utc = pd.Timestamp.utcnow().isoformat()
+        trades = []
+        for signal, status, exit_price in closed:
+            pnl_percentage, pnl_with_leverage = _calculate_pnl(signal.get('entry_price'), exit_price, signal.get('trend'), signal.get('rowid'))
+            trades.append({
+                **signal, 'status': status, 'outcome_timestamp_utc': timestamp_utc, 'exit_price': exit_price,
+                'pnl_percentage': pnl_percentage, 'pnl_with_leverage': pnl_with_leverage,
+            })
+        trades = write_closed_trades(self.db_path, trades)
+        for trade in trades:
+            logger.info(f"⚡ {trade['symbol']} rowid {trade['rowid']} closed by stream: {trade['status']} at {trade['exit_price']}")
+        return trades
+
+    async def handle_message(self, raw: Any) -> List[Dict[str, Any]]:
+        """Xử lý một message thô từ WebSocket; trả về các trade vừa đóng."""
+        payload = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+        closed = []
+        for symbol, price in _iter_price_ticks(payload):
+            self.ticks_processed += 1
+            closed.extend(self.index.on_price(symbol, price))
+        if not closed:
+            return []
+
+        trades = self._write_outcomes(closed)
+        if self.on_close:
+            for trade in trades:
+                try:
+                    await self.on_close(trade)
+                except Exception as e:
+                    logger.error(f"❌ Price stream: on_close failed for {trade.get('symbol')}: {e}", exc_info=True)
+        return trades
+
+    async def _sync_periodically(self):
+        while True:
+            await asyncio.sleep(self.sync_interval_seconds)
+            self.sync_active_signals()
+
+    async def run(self):
+        """Kết nối tới luồng giá và tự kết nối lại (backoff lũy thừa) khi bị ngắt."""
+        self.sync_active_signals()
+        sync_task = asyncio.create_task(self._sync_periodically())
+        backoff = 1
+        try:
+            while True:
+                try:
+                    async with websockets.connect(self.stream_url, ping_interval=20) as ws:
+                        logger.info(f"📡 Price stream connected: {self.stream_url}")
+                        backoff = 1
+                        async for raw in ws:
+                            await self.handle_message(raw)
+                    reason = "closed by server"
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    reason = str(e)
+                logger.warning(f"⚠️ Price stream disconnected ({reason}). Reconnecting in {backoff}s...")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+        finally:
+            sync_task.cancel()
+
+async def run_replay_server(frames_path: str, host: str = '127.0.0.1', port: int = 8765, interval_seconds: float = 0.0):
+    """
+    Server WebSocket cục bộ phát lại các frame đã ghi (mỗi dòng một message JSON),
+    dùng để chạy PriceStreamEngine offline: stream_url='ws://127.0.0.1:8765'.
+    """
+    with open(frames_path, 'r') as f:
+        frames = [line.strip() for line in f if line.strip()]
+
+    async def replay(ws):
+        for frame in frames:
+            await ws.send(frame)
+            if interval_seconds:
+                await asyncio.sleep(interval_seconds)
+
+    async with websockets.serve(replay, host, port):
+        logger.info(f"🎞️ Replaying {len(frames)} frame(s) on ws://{host}:{port}")
+        await asyncio.Future()
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2:
+        print("Usage: python -m src.price_stream <frames.jsonl> [port]")
+        sys.exit(1)
+    asyncio.run(run_replay_server(sys.argv[1], port=int(sys.argv[2]) if len(sys.argv) > 2 else 8765))
@@ -0,0 +1,222 @@
+# rate_limiter.py
+# Bộ điều phối gửi tin Telegram chủ động theo giới hạn của Telegram thay vì chỉ phản ứng với lỗi 429:
+#   - một token bucket toàn cục (~30 tin/giây cho mỗi bot)
+#   - một token bucket cho mỗi chat (~1 tin/giây với chat riêng, ~20 tin/phút với group/channel)
+#   - hàng đợi ưu tiên: cảnh báo đóng lệnh / tín hiệu mạnh đi trước các bản tóm tắt
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Làn ưu tiên (số nhỏ hơn được gửi trước)
+PRIORITY_HIGH = 0    # Đóng lệnh, tín hiệu mạnh
+PRIORITY_NORMAL = 1  # Thông báo khởi động, lỗi hệ thống
+PRIORITY_LOW = 2     # Tóm tắt định kỳ, báo cáo mô phỏng/huấn luyện
+
+class TokenBucket:
+    """Token bucket đơn giản dựa trên time.monotonic(); có thể bị tạm dừng theo retry_after."""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Số giây phải chờ trước khi lấy được một token (0 nếu có thể gửi ngay)."""
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def is_full(self, now: float) -> bool:
+        """True nếu bucket đã hồi đủ token và không bị tạm dừng (xóa đi rồi tạo lại cũng không khác gì)."""
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float, now: float) -> None:
+        """Dừng bucket trong `seconds` giây (theo retry_after của Telegram) và xả hết token."""
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'chat_id', 'send_func', 'kwargs', 'future', 'rate_limit_hits')
+
+    def __init__(self, priority: int, seq: int, chat_id: str, send_func: Callable[..., Awaitable[Any]], kwargs: Dict[str, Any], future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.send_func = send_func
+        self.kwargs = kwargs
+        self.future = future
+        self.rate_limit_hits = 0
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+def _retry_after_seconds(error: httpx.HTTPStatusError) -> Optional[float]:
+    try:
+        return float(error.response.json().get('parameters', {}).get('retry_after'))
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+        return None
+
+class TelegramDispatcher:
+    """
+    Điều phối mọi lệnh gửi Telegram qua các token bucket.
+    Mỗi chat có một heap riêng theo (priority, seq); mỗi lượt chọn job ưu tiên nhất trong số
+    các chat đang có token, nên một chat bị giới hạn không chặn các chat khác.
+    Lỗi 429 tạm dừng bucket của chat theo retry_after rồi xếp lại job, không sleep cố định.
+    """
+    def __init__(
+        self,
+        global_rate_per_second: float = 30.0,
+        global_burst: float = 30.0,
+        private_rate_per_second: float = 1.0,
+        private_burst: float = 1.0,
+        group_rate_per_minute: float = 20.0,
+        group_burst: float = 3.0,
+        max_rate_limit_retries: int = 5,
+    ):
+        self.global_bucket = TokenBucket(global_rate_per_second, global_burst)
+        self.private_rate = private_rate_per_second
+        self.private_burst = private_burst
+        self.group_rate = group_rate_per_minute / 60.0
+        self.group_burst = group_burst
+        self.max_rate_limit_retries = max_rate_limit_retries
+
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._pending: Dict[str, List[_Job]] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+        self.sent_count = 0
+        self.rate_limited_count = 0
+
+    def _bucket_for(self, chat_id: str) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # ID số của group/channel trên Telegram là số âm; channel công khai còn được gọi bằng @username
+            if chat_id.startswith(('-', '@')):
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def pending_count(self) -> int:
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    def _ensure_worker(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    def _enqueue(self, job: _Job) -> None:
+        heapq.heappush(self._pending.setdefault(job.chat_id, []), job)
+        self._wakeup.set()
+
+    async def submit(self, send_func: Callable[..., Awaitable[Any]], priority: int = PRIORITY_NORMAL, **kwargs: Any) -> Any:
+        """Xếp một lệnh gửi vào hàng đợi và chờ kết quả của nó."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(priority, next(self._seq), str(kwargs.get('chat_id')), send_func, kwargs, future)
+        self._enqueue(job)
+        return await future
+
+    def _pick_ready_job(self, now: float) -> tuple:
+        """Trả về (job, 0) nếu có job gửi được ngay, ngược lại (None, số giây chờ ngắn nhất)."""
+        best_chat, next_ready = None, float('inf')
+        for chat_id, jobs in self._pending.items():
+            wait = self._bucket_for(chat_id).wait_time(now)
+            if wait > 0:
+                next_ready = min(next_ready, wait)
+            elif best_chat is None or jobs[0] < self._pending[best_chat][0]:
+                best_chat = chat_id
+        if best_chat is None:
+            return None, next_ready
+        global_wait = self.global_bucket.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+        jobs = self._pending[best_chat]
+        job = heapq.heappop(jobs)
+        if not jobs:
+            del self._pending[best_chat]
+        return job, 0.0
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if not self._pending:
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            job, wait = self._pick_ready_job(now)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if job.future.done():  # Người gửi đã hủy
+                continue
+            self.global_bucket.consume(now)
+            self._bucket_for(job.chat_id).consume(now)
+            task = asyncio.create_task(self._execute(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _execute(self, job: _Job) -> None:
+        try:
+            result = await job.send_func(**job.kwargs)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 429 and job.rate_limit_hits < self.max_rate_limit_retries:
+                retry_after = _retry_after_seconds(e) or 2 ** job.rate_limit_hits
+                job.rate_limit_hits += 1
+                self.rate_limited_count += 1
+                self._bucket_for(job.chat_id).pause(retry_after, time.monotonic())
+                logger.warning(f"Telegram rate limit (429) for chat {job.chat_id}. Pausing chat for {retry_after}s and requeueing (hit {job.rate_limit_hits}/{self.max_rate_limit_retries}).")
+                self._enqueue(job)
+                return
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        self.sent_count += 1
+        if not job.future.done():
+            job.future.set_result(result)
+
+    async def aclose(self) -> None:
+        """Dừng worker; các job còn chờ bị hủy."""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        for jobs in self._pending.values():
+            for job in jobs:
+                if not job.future.done():
+                    job.future.cancel()
+        self._pending.clear()
@@ -0,0 +1,131 @@
+# render_benchmark.py - So sánh renderer template biên dịch sẵn với cách cũ (f-string + re.sub cho mỗi trường).
+# Renderer cũ và dữ liệu mẫu ở đây cũng là chuẩn cho test golden output (tests/test_markdown_template.py).
+# Cách chạy: python -m src.render_benchmark [số_tín_hiệu]
+import random
+import re
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+from . import config
+from .notifications import (
+    SIGNAL_TEMPLATE, SIGNAL_SUMMARY_TEMPLATE, TRADE_OUTCOME_TEMPLATE, _signal_fields, _trade_outcome_fields,
+)
+
+# --- Renderer cũ, giữ nguyên để làm chuẩn so sánh ---
+
+def _legacy_esc(text: Any) -> str:
+    if not isinstance(text, str):
+        text = str(text)
+    return re.sub(r'([_*\[\]()~`>#+\-=|{}.!])', r'\\\1', text)
+
+def _legacy_num(value: Any, precision: int = 5) -> str:
+    if value is None: return '`—`'
+    try:
+        return f"`{_legacy_esc(f'{float(value):.{precision}f}')}`"
+    except (ValueError, TypeError):
+        return '`—`'
+
+def legacy_signal(result: Dict[str, Any]) -> str:
+    header = _legacy_esc("🆘 New Signal Found! 🆘")
+    separator = _legacy_esc("\n\n----------------------------------------\n\n")
+    trend_raw = result.get('trend', '').replace("_", " ").title()
+    trend_emoji = "🔼 LONG" if "Bullish" in trend_raw else "🔽 SHORT"
+    return header + separator + (
+        f"\\#{_legacy_esc(trend_raw)} // {trend_emoji} // {_legacy_esc(result.get('symbol', 'N/A'))}\n"
+        f"📌Entry: {_legacy_num(result.get('entry_price'))}\n"
+        f"❌SL: {_legacy_num(result.get('stop_loss'))}\n"
+        f"🎯TP1: {_legacy_num(result.get('take_profit_1'))}\n"
+        f"🎯TP2: {_legacy_num(result.get('take_profit_2'))}\n"
+        f"🎯TP3: {_legacy_num(result.get('take_profit_3'))}"
+    )
+
+def legacy_signal_summary(i: int, result: Dict[str, Any]) -> str:
+    trend_raw = result.get('trend', '').replace("_", " ").title()
+    trend_emoji = "🔼 LONG" if "Bullish" in trend_raw else "🔽 SHORT"
+    return (
+        f"*{i+1}\\. {_legacy_esc(result.get('symbol', 'N/A'))}* \\| {trend_emoji}\n"
+        f"  Entry: {_legacy_num(result.get('entry_price'))} \\| SL: {_legacy_num(result.get('stop_loss'))} \\| TP1: {_legacy_num(result.get('take_profit_1'))}"
+        f" \\| TP2: {_legacy_num(result.get('take_profit_2'))} \\| TP3: {_legacy_num(result.get('take_profit_3'))}"
+    )
+
+def legacy_trade_outcome(trade_details: Dict[str, Any]) -> str:
+    status_raw = trade_details.get('status', 'N/A')
+    trend_raw = trade_details.get('trend', '')
+    pnl_percentage_from_db = trade_details.get('pnl_percentage')
+    is_win = ("TP" in status_raw) or (pnl_percentage_from_db is not None and pnl_percentage_from_db > 0)
+    outcome_emoji, outcome_text = ("✅", "WIN") if is_win else ("❌", "LOSS")
+    header = f"{outcome_emoji} *Trade Closed: {_legacy_esc(outcome_text)}* {outcome_emoji}"
+    symbol = _legacy_esc(trade_details.get('symbol', 'N/A'))
+    direction = f"LONG 🔼" if 'BULLISH' in trend_raw else f"SHORT 🔽"
+    pnl_with_leverage_str = "`—`"
+    entry_p, closing_p = trade_details.get('entry_price'), trade_details.get('exit_price')
+    if entry_p and closing_p:
+        try:
+            pnl = ((float(closing_p) - float(entry_p)) / float(entry_p)) * 100
+            if 'BEARISH' in trend_raw: pnl *= -1
+            pnl_with_leverage_str = f"`{_legacy_esc(f'{pnl * config.LEVERAGE:+.2f}%')}`"
+        except (ValueError, TypeError): pass
+    return (
+        f"{header}\n\n"
+        f"Symbol: `{symbol}`\n"
+        f"Direction: `{_legacy_esc(direction)}`\n"
+        f"Outcome: `{_legacy_esc(status_raw)}`\n\n"
+        f"Entry Price: {_legacy_num(trade_details.get('entry_price'))}\n"
+        f"Closing Price: {_legacy_num(closing_p)}\n"
+        f"PNL \\(x{config.LEVERAGE}\\): {pnl_with_leverage_str}"
+    )
+
+# --- Dữ liệu mẫu ---
+
+def make_signals(n: int, seed: int = 7) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    trends = ['STRONG_BULLISH', 'STRONG_BEARISH', 'BULLISH', 'BEARISH']
+    symbols = ['BTCUSDT', '1000PEPEUSDT', 'ETH_USDT', 'A.B-C!USDT', 'X(Y)USDT']
+    signals = []
+    for i in range(n):
+        entry = rng.uniform(0.0001, 70000)
+        value = lambda k: None if rng.random() < 0.05 else (entry * k if rng.random() > 0.02 else 'n/a')
+        signals.append({
+            'rowid': i, 'symbol': rng.choice(symbols), 'trend': rng.choice(trends), 'entry_price': entry,
+            'stop_loss': value(0.97), 'take_profit_1': value(1.02), 'take_profit_2': value(1.04), 'take_profit_3': value(1.06),
+        })
+    return signals
+
+def make_trades(signals: List[Dict[str, Any]], seed: int = 11) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    statuses = ['SL_HIT', 'TP1_HIT', 'TP2_HIT', 'TP3_HIT', 'CLOSED_MANUAL']
+    return [{
+        **s, 'status': rng.choice(statuses), 'exit_price': None if rng.random() < 0.03 else s['entry_price'] * rng.uniform(0.95, 1.05),
+        'pnl_percentage': rng.choice([None, rng.uniform(-5, 5)]),
+    } for s in signals]
+
+# --- Đo ---
+
+def _time(fn: Callable[[], Any], repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_benchmark(n_signals: int = 1000) -> Dict[str, float]:
+    signals = make_signals(n_signals)
+    trades = make_trades(signals)
+    return {
+        'signal_legacy': _time(lambda: [legacy_signal(s) for s in signals]),
+        'signal_template': _time(lambda: SIGNAL_TEMPLATE.render_many(_signal_fields(s) for s in signals)),
+        'summary_legacy': _time(lambda: [legacy_signal_summary(i, s) for i, s in enumerate(signals)]),
+        'summary_template': _time(lambda: SIGNAL_SUMMARY_TEMPLATE.render_many(_signal_fields(s, i + 1) for i, s in enumerate(signals))),
+        'outcome_legacy': _time(lambda: [legacy_trade_outcome(t) for t in trades]),
+        'outcome_template': _time(lambda: TRADE_OUTCOME_TEMPLATE.render_many(_trade_outcome_fields(t) for t in trades)),
+    }
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    results = run_benchmark(n)
+    print(f"Signals: {n}")
+    for kind in ('signal', 'summary', 'outcome'):
+        legacy, template = results[f'{kind}_legacy'], results[f'{kind}_template']
+        print(f"  {kind:<8} legacy {legacy * 1000:8.2f} ms | template {template * 1000:8.2f} ms | x{legacy / template:.1f}")
@@ -0,0 +1,123 @@
+# resolver_benchmark.py - Đo updater.first_hit_outcomes so với vòng lặp cũ của data_simulator
+# (duyệt 5 nến sau entry bằng df.iloc, rẽ nhánh theo từng mức TP) trên nến random-walk tổng hợp.
+# Vòng lặp cũ ở đây cũng là chuẩn cho test parity (tests/test_resolver.py).
+# Cách chạy: python -m src.resolver_benchmark [số_nến] [số_lệnh]
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .updater import first_hit_outcomes
+
+_SL_FACTOR = 0.025
+_TP_FACTORS = (0.028, 0.036, 0.049)
+_HORIZON = 5
+
+def make_candles(n_candles: int, seed: int = 11) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_candles)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.008, n_candles)) * close
+    return pd.DataFrame({
+        'open': open_, 'high': np.maximum(open_, close) + spread,
+        'low': np.minimum(open_, close) - spread, 'close': close,
+    }, index=pd.date_range('2024-01-01', periods=n_candles, freq='15min'))
+
+def legacy_resolve(df: pd.DataFrame, entries: np.ndarray, trends: List[str]) -> List[Tuple[str, float, float]]:
+    """Vòng lặp của data_simulator trước khi vector hóa (giữ nguyên logic) -> [(status, exit_price, pnl)]."""
+    results = []
+    for i, trend in zip(entries, trends):
+        entry_price = df.iloc[i]['close']
+        sl_factor, (tp1_factor, tp2_factor, tp3_factor) = _SL_FACTOR, _TP_FACTORS
+        if trend == 'BULLISH':
+            stop_loss = entry_price * (1 - sl_factor)
+            take_profit_1 = entry_price * (1 + tp1_factor)
+            take_profit_2 = entry_price * (1 + tp2_factor)
+            take_profit_3 = entry_price * (1 + tp3_factor)
+        else:
+            stop_loss = entry_price * (1 + sl_factor)
+            take_profit_1 = entry_price * (1 - tp1_factor)
+            take_profit_2 = entry_price * (1 - tp2_factor)
+            take_profit_3 = entry_price * (1 - tp3_factor)
+        exit_price, status = None, 'ACTIVE'
+        for j in range(i + 1, min(i + 6, len(df))):
+            outcome_kline = df.iloc[j]
+            sl_hit, tp_hit, exit_price_candidate, status_candidate = False, False, None, None
+            if trend == 'BULLISH':
+                if outcome_kline['low'] <= stop_loss:
+                    sl_hit = True
+                if outcome_kline['high'] >= take_profit_3:
+                    tp_hit, exit_price_candidate, status_candidate = True, take_profit_3, 'TP3_HIT'
+                elif outcome_kline['high'] >= take_profit_2:
+                    tp_hit, exit_price_candidate, status_candidate = True, take_profit_2, 'TP2_HIT'
+                elif outcome_kline['high'] >= take_profit_1:
+                    tp_hit, exit_price_candidate, status_candidate = True, take_profit_1, 'TP1_HIT'
+            else:
+                if outcome_kline['high'] >= stop_loss:
+                    sl_hit = True
+                if outcome_kline['low'] <= take_profit_3:
+                    tp_hit, exit_price_candidate, status_candidate = True, take_profit_3, 'TP3_HIT'
+                elif outcome_kline['low'] <= take_profit_2:
+                    tp_hit, exit_price_candidate, status_candidate = True, take_profit_2, 'TP2_HIT'
+                elif outcome_kline['low'] <= take_profit_1:
+                    tp_hit, exit_price_candidate, status_candidate = True, take_profit_1, 'TP1_HIT'
+            if sl_hit:
+                exit_price, status = stop_loss, 'SL_HIT'
+                break
+            elif tp_hit:
+                exit_price, status = exit_price_candidate, status_candidate
+                break
+        if status == 'ACTIVE':
+            exit_price = df.iloc[min(i + 5, len(df) - 1)]['close']
+            status = 'CLOSED_MANUAL'
+        pnl = ((exit_price - entry_price) / entry_price) * 100
+        if trend == 'BEARISH':
+            pnl *= -1
+        results.append((status, exit_price, pnl))
+    return results
+
+def vectorized_resolve(df: pd.DataFrame, entries: np.ndarray, trends: List[str]) -> List[Tuple[str, float, float]]:
+    """Cùng phép tính như data_simulator._simulate_symbol hiện tại."""
+    closes = df['close'].to_numpy(dtype=float)
+    entry_prices = closes[entries]
+    is_long = np.asarray(trends) == 'BULLISH'
+    direction = np.where(is_long, 1.0, -1.0)
+    stop_loss = entry_prices * (1 - direction * _SL_FACTOR)
+    tp1, tp2, tp3 = (entry_prices * (1 + direction * factor) for factor in _TP_FACTORS)
+    statuses, exit_prices, _ = first_hit_outcomes(
+        df['high'].to_numpy(dtype=float), df['low'].to_numpy(dtype=float), closes,
+        entries, is_long, stop_loss, tp1, tp2, tp3, _HORIZON
+    )
+    pnl = (exit_prices - entry_prices) / entry_prices * 100 * direction
+    return list(zip(statuses.tolist(), exit_prices.tolist(), pnl.tolist()))
+
+def make_trades(n_candles: int, n_trades: int, seed: int = 11) -> Tuple[np.ndarray, List[str]]:
+    rng = np.random.default_rng(seed)
+    # Cùng dải entry như simulator (chừa 6 nến cuối), kể cả entry trùng nhau
+    entries = np.sort(rng.integers(0, n_candles - 6, n_trades))
+    return entries, rng.choice(['BULLISH', 'BEARISH'], n_trades).tolist()
+
+def run_benchmark(n_candles: int = 2880, n_trades: int = 2000, seed: int = 11) -> Dict[str, Any]:
+    df = make_candles(n_candles, seed)
+    entries, trends = make_trades(n_candles, n_trades, seed)
+    started = time.perf_counter()
+    expected = legacy_resolve(df, entries, trends)
+    legacy_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    vectorized_resolve(df, entries, trends)
+    vectorized_seconds = time.perf_counter() - started
+    return {
+        'trades': n_trades,
+        'statuses': pd.Series([e[0] for e in expected]).value_counts().to_dict(),
+        'legacy_seconds': legacy_seconds, 'vectorized_seconds': vectorized_seconds,
+    }
+
+if __name__ == '__main__':
+    n_candles = int(sys.argv[1]) if len(sys.argv) > 1 else 2880
+    n_trades = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    result = run_benchmark(n_candles, n_trades)
+    print(f"Trades: {result['trades']} on {n_candles} candles | outcomes: {result['statuses']}")
+    print(f"  loop (df.iloc)  {result['legacy_seconds'] * 1000:9.1f} ms | {result['trades'] / result['legacy_seconds']:10.0f} trades/s")
+    print(f"  vectorized      {result['vectorized_seconds'] * 1000:9.1f} ms | {result['trades'] / result['vectorized_seconds']:10.0f} trades/s")
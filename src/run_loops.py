@@ -3,36 +3,49 @@
 
 import logging
 import asyncio
-import sqlite3
 import os
 import sys
+from typing import Optional
 
 # Imports từ các module của dự án và thư viện bên ngoài
 from binance import AsyncClient
 from . import config # Dùng .config vì đang ở trong thư mục src
 from .analysis_engine import perform_ai_fallback_analysis, perform_elliotv8_analysis
 from .notifications import NotificationHandler
-from .updater import get_usdt_futures_symbols, check_signal_outcomes
+from .updater import get_usdt_futures_symbols, check_signal_outcomes, check_signal_outcomes_snapshot, PriceSnapshotTracker
+from .price_stream import PriceStreamEngine
+from .command_bot import CommandBot
+from .market_data_handler import binance_request_limiter
+from .state_cache import state_cache
+from .signal_coalescer import signal_coalescer
 from .api_server import app as flask_app
+from .model_registry import LiveModel, ModelBundle
 
 logger = logging.getLogger(__name__)
 
 # --- CÁC VÒNG LẶP CỦA BOT ---
 
-async def analysis_loop(client: AsyncClient, model, label_encoder, model_features):
+async def analysis_loop(client: AsyncClient, live_model: LiveModel):
     """LOOP 1: Phân tích thị trường liên tục, chọn chiến lược từ config."""
     logger.info(f"✅ Analysis Loop starting (Strategy: {config.STRATEGY_MODE})")
-    semaphore = asyncio.Semaphore(config.CONCURRENT_REQUESTS)
+    semaphore = binance_request_limiter()
 
-    async def process_with_semaphore(symbol: str):
+    async def process_with_semaphore(symbol: str, bundle: Optional[ModelBundle]):
         async with semaphore:
             if config.STRATEGY_MODE == 'Elliotv8':
                 await perform_elliotv8_analysis(client, symbol)
+            elif bundle is not None:
+                # Bản biên dịch cho cùng kết quả với model nhưng dự đoán một dòng nhanh hơn nhiều
+                model = bundle.compiled if config.MODEL_COMPILED_INFERENCE and bundle.compiled is not None else bundle.model
+                await perform_ai_fallback_analysis(client, symbol, model, bundle.label_encoder, bundle.features)
             else:
-                await perform_ai_fallback_analysis(client, symbol, model, label_encoder, model_features)
+                await perform_ai_fallback_analysis(client, symbol, None, None, None)
 
     while True:
         try:
+            # Đổi sang phiên bản model mới (nếu trainer vừa công bố / vừa quay lui) giữa hai chu kỳ;
+            # cả chu kỳ dùng chung một bộ model + encoder + features
+            bundle = await live_model.refresh()
             current_symbols = await get_usdt_futures_symbols(client)
             if not current_symbols:
                 logger.warning("Không tìm thấy symbol nào để phân tích. Bỏ qua chu kỳ này.")
@@ -40,7 +53,7 @@ async def analysis_loop(client: AsyncClient, model, label_encoder, model_feature
                 continue
             
             logger.info(f"--- Bắt đầu chu kỳ phân tích cho {len(current_symbols)} symbols ---")
-            tasks = [process_with_semaphore(s) for s in current_symbols]
+            tasks = [process_with_semaphore(s, bundle) for s in current_symbols]
             await asyncio.gather(*tasks)
             logger.info(f"--- Chu kỳ phân tích hoàn tất. Tạm nghỉ {config.LOOP_SLEEP_INTERVAL_SECONDS} giây. ---")
             await asyncio.sleep(config.LOOP_SLEEP_INTERVAL_SECONDS)
@@ -48,86 +61,69 @@ async def analysis_loop(client: AsyncClient, model, label_encoder, model_feature
             logger.error(f"Lỗi trong analysis_loop: {e}", exc_info=True)
             await asyncio.sleep(60)
 
-async def signal_check_loop(notifier: NotificationHandler):
-    """LOOP 2: Kiểm tra tín hiệu mới trong DB để gửi thông báo."""
-    logger.info("✅ New Signal Alert Loop starting...")
-    notified_signal_ids = set()
-    try:
-        with sqlite3.connect(f'file:{config.SQLITE_DB_PATH}?mode=ro', uri=True) as conn:
-            existing_ids = conn.execute("SELECT rowid FROM trend_analysis WHERE status = 'ACTIVE'").fetchall()
-            notified_signal_ids.update(row[0] for row in existing_ids)
-    except Exception as e:
-        logger.error(f"Lỗi khi khởi tạo signal_check_loop: {e}")
-
-    while True:
-        try:
-            with sqlite3.connect(f'file:{config.SQLITE_DB_PATH}?mode=ro', uri=True) as conn:
-                conn.row_factory = sqlite3.Row
-                all_active_signals = conn.execute("SELECT rowid, * FROM trend_analysis WHERE status = 'ACTIVE'").fetchall()
-            new_signals_to_notify = [s for s in all_active_signals if s['rowid'] not in notified_signal_ids]
-            if new_signals_to_notify:
-                logger.info(f"Phát hiện {len(new_signals_to_notify)} tín hiệu mới cần thông báo.")
-                for signal in new_signals_to_notify:
-                    notifier.queue_signal(dict(signal))
-                    notified_signal_ids.add(signal['rowid'])
-        except Exception as e:
-            logger.error(f"Lỗi trong signal_check_loop: {e}", exc_info=True)
-        await asyncio.sleep(config.SIGNAL_CHECK_INTERVAL_SECONDS)
-
 async def updater_loop(client: AsyncClient):
-    """LOOP 3: Cập nhật trạng thái của các tín hiệu (check TP/SL)."""
-    logger.info("✅ Trade Updater Loop starting...")
+    """LOOP 3: Cập nhật trạng thái của các tín hiệu (check TP/SL) ở chế độ 'poll' hoặc 'snapshot'."""
+    snapshot_mode = config.TRADE_UPDATER_MODE == 'snapshot'
+    logger.info(f"✅ Trade Updater Loop starting (mode: {'snapshot' if snapshot_mode else 'poll'})...")
+    tracker = PriceSnapshotTracker(max_gap_ms=config.SNAPSHOT_MAX_GAP_SECONDS * 1000) if snapshot_mode else None
+    interval = config.SNAPSHOT_UPDATER_INTERVAL_SECONDS if snapshot_mode else config.UPDATER_INTERVAL_SECONDS
     while True:
         try:
-            await check_signal_outcomes(client)
+            if snapshot_mode:
+                await check_signal_outcomes_snapshot(client, tracker)
+            else:
+                await check_signal_outcomes(client)
         except Exception as e:
             logger.error(f"Lỗi nghiêm trọng trong updater_loop: {e}", exc_info=True)
-        await asyncio.sleep(config.UPDATER_INTERVAL_SECONDS)
-
-async def outcome_check_loop(notifier: NotificationHandler):
-    """LOOP 4: Kiểm tra các giao dịch đã đóng để gửi thông báo kết quả."""
-    logger.info("✅ Trade Outcome Notification Loop starting...")
-    notified_trade_ids = set()
-    try:
-        with sqlite3.connect(f'file:{config.SQLITE_DB_PATH}?mode=ro', uri=True) as conn:
-            closed_trades = conn.execute("SELECT rowid FROM trend_analysis WHERE status != 'ACTIVE'").fetchall()
-            notified_trade_ids.update(row[0] for row in closed_trades)
-    except Exception as e:
-        logger.error(f"Lỗi khi khởi tạo outcome_check_loop: {e}")
+        await asyncio.sleep(interval)
 
-    while True:
-        try:
-            with sqlite3.connect(f'file:{config.SQLITE_DB_PATH}?mode=ro', uri=True) as conn:
-                conn.row_factory = sqlite3.Row
-                all_closed_trades = conn.execute("SELECT rowid, * FROM trend_analysis WHERE status != 'ACTIVE'").fetchall()
-                newly_closed_trades = [t for t in all_closed_trades if t['rowid'] not in notified_trade_ids]
-            if newly_closed_trades:
-                logger.info(f"Phát hiện {len(newly_closed_trades)} giao dịch vừa đóng.")
-                for trade in newly_closed_trades:
-                    notifier.queue_trade_outcome(dict(trade))
-                    notified_trade_ids.add(trade['rowid'])
-        except Exception as e:
-            logger.error(f"Lỗi trong outcome_check_loop: {e}", exc_info=True)
-        await asyncio.sleep(config.SIGNAL_CHECK_INTERVAL_SECONDS)
+async def price_stream_loop(notifier: NotificationHandler):
+    """LOOP 3 (chế độ 'stream'): Đóng lệnh TP/SL theo thời gian thực từ luồng mark price."""
+    logger.info("✅ Real-time Price Stream Loop starting...")
+    engine = PriceStreamEngine(config.SQLITE_DB_PATH, on_close=notifier.publish_trade_outcome_now)
+    await engine.run()
 
 async def notification_flush_loop(notifier: NotificationHandler):
-    """LOOP 5: Gửi các thông báo trong hàng đợi một cách định kỳ."""
-    logger.info("✅ Notification Queue Flush Loop starting (10 min interval)...")
-    while True:
-        await asyncio.sleep(10 * 60)
-        logger.info("⏰ Đến giờ, gửi các thông báo đang chờ...")
-        await asyncio.gather(
-            notifier.flush_signal_queue(),
-            notifier.flush_outcome_queue()
-        )
+    """
+    LOOP 5: Gửi các thông báo đang chờ trong outbox theo chính sách flush của từng hàng đợi
+    (đủ lô / quá thời gian chờ tối đa / thông báo khẩn) thay vì ngủ cố định 10 phút.
+    Tín hiệu/kết quả được ghi vào outbox cùng giao dịch lưu trade, nên không cần vòng lặp dò DB;
+    những gì lần chạy trước còn dở được gửi ngay khi khởi động vì đã quá hạn chờ.
+    """
+    logger.info(f"✅ Notification Flush Scheduler starting (policies: {config.NOTIFICATION_FLUSH_POLICIES})...")
+    await notifier.flush_scheduler.run()
 
 async def summary_loop(notifier: NotificationHandler):
-    """LOOP 6: Gửi tóm tắt hiệu suất hoạt động định kỳ."""
+    """
+    LOOP 6: Tóm tắt hiệu suất định kỳ.
+    Ở chế độ bảng trực tiếp (LIVE_BOARD_ENABLED), một tin duy nhất mỗi chat được sửa tại chỗ mỗi
+    LIVE_BOARD_REFRESH_SECONDS; ngược lại gửi một tin tóm tắt mới mỗi giờ như trước.
+    """
+    if config.LIVE_BOARD_ENABLED:
+        logger.info(f"✅ Live Board Loop starting ({config.LIVE_BOARD_REFRESH_SECONDS}s refresh, edits in place)...")
+        last_latency_log = 0.0
+        while True:
+            await notifier.update_live_board()
+            if asyncio.get_running_loop().time() - last_latency_log >= 60 * 60:
+                last_latency_log = asyncio.get_running_loop().time()
+                logger.info(f"📋 Live board updates so far: {notifier.live_board.counts}")
+                logger.info(f"🔁 Duplicate signal suppression: {signal_coalescer.report()}")
+                logger.info(f"⏱️ Notification time-to-delivery (24h): {notifier.delivery_latency_stats()}")
+            await asyncio.sleep(config.LIVE_BOARD_REFRESH_SECONDS)
+
     logger.info("✅ Periodic Summary Loop starting (60 min interval)...")
     while True:
         await asyncio.sleep(60 * 60)
         logger.info("📰 Tạo và gửi tóm tắt hiệu suất định kỳ...")
         await notifier.send_periodic_summary_notification()
+        logger.info(f"⏱️ Notification time-to-delivery (24h): {notifier.delivery_latency_stats()}")
+        logger.info(f"🔁 Duplicate signal suppression: {signal_coalescer.report()}")
+
+async def command_loop(notifier: NotificationHandler):
+    """LOOP 8: Trả lời lệnh Telegram (/stats, /active, /signal, /perf) từ bộ đệm trong bộ nhớ."""
+    if not state_cache.loaded:
+        await asyncio.get_running_loop().run_in_executor(None, state_cache.load, config.SQLITE_DB_PATH)
+    await CommandBot(notifier.telegram_handler, notifier.dispatcher, state_cache).run()
 
 # Trong tệp: src/run_loops.py
 
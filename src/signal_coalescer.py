@@ -0,0 +1,89 @@
+# signal_coalescer.py
+# Gộp tín hiệu trùng trước khi lưu: trong cửa sổ thời gian của (symbol, hướng), nếu tín hiệu trước đó cùng hướng
+# vẫn đang ACTIVE thì tín hiệu mới bị bỏ qua. Tín hiệu bị bỏ không tạo dòng DB, không vào outbox và không
+# thêm một lệnh cho updater theo dõi. Cùng một nến (kline_open_time) luôn chỉ được lưu một lần.
+import logging
+import sqlite3
+import time
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+
+from . import config
+from .state_cache import state_cache
+
+logger = logging.getLogger(__name__)
+
+def signal_direction(trend: Optional[str]) -> str:
+    return 'LONG' if 'BULLISH' in (trend or '') else 'SHORT'
+
+class SignalCoalescer:
+    """Giữ tín hiệu được chấp nhận gần nhất của mỗi (symbol, hướng) và đếm số tín hiệu đã bị gộp."""
+    def __init__(self, default_window_seconds: float, overrides: Optional[Dict[str, float]] = None):
+        self.default_window_seconds = default_window_seconds
+        # Khóa "SYMBOL:HƯỚNG" ưu tiên hơn "SYMBOL"
+        self.overrides = overrides or {}
+        self._last: Dict[Tuple[str, str], Tuple[float, Any, Optional[str]]] = {} # -> (thời điểm chấp nhận, rowid, kline_open_time)
+        self._loaded = False
+        self.accepted = 0
+        self.suppressed = 0
+        self.suppressed_by_key: Counter = Counter()
+
+    def window_for(self, symbol: str, direction: str) -> float:
+        return self.overrides.get(f"{symbol}:{direction}", self.overrides.get(symbol, self.default_window_seconds))
+
+    def load(self, db_path: str) -> None:
+        """Nạp các tín hiệu ACTIVE hiện có để cửa sổ vẫn đúng sau khi khởi động lại."""
+        self._loaded = True
+        try:
+            with sqlite3.connect(db_path) as conn:
+                rows = conn.execute(
+                    "SELECT rowid, symbol, trend, kline_open_time, analysis_timestamp_utc FROM trend_analysis "
+                    "WHERE status = 'ACTIVE' ORDER BY rowid"
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Signal coalescer load failed: {e}", exc_info=True)
+            return
+        for rowid, symbol, trend, kline_time, analysed_at in rows:
+            timestamp = pd.to_datetime(analysed_at, utc=True, errors='coerce')
+            accepted_at = time.time() if pd.isna(timestamp) else timestamp.timestamp()
+            self._last[(symbol, signal_direction(trend))] = (accepted_at, rowid, kline_time)
+
+    def _is_open(self, rowid: Any) -> bool:
+        # Không có bộ đệm trạng thái thì coi như lệnh trước vẫn mở (an toàn: không gửi trùng)
+        return rowid in state_cache.active_signals if state_cache.loaded else True
+
+    def admit(self, symbol: str, trend: Optional[str], kline_time: Optional[str] = None) -> bool:
+        """True nếu tín hiệu nên được lưu; False nếu trùng (đã được đếm vào số bị gộp)."""
+        if not self._loaded:
+            self.load(config.SQLITE_DB_PATH)
+        direction = signal_direction(trend)
+        key = (symbol, direction)
+        last = self._last.get(key)
+        if last is not None:
+            accepted_at, rowid, last_kline = last
+            same_candle = kline_time is not None and kline_time == last_kline
+            within_window = time.time() - accepted_at < self.window_for(symbol, direction)
+            if same_candle or (within_window and self._is_open(rowid)):
+                self.suppressed += 1
+                self.suppressed_by_key[f"{symbol}:{direction}"] += 1
+                logger.info(f"🔁 Duplicate {direction} signal for {symbol} suppressed (signal {rowid} still open).")
+                return False
+        return True
+
+    def record(self, symbol: str, trend: Optional[str], rowid: Any, kline_time: Optional[str] = None) -> None:
+        """Ghi nhận một tín hiệu vừa được lưu."""
+        self._last[(symbol, signal_direction(trend))] = (time.time(), rowid, kline_time)
+        self.accepted += 1
+
+    def report(self, top: int = 5) -> Dict[str, Any]:
+        total = self.accepted + self.suppressed
+        return {
+            'accepted': self.accepted, 'suppressed': self.suppressed,
+            'suppression_rate': (self.suppressed / total) * 100 if total else 0.0,
+            'top_suppressed': self.suppressed_by_key.most_common(top),
+        }
+
+# Bộ gộp dùng chung của tiến trình bot
+signal_coalescer = SignalCoalescer(config.SIGNAL_COALESCE_WINDOW_SECONDS, config.SIGNAL_COALESCE_WINDOW_OVERRIDES)
@@ -0,0 +1,76 @@
+# simulator_benchmark.py - Đo thời gian khởi động của data_simulator trên một Binance client giả lập
+# (mỗi get_historical_klines chờ một độ trễ cố định rồi trả về nến random-walk tổng hợp):
+#   tuần tự (CONCURRENT_REQUESTS=1, SIMULATOR_WORKERS=1) | đồng thời (giá trị trong config)
+# DB là tệp tạm mới cho mỗi lần chạy.
+# Cách chạy: python -m src.simulator_benchmark [số_symbol] [độ_trễ_mỗi_yêu_cầu_giây] [số_lệnh_mỗi_symbol]
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from . import config
+from .data_simulator import simulate_trade_data
+from .database_handler import init_sqlite_db
+
+_INTERVAL_MS = 15 * 60 * 1000
+
+class FakeKlineClient:
+    """Chỉ có get_historical_klines như AsyncClient; nến 15m tổng hợp, định dạng giống Binance."""
+    def __init__(self, latency_seconds: float, n_klines: int = 30 * 96):
+        self.latency_seconds = latency_seconds
+        self.n_klines = n_klines
+        self.requests = 0
+
+    async def get_historical_klines(self, symbol: str, interval: str, start_str: str, end_str: str = None) -> List[List[Any]]:
+        self.requests += 1
+        await asyncio.sleep(self.latency_seconds)
+        rng = np.random.default_rng(abs(hash(symbol)) % 2**32)
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.006, self.n_klines)))
+        open_ = np.concatenate([[close[0]], close[:-1]])
+        spread = np.abs(rng.normal(0, 0.004, self.n_klines)) * close
+        high, low = np.maximum(open_, close) + spread, np.minimum(open_, close) - spread
+        start_ms = (int(time.time() * 1000) // _INTERVAL_MS - self.n_klines) * _INTERVAL_MS
+        return [
+            [start_ms + i * _INTERVAL_MS, str(open_[i]), str(high[i]), str(low[i]), str(close[i]), '1000', start_ms + (i + 1) * _INTERVAL_MS - 1]
+            for i in range(self.n_klines)
+        ]
+
+def _run(n_symbols: int, latency_seconds: float, trades_per_symbol: int) -> Dict[str, Any]:
+    db_path = tempfile.mktemp(suffix='.sqlite', prefix='simulator-bench-')
+    init_sqlite_db(db_path)
+    try:
+        client = FakeKlineClient(latency_seconds)
+        symbols = [f"SYM{i}USDT" for i in range(n_symbols)]
+        return asyncio.run(simulate_trade_data(client, db_path, symbols, num_trades_per_symbol=trades_per_symbol))
+    finally:
+        os.remove(db_path)
+
+def run_benchmark(n_symbols: int = 20, latency_seconds: float = 0.5, trades_per_symbol: int = 9) -> Dict[str, Dict[str, Any]]:
+    saved = config.CONCURRENT_REQUESTS, config.SIMULATOR_WORKERS, config.FEATURE_STORE_ENABLED
+    config.FEATURE_STORE_ENABLED = False
+    results = {}
+    try:
+        config.CONCURRENT_REQUESTS, config.SIMULATOR_WORKERS = 1, 1
+        results['sequential'] = _run(n_symbols, latency_seconds, trades_per_symbol)
+        config.CONCURRENT_REQUESTS, config.SIMULATOR_WORKERS = saved[0], saved[1]
+        results['concurrent'] = _run(n_symbols, latency_seconds, trades_per_symbol)
+    finally:
+        config.CONCURRENT_REQUESTS, config.SIMULATOR_WORKERS, config.FEATURE_STORE_ENABLED = saved
+    return results
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    trades = int(sys.argv[3]) if len(sys.argv) > 3 else 9
+    results = run_benchmark(n, latency, trades)
+    print(f"Symbols: {n} | request latency: {latency}s | trades/symbol: {trades} | "
+          f"CONCURRENT_REQUESTS={config.CONCURRENT_REQUESTS}, workers={config.SIMULATOR_WORKERS or os.cpu_count()}")
+    for name, report in results.items():
+        print(f"  {name:<11} {report['rows']:>6} rows | {report['seconds']:6.2f}s wall "
+              f"(write {report['write_seconds'] * 1000:.1f} ms) | {report['rows_per_second']:8.0f} rows/s")
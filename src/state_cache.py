@@ -0,0 +1,173 @@
+# state_cache.py
+# Trạng thái trong bộ nhớ để trả lời lệnh Telegram (/stats, /active, /signal, /perf) mà không quét bảng:
+#   - kết quả phân tích mới nhất của từng symbol (ghi bởi analysis_engine mỗi chu kỳ)
+#   - các tín hiệu ACTIVE theo rowid (thêm khi lưu tín hiệu, bỏ khi write_closed_trades đóng lệnh)
+#   - thống kê tích lũy của lệnh đã đóng + các lệnh đóng gần đây (cho /perf theo khung thời gian)
+# Chỉ đọc DB một lần lúc khởi động (load); sau đó được cập nhật bởi chính các đường ghi.
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+def _is_win(status: Optional[str], pnl_percentage: Optional[float]) -> bool:
+    # Cùng định nghĩa với performance_analyzer: chạm TP hoặc PnL dương
+    return 'TP' in (status or '') or (pnl_percentage is not None and pnl_percentage > 0)
+
+class StateCache:
+    """An toàn luồng (updater có thể ghi từ executor); mọi truy vấn chỉ đọc dict/deque trong bộ nhớ."""
+    def __init__(self, window_seconds: float = 7 * 86400):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.latest_analysis: Dict[str, Dict[str, Any]] = {}
+        self.active_signals: Dict[int, Dict[str, Any]] = {}
+        self.totals = {'trades': 0, 'wins': 0, 'net_pnl_percentage': 0.0}
+        # Lệnh đóng gần đây gộp theo phút: [phút, số lệnh, thắng, tổng PnL, (symbol, PnL) tốt nhất, tệ nhất],
+        # nên /perf 7d chỉ cộng tối đa ~10k bucket thay vì duyệt từng lệnh
+        self._minute_buckets: Deque[list] = deque()
+        self._recent_closed_ids: set = set()
+        self._recent_closed_order: Deque[Tuple[float, Any]] = deque()
+
+    def load(self, db_path: str) -> None:
+        """Nạp trạng thái ban đầu từ DB (một lần khi khởi động)."""
+        cutoff = time.time() - self.window_seconds
+        try:
+            with sqlite3.connect(db_path) as conn:
+                conn.row_factory = sqlite3.Row
+                active = [dict(row) for row in conn.execute(
+                    "SELECT rowid, symbol, trend, method, timeframe, kline_open_time, entry_price, stop_loss, "
+                    "take_profit_1, take_profit_2, take_profit_3 FROM trend_analysis WHERE status = 'ACTIVE'"
+                )]
+                closed = conn.execute(
+                    "SELECT rowid, symbol, status, pnl_percentage, outcome_timestamp_utc FROM trend_analysis WHERE status != 'ACTIVE'"
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"State cache load failed: {e}", exc_info=True)
+            return
+
+        # Chuyển thời gian đóng lệnh theo cả cột một lần (ISO có hoặc không có múi giờ)
+        closed_at = pd.to_datetime(
+            pd.Series([row['outcome_timestamp_utc'] for row in closed], dtype=object), utc=True, errors='coerce', format='ISO8601'
+        )
+        closed_epoch = (closed_at - pd.Timestamp(0, tz='UTC')).dt.total_seconds().fillna(float('-inf')).tolist()
+        recent = []
+        with self._lock:
+            self.active_signals = {row['rowid']: row for row in active}
+            self.totals = {'trades': 0, 'wins': 0, 'net_pnl_percentage': 0.0}
+            for row, epoch in zip(closed, closed_epoch):
+                win = _is_win(row['status'], row['pnl_percentage'])
+                self.totals['trades'] += 1
+                self.totals['wins'] += win
+                self.totals['net_pnl_percentage'] += row['pnl_percentage'] or 0.0
+                if epoch >= cutoff:
+                    recent.append((epoch, row['rowid'], row['symbol'], row['pnl_percentage'], win))
+            recent.sort()
+            self._minute_buckets.clear(); self._recent_closed_ids.clear(); self._recent_closed_order.clear()
+            for closed_at, rowid, symbol, pnl, win in recent:
+                self._append_closed(closed_at, rowid, symbol, pnl, win)
+            self.loaded = True
+        logger.info(f"🗂️ State cache loaded: {len(active)} active signal(s), {self.totals['trades']} closed trade(s), {len(recent)} in the last {self.window_seconds / 86400:g}d.")
+
+    def _append_closed(self, closed_at: float, rowid: Any, symbol: str, pnl: Optional[float], win: bool) -> None:
+        # Thời gian đóng không giảm (load sắp xếp trước, lệnh mới dùng thời điểm hiện tại)
+        minute = int(closed_at // 60)
+        if not self._minute_buckets or self._minute_buckets[-1][0] != minute:
+            self._minute_buckets.append([minute, 0, 0, 0.0, None, None])
+        bucket = self._minute_buckets[-1]
+        bucket[1] += 1
+        bucket[2] += win
+        if pnl is not None:
+            bucket[3] += pnl
+            if bucket[4] is None or pnl > bucket[4][1]:
+                bucket[4] = (symbol, pnl)
+            if bucket[5] is None or pnl < bucket[5][1]:
+                bucket[5] = (symbol, pnl)
+        self._recent_closed_ids.add(rowid)
+        self._recent_closed_order.append((closed_at, rowid))
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._minute_buckets and (self._minute_buckets[0][0] + 1) * 60 <= cutoff:
+            self._minute_buckets.popleft()
+        while self._recent_closed_order and self._recent_closed_order[0][0] < cutoff:
+            _, rowid = self._recent_closed_order.popleft()
+            self._recent_closed_ids.discard(rowid)
+
+    # --- Các đường ghi ---
+
+    def record_analysis(self, symbol: str, analysis: Dict[str, Any]) -> None:
+        self.latest_analysis[symbol] = {**analysis, 'analysed_at': time.time()}
+
+    def add_active_signal(self, signal: Dict[str, Any]) -> None:
+        if signal.get('rowid') is None:
+            return
+        with self._lock:
+            self.active_signals[signal['rowid']] = signal
+
+    def record_closed_trades(self, trades: List[Dict[str, Any]]) -> None:
+        now = time.time()
+        with self._lock:
+            for trade in trades:
+                rowid = trade.get('rowid')
+                self.active_signals.pop(rowid, None)
+                if rowid in self._recent_closed_ids:  # Đã ghi nhận (vd. bởi một đường cập nhật khác)
+                    continue
+                pnl = trade.get('pnl_percentage')
+                win = _is_win(trade.get('status'), pnl)
+                self.totals['trades'] += 1
+                self.totals['wins'] += win
+                self.totals['net_pnl_percentage'] += pnl or 0.0
+                self._append_closed(now, rowid, trade.get('symbol'), pnl, win)
+            self._prune(now)
+
+    # --- Truy vấn ---
+
+    def active_list(self, symbol: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Tín hiệu đang mở, mới nhất trước."""
+        with self._lock:
+            signals = [s for s in self.active_signals.values() if symbol is None or s.get('symbol') == symbol]
+        return sorted(signals, key=lambda s: s.get('rowid') or 0, reverse=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            trades, wins, net = self.totals['trades'], self.totals['wins'], self.totals['net_pnl_percentage']
+            active = len(self.active_signals)
+        return {
+            'total_completed_trades': trades, 'wins': wins, 'losses': trades - wins,
+            'win_rate': (wins / trades) * 100 if trades else 0.0, 'net_pnl_percentage': net, 'active': active,
+        }
+
+    def performance(self, window_seconds: float) -> Dict[str, Any]:
+        """Thống kê các lệnh đóng trong window_seconds gần nhất (tối đa self.window_seconds), chính xác tới phút."""
+        now = time.time()
+        cutoff_minute = int((now - window_seconds) // 60)
+        trades = wins = 0
+        net, best, worst = 0.0, None, None
+        with self._lock:
+            self._prune(now)
+            for minute, count, won, pnl_sum, top, bottom in reversed(self._minute_buckets):
+                if minute < cutoff_minute:
+                    break
+                trades += count
+                wins += won
+                net += pnl_sum
+                if top is not None and (best is None or top[1] > best[1]):
+                    best = top
+                if bottom is not None and (worst is None or bottom[1] < worst[1]):
+                    worst = bottom
+        return {
+            'trades': trades, 'wins': wins, 'losses': trades - wins,
+            'win_rate': (wins / trades) * 100 if trades else 0.0,
+            'net_pnl_percentage': net, 'best': best, 'worst': worst,
+        }
+
+# Bộ đệm dùng chung của tiến trình bot
+state_cache = StateCache(window_seconds=config.STATE_CACHE_PERF_WINDOW_SECONDS)
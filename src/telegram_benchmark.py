@@ -0,0 +1,72 @@
+# telegram_benchmark.py - Đo số tin nhắn/giây của TelegramHandler trên một server Telegram giả lập cục bộ.
+# Cách chạy: python -m src.telegram_benchmark [số_tin_nhắn] [số_tin_gửi_đồng_thời]
+import asyncio
+import logging
+import sys
+import time
+
+import httpx
+from aiohttp import web
+
+from .telegram_handler import TelegramHandler
+
+logger = logging.getLogger(__name__)
+
+FAKE_HOST = '127.0.0.1'
+FAKE_PORT = 8081
+
+async def start_fake_telegram_server(host: str = FAKE_HOST, port: int = FAKE_PORT, latency_seconds: float = 0.0) -> web.AppRunner:
+    """Server giả lập trả lời mọi /bot<token>/<method> bằng {"ok": true} như Telegram."""
+    async def handle(request: web.Request) -> web.Response:
+        await request.read()
+        if latency_seconds:
+            await asyncio.sleep(latency_seconds)
+        return web.json_response({'ok': True, 'result': {'message_id': 1}})
+
+    app = web.Application()
+    app.router.add_post('/{bot}/{method}', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+async def _send_many(send, n_messages: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            await send(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_messages)))
+    return time.perf_counter() - start
+
+async def run_benchmark(n_messages: int = 500, concurrency: int = 1) -> dict:
+    """So sánh client dùng chung (keep-alive) với cách cũ: tạo client mới cho mỗi tin nhắn."""
+    runner = await start_fake_telegram_server()
+    base = f"http://{FAKE_HOST}:{FAKE_PORT}"
+    results = {}
+    try:
+        async def per_message_client(i: int):
+            async with httpx.AsyncClient() as client:
+                response = await client.post(f"{base}/botTEST/sendMessage", json={'chat_id': '1', 'text': f'msg {i}'}, timeout=30.0)
+                response.raise_for_status()
+
+        elapsed = await _send_many(per_message_client, n_messages, concurrency)
+        results['new_client_per_message'] = n_messages / elapsed
+
+        async with TelegramHandler(api_token='TEST', api_base_url=base) as handler:
+            elapsed = await _send_many(lambda i: handler.send_message('1', f'msg {i}'), n_messages, concurrency)
+        results['pooled_client'] = n_messages / elapsed
+    finally:
+        await runner.cleanup()
+    return results
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    c = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    stats = asyncio.run(run_benchmark(n, c))
+    print(f"Messages: {n} | Concurrency: {c}")
+    for name, rate in stats.items():
+        print(f"  {name:<24} {rate:8.1f} msg/s")
@@ -1,7 +1,7 @@
 # telegram_handler.py (Phiên bản đã sửa lỗi cú pháp và tối ưu)
 import httpx
 import logging
-import re
+from .markdown_template import MARKDOWNV2_ESCAPE_TABLE
 from typing import Union, Dict, Any, Optional
 
 logger = logging.getLogger(__name__)
@@ -11,45 +11,93 @@ class TelegramHandler:
     Handles interactions with the Telegram Bot API, including sending messages
     and photos, with robust error handling and logging.
     """
-    def __init__(self, api_token: str, proxy_url: Optional[str] = None):
+    def __init__(
+        self,
+        api_token: str,
+        proxy_url: Optional[str] = None,
+        api_base_url: str = "https://api.telegram.org",
+        http2: bool = False,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 60.0,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 30.0,
+    ):
         if not api_token:
             logger.error("Telegram API token is missing.")
             raise ValueError("Telegram API token cannot be empty.")
         self.api_token = api_token
-        self.base_url = f"https://api.telegram.org/bot{self.api_token}"
+        self.base_url = f"{api_base_url.rstrip('/')}/bot{self.api_token}"
         # Store the proxy URL directly. The 'proxy' argument in httpx expects a string.
         # This change improves compatibility with various httpx versions.
         self.proxy_url = proxy_url
         if self.proxy_url:
             logger.info(f"Telegram handler configured to use proxy: {self.proxy_url}")
 
+        # HTTP/2 cần gói 'h2'; nếu không có thì dùng HTTP/1.1 keep-alive.
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("HTTP/2 requested for Telegram but the 'h2' package is not installed. Falling back to HTTP/1.1.")
+                http2 = False
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        # Client dùng chung, được tạo khi gửi request đầu tiên (trong event loop đang chạy)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Trả về client HTTP dùng chung (keep-alive, connection pool), tạo mới nếu chưa có hoặc đã đóng."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                proxy=self.proxy_url,
+                http2=self.http2,
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Đóng client HTTP dùng chung. Gọi khi tắt bot."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("Telegram HTTP client closed.")
+        self._client = None
+
+    async def __aenter__(self) -> "TelegramHandler":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
 
     @staticmethod
     def escape_markdownv2(text: str) -> str:
         """
-        Escapes text for Telegram's MarkdownV2 parse mode using regex.
-        This is safer and prevents double-escaping.
+        Escapes text for Telegram's MarkdownV2 parse mode.
+        Uses a str.translate table (one pass, no regex); backslashes are left as-is to prevent double-escaping.
         """
         if not isinstance(text, str):
             text = str(text)
         # Characters to escape: _*[]()~`>#+-=|{}.!
-        escape_chars = r'([_*\[\]()~`>#+\-=|{}.!])'
-        return re.sub(escape_chars, r'\\\1', text)
+        return text.translate(MARKDOWNV2_ESCAPE_TABLE)
 
     async def _make_request(self, method: str, endpoint: str, **kwargs: Any):
         """
         A generic, internal method to make requests to the Telegram API.
-        Handles client initialization, request sending, and error logging.
+        Uses the shared pooled client, sends the request and logs errors.
         """
         url = f"{self.base_url}/{endpoint}"
         try:
-            # Use the 'proxy' argument for compatibility with older httpx versions
-            # that do not recognize the 'proxies' dictionary argument.
-            async with httpx.AsyncClient(proxy=self.proxy_url) as client:
-                response = await client.request(method, url, timeout=30.0, **kwargs)
-                response.raise_for_status()
-                logger.debug(f"Telegram API request to '{endpoint}' successful: {response.status_code}")
-                return response.json()
+            # Dùng lại client chung để tránh bắt tay TCP/TLS (và proxy) cho mỗi tin nhắn.
+            response = await self._get_client().request(method, url, **kwargs)
+            response.raise_for_status()
+            logger.debug(f"Telegram API request to '{endpoint}' successful: {response.status_code}")
+            return response.json()
 
         except httpx.HTTPStatusError as e:
             # Log the detailed error response from Telegram for better debugging
@@ -65,11 +113,35 @@ class TelegramHandler:
             raise
 
     async def send_message(self, chat_id: Union[str, int], text: str, **kwargs: Any):
-        """Sends a text-only message with enhanced error logging."""
+        """Sends a text-only message with enhanced error logging. Returns the API response (result.message_id...)."""
         payload = {'chat_id': str(chat_id), 'text': text, **kwargs}
-        await self._make_request("POST", "sendMessage", json=payload)
+        response = await self._make_request("POST", "sendMessage", json=payload)
         logger.info(f"Telegram text message sent successfully to chat_id: {chat_id}.")
+        return response
+
+    async def edit_message_text(self, chat_id: Union[str, int], message_id: int, text: str, **kwargs: Any):
+        """Edits the text of a message previously sent by the bot."""
+        payload = {'chat_id': str(chat_id), 'message_id': message_id, 'text': text, **kwargs}
+        response = await self._make_request("POST", "editMessageText", json=payload)
+        logger.debug(f"Telegram message {message_id} edited in chat_id: {chat_id}.")
+        return response
+
+    async def pin_chat_message(self, chat_id: Union[str, int], message_id: int, disable_notification: bool = True):
+        """Pins a message (the bot needs pin rights in groups/channels)."""
+        payload = {'chat_id': str(chat_id), 'message_id': message_id, 'disable_notification': disable_notification}
+        return await self._make_request("POST", "pinChatMessage", json=payload)
+
 
+    async def get_updates(self, offset: Optional[int] = None, timeout: int = 25, allowed_updates: Optional[list] = None) -> list:
+        """Long-polls getUpdates; returns the list of updates (empty on timeout)."""
+        payload: Dict[str, Any] = {'timeout': timeout, 'allowed_updates': allowed_updates or ['message']}
+        if offset is not None:
+            payload['offset'] = offset
+        # Thời gian chờ đọc phải dài hơn thời gian long-poll của Telegram
+        response = await self._make_request(
+            "POST", "getUpdates", json=payload, timeout=httpx.Timeout(timeout + 10, connect=self.timeout.connect)
+        )
+        return response.get('result', []) if response else []
 
     async def send_photo(
         self,
@@ -1,126 +1,248 @@
 # trainer.py (Phiên bản nâng cấp với Data Balancing và Target thực tế)
+# Hai chế độ huấn luyện:
+#   - full: đọc toàn bộ lệnh đã đóng, huấn luyện RandomForest từ đầu (chạy thưa, TRAINING_FULL_RETRAIN_INTERVAL_SECONDS)
+#   - incremental: chỉ đọc các lệnh đóng sau watermark của phiên bản trước rồi thêm cây bằng warm_start trên cửa sổ
+#     trượt, hoặc huấn luyện lại trên một mẫu reservoir có kích thước cố định -> chi phí không tăng theo lịch sử.
+# Mỗi model mới được công bố vào model_registry (thư mục phiên bản + con trỏ CURRENT nguyên tử).
+# Trạng thái giữa các phiên bản (watermark, cửa sổ/reservoir, danh sách feature) lưu ở TRAINING_STATE_PATH;
+# thời gian huấn luyện và accuracy của từng phiên bản được ghi thêm vào TRAINING_HISTORY_PATH.
+import json
 import logging
-import sqlite3
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
-from sklearn.metrics import classification_report # CẬP NHẬT: Thêm thư viện để báo cáo chi tiết
+from sklearn.metrics import balanced_accuracy_score, classification_report # CẬP NHẬT: Thêm thư viện để báo cáo chi tiết
 import joblib
 from . import config as config
+from .compiled_forest import CompiledForest, verify
+from .model_registry import model_registry
+from .feature_store import feature_store
+from .training_data import ClosedTrades, load_closed_trades, reservoir_slots
 
 logger = logging.getLogger(__name__)
 
-def train_model() -> float | None:
+# CẬP NHẬT: Danh sách features ban đầu, 'trend' giờ là một feature
+INITIAL_FEATURES = [
+    'ema_fast_val', 'ema_medium_val', 'ema_slow_val',
+    'rsi_val', 'atr_val',
+    'bbands_lower', 'bbands_middle', 'bbands_upper',
+    'trend'
+]
+TARGET = 'outcome' # CẬP NHẬT: Mục tiêu dự đoán là 'outcome'
+
+class TrainingResult(NamedTuple):
+    """
+    Kết quả một lượt huấn luyện thành công. changed=False: không có phiên bản mới, model đang dùng giữ nguyên.
+    accuracy luôn được chấm trên dữ liệu cân bằng để full và incremental so sánh được: full -> accuracy trên tập test
+    đã cân bằng; incremental -> balanced accuracy (trung bình recall WIN/LOSS) trên evaluated_rows lệnh mới giữ lại.
+    """
+    changed: bool
+    accuracy: Optional[float] = None
+    mode: Optional[str] = None # 'full' | 'incremental/<strategy>'
+    model_version: Optional[str] = None
+    evaluated_rows: int = 0
+
+def _load_closed_trades(since: Optional[str] = None) -> ClosedTrades:
+    """
+    Các lệnh đã đóng, đã gán nhãn (training_data: đọc theo khối, cột có kiểu, cửa sổ/reservoir theo config);
+    since = watermark (outcome_timestamp_utc) -> chỉ các lệnh đóng từ thời điểm đó.
+    """
+    loaded = load_closed_trades(since=since)
+    if config.FEATURE_STORE_ENABLED:
+        loaded = loaded._replace(frame=_attach_stored_features(loaded.frame))
+    return loaded
+
+def _attach_stored_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Lấy feature của nến vào lệnh từ feature store (cùng định nghĩa với lúc phục vụ) thay cho giá trị trong hàng
+    trend_analysis; lệnh cũ chưa có trong kho giữ nguyên giá trị của hàng.
+    """
+    keyed = (df['kline_open_ms'] >= 0) & df['timeframe'].notna()
+    if df.empty or not keyed.any():
+        return df
+    keys = pd.DataFrame({
+        'symbol': df.loc[keyed, 'symbol'].astype(str),
+        'timeframe': df.loc[keyed, 'timeframe'].astype(str),
+        'open_time_ms': df.loc[keyed, 'kline_open_ms'],
+    })
+    stored = feature_store.lookup(keys)
+    columns = [c for c in INITIAL_FEATURES if c in stored.columns]
+    found = stored[columns].notna().all(axis=1)
+    df.loc[found[found].index, columns] = stored.loc[found, columns].to_numpy(dtype=np.float32)
+    logger.info(f"Feature store ({feature_store.version}): {int(found.sum())}/{len(df)} row(s) read from stored features.")
+    return df
+
+def _balance(df: pd.DataFrame, random_state: int = 42) -> Optional[pd.DataFrame]:
+    """Undersampling về cùng số WIN và LOSS; None nếu thiếu một trong hai lớp."""
+    df_wins = df[df[TARGET] == 'WIN']
+    df_losses = df[df[TARGET] == 'LOSS']
+    if df_wins.empty or df_losses.empty:
+        return None
+    min_samples = min(len(df_wins), len(df_losses))
+    return pd.concat([
+        df_wins.sample(n=min_samples, random_state=random_state),
+        df_losses.sample(n=min_samples, random_state=random_state)
+    ])
+
+def _feature_matrix(df: pd.DataFrame, features: List[str]) -> pd.DataFrame:
+    # One-hot 'trend' rồi căn theo đúng danh sách feature của model (trend mới/thiếu -> cột 0)
+    X = pd.get_dummies(df[INITIAL_FEATURES], columns=['trend'])
+    return X.reindex(columns=features, fill_value=0)
+
+def _load_state() -> Optional[Dict[str, Any]]:
+    if not os.path.exists(config.TRAINING_STATE_PATH):
+        return None
+    try:
+        return joblib.load(config.TRAINING_STATE_PATH)
+    except Exception as e:
+        logger.warning(f"Could not read training state ({e}); a full retrain will run.")
+        return None
+
+def _save_state(state: Dict[str, Any]) -> None:
+    tmp_path = f"{config.TRAINING_STATE_PATH}.tmp"
+    joblib.dump(state, tmp_path)
+    os.replace(tmp_path, config.TRAINING_STATE_PATH)
+
+def _log_version(state: Dict[str, Any], mode: str, rows_loaded: int, train_rows: int, trees: int, seconds: float, accuracy: float, evaluated_rows: int) -> None:
+    record = {
+        'version': state['version'], 'mode': mode, 'rows_loaded': rows_loaded, 'train_rows': train_rows,
+        'trees': trees, 'seconds': round(seconds, 3), 'accuracy': round(float(accuracy), 4), 'evaluated_rows': evaluated_rows,
+        'watermark': state['watermark'], 'model_version': state.get('model_version'), 'finished_at': datetime.now(timezone.utc).isoformat(),
+    }
+    logger.info(
+        f"🧾 Model v{record['version']} [{record['model_version']}] ({mode}): {rows_loaded} new row(s), {train_rows} training row(s), "
+        f"{trees} tree(s), {seconds:.2f}s, accuracy {accuracy:.2%} on {evaluated_rows} held-out row(s)."
+    )
+    try:
+        with open(config.TRAINING_HISTORY_PATH, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        logger.warning(f"Could not append to training history: {e}")
+
+def _compile(model: RandomForestClassifier, X_verify: Any) -> Optional[CompiledForest]:
+    """Biên dịch model thành mảng phẳng; chỉ dùng khi kết quả trùng từng bit với model trên tập kiểm tra."""
+    if not config.MODEL_COMPILE_ENABLED:
+        return None
+    try:
+        compiled = CompiledForest.from_sklearn(model)
+        check = verify(compiled, model, X_verify)
+    except Exception as e:
+        logger.error(f"❌ Could not compile the model: {e}", exc_info=True)
+        return None
+    if not (check['labels_identical'] and check['proba_identical']):
+        logger.warning(f"⚠️ Compiled model differs from sklearn on {check['rows']} rows (max diff {check['max_abs_diff']:.3g}); not publishing it.")
+        return None
+    logger.info(f"🧩 Model compiled: {compiled.n_trees} trees, {compiled.nbytes / 1e6:.1f} MB, identical on {check['rows']} rows.")
+    return compiled
+
+def _publish(model: RandomForestClassifier, label_encoder: LabelEncoder, features: List[str], state: Dict[str, Any], mode: str, accuracy: float, X_verify: Any) -> str:
+    # Model + encoder + danh sách feature (+ bản biên dịch) cuối cùng luôn được công bố cùng nhau thành một phiên bản
+    version = model_registry.publish(model, label_encoder, features, {
+        'mode': mode, 'accuracy': float(accuracy), 'evaluated_rows': len(X_verify), 'trees': len(model.estimators_),
+        'watermark': state['watermark'],
+    }, compiled=_compile(model, X_verify))
+    state['model_version'] = version
+    return version
+
+def _resolve_mode(mode: Optional[str], state: Optional[Dict[str, Any]]) -> str:
+    mode = mode or config.TRAINING_MODE
+    if mode == 'full':
+        return 'full'
+    if state is None or model_registry.current_version() is None:
+        logger.info("No previous model version found; running a full retrain.")
+        return 'full'
+    if state.get('model_version') != model_registry.current_version():
+        # CURRENT đã bị đổi ngoài trainer (rollback/set_current): watermark, cửa sổ và reservoir thuộc phiên bản khác
+        logger.info(f"Current model {model_registry.current_version()} is not the last trained version {state.get('model_version')}; running a full retrain.")
+        return 'full'
+    if time.time() - state.get('last_full_at', 0) >= config.TRAINING_FULL_RETRAIN_INTERVAL_SECONDS:
+        logger.info("Full retrain interval elapsed; running a full retrain.")
+        return 'full'
+    return 'incremental'
+
+def train_model(mode: Optional[str] = None) -> Optional[TrainingResult]:
     """
-    Huấn luyện model dựa trên kết quả WIN/LOSS thực tế và trả về độ chính xác (accuracy).
-    Sử dụng kỹ thuật cân bằng dữ liệu (undersampling).
+    Huấn luyện model dựa trên kết quả WIN/LOSS thực tế và trả về TrainingResult (accuracy của phiên bản mới).
+    mode: 'full' | 'incremental' (mặc định theo config.TRAINING_MODE; tự chuyển sang full khi chưa có phiên bản
+    trước hoặc đã tới lịch huấn luyện lại toàn bộ).
+    Lượt incremental chưa đủ lệnh mới trả về TrainingResult(changed=False): không có accuracy mới để công bố.
     Trả về None nếu có lỗi hoặc không đủ dữ liệu hợp lệ.
+    Khi registry đang ghim một phiên bản (sau rollback) thì không huấn luyện: TrainingResult(changed=False).
     """
-    logger.info("🚀 Starting Advanced Model Training...")
+    pinned = model_registry.pinned_version()
+    if pinned:
+        logger.warning(f"📌 Model {pinned} is pinned (rolled back); skipping training until it is unpinned (python -m src.model_registry unpin).")
+        return TrainingResult(False, model_version=pinned)
+    state = _load_state()
+    if _resolve_mode(mode, state) == 'full':
+        return _train_full()
+    return _train_incremental(state)
+
+def _train_full() -> Optional[TrainingResult]:
+    """Huấn luyện từ đầu trên toàn bộ lịch sử, sử dụng kỹ thuật cân bằng dữ liệu (undersampling)."""
+    logger.info("🚀 Starting Advanced Model Training (full)...")
+    started = time.perf_counter()
 
     try:
-        with sqlite3.connect(config.SQLITE_DB_PATH) as conn:
-            # CẢI TIẾN: Lấy tất cả các giao dịch đã đóng (status != 'ACTIVE')
-            # và bao gồm cả pnl_percentage để xác định kết quả một cách chính xác.
-            query = """
-            SELECT 
-                ema_fast_val, ema_medium_val, ema_slow_val, 
-                rsi_val, atr_val, 
-                bbands_lower, bbands_middle, bbands_upper, 
-                trend,
-                status,
-                pnl_percentage
-            FROM trend_analysis
-            WHERE 
-                status != 'ACTIVE' 
-                AND pnl_percentage IS NOT NULL 
-                AND trend IS NOT NULL
-            """
-            df = pd.read_sql(query, conn)
+        loaded = _load_closed_trades()
     except Exception as e:
         logger.error(f"❌ Failed to load data for training: {e}", exc_info=True)
         return None
 
+    # CẢI TIẾN: Một giao dịch là 'WIN' nếu nó chạm TP hoặc có PnL > 0 (nhãn đã gán khi nạp)
+    df = loaded.frame
     if df.empty:
         logger.warning("⚠️ No completed WIN/LOSS trades found to train on. Skipping training.")
         return None
 
     logger.info(f"Loaded {len(df)} completed trade records from the database.")
-
-    # CẢI TIẾN: Tạo cột 'outcome' một cách linh hoạt trong Python.
-    # Một giao dịch là 'WIN' nếu nó chạm TP hoặc có PnL > 0.
-    df['outcome'] = df.apply(
-        lambda row: 'WIN' if ('TP' in row['status'] or row['pnl_percentage'] > 0) else 'LOSS',
-        axis=1
-    )
+    rows_loaded = loaded.report.rows_scanned
 
     # CẢI TIẾN: Kiểm tra dữ liệu sau khi tạo cột 'outcome'
-    outcome_col = 'outcome'
-    logger.info(f"Value counts for '{outcome_col}' column:\n" + str(df[outcome_col].value_counts()))
-    if df[outcome_col].nunique() < 2:
+    logger.info(f"Value counts for '{TARGET}' column:\n" + str(df[TARGET].value_counts()))
+    if df[TARGET].nunique() < 2:
         logger.error(
-            f"Training failed: Only one class ('{df[outcome_col].unique()[0]}') found "
+            f"Training failed: Only one class ('{df[TARGET].unique()[0] if len(df) else None}') found "
             f"in the outcome column. Cannot train with a single outcome."
         )
         return None
-    
-    # CẬP NHẬT: Danh sách features ban đầu, 'trend' giờ là một feature
-    initial_features = [
-        'ema_fast_val', 'ema_medium_val', 'ema_slow_val',
-        'rsi_val', 'atr_val',
-        'bbands_lower', 'bbands_middle', 'bbands_upper',
-        'trend' 
-    ]
-    target = 'outcome' # CẬP NHẬT: Mục tiêu dự đoán là 'outcome'
-
-    df.dropna(subset=initial_features + [target], inplace=True)
 
     if len(df) < 10: # Đặt một ngưỡng tối thiểu cao hơn cho dữ liệu sạch
-        logger.warning(f"⚠️ Not enough clean data. Only {len(df)} rows. Minimum 50 required.")
+        logger.warning(f"⚠️ Not enough clean data. Only {len(df)} rows. Minimum 10 required.")
         return None
 
     # CẬP NHẬT: Logic cân bằng dữ liệu (Undersampling)
     logger.info("⚖️ Balancing data using Undersampling...")
-    df_wins = df[df[target] == 'WIN']
-    df_losses = df[df[target] == 'LOSS']
-
-    if df_wins.empty or df_losses.empty:
+    df_balanced = _balance(df)
+    if df_balanced is None:
         logger.warning(f"⚠️ Training data needs both WIN and LOSS samples. Skipping.")
         return None
-
-    min_samples = min(len(df_wins), len(df_losses))
-    logger.info(f"Balancing to {min_samples} WINs and {min_samples} LOSSes.")
-    
-    df_balanced = pd.concat([
-        df_wins.sample(n=min_samples, random_state=42),
-        df_losses.sample(n=min_samples, random_state=42)
-    ])
+    logger.info(f"Balancing to {len(df_balanced) // 2} WINs and {len(df_balanced) // 2} LOSSes.")
 
     # CẬP NHẬT: Xử lý feature 'trend' (dạng text) bằng One-Hot Encoding
-    X_pre_process = df_balanced[initial_features]
-    y = df_balanced[target]
-    
-    X = pd.get_dummies(X_pre_process, columns=['trend'], drop_first=True)
-    
+    X = pd.get_dummies(df_balanced[INITIAL_FEATURES], columns=['trend'], drop_first=True)
+    y = df_balanced[TARGET]
+
     # Lưu lại danh sách features cuối cùng sau khi xử lý
     final_features = X.columns.tolist()
 
     label_encoder = LabelEncoder()
     y_encoded = label_encoder.fit_transform(y)
-    
+
     # Vì đã cân bằng, stratify không còn quá quan trọng nhưng vẫn nên giữ
     X_train, X_test, y_train, y_test = train_test_split(X, y_encoded, test_size=0.2, random_state=42, stratify=y_encoded)
 
     logger.info("🤖 Fitting RandomForestClassifier model...")
-    model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1, class_weight='balanced')
+    model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=config.TRAINING_N_JOBS, class_weight='balanced')
     model.fit(X_train, y_train)
 
-    # Lưu model và các thành phần cần thiết
-    joblib.dump(model, "model_trend.pkl")
-    joblib.dump(label_encoder, "trend_label_encoder.pkl")
-    joblib.dump(final_features, "model_features.pkl") # CẬP NHẬT: Lưu danh sách feature cuối cùng
-
     accuracy = model.score(X_test, y_test)
     logger.info(f"✅ Model trained successfully. Accuracy on test set: {accuracy:.2%}")
 
@@ -130,5 +252,121 @@ def train_model() -> float | None:
     report = classification_report(y_test, y_pred, target_names=label_encoder.classes_)
     print(report) # In ra console để xem
     logger.info(f"\n{report}")
-    
-    return accuracy
+
+    # Khởi tạo trạng thái cho các lần cập nhật tăng dần tiếp theo
+    previous = _load_state() or {}
+    watermark, boundary_ids = loaded.watermark, loaded.boundary_ids
+    by_close = df.sort_values('outcome_ms', kind='stable')
+    reservoir_size = min(len(df), config.TRAINING_RESERVOIR_SIZE)
+    state = {
+        'version': previous.get('version', 0) + 1,
+        'last_full_at': time.time(),
+        'watermark': watermark,
+        'boundary_ids': boundary_ids,
+        'features': final_features,
+        'window': by_close.tail(config.TRAINING_WINDOW_ROWS).reset_index(drop=True),
+        'reservoir': df.sample(n=reservoir_size, random_state=42).reset_index(drop=True),
+        'seen': loaded.report.rows_scanned,
+        'accuracy': accuracy,
+    }
+    version = _publish(model, label_encoder, final_features, state, 'full', accuracy, X_test)
+    _save_state(state)
+    _log_version(state, 'full', rows_loaded, len(X_train), len(model.estimators_), time.perf_counter() - started, accuracy, len(X_test))
+    return TrainingResult(True, accuracy, 'full', version, len(X_test))
+
+def _update_reservoir(reservoir: pd.DataFrame, new_rows: pd.DataFrame, seen: int, rng: np.random.Generator) -> Tuple[pd.DataFrame, int]:
+    """Reservoir sampling (Algorithm R): mỗi lệnh đã thấy có cùng xác suất nằm trong mẫu kích thước cố định."""
+    capacity = config.TRAINING_RESERVOIR_SIZE
+    free = max(0, capacity - len(reservoir))
+    reservoir = pd.concat([reservoir, new_rows.iloc[:free]], ignore_index=True)
+    seen += min(free, len(new_rows))
+    rest = new_rows.iloc[free:]
+    if len(rest):
+        # Tính một lần cho cả lô thay vì từng hàng; ô bị thay lấy hàng mới tương ứng
+        positions, slots = reservoir_slots(seen, len(rest), capacity, rng)
+        take = np.arange(len(reservoir))
+        take[slots] = len(reservoir) + np.arange(len(slots))
+        reservoir = pd.concat([reservoir, rest.iloc[positions]], ignore_index=True).iloc[take].reset_index(drop=True)
+        seen += len(rest)
+    return reservoir, seen
+
+def _train_incremental(state: Dict[str, Any]) -> Optional[TrainingResult]:
+    strategy = config.TRAINING_INCREMENTAL_STRATEGY
+    logger.info(f"🚀 Starting incremental model training ({strategy}) from watermark {state['watermark']}...")
+    started = time.perf_counter()
+
+    try:
+        loaded = _load_closed_trades(since=state['watermark'])
+    except Exception as e:
+        logger.error(f"❌ Failed to load data for training: {e}", exc_info=True)
+        return None
+    new_rows = loaded.frame[~loaded.frame['rowid'].isin(state.get('boundary_ids', []))]
+    rows_loaded = len(new_rows)
+    if new_rows.empty:
+        logger.info(f"No trades closed since the last model version (v{state['version']}); model unchanged.")
+        return TrainingResult(False, model_version=state.get('model_version'))
+    min_rows = max(config.TRAINING_INCREMENTAL_MIN_ROWS, config.TRAINING_MIN_HOLDOUT_ROWS + 1)
+    if rows_loaded < min_rows:
+        # Không đủ lệnh cho một tập chấm điểm đáng tin: không công bố phiên bản mới, các lệnh được tích lũy cho lượt sau
+        logger.info(
+            f"Only {rows_loaded} trade(s) closed since v{state['version']} (< {min_rows} needed for a holdout); "
+            f"model unchanged, rows kept for the next run."
+        )
+        return TrainingResult(False, model_version=state.get('model_version'))
+
+    # Giữ lại 20% lệnh mới (ít nhất TRAINING_MIN_HOLDOUT_ROWS, chưa học) để chấm model trên dữ liệu gần nhất
+    rng = np.random.default_rng(state['version'])
+    holdout_mask = np.zeros(len(new_rows), dtype=bool)
+    holdout_mask[rng.choice(len(new_rows), max(config.TRAINING_MIN_HOLDOUT_ROWS, round(len(new_rows) * 0.2)), replace=False)] = True
+    holdout, learn = new_rows[holdout_mask], new_rows[~holdout_mask]
+    if holdout[TARGET].nunique() < 2:
+        # Chỉ một lớp trong tập chấm điểm: balanced accuracy không so được với accuracy của full, nên chờ thêm lệnh
+        logger.info(f"Holdout of {len(holdout)} new trade(s) has a single outcome; model unchanged, rows kept for the next run.")
+        return TrainingResult(False, model_version=state.get('model_version'))
+
+    # Bản sao ghi được (không mmap) của phiên bản đang dùng để thêm cây
+    bundle = model_registry.load(mmap=False)
+    model, label_encoder, features = bundle.model, bundle.label_encoder, bundle.features
+
+    if strategy == 'reservoir':
+        reservoir, seen = _update_reservoir(state['reservoir'], learn, state['seen'], rng)
+        training_rows = _balance(reservoir)
+        if training_rows is None:
+            logger.warning("⚠️ Reservoir needs both WIN and LOSS samples. Skipping.")
+            return None
+        model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=config.TRAINING_N_JOBS, class_weight='balanced')
+        model.fit(_feature_matrix(training_rows, features), label_encoder.transform(training_rows[TARGET]))
+        state.update(reservoir=reservoir, seen=seen)
+    else:
+        window = pd.concat([state['window'], learn], ignore_index=True).tail(config.TRAINING_WINDOW_ROWS).reset_index(drop=True)
+        training_rows = _balance(window, random_state=state['version'])
+        if training_rows is None:
+            logger.warning("⚠️ Training window needs both WIN and LOSS samples. Skipping.")
+            return None
+        # Thêm cây mới học trên cửa sổ gần nhất; dữ liệu đã cân bằng nên không cần class_weight cho các cây này
+        model.set_params(warm_start=True, class_weight=None, n_jobs=config.TRAINING_N_JOBS, n_estimators=len(model.estimators_) + config.TRAINING_WARM_START_TREES)
+        model.fit(_feature_matrix(training_rows, features), label_encoder.transform(training_rows[TARGET]))
+        if len(model.estimators_) > config.TRAINING_MAX_TREES:
+            # Bỏ các cây cũ nhất để forest (và thời gian dự đoán) có kích thước cố định
+            model.estimators_ = model.estimators_[-config.TRAINING_MAX_TREES:]
+            model.set_params(n_estimators=config.TRAINING_MAX_TREES)
+        state.update(window=window, seen=state['seen'] + len(learn))
+
+    # Lệnh mới không cân bằng WIN/LOSS: balanced accuracy tương đương accuracy trên tập test đã cân bằng của full
+    X_evaluation = _feature_matrix(holdout, features)
+    accuracy = balanced_accuracy_score(label_encoder.transform(holdout[TARGET]), model.predict(X_evaluation))
+
+    # Các lệnh giữ lại để chấm điểm vẫn được đưa vào dữ liệu cho phiên bản sau
+    if strategy == 'reservoir':
+        state['reservoir'], state['seen'] = _update_reservoir(state['reservoir'], holdout, state['seen'], rng)
+    else:
+        state['window'] = pd.concat([state['window'], holdout], ignore_index=True).tail(config.TRAINING_WINDOW_ROWS).reset_index(drop=True)
+
+    watermark, boundary_ids = loaded.watermark or state['watermark'], loaded.boundary_ids
+    if watermark == state['watermark']:
+        boundary_ids = list(set(boundary_ids) | set(state.get('boundary_ids', [])))
+    state.update(version=state['version'] + 1, watermark=watermark, boundary_ids=boundary_ids, accuracy=accuracy)
+    version = _publish(model, label_encoder, features, state, f"incremental/{strategy}", accuracy, X_evaluation)
+    _save_state(state)
+    _log_version(state, f"incremental/{strategy}", rows_loaded, len(training_rows), len(model.estimators_), time.perf_counter() - started, accuracy, len(holdout))
+    return TrainingResult(True, accuracy, f"incremental/{strategy}", version, len(holdout))
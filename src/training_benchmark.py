@@ -0,0 +1,111 @@
+# training_benchmark.py - Đo độ trễ của vòng phân tích trong khi huấn luyện lại model:
+#   idle (không huấn luyện) | thread (train_model trong thread executor, cách cũ) | subprocess (training_worker)
+# Mỗi tick mô phỏng một lượt phân tích một symbol trên event loop (tính chỉ báo bằng pandas + predict_proba một dòng)
+# và đo cả thời gian xử lý lẫn độ trễ đánh thức của event loop. Dữ liệu huấn luyện là DB tổng hợp trong thư mục tạm.
+# Cách chạy: python -m src.training_benchmark [số_lệnh_đã_đóng] [số_giây_idle]
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from . import config
+from .database_handler import init_sqlite_db
+from .model_registry import model_registry
+from .trainer import train_model
+from .training_worker import train_in_subprocess
+
+_TICK_SECONDS = 0.05
+
+def make_training_db(db_path: str, n_trades: int, seed: int = 3) -> None:
+    init_sqlite_db(db_path)
+    rng = np.random.default_rng(seed)
+    values = rng.random((n_trades, 8)) * 100
+    wins = values[:, 3] + rng.normal(0, 15, n_trades) > 50
+    trends = rng.choice(['BULLISH', 'BEARISH', 'STRONG_BULLISH', 'STRONG_BEARISH'], n_trades)
+    closed_at = pd.date_range('2025-01-01', periods=n_trades, freq='min').strftime('%Y-%m-%dT%H:%M:%S')
+    rows = [
+        (*values[i].tolist(), trends[i], 'TP1_HIT' if wins[i] else 'SL_HIT', 1.0 if wins[i] else -1.0, closed_at[i], 'BENCHUSDT')
+        for i in range(n_trades)
+    ]
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(
+            "INSERT INTO trend_analysis (ema_fast_val, ema_medium_val, ema_slow_val, rsi_val, atr_val, bbands_lower, "
+            "bbands_middle, bbands_upper, trend, status, pnl_percentage, outcome_timestamp_utc, symbol) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows,
+        )
+
+def _analysis_workload(candles: pd.DataFrame, model: RandomForestClassifier) -> None:
+    # Phần CPU của một lượt perform_ai_fallback_analysis: chỉ báo trên ~300 nến rồi dự đoán cho nến cuối
+    close = candles['close']
+    features = pd.DataFrame({
+        'ema_fast': close.ewm(span=config.EMA_FAST, adjust=False).mean(),
+        'ema_medium': close.ewm(span=config.EMA_MEDIUM, adjust=False).mean(),
+        'ema_slow': close.ewm(span=config.EMA_SLOW, adjust=False).mean(),
+        'volatility': close.pct_change().rolling(config.ATR_PERIOD).std(),
+    })
+    model.predict_proba(features.iloc[[-1]].fillna(0).to_numpy())
+
+async def _measure(duration: float, candles: pd.DataFrame, model: RandomForestClassifier, stop: asyncio.Event = None) -> Dict[str, List[float]]:
+    latencies, lags = [], []
+    deadline = time.perf_counter() + duration
+    while (stop is None and time.perf_counter() < deadline) or (stop is not None and not stop.is_set()):
+        start = time.perf_counter()
+        _analysis_workload(candles, model)
+        latencies.append(time.perf_counter() - start)
+        before_sleep = time.perf_counter()
+        await asyncio.sleep(_TICK_SECONDS)
+        lags.append(time.perf_counter() - before_sleep - _TICK_SECONDS)
+    return {'latency': latencies, 'lag': lags}
+
+async def _measure_during(train, candles: pd.DataFrame, model: RandomForestClassifier) -> Dict[str, List[float]]:
+    stop = asyncio.Event()
+    measuring = asyncio.create_task(_measure(0, candles, model, stop))
+    started = time.perf_counter()
+    accuracy = await train()
+    stop.set()
+    result = await measuring
+    result['training_seconds'] = time.perf_counter() - started
+    result['accuracy'] = accuracy
+    return result
+
+def _summary(values: List[float]) -> str:
+    ms = sorted(v * 1000 for v in values)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    return f"p50 {statistics.median(ms):7.2f} ms | p95 {p95:7.2f} ms | max {ms[-1]:7.2f} ms"
+
+async def run_benchmark(n_trades: int = 200000, idle_seconds: float = 5.0) -> Dict[str, Dict]:
+    workdir = tempfile.mkdtemp(prefix='training-bench-')
+    config.SQLITE_DB_PATH = os.path.join(workdir, 'bench.sqlite')
+    config.TRAINING_STATE_PATH = os.path.join(workdir, 'training_state.pkl')
+    config.TRAINING_HISTORY_PATH = os.path.join(workdir, 'training_history.jsonl')
+    config.MODEL_REGISTRY_DIR = model_registry.root = os.path.join(workdir, 'models')
+    make_training_db(config.SQLITE_DB_PATH, n_trades)
+
+    rng = np.random.default_rng(5)
+    candles = pd.DataFrame({'close': 100 + rng.normal(0, 1, 300).cumsum()})
+    model = RandomForestClassifier(n_estimators=100, random_state=42).fit(rng.random((2000, 4)), rng.integers(0, 2, 2000))
+    loop = asyncio.get_running_loop()
+
+    results = {'idle': await _measure(idle_seconds, candles, model)}
+    results['thread'] = await _measure_during(lambda: loop.run_in_executor(None, train_model, 'full'), candles, model)
+    results['subprocess'] = await _measure_during(lambda: train_in_subprocess('full'), candles, model)
+    print(f"Work directory: {workdir}")
+    return results
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    idle = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    results = asyncio.run(run_benchmark(n, idle))
+    print(f"Closed trades: {n} | cores: {os.cpu_count()} | training worker: {config.TRAINING_MAX_CORES or 'all'} core(s), nice {config.TRAINING_NICENESS}")
+    for phase, result in results.items():
+        extra = f" | training {result['training_seconds']:.1f}s" if 'training_seconds' in result else ""
+        print(f"  {phase:<10} analysis {_summary(result['latency'])}{extra}")
+        print(f"  {'':<10} loop lag {_summary(result['lag'])}")
@@ -0,0 +1,268 @@
+# training_data.py
+# Bộ nạp dữ liệu huấn luyện theo từng khối (chunk) thay cho một lần pd.read_sql toàn bộ trend_analysis:
+#   - đọc TRAINING_LOADER_CHUNK_ROWS hàng mỗi lần và đổi ngay sang mảng NumPy có kiểu cố định
+#     (feature float32, thời điểm int64 ms, symbol/timeframe/trend là mã số nguyên) rồi bỏ khối chuỗi gốc
+#   - nhãn WIN/LOSS tính trong câu SQL (cùng quy tắc với trainer: status có 'TP' hoặc PnL > 0), không còn cột status
+#   - tùy chọn cửa sổ thời gian (TRAINING_LOADER_WINDOW_DAYS) và lấy mẫu reservoir phân tầng theo nhãn
+#     (TRAINING_LOADER_SAMPLING = 'reservoir': cùng số WIN và LOSS, giống undersampling của trainer)
+#   - bộ nhớ đệm cấp phát trước, không vượt TRAINING_LOADER_MAX_MEMORY_MB (quá thì chỉ giữ các hàng mới nhất)
+#   - watermark (outcome_timestamp_utc lớn nhất + rowid đúng thời điểm đó) tính dần qua các khối
+# Mỗi lần nạp trả về LoadReport: số hàng, số khối, thời gian và bộ nhớ đỉnh.
+import logging
+import sqlite3
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import config
+from .feature_store import to_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_FEATURES = [
+    'ema_fast_val', 'ema_medium_val', 'ema_slow_val',
+    'rsi_val', 'atr_val',
+    'bbands_lower', 'bbands_middle', 'bbands_upper',
+]
+_CATEGORICAL = ('symbol', 'timeframe', 'trend')
+_TIMES = ('kline_open_ms', 'signal_ms', 'outcome_ms')
+OUTCOME_LABELS = ['LOSS', 'WIN'] # Mã 0 / 1, cùng thứ tự với LabelEncoder
+
+_WHERE = (
+    "status != 'ACTIVE' AND pnl_percentage IS NOT NULL AND trend IS NOT NULL AND "
+    + " AND ".join(f"{name} IS NOT NULL" for name in NUMERIC_FEATURES)
+)
+
+def _query(where: str) -> str:
+    return f"""
+    SELECT
+        rowid, symbol, timeframe, kline_open_time,
+        COALESCE(entry_timestamp_utc, kline_open_time, outcome_timestamp_utc) AS signal_time,
+        outcome_timestamp_utc,
+        {', '.join(NUMERIC_FEATURES)},
+        trend,
+        (instr(status, 'TP') > 0 OR pnl_percentage > 0) AS win
+    FROM trend_analysis
+    WHERE {where}
+    ORDER BY rowid
+    """
+
+class LoadReport(NamedTuple):
+    rows_scanned: int
+    rows_kept: int
+    chunks: int
+    seconds: float
+    peak_mb: float # Bộ đệm cấp phát trước + khối lớn nhất đang xử lý
+    max_rss_mb: float # RSS đỉnh của cả tiến trình (getrusage)
+
+class ClosedTrades(NamedTuple):
+    frame: pd.DataFrame
+    watermark: Optional[str]
+    boundary_ids: List[int]
+    report: LoadReport
+
+def reservoir_slots(seen: int, n_new: int, capacity: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Algorithm R cho n_new phần tử tới sau khi reservoir (đã đầy) thấy `seen` phần tử, tính một lần cho cả khối:
+    phần tử thứ t được giữ nếu randint(0, t) < capacity. Trả về (vị trí trong khối, ô reservoir bị thay);
+    nhiều phần tử trúng cùng một ô thì chỉ giữ phần tử sau cùng, đúng như khi chạy tuần tự.
+    """
+    t = seen + np.arange(1, n_new + 1)
+    slots = rng.integers(0, t)
+    positions = np.flatnonzero(slots < capacity)
+    slots = slots[positions]
+    # np.unique trên mảng đảo ngược -> lần xuất hiện cuối cùng của mỗi ô
+    _, last = np.unique(slots[::-1], return_index=True)
+    keep = np.sort(len(slots) - 1 - last)
+    return positions[keep], slots[keep]
+
+def _max_rss_mb() -> float:
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage / (1024 * 1024) if sys.platform == 'darwin' else usage / 1024
+    except ImportError:
+        return float('nan')
+
+def _encode(values: np.ndarray, categories: Dict[str, int]) -> np.ndarray:
+    """Chuỗi -> mã int32 theo từ điển dùng chung cho mọi khối (NULL -> -1)."""
+    codes, uniques = pd.factorize(values)
+    if len(uniques) == 0:
+        return codes.astype(np.int32)
+    lookup = np.array([categories.setdefault(u, len(categories)) for u in uniques], dtype=np.int32)
+    return np.where(codes >= 0, lookup[codes], -1).astype(np.int32)
+
+class _Buffer:
+    """Các cột kiểu cố định cấp phát trước cho `capacity` hàng."""
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.columns = {
+            'rowid': np.empty(capacity, dtype=np.int64),
+            **{name: np.empty(capacity, dtype=np.int64) for name in _TIMES},
+            **{name: np.empty(capacity, dtype=np.int32) for name in _CATEGORICAL},
+            **{name: np.empty(capacity, dtype=np.float32) for name in NUMERIC_FEATURES},
+            'win': np.empty(capacity, dtype=np.int8),
+        }
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.columns.values())
+
+    def put(self, slots: np.ndarray, chunk: Dict[str, np.ndarray], rows: np.ndarray) -> None:
+        for name, column in self.columns.items():
+            column[slots] = chunk[name][rows]
+
+    def take(self, slots: np.ndarray) -> Dict[str, np.ndarray]:
+        return {name: column[slots] for name, column in self.columns.items()}
+
+def bytes_per_row() -> int:
+    return _Buffer(1).nbytes
+
+def _typed_chunk(columns: Dict[str, tuple], categories: Dict[str, Dict[str, int]], need_kline_ms: bool) -> Dict[str, np.ndarray]:
+    """Các cột (tuple giá trị Python của một khối) -> mảng NumPy có kiểu."""
+    n = len(columns['rowid'])
+    typed = {
+        'rowid': np.array(columns['rowid'], dtype=np.int64),
+        'signal_ms': to_epoch_ms(columns['signal_time']),
+        'outcome_ms': to_epoch_ms(columns['outcome_timestamp_utc']),
+        # Chỉ cần để tra feature store; không dùng thì khỏi phân tích chuỗi thời gian
+        'kline_open_ms': to_epoch_ms(columns['kline_open_time']) if need_kline_ms else np.full(n, -1, dtype=np.int64),
+        'win': np.array(columns['win'], dtype=np.int8),
+    }
+    for name in _CATEGORICAL:
+        typed[name] = _encode(np.array(columns[name], dtype=object), categories[name])
+    for name in NUMERIC_FEATURES:
+        typed[name] = np.array(columns[name], dtype=np.float32)
+    return typed
+
+def _rows_nbytes(rows: List[tuple]) -> int:
+    # Ước lượng bộ nhớ của một khối hàng Python (list + tuple + giá trị) theo hàng đầu tiên
+    first = rows[0]
+    return len(rows) * (8 + sys.getsizeof(first) + sum(sys.getsizeof(v) for v in first))
+
+def _to_frame(columns: Dict[str, np.ndarray], categories: Dict[str, Dict[str, int]]) -> pd.DataFrame:
+    data = {'rowid': columns['rowid']}
+    for name in ('symbol', 'timeframe'):
+        data[name] = _categorical(columns[name], categories[name])
+    for name in _TIMES:
+        data[name] = columns[name]
+    for name in NUMERIC_FEATURES:
+        data[name] = columns[name]
+    data['trend'] = _categorical(columns['trend'], categories['trend'])
+    data['outcome'] = pd.Categorical.from_codes(columns['win'].astype(np.int8), categories=OUTCOME_LABELS)
+    return pd.DataFrame(data, copy=False)
+
+def _categorical(codes: np.ndarray, mapping: Dict[str, int]) -> pd.Categorical:
+    # Danh mục theo thứ tự chữ cái để get_dummies cho cùng cột (và cùng cột bị drop_first) như khi dùng chuỗi
+    names = sorted(mapping)
+    remap = np.empty(len(mapping) + 1, dtype=np.int32)
+    remap[-1] = -1
+    for name, code in mapping.items():
+        remap[code] = names.index(name)
+    return pd.Categorical.from_codes(remap[codes], categories=names)
+
+def load_closed_trades(since: Optional[str] = None, sampling: Optional[str] = None, window_days: Optional[float] = None,
+                       reservoir_size: Optional[int] = None, chunk_rows: Optional[int] = None,
+                       max_memory_mb: Optional[float] = None, random_state: int = 42,
+                       db_path: Optional[str] = None) -> ClosedTrades:
+    """
+    Các lệnh đã đóng (đã gán nhãn, bỏ hàng thiếu feature) dạng cột có kiểu.
+    since: watermark -> chỉ các lệnh đóng từ thời điểm đó (không cửa sổ/reservoir, dùng cho cập nhật tăng dần).
+    sampling: 'all' | 'reservoir'; window_days: chỉ giữ tín hiệu trong N ngày gần nhất (0 = toàn bộ).
+    """
+    sampling = sampling or config.TRAINING_LOADER_SAMPLING
+    window_days = config.TRAINING_LOADER_WINDOW_DAYS if window_days is None else window_days
+    chunk_rows = chunk_rows or config.TRAINING_LOADER_CHUNK_ROWS
+    max_memory_mb = max_memory_mb or config.TRAINING_LOADER_MAX_MEMORY_MB
+    if since is not None:
+        sampling, window_days = 'all', 0
+    started = time.perf_counter()
+
+    where, params = _WHERE, []
+    if since is not None:
+        where += " AND outcome_timestamp_utc >= ?"
+        params.append(since)
+    max_rows = max(1, int(max_memory_mb * 1024 * 1024 // bytes_per_row()))
+    with sqlite3.connect(db_path or config.SQLITE_DB_PATH) as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM trend_analysis WHERE {where}", params).fetchone()[0]
+        if sampling == 'reservoir':
+            per_class = min((reservoir_size or config.TRAINING_LOADER_RESERVOIR_SIZE) // 2, max_rows // 2)
+            capacity = 2 * per_class
+        else:
+            capacity = min(total, max_rows)
+            if total > max_rows:
+                logger.warning(f"⚠️ {total} closed trades exceed the {max_memory_mb} MB loader cap; keeping the newest {max_rows}.")
+        buffer = _Buffer(max(capacity, 1))
+        cutoff_ms = int((time.time() - window_days * 86400) * 1000) if window_days else None
+        categories: Dict[str, Dict[str, int]] = {name: {} for name in _CATEGORICAL}
+        rng = np.random.default_rng(random_state)
+        need_kline_ms = config.FEATURE_STORE_ENABLED
+        scanned, written, chunks, peak_chunk = 0, 0, 0, 0
+        seen = [0, 0] # Số hàng đã thấy của mỗi nhãn (reservoir)
+        watermark, boundary_ids = None, []
+
+        cursor = conn.execute(_query(where), params)
+        names = [d[0] for d in cursor.description]
+        while rows := cursor.fetchmany(chunk_rows):
+            chunks += 1
+            scanned += len(rows)
+            # Hàng + các tuple cột sau khi chuyển vị (dùng chung các giá trị)
+            peak_chunk = max(peak_chunk, _rows_nbytes(rows) + 8 * len(rows) * len(rows[0]))
+            columns = dict(zip(names, zip(*rows)))
+            del rows
+            # Watermark trên mọi hàng đã đọc (kể cả hàng bị cửa sổ/reservoir bỏ: chúng đã được "thấy")
+            chunk_max = max(filter(None, columns['outcome_timestamp_utc']), default=None)
+            if chunk_max is not None:
+                at_max = [rowid for rowid, closed_at in zip(columns['rowid'], columns['outcome_timestamp_utc']) if closed_at == chunk_max]
+                if watermark is None or chunk_max > watermark:
+                    watermark, boundary_ids = chunk_max, at_max
+                elif chunk_max == watermark:
+                    boundary_ids.extend(at_max)
+
+            typed = _typed_chunk(columns, categories, need_kline_ms)
+            del columns
+            rows = np.arange(len(typed['rowid']))
+            if cutoff_ms is not None:
+                rows = rows[typed['signal_ms'][rows] >= cutoff_ms]
+            if sampling == 'reservoir':
+                for label in (0, 1):
+                    label_rows = rows[typed['win'][rows] == label]
+                    base = label * per_class
+                    free = min(per_class - min(seen[label], per_class), len(label_rows))
+                    if free:
+                        buffer.put(base + seen[label] + np.arange(free), typed, label_rows[:free])
+                    rest = label_rows[free:]
+                    if len(rest):
+                        positions, slots = reservoir_slots(seen[label] + free, len(rest), per_class, rng)
+                        buffer.put(base + slots, typed, rest[positions])
+                    seen[label] += len(label_rows)
+            elif len(rows):
+                # Vòng tròn: quá sức chứa thì các hàng mới nhất (theo rowid) ghi đè các hàng cũ nhất
+                slots = (written + np.arange(len(rows))) % buffer.capacity
+                written += len(rows)
+                if len(rows) > buffer.capacity:
+                    rows, slots = rows[-buffer.capacity:], slots[-buffer.capacity:]
+                buffer.put(slots, typed, rows)
+
+    if sampling == 'reservoir':
+        columns = buffer.take(np.concatenate([label * per_class + np.arange(min(seen[label], per_class)) for label in (0, 1)]))
+    elif written > buffer.capacity:
+        columns = buffer.take((written + np.arange(buffer.capacity)) % buffer.capacity)
+    elif written == buffer.capacity:
+        columns = buffer.columns # Đầy đúng thứ tự: dùng luôn, không sao chép
+    else:
+        columns = buffer.take(np.arange(written))
+    frame = _to_frame(columns, categories)
+    report = LoadReport(
+        rows_scanned=scanned, rows_kept=len(frame), chunks=chunks, seconds=time.perf_counter() - started,
+        peak_mb=(buffer.nbytes + frame.memory_usage(deep=True).sum() + peak_chunk) / 1e6, max_rss_mb=_max_rss_mb(),
+    )
+    logger.info(
+        f"📥 Loaded {report.rows_kept}/{report.rows_scanned} closed trade(s) ({sampling}"
+        f"{f', last {window_days} day(s)' if window_days else ''}) in {report.chunks} chunk(s), {report.seconds:.2f}s, "
+        f"peak {report.peak_mb:.1f} MB (max RSS {report.max_rss_mb:.0f} MB)."
+    )
+    return ClosedTrades(frame, watermark, boundary_ids, report)
@@ -0,0 +1,69 @@
+# training_data_benchmark.py - So sánh cách nạp lệnh đã đóng cũ (một lần pd.read_sql cả bảng) với training_data
+# (đọc theo khối, cột có kiểu) ở các chế độ: toàn bộ | reservoir phân tầng | trần bộ nhớ nhỏ.
+# Mỗi cách chạy trong một tiến trình 'spawn' riêng để RSS đỉnh (getrusage) chỉ tính lần nạp đó.
+# DB tổng hợp nằm trong thư mục tạm (tạo một lần cho mỗi số hàng).
+# Cách chạy: python -m src.training_data_benchmark [số_lệnh_đã_đóng]
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+
+from . import config
+from .training_benchmark import make_training_db
+from .training_data import _max_rss_mb, load_closed_trades
+
+_CAP_MB = 32
+
+def _legacy_load() -> int:
+    # Cách cũ của trainer: đọc mọi cột dạng chuỗi/đối tượng rồi gán nhãn
+    with sqlite3.connect(config.SQLITE_DB_PATH) as conn:
+        df = pd.read_sql(
+            "SELECT rowid, * FROM trend_analysis WHERE status != 'ACTIVE' AND pnl_percentage IS NOT NULL AND trend IS NOT NULL", conn
+        )
+    df['outcome'] = np.where(df['status'].str.contains('TP', regex=False, na=False) | (df['pnl_percentage'] > 0), 'WIN', 'LOSS')
+    return len(df)
+
+_VARIANTS = {
+    'read_sql (old)': _legacy_load,
+    'chunked': lambda: len(load_closed_trades(sampling='all').frame),
+    'reservoir 100k': lambda: len(load_closed_trades(sampling='reservoir', reservoir_size=100000).frame),
+    f'cap {_CAP_MB} MB': lambda: len(load_closed_trades(sampling='all', max_memory_mb=_CAP_MB).frame),
+}
+
+def _child(name: str, db_path: str, conn) -> None:
+    config.SQLITE_DB_PATH = db_path
+    config.FEATURE_STORE_ENABLED = False
+    baseline = _max_rss_mb()
+    started = time.perf_counter()
+    rows = _VARIANTS[name]()
+    conn.send({'rows': rows, 'seconds': time.perf_counter() - started, 'peak_rss_mb': _max_rss_mb(), 'baseline_mb': baseline})
+    conn.close()
+
+def run_benchmark(n_trades: int = 1000000) -> Dict[str, Dict[str, Any]]:
+    db_path = os.path.join(tempfile.gettempdir(), f'training-data-bench-{n_trades}.sqlite')
+    if not os.path.exists(db_path):
+        make_training_db(db_path, n_trades)
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in _VARIANTS:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_child, args=(name, db_path, sender))
+        process.start()
+        sender.close()
+        results[name] = receiver.recv()
+        process.join()
+    return results
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    results = run_benchmark(n)
+    print(f"Closed trades: {n} | chunk rows: {config.TRAINING_LOADER_CHUNK_ROWS}")
+    for name, result in results.items():
+        print(f"  {name:<16} {result['rows']:>9} rows | {result['seconds']:6.2f}s | "
+              f"peak RSS {result['peak_rss_mb']:7.1f} MB (+{result['peak_rss_mb'] - result['baseline_mb']:.1f} MB over imports)")
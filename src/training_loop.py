@@ -2,6 +2,7 @@
 import asyncio
 import logging
 from .trainer import train_model
+from .training_worker import train_in_subprocess
 from . import config
 
 logger = logging.getLogger(__name__)
@@ -13,14 +14,22 @@ async def training_loop(notifier, total_symbols):
         # Wait for the configured interval before starting the next training cycle.
         await asyncio.sleep(config.TRAINING_INTERVAL_SECONDS)
         logger.info("🤖 Starting periodic model training cycle...")
-        new_accuracy = None # Initialize accuracy to None
+        result = None # None = training failed or had too little data
         try:
-            # Run the synchronous training function in a separate thread to avoid blocking the event loop.
-            loop = asyncio.get_running_loop()
-            new_accuracy = await loop.run_in_executor(None, train_model)
+            if config.TRAINING_IN_SUBPROCESS:
+                # Run training in a separate, CPU/memory-limited process so it cannot starve the event loop.
+                result = await train_in_subprocess()
+            else:
+                # Run the synchronous training function in a separate thread to avoid blocking the event loop.
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(None, train_model)
             
-            if new_accuracy is not None:
-                logger.info(f"✅ Periodic training complete. New accuracy: {new_accuracy:.2%}")
+            if result is not None and not result.changed:
+                # Chưa đủ lệnh mới: không có model mới, nên không có accuracy mới để thông báo
+                logger.info(f"Periodic training kept the current model ({result.model_version}); no notification sent.")
+                continue
+            if result is not None:
+                logger.info(f"✅ Periodic training complete ({result.mode}). New accuracy: {result.accuracy:.2%} on {result.evaluated_rows} held-out row(s)")
             else:
                 # This case handles when train_model returns None (e.g., not enough data).
                 logger.warning("Periodic training did not produce a new model (insufficient data).")
@@ -28,10 +37,12 @@ async def training_loop(notifier, total_symbols):
         except Exception as e:
             # Log the full exception traceback for debugging.
             logger.error(f"❌ An exception occurred during periodic training: {e}", exc_info=True)
-            # new_accuracy remains None, which will signal a failure in the notification.
-        
-        finally:
-            # Always send a notification, whether training succeeded, was skipped, or failed.
-            # The notification function is designed to handle `new_accuracy` being a float or None.
-            logger.info("Sending training result notification...")
-            await notifier.send_training_complete_notification(new_accuracy, total_symbols)
\ No newline at end of file
+            # result remains None, which will signal a failure in the notification.
+
+        # Send a notification whether training produced a new model, was skipped for lack of data, or failed.
+        # The notification function is designed to handle `accuracy` being a float or None.
+        logger.info("Sending training result notification...")
+        if result is None:
+            await notifier.send_training_complete_notification(None, total_symbols)
+        else:
+            await notifier.send_training_complete_notification(result.accuracy, total_symbols, result.mode, result.evaluated_rows)
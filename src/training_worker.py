@@ -0,0 +1,160 @@
+# training_worker.py
+# Chạy train_model trong một tiến trình con (multiprocessing 'spawn') thay vì thread executor:
+#   - giới hạn số core (CPU affinity + số luồng BLAS/OpenMP), bộ nhớ (RLIMIT_AS) và niceness của tiến trình con
+#   - log của trainer (tiến độ) và kết quả cuối được gửi về tiến trình bot qua một Pipe
+#   - hủy (bot tắt / task bị cancel) -> SIGTERM cho tiến trình con; trainer dọn thư mục tạm của registry khi thoát
+# Số luồng BLAS/OpenMP được đặt vào môi trường của tiến trình bot ngay trước Process.start() (tiến trình con thừa hưởng):
+# tiến trình 'spawn' nạp lại __main__ (run.py, vốn import numpy/sklearn) trước khi chạy _worker_main, nên đặt biến
+# môi trường trong tiến trình con là đã muộn; ở đó chỉ còn threadpoolctl giới hạn lại các pool đã khởi tạo.
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from . import config
+
+if TYPE_CHECKING:
+    from .trainer import TrainingResult
+
+logger = logging.getLogger(__name__)
+
+_POLL_INTERVAL_SECONDS = 0.2
+_TERMINATE_TIMEOUT_SECONDS = 10
+
+class _PipeLogHandler(logging.Handler):
+    """Chuyển log của tiến trình con về tiến trình bot."""
+    def __init__(self, conn):
+        super().__init__()
+        self.conn = conn
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.conn.send(('log', record.levelno, record.name, record.getMessage()))
+        except Exception:
+            pass
+
+def _config_snapshot() -> Dict[str, Any]:
+    # Tiến trình 'spawn' nạp lại config từ đầu -> mang theo các giá trị đơn giản hiện tại (kể cả giá trị đã đổi lúc chạy)
+    return {k: v for k, v in vars(config).items() if k.isupper() and isinstance(v, (str, int, float, bool, type(None)))}
+
+_THREAD_LIMIT_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'LOKY_MAX_CPU_COUNT')
+
+def _start_with_thread_limits(process: multiprocessing.Process, max_cores: int) -> None:
+    """Khởi động process với các biến giới hạn luồng trong môi trường, rồi trả lại môi trường cũ cho tiến trình bot."""
+    if max_cores <= 0:
+        process.start()
+        return
+    saved = {variable: os.environ.get(variable) for variable in _THREAD_LIMIT_VARIABLES}
+    os.environ.update({variable: str(max_cores) for variable in _THREAD_LIMIT_VARIABLES})
+    try:
+        process.start()
+    finally:
+        for variable, value in saved.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+def _apply_limits(max_cores: int, max_memory_mb: int, niceness: int) -> None:
+    if niceness:
+        os.nice(niceness)
+    if max_cores > 0:
+        # Pool BLAS/OpenMP đã được tạo khi nạp lại __main__ (theo biến môi trường từ _start_with_thread_limits); giới hạn lại cho chắc
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(max_cores)
+        if hasattr(os, 'sched_setaffinity'):
+            # Dùng các core cuối, để các core đầu cho tiến trình bot
+            allowed = sorted(os.sched_getaffinity(0))
+            os.sched_setaffinity(0, allowed[-max_cores:])
+    if max_memory_mb > 0:
+        try:
+            import resource
+            limit = max_memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError) as e:
+            logging.getLogger(__name__).warning(f"Could not set training memory limit: {e}")
+
+def _worker_main(conn, mode: Optional[str], settings: Dict[str, Any]) -> None:
+    """Điểm vào của tiến trình con."""
+    # SIGTERM -> SystemExit để các khối finally/except (vd. dọn thư mục staging của registry) vẫn chạy
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(143))
+    root = logging.getLogger()
+    root.handlers[:] = [_PipeLogHandler(conn)]
+    root.setLevel(logging.INFO)
+    try:
+        for name, value in settings.items():
+            setattr(config, name, value)
+        _apply_limits(config.TRAINING_MAX_CORES, config.TRAINING_MAX_MEMORY_MB, config.TRAINING_NICENESS)
+        from .trainer import train_model
+        started = time.perf_counter()
+        result = train_model(mode)
+        conn.send(('result', result, time.perf_counter() - started))
+    except MemoryError:
+        conn.send(('error', f"Training exceeded the {config.TRAINING_MAX_MEMORY_MB} MB memory limit."))
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Training worker failed: {e}", exc_info=True)
+        conn.send(('error', str(e)))
+    finally:
+        conn.close()
+
+def _stop(process: multiprocessing.Process) -> None:
+    if process.is_alive():
+        process.terminate()
+        process.join(_TERMINATE_TIMEOUT_SECONDS)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+async def train_in_subprocess(mode: Optional[str] = None) -> Optional['TrainingResult']:
+    """
+    Huấn luyện trong tiến trình con và trả về TrainingResult (None nếu lỗi hoặc không đủ dữ liệu),
+    giống train_model. Bị cancel -> tiến trình con bị dừng rồi CancelledError được ném tiếp.
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    # Không daemon: joblib tắt song song (n_jobs=1) trong tiến trình daemon; việc dừng do khối CancelledError bên dưới lo
+    process = context.Process(target=_worker_main, args=(sender, mode, _config_snapshot()), name='model-trainer', daemon=False)
+    _start_with_thread_limits(process, config.TRAINING_MAX_CORES)
+    sender.close()
+    logger.info(
+        f"🧵 Training worker started (pid {process.pid}, cores {config.TRAINING_MAX_CORES or 'all'}, "
+        f"memory {config.TRAINING_MAX_MEMORY_MB or 'unlimited'} MB, nice {config.TRAINING_NICENESS})."
+    )
+    result, finished = None, False
+    try:
+        while True:
+            # Kiểm tra trước khi đọc: mọi tin gửi trước khi tiến trình con thoát đều được đọc hết
+            alive = process.is_alive()
+            # Đọc hết tin nhắn đang chờ mà không chặn event loop
+            while receiver.poll():
+                try:
+                    message = receiver.recv()
+                except EOFError:
+                    break
+                kind = message[0]
+                if kind == 'log':
+                    _, level, name, text = message
+                    logger.log(level, f"[trainer] {text}")
+                elif kind == 'result':
+                    result, finished = message[1], True
+                    logger.info(f"🧵 Training worker finished in {message[2]:.2f}s.")
+                elif kind == 'error':
+                    finished = True
+                    logger.error(f"❌ Training worker error: {message[1]}")
+            if finished or not alive:
+                break
+            await asyncio.sleep(_POLL_INTERVAL_SECONDS)
+    except asyncio.CancelledError:
+        logger.info(f"🛑 Cancelling training worker (pid {process.pid})...")
+        await asyncio.get_running_loop().run_in_executor(None, _stop, process)
+        raise
+    finally:
+        receiver.close()
+    await asyncio.get_running_loop().run_in_executor(None, process.join)
+    if not finished:
+        logger.error(f"❌ Training worker exited without a result (exit code {process.exitcode}).")
+    return result
@@ -1,15 +1,22 @@
-# updater.py (Phiên bản tối ưu với asyncio.gather và logic multi-TP)
+# updater.py (Phiên bản tối ưu: gom theo symbol, đánh giá vector hóa và logic multi-TP)
 import logging
 import sqlite3
+import numpy as np
 import pandas as pd
 from binance import AsyncClient
+from collections import defaultdict
 from . import config  # Import config to access trading settings and database path
-from .market_data_handler import get_market_data
+from . import outbox
+from .state_cache import state_cache
+from .market_data_handler import binance_request_limiter, get_market_data_since
 import asyncio
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Số rowid tối đa trong một mệnh đề IN (dưới giới hạn 999 biến của SQLite cũ)
+_SQL_IN_CHUNK = 500
+
 async def get_usdt_futures_symbols(client: AsyncClient) -> set:
     """Lấy tất cả các mã futures USDT đang hoạt động."""
     logger.info("🔍 Fetching all active USDT perpetual futures symbols...")
@@ -27,50 +34,176 @@ async def get_usdt_futures_symbols(client: AsyncClient) -> set:
         logger.error(f"❌ Failed to fetch symbol list: {e}", exc_info=True)
         return set()
 
-def _update_signal_outcome(conn: sqlite3.Connection, signal_data: Dict[str, Any], new_status: str, exit_price: float) -> None:
+def _calculate_pnl(entry_price: Any, exit_price: Any, trend: Any, row_id: Any = None) -> Tuple[Optional[float], Optional[float]]:
+    """Tính PnL (%) và PnL có đòn bẩy cho một lệnh đã đóng. Trả về (None, None) nếu thiếu dữ liệu."""
+    if not (entry_price and exit_price and trend):
+        return None, None
+    try:
+        pnl = ((float(exit_price) - float(entry_price)) / float(entry_price)) * 100
+        if 'BEARISH' in trend:
+            pnl *= -1 # Đảo dấu PnL cho lệnh short
+        return pnl, pnl * config.LEVERAGE
+    except (ValueError, TypeError, ZeroDivisionError) as pnl_e:
+        logger.error(f"Could not calculate PnL for rowid {row_id}: {pnl_e}")
+        return None, None
+
+def _entry_time_ms(signal: Dict[str, Any]) -> Optional[int]:
     """
-    Cập nhật trạng thái, giá thoát lệnh, PnL và thời gian xảy ra cho một tín hiệu.
+    Xác định thời điểm vào lệnh (epoch ms, UTC) của một tín hiệu.
+    Ưu tiên entry_timestamp_utc, sau đó kline_open_time, cuối cùng là timestamp_utc (giây).
     """
-    try:
-        timestamp_utc = pd.Timestamp.utcnow().isoformat()
-        row_id = signal_data.get('rowid')
-
-        # --- LOGIC MỚI: TÍNH TOÁN PNL KHI ĐÓNG LỆNH ---
-        entry_price = signal_data.get('entry_price')
-        trend = signal_data.get('trend')
-        pnl_percentage = None
-        pnl_with_leverage = None
-
-        if entry_price and exit_price and trend:
-            try:
-                pnl = ((float(exit_price) - float(entry_price)) / float(entry_price)) * 100
-                if 'BEARISH' in trend:
-                    pnl *= -1 # Đảo dấu PnL cho lệnh short
-                pnl_percentage = pnl
-                pnl_with_leverage = pnl * config.LEVERAGE
-            except (ValueError, TypeError, ZeroDivisionError) as pnl_e:
-                logger.error(f"Could not calculate PnL for rowid {row_id}: {pnl_e}")
-        # --- KẾT THÚC LOGIC MỚI ---
-
-        conn.execute(
-            """UPDATE trend_analysis 
-               SET status = ?, outcome_timestamp_utc = ?, exit_price = ?, pnl_percentage = ?, pnl_with_leverage = ?
-               WHERE rowid = ?""",
-            (new_status, timestamp_utc, exit_price, pnl_percentage, pnl_with_leverage, row_id)
-        )
-        logger.info(f"✅ Updated rowid {row_id} to status: {new_status} at price {exit_price} with PnL: {pnl_percentage:.2f}%")
-    except sqlite3.Error as e:
-        logger.error(f"❌ DB update failed (rowid {row_id}): {e}", exc_info=True)
+    for key in ('entry_timestamp_utc', 'kline_open_time'):
+        value = signal.get(key)
+        if not value:
+            continue
+        try:
+            ts = pd.Timestamp(value)
+            if ts.tzinfo is None:
+                ts = ts.tz_localize('UTC')
+            return int(ts.timestamp() * 1000)
+        except (ValueError, TypeError):
+            continue
+    value = signal.get('timestamp_utc')
+    if value:
+        try:
+            return int(float(value) * 1000)
+        except (ValueError, TypeError):
+            pass
+    return None
 
-async def check_signal_outcomes(client: AsyncClient) -> None:
+def classify_outcomes(
+    is_long: np.ndarray, high_since: np.ndarray, low_since: np.ndarray,
+    sl: np.ndarray, tp1: np.ndarray, tp2: np.ndarray, tp3: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Kiểm tra các tín hiệu đang hoạt động đã chạm TP/SL chưa.
-    Sử dụng asyncio.gather để tăng hiệu năng.
+    Áp dụng quy tắc TP/SL lên cực trị giá kể từ lúc vào lệnh của từng tín hiệu:
+    ưu tiên SL, sau đó TP3 > TP2 > TP1.
+    Trả về (statuses, exit_prices); status rỗng '' nghĩa là lệnh vẫn ACTIVE.
     """
-    logger.info("🚨 Checking TP/SL outcomes...")
-    db_path = config.SQLITE_DB_PATH
-    
-    active_signals: List[sqlite3.Row] = []
+    is_short = ~is_long
+    conditions = [
+        (is_long & (low_since <= sl)) | (is_short & (high_since >= sl)),
+        (is_long & (high_since >= tp3)) | (is_short & (low_since <= tp3)),
+        (is_long & (high_since >= tp2)) | (is_short & (low_since <= tp2)),
+        (is_long & (high_since >= tp1)) | (is_short & (low_since <= tp1)),
+    ]
+    statuses = np.select(conditions, ['SL_HIT', 'TP3_HIT', 'TP2_HIT', 'TP1_HIT'], default='')
+    exit_prices = np.select(conditions, [sl, tp3, tp2, tp1], default=np.nan)
+    return statuses, exit_prices
+
+def extremes_since(open_times_ms: np.ndarray, highs: np.ndarray, lows: np.ndarray, start_ms: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (high, low) trên các nến có open_time > start_ms, cho nhiều mốc start_ms cùng lúc.
+    Dùng mảng max/min lũy kế tính ngược (suffix) nên chi phí là O(số nến + số mốc).
+    Mốc không có nến nào phía sau nhận (-inf, +inf).
+    """
+    n_candles = len(open_times_ms)
+    # Phần tử cuối là giá trị trung tính cho các tín hiệu chưa có nến nào sau entry
+    suffix_high = np.full(n_candles + 1, -np.inf)
+    suffix_low = np.full(n_candles + 1, np.inf)
+    if n_candles:
+        suffix_high[:-1] = np.maximum.accumulate(highs[::-1])[::-1]
+        suffix_low[:-1] = np.minimum.accumulate(lows[::-1])[::-1]
+
+    start_idx = np.searchsorted(open_times_ms, start_ms, side='right')
+    return suffix_high[start_idx], suffix_low[start_idx]
+
+def resolve_outcomes(
+    open_times_ms: np.ndarray, highs: np.ndarray, lows: np.ndarray,
+    entry_ms: np.ndarray, is_long: np.ndarray,
+    sl: np.ndarray, tp1: np.ndarray, tp2: np.ndarray, tp3: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Đánh giá TP/SL cho nhiều tín hiệu của cùng một symbol trong một lượt vector hóa.
+    Mỗi tín hiệu chỉ xét các nến có open_time > entry_ms của chính nó.
+    """
+    high_since, low_since = extremes_since(open_times_ms, highs, lows, entry_ms)
+    return classify_outcomes(is_long, high_since, low_since, sl, tp1, tp2, tp3)
+
+def first_hit_outcomes(
+    highs: np.ndarray, lows: np.ndarray, closes: np.ndarray,
+    entry_idx: np.ndarray, is_long: np.ndarray,
+    sl: np.ndarray, tp1: np.ndarray, tp2: np.ndarray, tp3: np.ndarray,
+    horizon: int, max_cells: int = 1 << 22
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Kết quả TP/SL của nhiều lệnh trên cùng một chuỗi nến, xét tối đa `horizon` nến sau nến vào lệnh (chỉ số entry_idx).
+    Với mỗi nến trong cửa sổ: max/min lũy kế kể từ sau entry -> classify_outcomes (ưu tiên SL, rồi TP3 > TP2 > TP1);
+    nến đầu tiên có kết quả là nến đóng lệnh. Không chạm mức nào: 'CLOSED_MANUAL' tại giá close của nến cuối cửa sổ
+    (cửa sổ bị cắt ở cuối dữ liệu). Xử lý theo khối để bảng (lệnh x horizon) không vượt quá max_cells phần tử.
+    Trả về (statuses, exit_prices, exit_idx).
+    """
+    n_candles, n_trades = len(highs), len(entry_idx)
+    statuses = np.empty(n_trades, dtype='<U13')
+    exit_prices = np.empty(n_trades)
+    exit_idx = np.empty(n_trades, dtype=np.int64)
+    offsets = np.arange(1, horizon + 1)
+    block = max(1, max_cells // max(horizon, 1))
+    for start in range(0, n_trades, block):
+        part = slice(start, start + block)
+        entries = entry_idx[part]
+        window = entries[:, None] + offsets
+        inside = window < n_candles
+        window = np.minimum(window, n_candles - 1)
+        high_since = np.maximum.accumulate(np.where(inside, highs[window], -np.inf), axis=1)
+        low_since = np.minimum.accumulate(np.where(inside, lows[window], np.inf), axis=1)
+        bar_status, bar_exit = classify_outcomes(
+            is_long[part, None], high_since, low_since,
+            sl[part, None], tp1[part, None], tp2[part, None], tp3[part, None]
+        )
+        hit = bar_status != ''
+        any_hit = hit.any(axis=1)
+        first = hit.argmax(axis=1)
+        rows = np.arange(len(entries))
+        last = np.minimum(entries + horizon, n_candles - 1)
+        statuses[part] = np.where(any_hit, bar_status[rows, first], 'CLOSED_MANUAL')
+        exit_prices[part] = np.where(any_hit, bar_exit[rows, first], closes[last])
+        exit_idx[part] = np.where(any_hit, window[rows, first], last)
+    return statuses, exit_prices, exit_idx
+
+def _signal_arrays(signals: List[Dict[str, Any]]) -> Tuple[np.ndarray, ...]:
+    """(is_long, sl, tp1, tp2, tp3) dạng mảng NumPy cho một danh sách tín hiệu."""
+    return (
+        np.array(['BULLISH' in (s.get('trend') or '') for s in signals], dtype=bool),
+        *(np.array([s.get(col) for s in signals], dtype=float)
+          for col in ('stop_loss', 'take_profit_1', 'take_profit_2', 'take_profit_3')),
+    )
+
+def _market_data_arrays(market_data: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return (
+        market_data.index.as_unit("ms").asi8,
+        market_data['high'].to_numpy(dtype=float),
+        market_data['low'].to_numpy(dtype=float),
+    )
+
+def _build_closed_trades(signals: List[Dict[str, Any]], statuses: np.ndarray, exit_prices: np.ndarray, timestamp_utc: str) -> List[Dict[str, Any]]:
+    """Chuyển kết quả phân loại thành các bản ghi trade đã đóng (kèm PnL) để ghi bằng write_closed_trades."""
+    trades = []
+    for signal, status, exit_price in zip(signals, statuses, exit_prices):
+        trend = signal.get('trend') or ''
+        if not status or not ('BULLISH' in trend or 'BEARISH' in trend):
+            continue
+        exit_price = float(exit_price)
+        pnl_percentage, pnl_with_leverage = _calculate_pnl(signal.get('entry_price'), exit_price, trend, signal.get('rowid'))
+        trades.append({
+            **signal, 'status': str(status), 'outcome_timestamp_utc': timestamp_utc, 'exit_price': exit_price,
+            'pnl_percentage': pnl_percentage, 'pnl_with_leverage': pnl_with_leverage,
+        })
+        pnl_str = f"{pnl_percentage:.2f}%" if pnl_percentage is not None else "N/A"
+        logger.info(f"✅ Updated rowid {signal.get('rowid')} to status: {status} at price {exit_price} with PnL: {pnl_str}")
+    return trades
+
+def _evaluate_symbol_signals(signals: List[Dict[str, Any]], market_data: pd.DataFrame, timestamp_utc: str) -> List[Dict[str, Any]]:
+    """Chạy resolve_outcomes cho các tín hiệu của một symbol và trả về các trade đã đóng."""
+    statuses, exit_prices = resolve_outcomes(
+        *_market_data_arrays(market_data),
+        np.array([s['_entry_ms'] for s in signals], dtype=np.int64),
+        *_signal_arrays(signals),
+    )
+    return _build_closed_trades(signals, statuses, exit_prices, timestamp_utc)
+
+def _load_active_signals(db_path: str) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """Đọc các tín hiệu ACTIVE, gắn '_entry_ms' và nhóm theo symbol. Trả về None nếu lỗi DB."""
     try:
         with sqlite3.connect(db_path) as conn:
             conn.row_factory = sqlite3.Row
@@ -79,59 +212,220 @@ async def check_signal_outcomes(client: AsyncClient) -> None:
             ).fetchall()
     except sqlite3.Error as e:
         logger.error(f"❌ DB read failed: {e}", exc_info=True)
-        return
+        return None
 
-    if not active_signals:
-        logger.info("ℹ️ No active signals to check.")
-        return
-
-    # CẢI THIỆN: Tạo các tác vụ lấy dữ liệu để chạy đồng thời
-    logger.info(f"🔍 Concurrently fetching market data for {len(active_signals)} active signal(s)...")
-    tasks = [
-        get_market_data(client, signal['symbol'], config.TIMEFRAME, limit=15)
-        for signal in active_signals
-    ]
-    # Chạy tất cả các tác vụ cùng lúc và nhận kết quả
-    market_data_results = await asyncio.gather(*tasks, return_exceptions=True)
+    signals_by_symbol: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for row in active_signals:
+        signal = dict(row)
+        signal['_entry_ms'] = _entry_time_ms(signal)
+        if signal['_entry_ms'] is None:
+            logger.warning(f"⚠️ Signal rowid {signal.get('rowid')} ({signal.get('symbol')}) has no usable entry time. Skipping.")
+            continue
+        signals_by_symbol[signal['symbol']].append(signal)
+    return signals_by_symbol
 
-    # Dùng một kết nối duy nhất để ghi tất cả các thay đổi
+def write_closed_trades(db_path: str, trades: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Ghi tất cả lệnh vừa đóng trong một giao dịch duy nhất, kèm thông báo kết quả vào outbox
+    (idempotency key outbox.trade_key) để thông báo không bị mất nếu bot dừng trước khi gửi.
+    Lệnh đã được đóng ở nơi khác (status không còn 'ACTIVE') bị bỏ qua: trong cùng giao dịch BEGIN IMMEDIATE,
+    đọc trước các rowid còn ACTIVE rồi ghi bằng một executemany (WHERE status = 'ACTIVE' để chắc chắn);
+    chỉ các trade thực sự được ghi mới vào outbox/state_cache và được trả về (rỗng nếu lỗi DB).
+    """
+    if not trades:
+        logger.info("ℹ️ No TP/SL hits in this pass.")
+        return []
     try:
         with sqlite3.connect(db_path) as conn:
-            # Xử lý kết quả sau khi đã có tất cả dữ liệu
-            for signal, market_data in zip(active_signals, market_data_results):
-                try:
-                    if isinstance(market_data, Exception):
-                        logger.error(f"Error fetching data for {signal['symbol']}: {market_data}")
-                        continue
-                    if market_data is None or market_data.empty:
-                        logger.warning(f"⚠️ No market data returned for {signal['symbol']}.")
-                        continue
-
-                    trend = signal['trend']
-                    sl, tp1, tp2, tp3 = signal['stop_loss'], signal['take_profit_1'], signal['take_profit_2'], signal['take_profit_3']
-
-                    recent_low = market_data['low'].min()
-                    recent_high = market_data['high'].max()
-                    
-                    # CẢI THIỆN: Logic kiểm tra Multi-TP, ưu tiên SL rồi đến TP cao nhất.
-                    # Điều này đảm bảo các lệnh được cắt lỗ một cách an toàn trong trường hợp nến biến động mạnh.
-                    if 'BULLISH' in trend: # For LONG trades
-                        if recent_low <= sl: # 1. Kiểm tra Stop Loss trước tiên
-                            _update_signal_outcome(conn, dict(signal), 'SL_HIT', sl)
-                        elif recent_high >= tp3: # 2. Sau đó kiểm tra các mức Take Profit từ cao đến thấp
-                            _update_signal_outcome(conn, dict(signal), 'TP3_HIT', tp3)
-                        elif recent_high >= tp2: _update_signal_outcome(conn, dict(signal), 'TP2_HIT', tp2)
-                        elif recent_high >= tp1: _update_signal_outcome(conn, dict(signal), 'TP1_HIT', tp1)
-
-                    elif 'BEARISH' in trend: # For SHORT trades
-                        if recent_high >= sl: # 1. Kiểm tra Stop Loss trước tiên
-                            _update_signal_outcome(conn, dict(signal), 'SL_HIT', sl)
-                        elif recent_low <= tp3: # 2. Sau đó kiểm tra các mức Take Profit từ cao đến thấp
-                            _update_signal_outcome(conn, dict(signal), 'TP3_HIT', tp3)
-                        elif recent_low <= tp2: _update_signal_outcome(conn, dict(signal), 'TP2_HIT', tp2)
-                        elif recent_low <= tp1: _update_signal_outcome(conn, dict(signal), 'TP1_HIT', tp1)
-                            
-                except Exception as e:
-                    logger.error(f"❌ Error processing signal outcome ({signal['symbol']}): {e}", exc_info=True)
+            conn.execute("BEGIN IMMEDIATE")
+            rowids = [t['rowid'] for t in trades]
+            still_active = set()
+            for start in range(0, len(rowids), _SQL_IN_CHUNK):
+                chunk = rowids[start:start + _SQL_IN_CHUNK]
+                still_active.update(rowid for (rowid,) in conn.execute(
+                    f"SELECT rowid FROM trend_analysis WHERE status = 'ACTIVE' AND rowid IN ({','.join('?' * len(chunk))})", chunk
+                ))
+            written = [t for t in trades if t['rowid'] in still_active]
+            changes_before = conn.total_changes
+            conn.executemany(
+                """UPDATE trend_analysis 
+                   SET status = ?, outcome_timestamp_utc = ?, exit_price = ?, pnl_percentage = ?, pnl_with_leverage = ?
+                   WHERE rowid = ? AND status = 'ACTIVE'""",
+                [(t['status'], t['outcome_timestamp_utc'], t['exit_price'], t['pnl_percentage'], t['pnl_with_leverage'], t['rowid'])
+                 for t in written]
+            )
+            if conn.total_changes - changes_before != len(written):
+                # Không xảy ra khi đã giữ khóa ghi; nếu có thì rollback thay vì công bố sai
+                raise sqlite3.DatabaseError(f"expected {len(written)} outcome update(s), wrote {conn.total_changes - changes_before}")
+            outbox.enqueue_many(conn, 'outcome', ((outbox.trade_key('outcome', t), t) for t in written))
+        skipped = len(trades) - len(written)
+        logger.info(f"💾 Wrote {len(written)} outcome update(s) in one batch"
+                    + (f" ({skipped} already closed elsewhere, skipped)." if skipped else "."))
+        state_cache.record_closed_trades(written)
+        return written
     except sqlite3.Error as e:
         logger.error(f"❌ DB write operation failed: {e}", exc_info=True)
+        return []
+
+async def _fetch_since_oldest_entry(client: AsyncClient, signals_by_symbol: Dict[str, List[Dict[str, Any]]]) -> List[Any]:
+    """Tải nến cho mỗi symbol đúng một lần, bắt đầu từ entry cũ nhất trong các tín hiệu của nó."""
+    semaphore = binance_request_limiter()
+
+    async def fetch(symbol: str) -> pd.DataFrame:
+        oldest_entry_ms = min(s['_entry_ms'] for s in signals_by_symbol[symbol])
+        async with semaphore:
+            return await get_market_data_since(
+                client, symbol, config.TIMEFRAME, oldest_entry_ms,
+                max_pages=config.UPDATER_MAX_KLINE_PAGES
+            )
+
+    return await asyncio.gather(*(fetch(s) for s in signals_by_symbol), return_exceptions=True)
+
+async def check_signal_outcomes(client: AsyncClient) -> None:
+    """
+    Kiểm tra các tín hiệu đang hoạt động đã chạm TP/SL chưa.
+    Gom tín hiệu theo symbol: mỗi symbol chỉ tải nến một lần, bắt đầu từ entry cũ nhất,
+    rồi đánh giá mọi tín hiệu trên các nến sau entry của chính nó và ghi bằng một executemany.
+    """
+    logger.info("🚨 Checking TP/SL outcomes...")
+    signals_by_symbol = _load_active_signals(config.SQLITE_DB_PATH)
+    if signals_by_symbol is None:
+        return
+    if not signals_by_symbol:
+        logger.info("ℹ️ No active signals to check.")
+        return
+
+    symbols = list(signals_by_symbol)
+    total_signals = sum(len(v) for v in signals_by_symbol.values())
+    logger.info(f"🔍 Concurrently fetching market data for {len(symbols)} symbol(s) covering {total_signals} active signal(s)...")
+    market_data_results = await _fetch_since_oldest_entry(client, signals_by_symbol)
+
+    timestamp_utc = pd.Timestamp.utcnow().isoformat()
+    closed_trades: List[Dict[str, Any]] = []
+    for symbol, market_data in zip(symbols, market_data_results):
+        try:
+            if isinstance(market_data, Exception):
+                logger.error(f"Error fetching data for {symbol}: {market_data}")
+                continue
+            if market_data is None or market_data.empty:
+                logger.warning(f"⚠️ No market data returned for {symbol}.")
+                continue
+            closed_trades.extend(_evaluate_symbol_signals(signals_by_symbol[symbol], market_data, timestamp_utc))
+        except Exception as e:
+            logger.error(f"❌ Error processing signal outcomes ({symbol}): {e}", exc_info=True)
+
+    write_closed_trades(config.SQLITE_DB_PATH, closed_trades)
+
+class PriceSnapshotTracker:
+    """
+    Bộ theo dõi high/low trong bộ nhớ, giữ giữa các lượt của updater ở chế độ 'snapshot'.
+    Với mỗi symbol lưu {rowid: [high, low, covered_until_ms]}: cực trị giá quan sát được
+    từ lúc vào lệnh đến covered_until_ms. Một tín hiệu có "khoảng trống" khi nó mới xuất hiện
+    (chưa có dữ liệu từ entry) hoặc khi lượt quan sát gần nhất đã quá max_gap_ms.
+    """
+    def __init__(self, max_gap_ms: int):
+        self.max_gap_ms = max_gap_ms
+        self._by_symbol: Dict[str, Dict[int, List[float]]] = defaultdict(dict)
+
+    def prune(self, signals_by_symbol: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Bỏ các tín hiệu không còn ACTIVE (đã đóng ở lượt trước hoặc ở nơi khác)."""
+        for symbol in list(self._by_symbol):
+            active_ids = {s['rowid'] for s in signals_by_symbol.get(symbol, [])}
+            tracked = self._by_symbol[symbol]
+            for rowid in list(tracked):
+                if rowid not in active_ids:
+                    del tracked[rowid]
+            if not tracked:
+                del self._by_symbol[symbol]
+
+    def observe(self, symbol: str, signals: List[Dict[str, Any]], price: Optional[float], now_ms: int) -> List[Dict[str, Any]]:
+        """
+        Cập nhật cực trị của các tín hiệu đang được theo dõi liên tục bằng giá hiện tại.
+        Trả về các tín hiệu có khoảng trống cần bù bằng klines.
+        """
+        tracked = self._by_symbol[symbol]
+        gapped = []
+        for signal in signals:
+            state = tracked.get(signal['rowid'])
+            if price is None or state is None or now_ms - state[2] > self.max_gap_ms:
+                gapped.append(signal)
+                continue
+            state[0] = max(state[0], price)
+            state[1] = min(state[1], price)
+            state[2] = now_ms
+        return gapped
+
+    def backfill(self, symbol: str, signals: List[Dict[str, Any]], market_data: pd.DataFrame, price: Optional[float], now_ms: int) -> None:
+        """Đặt lại cực trị của các tín hiệu có khoảng trống từ klines kể từ entry (và giá hiện tại)."""
+        highs, lows = extremes_since(
+            *_market_data_arrays(market_data),
+            np.array([s['_entry_ms'] for s in signals], dtype=np.int64)
+        )
+        tracked = self._by_symbol[symbol]
+        for signal, high, low in zip(signals, highs, lows):
+            state = tracked.get(signal['rowid'])
+            high, low = float(high), float(low)
+            if state is not None:
+                high, low = max(high, state[0]), min(low, state[1])
+            if price is not None:
+                high, low = max(high, price), min(low, price)
+            tracked[signal['rowid']] = [high, low, now_ms]
+
+    def extremes(self, symbol: str, signals: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+        tracked = self._by_symbol.get(symbol, {})
+        states = [tracked.get(s['rowid'], (-np.inf, np.inf)) for s in signals]
+        return (
+            np.array([st[0] for st in states], dtype=float),
+            np.array([st[1] for st in states], dtype=float),
+        )
+
+async def check_signal_outcomes_snapshot(client: AsyncClient, tracker: PriceSnapshotTracker) -> None:
+    """
+    Chế độ 'snapshot': một request /fapi/v1/ticker/price cho tất cả symbol mỗi lượt,
+    chi phí cố định bất kể số tín hiệu ACTIVE. Chỉ các symbol có tín hiệu bị khoảng trống
+    trong tracker mới phải tải klines (từ entry cũ nhất trong số đó).
+    """
+    logger.info("🚨 Checking TP/SL outcomes (price snapshot)...")
+    signals_by_symbol = _load_active_signals(config.SQLITE_DB_PATH)
+    if signals_by_symbol is None:
+        return
+    tracker.prune(signals_by_symbol)
+    if not signals_by_symbol:
+        logger.info("ℹ️ No active signals to check.")
+        return
+
+    try:
+        tickers = await client.futures_symbol_ticker()
+        prices = {t['symbol']: float(t['price']) for t in tickers}
+    except Exception as e:
+        logger.error(f"❌ Failed to fetch price snapshot: {e}. All symbols fall back to klines.", exc_info=True)
+        prices = {}
+    now_ms = int(pd.Timestamp.utcnow().timestamp() * 1000)
+
+    gapped_by_symbol: Dict[str, List[Dict[str, Any]]] = {}
+    for symbol, signals in signals_by_symbol.items():
+        gapped = tracker.observe(symbol, signals, prices.get(symbol), now_ms)
+        if gapped:
+            gapped_by_symbol[symbol] = gapped
+
+    if gapped_by_symbol:
+        logger.info(f"🔍 Backfilling {len(gapped_by_symbol)} symbol(s) with tracker gaps from klines...")
+        market_data_results = await _fetch_since_oldest_entry(client, gapped_by_symbol)
+        for (symbol, gapped), market_data in zip(gapped_by_symbol.items(), market_data_results):
+            if isinstance(market_data, Exception) or market_data is None or market_data.empty:
+                logger.warning(f"⚠️ Could not backfill {symbol}; it will be retried next pass.")
+                continue
+            tracker.backfill(symbol, gapped, market_data, prices.get(symbol), now_ms)
+
+    timestamp_utc = pd.Timestamp.utcnow().isoformat()
+    closed_trades: List[Dict[str, Any]] = []
+    for symbol, signals in signals_by_symbol.items():
+        try:
+            high_since, low_since = tracker.extremes(symbol, signals)
+            is_long, sl, tp1, tp2, tp3 = _signal_arrays(signals)
+            statuses, exit_prices = classify_outcomes(is_long, high_since, low_since, sl, tp1, tp2, tp3)
+            closed_trades.extend(_build_closed_trades(signals, statuses, exit_prices, timestamp_utc))
+        except Exception as e:
+            logger.error(f"❌ Error processing signal outcomes ({symbol}): {e}", exc_info=True)
+
+    write_closed_trades(config.SQLITE_DB_PATH, closed_trades)
@@ -0,0 +1,196 @@
+# walk_forward.py
+# Đánh giá walk-forward cho model của trainer, thay cho một lần train_test_split ngẫu nhiên (lộ dữ liệu tương lai):
+#   - các lệnh đã đóng được xếp theo thời điểm tín hiệu rồi chia thành các khối liên tiếp; fold i huấn luyện trên các
+#     khối trước nó (cửa sổ 'rolling' hoặc 'expanding') và chấm trên khối kế tiếp, bỏ một khoảng embargo ở giữa
+#     để lệnh cuối tập huấn luyện không chồng thời gian với lệnh đầu tập kiểm tra
+#   - mỗi (fold, bộ tham số trong WALK_FORWARD_PARAM_GRID) là một tác vụ của process pool; các worker đọc chung
+#     ma trận feature qua mmap (chỉ đọc) thay vì nhận một bản sao qua pickle
+#   - dữ liệu đã chuẩn bị (X, y, chỉ số train/test của từng fold) được cache theo dấu vân tay của DB + cấu hình,
+#     nên chạy lại với lưới tham số khác không phải đọc/gán nhãn lại lịch sử
+# Cách chạy: python -m src.walk_forward [số_fold] [số_worker]
+import concurrent.futures
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import ParameterGrid
+
+from . import config
+from .features import FEATURE_SET_VERSION
+from .trainer import INITIAL_FEATURES, TARGET, _feature_matrix, _load_closed_trades
+
+logger = logging.getLogger(__name__)
+
+# Dữ liệu mmap của worker (nạp một lần cho mỗi tiến trình trong pool)
+_worker_data: Dict[str, Any] = {}
+
+def _fingerprint(n_folds: int) -> str:
+    """Dấu vân tay của các lệnh đã đóng + cấu hình chia fold; đổi bất kỳ thứ gì -> thư mục cache mới."""
+    with sqlite3.connect(config.SQLITE_DB_PATH) as conn:
+        summary = conn.execute(
+            "SELECT COUNT(*), MAX(rowid), MAX(outcome_timestamp_utc) FROM trend_analysis "
+            "WHERE status != 'ACTIVE' AND pnl_percentage IS NOT NULL AND trend IS NOT NULL"
+        ).fetchone()
+    key = {
+        'db': os.path.abspath(config.SQLITE_DB_PATH), 'summary': summary, 'features': FEATURE_SET_VERSION,
+        'feature_store': config.FEATURE_STORE_ENABLED, 'folds': n_folds, 'window': config.WALK_FORWARD_WINDOW,
+        'train_blocks': config.WALK_FORWARD_TRAIN_BLOCKS, 'embargo': config.WALK_FORWARD_EMBARGO_HOURS,
+        'loader': (config.TRAINING_LOADER_SAMPLING, config.TRAINING_LOADER_WINDOW_DAYS, config.TRAINING_LOADER_RESERVOIR_SIZE),
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:12]
+
+def _balanced_indices(indices: np.ndarray, y: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Undersampling như trainer._balance: cùng số WIN và LOSS trong tập huấn luyện của fold."""
+    wins, losses = indices[y[indices] == 1], indices[y[indices] == 0]
+    n = min(len(wins), len(losses))
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.sort(np.concatenate([rng.choice(wins, n, replace=False), rng.choice(losses, n, replace=False)]))
+
+def _split_folds(times: np.ndarray, y: np.ndarray, n_folds: int) -> List[Dict[str, Any]]:
+    """Chia theo thời gian thành n_folds + WALK_FORWARD_TRAIN_BLOCKS khối có số lệnh bằng nhau."""
+    blocks = np.array_split(np.arange(len(times)), n_folds + config.WALK_FORWARD_TRAIN_BLOCKS)
+    embargo_ms = int(config.WALK_FORWARD_EMBARGO_HOURS * 3600 * 1000)
+    rng = np.random.default_rng(42)
+    folds = []
+    for i in range(n_folds):
+        test = blocks[config.WALK_FORWARD_TRAIN_BLOCKS + i]
+        first = 0 if config.WALK_FORWARD_WINDOW == 'expanding' else i
+        train = np.concatenate(blocks[first:config.WALK_FORWARD_TRAIN_BLOCKS + i])
+        if len(test) == 0 or len(train) == 0:
+            continue
+        train = train[times[train] < times[test[0]] - embargo_ms]
+        folds.append({
+            'fold': i, 'train': _balanced_indices(train, y, rng), 'test': test,
+            'train_from': int(times[train[0]]) if len(train) else None, 'test_from': int(times[test[0]]), 'test_to': int(times[test[-1]]),
+        })
+    return folds
+
+def prepare_dataset(n_folds: int) -> Tuple[str, Dict[str, Any]]:
+    """Trả về (thư mục cache, meta); chỉ đọc + gán nhãn lịch sử khi cache chưa có."""
+    directory = os.path.join(config.WALK_FORWARD_CACHE_DIR, _fingerprint(n_folds))
+    meta_path = os.path.join(directory, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        logger.info(f"Walk-forward dataset loaded from cache {directory} ({meta['rows']} rows, {len(meta['folds'])} folds).")
+        return directory, meta
+
+    started = time.perf_counter()
+    df = _load_closed_trades().frame
+    if df.empty or df[TARGET].nunique() < 2:
+        raise ValueError("Walk-forward evaluation needs closed trades with both WIN and LOSS outcomes.")
+    # signal_ms: entry_timestamp_utc, rồi kline_open_time, cuối cùng là lúc đóng lệnh (training_data)
+    df = df.sort_values('signal_ms', kind='stable').reset_index(drop=True)
+    # Cùng cách mã hóa feature như trainer (one-hot trend, drop_first) trên toàn bộ lịch sử
+    features = pd.get_dummies(df[INITIAL_FEATURES], columns=['trend'], drop_first=True).columns.tolist()
+    # float32: RandomForest vốn đổi X sang float32 nên không mất gì, mà mmap nhỏ đi một nửa
+    X = _feature_matrix(df, features).to_numpy(dtype=np.float32)
+    y = (df[TARGET] == 'WIN').to_numpy(dtype=np.int8) # Giống LabelEncoder: LOSS=0, WIN=1
+    times = df['signal_ms'].to_numpy(dtype=np.int64)
+    folds = _split_folds(times, y, n_folds)
+
+    staging = f"{directory}.tmp-{os.getpid()}"
+    os.makedirs(staging, exist_ok=True)
+    np.save(os.path.join(staging, 'X.npy'), X)
+    np.save(os.path.join(staging, 'y.npy'), y)
+    fold_meta = []
+    for fold in folds:
+        np.save(os.path.join(staging, f"fold-{fold['fold']:02d}-train.npy"), fold['train'])
+        np.save(os.path.join(staging, f"fold-{fold['fold']:02d}-test.npy"), fold['test'])
+        fold_meta.append({k: v for k, v in fold.items() if k not in ('train', 'test')} | {'train_rows': len(fold['train']), 'test_rows': len(fold['test'])})
+    meta = {'rows': len(X), 'features': features, 'classes': ['LOSS', 'WIN'], 'folds': fold_meta}
+    with open(os.path.join(staging, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    try:
+        os.replace(staging, directory)
+    except OSError: # Một lần chạy khác vừa ghi cùng cache
+        shutil.rmtree(staging, ignore_errors=True)
+    logger.info(f"Walk-forward dataset prepared in {time.perf_counter() - started:.2f}s: {len(X)} rows, {len(fold_meta)} folds -> {directory}.")
+    return directory, meta
+
+def _init_worker(directory: str, niceness: int) -> None:
+    if niceness:
+        os.nice(niceness)
+    _worker_data.clear()
+    _worker_data['directory'] = directory
+    _worker_data['X'] = np.load(os.path.join(directory, 'X.npy'), mmap_mode='r')
+    _worker_data['y'] = np.load(os.path.join(directory, 'y.npy'), mmap_mode='r')
+
+def _evaluate(fold: int, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Huấn luyện + chấm một (fold, bộ tham số) trong worker."""
+    directory, X, y = _worker_data['directory'], _worker_data['X'], _worker_data['y']
+    train = np.load(os.path.join(directory, f"fold-{fold:02d}-train.npy"))
+    test = np.load(os.path.join(directory, f"fold-{fold:02d}-test.npy"))
+    started = time.perf_counter()
+    model = RandomForestClassifier(random_state=42, n_jobs=1, **params)
+    model.fit(X[train], y[train])
+    fit_seconds = time.perf_counter() - started
+    predicted = model.predict(X[test])
+    actual = y[test]
+    recalls = [np.mean(predicted[actual == label] == label) for label in (0, 1) if np.any(actual == label)]
+    predicted_win = predicted == 1
+    return {
+        'fold': fold, 'params': ', '.join(f"{k}={v}" for k, v in sorted(params.items())),
+        **{f"param_{k}": v for k, v in params.items()},
+        'train_rows': len(train), 'test_rows': len(test),
+        'accuracy': float(np.mean(predicted == actual)),
+        'balanced_accuracy': float(np.mean(recalls)),
+        # Tỉ lệ thắng thực tế của các lệnh model dự đoán WIN (điều bot thực sự quan tâm)
+        'win_precision': float(np.mean(actual[predicted_win] == 1)) if predicted_win.any() else float('nan'),
+        'predicted_win_rate': float(np.mean(predicted_win)),
+        'fit_seconds': round(fit_seconds, 3),
+    }
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    """Một hàng cho mỗi bộ tham số: trung bình/độ lệch qua các fold, tốt nhất (balanced accuracy) trước."""
+    table = results.groupby('params', sort=False).agg(
+        folds=('fold', 'count'),
+        accuracy=('accuracy', 'mean'), accuracy_std=('accuracy', 'std'),
+        balanced_accuracy=('balanced_accuracy', 'mean'), balanced_accuracy_std=('balanced_accuracy', 'std'),
+        win_precision=('win_precision', 'mean'), fit_seconds=('fit_seconds', 'sum'),
+    )
+    return table.sort_values('balanced_accuracy', ascending=False).reset_index()
+
+def run_walk_forward(n_folds: Optional[int] = None, workers: Optional[int] = None, param_grid: Optional[Dict[str, List[Any]]] = None) -> pd.DataFrame:
+    """Chạy toàn bộ lưới tham số trên mọi fold; trả về bảng kết quả theo fold (cũng ghi ra WALK_FORWARD_RESULTS_PATH)."""
+    n_folds = n_folds or config.WALK_FORWARD_FOLDS
+    workers = workers or config.WALK_FORWARD_WORKERS or os.cpu_count() or 1
+    grid = list(ParameterGrid(param_grid or config.WALK_FORWARD_PARAM_GRID))
+    directory, meta = prepare_dataset(n_folds)
+    tasks = [(fold['fold'], params) for fold in meta['folds'] if fold['train_rows'] > 0 for params in grid]
+    if not tasks:
+        raise ValueError("No walk-forward fold has training data; add more closed trades or reduce the number of folds.")
+    logger.info(f"🔁 Walk-forward: {len(meta['folds'])} fold(s) x {len(grid)} parameter set(s) on {workers} worker(s)...")
+
+    started = time.perf_counter()
+    rows = []
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                                initargs=(directory, config.TRAINING_NICENESS)) as pool:
+        futures = [pool.submit(_evaluate, fold, params) for fold, params in tasks]
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            rows.append(future.result())
+            logger.info(f"  [{done}/{len(futures)}] fold {rows[-1]['fold']}: balanced accuracy {rows[-1]['balanced_accuracy']:.2%}")
+    results = pd.DataFrame(rows).sort_values(['fold'], kind='stable').reset_index(drop=True)
+    results.to_csv(config.WALK_FORWARD_RESULTS_PATH, index=False)
+    logger.info(f"✅ Walk-forward finished in {time.perf_counter() - started:.1f}s; per-fold results in {config.WALK_FORWARD_RESULTS_PATH}.")
+    return results
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    results = run_walk_forward(n, workers)
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.float_format', '{:.4f}'.format):
+        print(summarize(results).to_string(index=False))
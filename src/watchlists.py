@@ -0,0 +1,224 @@
+# watchlists.py
+# Danh sách theo dõi của từng người dùng: symbol (hoặc '*' = mọi symbol), các phương pháp phân tích và độ tin cậy tối thiểu.
+# Tín hiệu/kết quả khớp được gửi tới chat Telegram riêng của người dùng (qua outbox + dispatcher như các đích khác).
+# Bên đọc giữ một chỉ mục ngược symbol -> người theo dõi trong bộ nhớ, nên tìm người nhận tốn O(số người theo dõi symbol đó).
+# Mỗi thay đổi ghi một dòng vào watchlist_changes; chỉ mục chỉ nạp lại những người dùng có thay đổi mới.
+# Chat nhận thông báo chỉ được gán khi người dùng chứng minh sở hữu: API cấp một token dùng một lần,
+# người dùng mở deep link t.me/<bot>?start=<token> và command bot đổi token lấy chat_id của chính cuộc trò chuyện đó.
+import logging
+import secrets
+import sqlite3
+import time
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+ALL_SYMBOLS = '*'
+# Chỉ tín hiệu của các phương pháp này mang độ tin cậy; min_confidence > 0 chỉ hợp lệ khi watchlist giới hạn vào chúng
+CONFIDENCE_METHODS = frozenset({'AI'})
+
+def init_watchlist_tables(cursor: sqlite3.Cursor) -> None:
+    """Tạo các bảng watchlist nếu chưa có. Được gọi từ init_sqlite_db và từ API server."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_watchlists (
+        user_id INTEGER NOT NULL,
+        symbol TEXT NOT NULL, -- '*' = mọi symbol
+        methods TEXT NOT NULL DEFAULT '', -- Phân tách bằng dấu phẩy; rỗng = mọi phương pháp
+        min_confidence REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, symbol)
+    );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_telegram_chats (
+        user_id INTEGER PRIMARY KEY,
+        chat_id TEXT NOT NULL
+    );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS telegram_link_tokens (
+        token TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS watchlist_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        changed_at REAL
+    );
+    """)
+
+# --- Phía ghi (API server) ---
+
+def _record_change(conn: sqlite3.Connection, user_id: int) -> None:
+    conn.execute("INSERT INTO watchlist_changes (user_id, changed_at) VALUES (?, ?)", (user_id, time.time()))
+
+def set_user_chat(conn: sqlite3.Connection, user_id: int, chat_id: Optional[str]) -> None:
+    """Gán (hoặc gỡ, nếu chat_id rỗng) chat Telegram nhận thông báo của người dùng."""
+    if chat_id:
+        conn.execute("INSERT OR REPLACE INTO user_telegram_chats (user_id, chat_id) VALUES (?, ?)", (user_id, str(chat_id)))
+    else:
+        conn.execute("DELETE FROM user_telegram_chats WHERE user_id = ?", (user_id,))
+    _record_change(conn, user_id)
+
+def create_chat_link_token(conn: sqlite3.Connection, user_id: int, ttl_seconds: float) -> str:
+    """Cấp token dùng một lần (thay mọi token cũ của người dùng) cho deep link /start <token>."""
+    token = secrets.token_urlsafe(24)  # Chỉ gồm A-Z a-z 0-9 _ -, hợp lệ cho tham số start của Telegram
+    conn.execute("DELETE FROM telegram_link_tokens WHERE user_id = ? OR expires_at < ?", (user_id, time.time()))
+    conn.execute("INSERT INTO telegram_link_tokens (token, user_id, expires_at) VALUES (?, ?, ?)", (token, user_id, time.time() + ttl_seconds))
+    return token
+
+def redeem_chat_link_token(conn: sqlite3.Connection, token: str, chat_id: Any) -> Optional[int]:
+    """Đổi token lấy chat đang gửi lệnh /start: gán chat cho người dùng và hủy token. None nếu token sai/hết hạn."""
+    row = conn.execute("SELECT user_id, expires_at FROM telegram_link_tokens WHERE token = ?", (token,)).fetchone()
+    if row is None:
+        return None
+    conn.execute("DELETE FROM telegram_link_tokens WHERE token = ?", (token,))
+    user_id, expires_at = row
+    if expires_at < time.time():
+        return None
+    set_user_chat(conn, user_id, chat_id)
+    return user_id
+
+def disable_chat(conn: sqlite3.Connection, chat_id: str) -> int:
+    """Gỡ một chat không còn nhận được tin (bot bị chặn, chat không tồn tại) khỏi mọi người dùng; trả về số người dùng bị ảnh hưởng."""
+    user_ids = [user_id for (user_id,) in conn.execute("SELECT user_id FROM user_telegram_chats WHERE chat_id = ?", (str(chat_id),))]
+    conn.execute("DELETE FROM user_telegram_chats WHERE chat_id = ?", (str(chat_id),))
+    for user_id in user_ids:
+        _record_change(conn, user_id)
+    return len(user_ids)
+
+def set_user_watchlist(conn: sqlite3.Connection, user_id: int, entries: Iterable[Dict[str, Any]]) -> int:
+    """
+    Thay toàn bộ danh sách theo dõi của người dùng. Mỗi entry: {'symbol', 'methods': [...], 'min_confidence'}.
+    min_confidence > 0 yêu cầu methods chỉ gồm CONFIDENCE_METHODS (tín hiệu theo luật không có độ tin cậy để so).
+    Trả về số entry đã lưu; ValueError nếu dữ liệu không hợp lệ.
+    """
+    rows = {}
+    for entry in entries:
+        symbol = str(entry.get('symbol') or '').strip().upper()
+        if not symbol:
+            raise ValueError("Each watchlist entry needs a symbol ('*' for all symbols).")
+        methods = entry.get('methods') or []
+        if isinstance(methods, str):
+            methods = methods.split(',')
+        min_confidence = float(entry.get('min_confidence') or 0)
+        if not 0 <= min_confidence <= 1:
+            raise ValueError("min_confidence must be between 0 and 1.")
+        methods = sorted({m.strip() for m in methods if m.strip()})
+        if min_confidence > 0 and (not methods or not CONFIDENCE_METHODS.issuperset(methods)):
+            raise ValueError(
+                f"min_confidence only applies to {', '.join(sorted(CONFIDENCE_METHODS))} signals; rule-based signals carry no confidence. "
+                f"Set methods to {sorted(CONFIDENCE_METHODS)} or drop min_confidence for {symbol}."
+            )
+        rows[symbol] = (user_id, symbol, ','.join(methods), min_confidence)
+    conn.execute("DELETE FROM user_watchlists WHERE user_id = ?", (user_id,))
+    conn.executemany("INSERT INTO user_watchlists (user_id, symbol, methods, min_confidence) VALUES (?, ?, ?, ?)", rows.values())
+    _record_change(conn, user_id)
+    return len(rows)
+
+def get_user_watchlist(conn: sqlite3.Connection, user_id: int) -> Dict[str, Any]:
+    chat = conn.execute("SELECT chat_id FROM user_telegram_chats WHERE user_id = ?", (user_id,)).fetchone()
+    entries = conn.execute(
+        "SELECT symbol, methods, min_confidence FROM user_watchlists WHERE user_id = ? ORDER BY symbol", (user_id,)
+    ).fetchall()
+    return {
+        'telegram_chat_id': chat[0] if chat else None,
+        'entries': [{'symbol': s, 'methods': [m for m in methods.split(',') if m], 'min_confidence': c} for s, methods, c in entries],
+    }
+
+def delete_user_watchlist(conn: sqlite3.Connection, user_id: int) -> None:
+    conn.execute("DELETE FROM user_watchlists WHERE user_id = ?", (user_id,))
+    conn.execute("DELETE FROM user_telegram_chats WHERE user_id = ?", (user_id,))
+    _record_change(conn, user_id)
+
+# --- Phía đọc (bot) ---
+
+class Subscription(NamedTuple):
+    user_id: int
+    chat_id: str
+    methods: FrozenSet[str]
+    min_confidence: float
+
+    def matches(self, payload: Dict[str, Any]) -> bool:
+        if self.methods and payload.get('method') not in self.methods:
+            return False
+        # set_user_watchlist chỉ cho phép min_confidence > 0 cùng CONFIDENCE_METHODS; None = model không có predict_proba
+        confidence = payload.get('confidence')
+        return confidence is None or confidence >= self.min_confidence
+
+class WatchlistIndex:
+    """Chỉ mục ngược symbol -> {user_id: Subscription}, cập nhật tăng dần theo watchlist_changes."""
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._by_symbol: Dict[str, Dict[int, Subscription]] = {}
+        self._user_symbols: Dict[int, Set[str]] = {}
+        self._last_seq: Optional[int] = None
+
+    @property
+    def user_count(self) -> int:
+        return len(self._user_symbols)
+
+    def _remove_user(self, user_id: int) -> None:
+        for symbol in self._user_symbols.pop(user_id, ()):
+            subscribers = self._by_symbol.get(symbol)
+            if subscribers is not None:
+                subscribers.pop(user_id, None)
+                if not subscribers:
+                    del self._by_symbol[symbol]
+
+    def _add_rows(self, rows: Iterable[tuple]) -> None:
+        for user_id, chat_id, symbol, methods, min_confidence in rows:
+            subscription = Subscription(user_id, chat_id, frozenset(m for m in methods.split(',') if m), min_confidence or 0.0)
+            self._by_symbol.setdefault(symbol, {})[user_id] = subscription
+            self._user_symbols.setdefault(user_id, set()).add(symbol)
+
+    _SELECT = """
+        SELECT w.user_id, c.chat_id, w.symbol, w.methods, w.min_confidence
+        FROM user_watchlists w JOIN user_telegram_chats c ON c.user_id = w.user_id
+    """
+
+    def refresh(self) -> int:
+        """Nạp lần đầu toàn bộ, sau đó chỉ nạp lại người dùng có thay đổi. Trả về số người dùng được nạp lại."""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                if self._last_seq is None:
+                    init_watchlist_tables(conn.cursor())
+                    last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM watchlist_changes").fetchone()[0]
+                    self._by_symbol.clear()
+                    self._user_symbols.clear()
+                    self._add_rows(conn.execute(self._SELECT))
+                    self._last_seq = last_seq
+                    logger.info(f"👥 Watchlist index loaded: {self.user_count} user(s), {len(self._by_symbol)} symbol key(s).")
+                    return self.user_count
+
+                changes = conn.execute(
+                    "SELECT user_id, seq FROM watchlist_changes WHERE seq > ? ORDER BY seq", (self._last_seq,)
+                ).fetchall()
+                if not changes:
+                    return 0
+                user_ids = sorted({user_id for user_id, _ in changes})
+                for user_id in user_ids:
+                    self._remove_user(user_id)
+                placeholders = ','.join('?' * len(user_ids))
+                self._add_rows(conn.execute(f"{self._SELECT} WHERE w.user_id IN ({placeholders})", user_ids))
+                self._last_seq = changes[-1][1]
+                logger.info(f"👥 Watchlist index updated for {len(user_ids)} user(s).")
+                return len(user_ids)
+        except sqlite3.Error as e:
+            logger.error(f"Watchlist index refresh failed: {e}", exc_info=True)
+            return 0
+
+    def recipients(self, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Các chat người dùng cần nhận payload (mỗi chat một lần); entry theo symbol cụ thể ưu tiên hơn '*'."""
+        exact = self._by_symbol.get(payload.get('symbol'), {})
+        wildcard = self._by_symbol.get(ALL_SYMBOLS, {})
+        chats: Dict[str, Dict[str, Any]] = {}
+        for user_id, subscription in exact.items():
+            if subscription.matches(payload):
+                chats.setdefault(subscription.chat_id, {'chat_id': subscription.chat_id, 'message_thread_id': None})
+        for user_id, subscription in wildcard.items():
+            if user_id not in exact and subscription.matches(payload):
+                chats.setdefault(subscription.chat_id, {'chat_id': subscription.chat_id, 'message_thread_id': None})
+        return list(chats.values())
@@ -0,0 +1,35 @@
+# test_markdown_template.py - Golden output: template biên dịch sẵn của notifications phải cho đầu ra giống hệt
+# từng ký tự với renderer cũ (f-string + re.sub, giữ trong src/render_benchmark.py) trên 1.000 tín hiệu mẫu.
+import pytest
+
+from src.markdown_template import MarkdownTemplate, escape
+from src.notifications import (
+    SIGNAL_TEMPLATE, SIGNAL_SUMMARY_TEMPLATE, TRADE_OUTCOME_TEMPLATE, _signal_fields, _trade_outcome_fields,
+)
+from src.render_benchmark import (
+    _legacy_esc, legacy_signal, legacy_signal_summary, legacy_trade_outcome, make_signals, make_trades,
+)
+
+_SIGNALS = make_signals(1000)
+_TRADES = make_trades(_SIGNALS)
+
+def test_signal_messages_match_legacy_renderer():
+    assert SIGNAL_TEMPLATE.render_many(_signal_fields(s) for s in _SIGNALS) == [legacy_signal(s) for s in _SIGNALS]
+
+def test_signal_summaries_match_legacy_renderer():
+    expected = [legacy_signal_summary(i, s) for i, s in enumerate(_SIGNALS)]
+    assert SIGNAL_SUMMARY_TEMPLATE.render_many(_signal_fields(s, i + 1) for i, s in enumerate(_SIGNALS)) == expected
+
+def test_trade_outcomes_match_legacy_renderer():
+    assert TRADE_OUTCOME_TEMPLATE.render_many(_trade_outcome_fields(t) for t in _TRADES) == [legacy_trade_outcome(t) for t in _TRADES]
+
+def test_escape_matches_regex_escape():
+    for text in ['BTCUSDT', 'A.B-C!USDT', 'X(Y)_[z]~`>#+=|{}', '-0.00012', 12.5, None]:
+        assert escape(text) == _legacy_esc(text)
+
+def test_raw_field_is_inserted_verbatim():
+    assert MarkdownTemplate('*{title}* {body:raw}').render({'title': 'a.b', 'body': '_x\\.y_'}) == '*a\\.b* _x\\.y_'
+
+def test_conversion_is_rejected():
+    with pytest.raises(ValueError):
+        MarkdownTemplate('{body!r}')
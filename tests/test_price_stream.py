@@ -0,0 +1,87 @@
+# test_price_stream.py - Kiểm tra PriceStreamEngine đầu-cuối: phát lại một tệp frame mark price đã biết trước
+# qua run_replay_server trên cổng cục bộ, cho engine nghe rồi so các lệnh đóng (status, exit price) với kết quả mong đợi.
+import asyncio
+import json
+import socket
+import sqlite3
+from typing import Any, Dict, List
+
+import websockets
+
+from src.database_handler import init_sqlite_db
+from src.price_stream import PriceStreamEngine, run_replay_server
+
+# (symbol, trend, entry, sl, tp1, tp2, tp3)
+_SIGNALS = [
+    ('AAAUSDT', 'BULLISH', 100.0, 97.0, 103.0, 105.0, 108.0),
+    ('BBBUSDT', 'BEARISH', 50.0, 52.0, 48.0, 47.0, 45.0),
+    ('CCCUSDT', 'BULLISH', 10.0, 9.5, 10.5, 11.0, 12.0),
+]
+# Mỗi frame là một message !markPrice@arr@1s
+_FRAMES = [
+    [{'s': 'AAAUSDT', 'p': '101.0'}, {'s': 'BBBUSDT', 'p': '49.0'}, {'s': 'CCCUSDT', 'p': '10.1'}],
+    [{'s': 'AAAUSDT', 'p': '105.5'}, {'s': 'BBBUSDT', 'p': '52.5'}],
+    [{'s': 'AAAUSDT', 'p': '90.0'}, {'s': 'CCCUSDT', 'p': '10.2'}],
+]
+# AAA chạm TP2 ở frame 2 (frame 3 không được đóng lại thành SL), BBB chạm SL, CCC vẫn ACTIVE
+_EXPECTED = {'AAAUSDT': ('TP2_HIT', 105.0), 'BBBUSDT': ('SL_HIT', 52.0)}
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _seed_db(db_path: str) -> None:
+    init_sqlite_db(db_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(
+            """INSERT INTO trend_analysis (symbol, trend, entry_price, stop_loss, take_profit_1, take_profit_2, take_profit_3,
+                   kline_open_time, analysis_timestamp_utc, status, method)
+               VALUES (?, ?, ?, ?, ?, ?, ?, '2024-01-01T00:00:00', '2024-01-01T00:15:00', 'ACTIVE', 'Rule-Based')""",
+            _SIGNALS
+        )
+
+async def _replay(db_path: str, frames_path: str):
+    """Engine thứ nhất nghe server phát lại; engine thứ hai được đồng bộ TRƯỚC đó nên vẫn giữ các lệnh đã bị đóng."""
+    url = f'ws://127.0.0.1:{_free_port()}'
+    closed: List[Dict[str, Any]] = []
+    stale_closed: List[Dict[str, Any]] = []
+
+    async def on_close(trade: Dict[str, Any]) -> None:
+        closed.append(trade)
+
+    async def stale_on_close(trade: Dict[str, Any]) -> None:
+        stale_closed.append(trade)
+
+    server = asyncio.create_task(run_replay_server(frames_path, port=int(url.rsplit(':', 1)[1])))
+    await asyncio.sleep(0.2)
+    try:
+        stale = PriceStreamEngine(db_path, on_close=stale_on_close, stream_url=url)
+        stale.sync_active_signals()
+        engine = PriceStreamEngine(db_path, on_close=on_close, stream_url=url)
+        engine.sync_active_signals()
+        async with websockets.connect(url) as ws:
+            for _ in range(len(_FRAMES)):
+                await engine.handle_message(await ws.recv())
+        for frame in _FRAMES:
+            await stale.handle_message(json.dumps(frame))
+    finally:
+        server.cancel()
+    return closed, stale_closed
+
+def test_replayed_frames_close_expected_signals_once(tmp_path):
+    db_path = str(tmp_path / 'stream.db')
+    frames_path = tmp_path / 'frames.jsonl'
+    _seed_db(db_path)
+    frames_path.write_text(''.join(json.dumps(frame) + '\n' for frame in _FRAMES))
+
+    closed, stale_closed = asyncio.run(_replay(db_path, str(frames_path)))
+
+    assert {t['symbol']: (t['status'], t['exit_price']) for t in closed} == _EXPECTED
+    assert stale_closed == []
+    with sqlite3.connect(db_path) as conn:
+        db_rows = {s: (st, px) for s, st, px in conn.execute("SELECT symbol, status, exit_price FROM trend_analysis")}
+        outcome_rows = conn.execute("SELECT COUNT(*) FROM notification_outbox WHERE kind = 'outcome'").fetchone()[0]
+    assert {s: db_rows[s] for s in _EXPECTED} == _EXPECTED
+    assert db_rows['CCCUSDT'][0] == 'ACTIVE'
+    assert outcome_rows == len(_EXPECTED)
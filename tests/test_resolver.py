@@ -0,0 +1,19 @@
+# test_resolver.py - Parity: updater.first_hit_outcomes (qua resolver_benchmark.vectorized_resolve, cùng phép tính với
+# data_simulator) phải cho cùng status, exit price và PnL (so sánh ==, không dung sai) với vòng lặp df.iloc cũ cho mọi lệnh.
+import numpy as np
+import pytest
+
+from src.resolver_benchmark import legacy_resolve, make_candles, make_trades, vectorized_resolve
+
+@pytest.mark.parametrize('seed', [3, 11, 29])
+def test_vectorized_resolver_matches_loop(seed):
+    df = make_candles(2880, seed)
+    entries, trends = make_trades(len(df), 2000, seed)
+    assert vectorized_resolve(df, entries, trends) == legacy_resolve(df, entries, trends)
+
+def test_entries_near_the_last_candle_close_manually_like_the_loop():
+    # Entry trong 5 nến cuối không có đủ nến phía sau: cả hai phải đóng ở nến cuối cùng có được
+    df = make_candles(300, 5)
+    entries = np.arange(250, 300)
+    trends = ['BULLISH' if i % 2 else 'BEARISH' for i in entries]
+    assert vectorized_resolve(df, entries, trends) == legacy_resolve(df, entries, trends)